@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: ImageArchiveReader
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import hashlib
+import tarfile
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.container.archivereader import ImageArchiveReader
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+def archive(members):
+    """In memory tar archive with the given (name, data) members,
+    data None is a directory, a tuple (type, target) is a link"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tarf:
+        for (name, data) in members:
+            tarinfo = tarfile.TarInfo(name)
+            if data is None:
+                tarinfo.type = tarfile.DIRTYPE
+                tarf.addfile(tarinfo)
+            elif isinstance(data, tuple):
+                (tarinfo.type, tarinfo.linkname) = data
+                tarf.addfile(tarinfo)
+            else:
+                tarinfo.size = len(data)
+                tarf.addfile(tarinfo, io.BytesIO(data))
+    buf.seek(0)
+    return tarfile.open(fileobj=buf, mode="r|")
+
+
+class ImageArchiveReaderTestCase(TestCase):
+    """Test ImageArchiveReader() loading of image archives."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.layersdir = "/r/layers"
+
+    def tearDown(self):
+        pass
+
+    def test_01__member_name(self):
+        """Test01 ImageArchiveReader()._member_name()."""
+        reader = ImageArchiveReader(self.local)
+        self.assertEqual(reader._member_name(tarfile.TarInfo("./aa/layer.tar")),
+                         "aa/layer.tar")
+        self.assertEqual(reader._member_name(tarfile.TarInfo("/etc/x")), "")
+        self.assertEqual(reader._member_name(tarfile.TarInfo("a/../../x")), "")
+        self.assertEqual(reader._member_name(tarfile.TarInfo(".")), "")
+
+    @patch.object(ImageArchiveReader, '_write')
+    @patch('udocker.container.archivereader.Unique.filename')
+    def test_02__write_layer(self, mock_fname, mock_write):
+        """Test02 ImageArchiveReader()._write_layer()."""
+        mock_fname.return_value = "udocker-1-x-layer.tar"
+        reader = ImageArchiveReader(self.local)
+        self.assertEqual(reader._write_layer(Mock(), "aa/layer.tar"),
+                         "/r/layers/udocker-1-x-layer.tar")
+        self.assertEqual(mock_write.call_args[0][0].chksum.name, "sha256")
+        self.assertEqual(reader.layer_files,
+                         ["/r/layers/udocker-1-x-layer.tar"])
+        self.assertEqual(
+            reader.layer_digests[
+                os.path.realpath("/r/layers/udocker-1-x-layer.tar")],
+            "sha256:" + hashlib.sha256(b"").hexdigest())
+
+        digest = hashlib.sha256(b"layer").hexdigest()
+        mock_write.side_effect = \
+            lambda fileobj, f_path: fileobj.chksum.update(b"layer")
+        self.assertTrue(reader._write_layer(Mock(), "blobs/sha256/" + digest))
+        self.assertFalse(reader._write_layer(Mock(), "blobs/sha256/ab12"))
+
+    @patch('udocker.container.archivereader.os.symlink')
+    @patch('udocker.container.archivereader.FileUtil.mkdir')
+    @patch.object(ImageArchiveReader, '_write_layer')
+    @patch.object(ImageArchiveReader, '_write')
+    def test_03__extract(self, mock_write, mock_wlayer, mock_mkdir,
+                         mock_symlink):
+        """Test03 ImageArchiveReader()._extract()."""
+        mock_wlayer.side_effect = \
+            lambda fileobj, name: "/r/layers/udocker-1-x-" + name[-2:]
+        tarf = archive([("oci-layout", b"{}"), ("blobs", None),
+                        ("blobs/sha256/aa", b"\x1f\x8b\x08"),
+                        ("blobs/sha256/bb", b' {"layers": []}'),
+                        ("cc/layer.tar", b"{tar}"),
+                        ("../x", b"evil")])
+        reader = ImageArchiveReader(self.local)
+        self.assertTrue(reader._extract(tarf, "/tmp/img"))
+        written = [call[0][1] for call in mock_write.call_args_list]
+        self.assertEqual(written, ["/tmp/img/oci-layout",
+                                   "/tmp/img/blobs/sha256/bb"])
+        self.assertEqual([call[0][1] for call in mock_wlayer.call_args_list],
+                         ["blobs/sha256/aa", "cc/layer.tar"])
+        mock_symlink.assert_called_with("/r/layers/udocker-1-x-ar",
+                                        "/tmp/img/cc/layer.tar")
+
+        mock_wlayer.side_effect = None
+        mock_wlayer.return_value = ""
+        tarf = archive([("cc/layer.tar", b"tar")])
+        self.assertFalse(reader._extract(tarf, "/tmp/img"))
+
+    @patch('udocker.container.archivereader.sys')
+    @patch('udocker.container.archivereader.Msg')
+    @patch('udocker.container.archivereader.Compression')
+    @patch('udocker.container.archivereader.open', create=True)
+    @patch.object(ImageArchiveReader, 'remove_unused')
+    @patch.object(ImageArchiveReader, '_extract')
+    @patch('udocker.container.archivereader.tarfile.open')
+    def test_04_extract(self, mock_open, mock_extract, mock_remove,
+                        mock_fopen, mock_compress, mock_msg, mock_sys):
+        """Test04 ImageArchiveReader().extract()."""
+        mock_fopen.return_value.peek.return_value = b"tar\0"
+        mock_compress.detect.return_value = ""
+        mock_extract.return_value = True
+        reader = ImageArchiveReader(self.local)
+        self.assertTrue(reader.extract("img.tar", "/tmp/img"))
+        mock_open.assert_called_with(fileobj=mock_fopen.return_value,
+                                     mode="r|*")
+        self.assertTrue(mock_open.return_value.close.called)
+        self.assertTrue(mock_fopen.return_value.close.called)
+        self.assertFalse(mock_compress.called)
+        self.assertFalse(mock_remove.called)
+
+        mock_compress.detect.return_value = "zstd"
+        stream = Mock()
+        stream.read.side_effect = [b"\0" * 512, b""]
+        mock_compress.return_value.decompress_from.return_value = stream
+        mock_compress.return_value.close.return_value = True
+        self.assertTrue(reader.extract("img.tar.zst", "/tmp/img"))
+        mock_compress.assert_called_with("zstd")
+        mock_open.assert_called_with(fileobj=stream, mode="r|*")
+        self.assertEqual(stream.read.call_count, 2)
+
+        stream.read.side_effect = [b""]
+        mock_compress.return_value.close.return_value = False
+        self.assertFalse(reader.extract("img.tar.zst", "/tmp/img"))
+        self.assertTrue(mock_remove.called)
+
+        mock_remove.reset_mock()
+        mock_compress.detect.return_value = ""
+        mock_extract.side_effect = tarfile.ReadError("truncated")
+        self.assertFalse(reader.extract("-", "/tmp/img"))
+        self.assertTrue(mock_remove.called)
+        self.assertFalse(mock_sys.stdin.buffer.close.called)
+
+    @patch('udocker.container.archivereader.FileUtil.remove')
+    @patch('udocker.container.archivereader.os.path.exists')
+    def test_05_remove_unused(self, mock_exists, mock_remove):
+        """Test05 ImageArchiveReader().remove_unused()."""
+        mock_exists.side_effect = lambda path: path.endswith("aa")
+        reader = ImageArchiveReader(self.local)
+        reader.layer_files = ["/r/layers/udocker-1-x-aa",
+                              "/r/layers/udocker-1-x-bb"]
+        reader.remove_unused()
+        self.assertEqual(mock_remove.call_count, 1)
+        self.assertEqual(reader.layer_files, [])
+
+    def test_06__is_layer(self):
+        """Test06 ImageArchiveReader()._is_layer()."""
+        reader = ImageArchiveReader(self.local)
+        self.assertTrue(reader._is_layer("aa/layer.tar", 10))
+        self.assertFalse(reader._is_layer("aa/json", 10))
+        self.assertTrue(reader._is_layer("blobs/sha256/aa", 10, b"\x1f\x8b"))
+        self.assertFalse(reader._is_layer("blobs/sha256/aa", 10, b' {"a"'))
+        self.assertTrue(reader._is_layer("blobs/sha256/aa",
+                                         reader.META_MAXSIZE + 1, b"{"))
+
+    @patch('udocker.container.archivereader.FileUtil.copyto')
+    @patch('udocker.container.archivereader.Unique.filename')
+    def test_07__link_layer(self, mock_fname, mock_copyto):
+        """Test07 ImageArchiveReader()._link_layer()."""
+        mock_fname.return_value = "udocker-1-x-aa"
+        mock_copyto.return_value = True
+        reader = ImageArchiveReader(self.local)
+        self.assertEqual(reader._link_layer("/img/blobs/sha256/aa",
+                                            "blobs/sha256/aa"),
+                         "/r/layers/udocker-1-x-aa")
+        mock_copyto.assert_called_with("/r/layers/udocker-1-x-aa", link=True)
+        self.assertEqual(reader.layer_files, ["/r/layers/udocker-1-x-aa"])
+
+        mock_copyto.return_value = False
+        self.assertEqual(reader._link_layer("/img/blobs/sha256/aa",
+                                            "blobs/sha256/aa"), "")
+
+    @patch.object(ImageArchiveReader, 'remove_unused')
+    @patch('udocker.container.archivereader.Msg')
+    @patch('udocker.container.archivereader.os.symlink')
+    @patch('udocker.container.archivereader.FileUtil')
+    @patch.object(ImageArchiveReader, '_link_layer')
+    @patch('udocker.container.archivereader.os.path')
+    @patch('udocker.container.archivereader.os.walk')
+    def test_08_link(self, mock_walk, mock_path, mock_llayer, mock_futil,
+                     mock_symlink, mock_msg, mock_remove):
+        """Test08 ImageArchiveReader().link()."""
+        mock_walk.return_value = [("/img", ["blobs"], ["index.json"]),
+                                  ("/img/blobs", ["sha256"], []),
+                                  ("/img/blobs/sha256", [], ["aa", "bb"])]
+        mock_path.realpath.side_effect = lambda path: path
+        mock_path.dirname.side_effect = lambda path: path.rsplit('/', 1)[0]
+        mock_path.isfile.return_value = True
+        mock_path.getsize.return_value = 10
+        mock_futil.return_value.getdata.side_effect = \
+            [b"{}", b"\x1f\x8b", b"{}"]
+        mock_futil.return_value.copyto.return_value = True
+        mock_llayer.return_value = "/r/layers/udocker-1-x-aa"
+        reader = ImageArchiveReader(self.local)
+        self.assertTrue(reader.link("/img", "/tmp/img"))
+        mock_llayer.assert_called_once_with("/img/blobs/sha256/aa",
+                                            "blobs/sha256/aa")
+        mock_symlink.assert_called_once_with("/r/layers/udocker-1-x-aa",
+                                             "/tmp/img/blobs/sha256/aa")
+        mock_futil.return_value.copyto.assert_called_with(
+            "/tmp/img/blobs/sha256/bb")
+        self.assertFalse(mock_remove.called)
+
+        mock_futil.return_value.getdata.side_effect = None
+        mock_futil.return_value.getdata.return_value = b"\x1f\x8b"
+        mock_llayer.return_value = ""
+        self.assertFalse(reader.link("/img", "/tmp/img"))
+        self.assertTrue(mock_remove.called)
+
+        mock_remove.reset_mock()
+        mock_walk.side_effect = OSError("denied")
+        self.assertFalse(reader.link("/img", "/tmp/img"))
+        self.assertTrue(mock_remove.called)
+
+    def test_09__link_target(self):
+        """Test09 ImageArchiveReader()._link_target()."""
+        reader = ImageArchiveReader(self.local)
+        member = tarfile.TarInfo("bb/layer.tar")
+        member.type = tarfile.SYMTYPE
+        member.linkname = "../aa/layer.tar"
+        self.assertEqual(reader._link_target(member, "bb/layer.tar"),
+                         "aa/layer.tar")
+        member.linkname = "../../etc/passwd"
+        self.assertEqual(reader._link_target(member, "bb/layer.tar"), "")
+        member.linkname = "/etc/passwd"
+        self.assertEqual(reader._link_target(member, "bb/layer.tar"), "")
+        member.type = tarfile.LNKTYPE
+        member.linkname = "aa/layer.tar"
+        self.assertEqual(reader._link_target(member, "bb/layer.tar"),
+                         "aa/layer.tar")
+
+    @patch.object(ImageArchiveReader, '_link_layer')
+    @patch.object(ImageArchiveReader, '_write')
+    @patch('udocker.container.archivereader.Unique.filename')
+    def test_10__extract_links(self, mock_fname, mock_write, mock_llayer):
+        """Test10 ImageArchiveReader()._extract() with linked layers."""
+        tmpdir = tempfile.mkdtemp()
+        self.local.layersdir = tmpdir + "/layers"
+        os.mkdir(self.local.layersdir)
+        mock_fname.side_effect = lambda name: "udocker-1-x-" + name
+        mock_write.side_effect = \
+            lambda fileobj, f_path: open(f_path, "wb").close()
+        mock_llayer.side_effect = lambda f_path, name: f_path + ".link"
+        try:
+            for members in (
+                    [("aa/layer.tar", b"tar"),
+                     ("bb/layer.tar", (tarfile.SYMTYPE, "../aa/layer.tar")),
+                     ("bb/json", (tarfile.LNKTYPE, "aa/json")),
+                     ("aa/json", b"{}"),
+                     ("cc/layer.tar", (tarfile.SYMTYPE, "../zz/layer.tar"))],
+                    [("bb/layer.tar", (tarfile.SYMTYPE, "../aa/layer.tar")),
+                     ("aa/layer.tar", b"tar")]):
+                destdir = tempfile.mkdtemp(dir=tmpdir)
+                reader = ImageArchiveReader(self.local)
+                self.assertTrue(reader._extract(archive(members), destdir))
+                layer_file = self.local.layersdir + "/udocker-1-x-layer.tar"
+                self.assertEqual(os.readlink(destdir + "/aa/layer.tar"),
+                                 layer_file)
+                self.assertEqual(os.readlink(destdir + "/bb/layer.tar"),
+                                 layer_file + ".link")
+                mock_llayer.assert_called_with(layer_file, "bb/layer.tar")
+                self.assertFalse(os.path.lexists(destdir + "/cc/layer.tar"))
+                if os.path.exists(destdir + "/aa/json"):
+                    self.assertEqual(os.readlink(destdir + "/bb/json"),
+                                     destdir + "/aa/json")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_11__check_diff_ids(self):
+        """Test11 ImageArchiveReader()._check_diff_ids()."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            destdir = os.path.realpath(tmpdir)
+            layer_file = destdir + "/layer"
+            with open(layer_file, "wb") as filep:
+                filep.write(b"tar")
+            os.mkdir(destdir + "/aa")
+            os.symlink(layer_file, destdir + "/aa/layer.tar")
+            digest = "sha256:" + hashlib.sha256(b"tar").hexdigest()
+            jsons = {destdir + "/manifest.json":
+                         [{"Config": "cc.json", "Layers": ["aa/layer.tar"]}],
+                     destdir + "/cc.json": {"rootfs": {"diff_ids": [digest]}}}
+            self.local.load_json.side_effect = jsons.get
+            reader = ImageArchiveReader(self.local)
+            reader.layer_digests[layer_file] = digest
+            self.assertTrue(reader._check_diff_ids(destdir))
+
+            jsons[destdir + "/cc.json"] = \
+                {"rootfs": {"diff_ids": ["sha256:" + "0" * 64]}}
+            self.assertFalse(reader._check_diff_ids(destdir))
+
+            with open(layer_file, "wb") as filep:
+                filep.write(b"\x1f\x8b\x08\x00")
+            self.assertTrue(reader._check_diff_ids(destdir))
+
+            del jsons[destdir + "/manifest.json"]
+            self.assertTrue(reader._check_diff_ids(destdir))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -390,6 +390,58 @@ class UdockerCLITestCase(TestCase):
         self.assertTrue(mock_chkimg.called)
         self.assertTrue(mock_save.called)
         self.assertEqual(status, 0)
+        mock_save.assert_called_with([("ipyimg", "latest")], "ipyrad",
+                                     "docker", False)
+
+        argv = ["udocker", "save", "--format=oci", "--compress=zstd",
+                "-o", "ipyrad", "ipyimg:latest"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_save(cmdp)
+        self.assertEqual(status, 0)
+        mock_save.assert_called_with([("ipyimg", "latest")], "ipyrad", "oci",
+                                     "zstd")
+
+        argv = ["udocker", "save", "--compress=lz4", "-o", "ipyrad",
+                "ipyimg:latest"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_save.reset_mock()
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_save(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_save.called)
+
+        argv = ["udocker", "save", "--format=tgz", "-o", "ipyrad",
+                "ipyimg:latest"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_save.reset_mock()
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_save(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_save.called)
+
+        argv = ["udocker", "save", "--format=oci-dir", "-o", "ipyrad",
+                "ipyimg:latest"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_save(cmdp)
+        self.assertEqual(status, 0)
+        mock_save.assert_called_with([("ipyimg", "latest")], "ipyrad",
+                                     "oci-dir", False)
+
+        argv = ["udocker", "save", "--format=oci-dir", "--compress=gzip",
+                "-o", "ipyrad", "ipyimg:latest"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_save.reset_mock()
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_save(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_save.called)
 
     @patch('udocker.cli.LocalFileAPI.import_toimage')
     @patch('udocker.cli.LocalFileAPI.import_tocontainer')
@@ -613,13 +665,14 @@ class UdockerCLITestCase(TestCase):
         self.assertTrue(mock_setrepo.called)
         self.assertTrue(mock_ks.return_value.delete.called)
 
+    @patch('udocker.cli.ContainerPool')
     @patch.object(UdockerCLI, '_set_repository')
     @patch.object(UdockerCLI, '_check_imagespec')
     @patch('udocker.cli.DockerIoAPI')
     @patch('udocker.cli.KeyStore.get')
     @patch('udocker.cli.Msg')
     def test_19_do_pull(self, mock_msg, mock_ksget, mock_dioa,
-                        mock_chkimg, mock_setrepo):
+                        mock_chkimg, mock_setrepo, mock_pool):
         """Test19 UdockerCLI().do_pull()."""
         mock_msg.level = 0
         argv = ["udocker", "-h"]
@@ -655,9 +708,18 @@ class UdockerCLITestCase(TestCase):
         mock_ksget.return_value = "zx1"
         mock_dioa.return_value.set_v2_login_token.return_value = None
         mock_dioa.return_value.get.return_value = True
+        mock_pool.return_value.get_config.return_value = None
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_pull(cmdp)
+        self.assertEqual(status, 0)
+        self.assertFalse(mock_pool.return_value.invalidate.called)
+
+        mock_pool.return_value.get_config.return_value = {"size": 2}
         udoc = UdockerCLI(self.local)
         status = udoc.do_pull(cmdp)
         self.assertEqual(status, 0)
+        self.assertTrue(mock_pool.return_value.invalidate.called)
+        self.assertTrue(mock_pool.return_value.refill_background.called)
 
     @patch.object(UdockerCLI, '_check_imagespec')
     @patch('udocker.cli.ContainerStructure')
@@ -731,15 +793,17 @@ class UdockerCLITestCase(TestCase):
     # def test_22__get_run_options(self):
     #    """Test22 UdockerCLI()._get_run_options()"""
 
+    @patch('udocker.cli.ContainerPool')
     @patch('udocker.cli.ExecutionMode')
     @patch('udocker.cli.Msg')
     @patch.object(UdockerCLI, 'do_pull')
     @patch.object(UdockerCLI, '_create')
     @patch.object(UdockerCLI, '_check_imagespec')
     def test_23_do_run(self, mock_chkimg, mock_create, mock_pull,
-                       mock_msg, mock_exec):
+                       mock_msg, mock_exec, mock_pool):
         """Test23 UdockerCLI().do_run()."""
         mock_msg.level = 0
+        mock_pool.return_value.claim.return_value = ""
         mock_pull.return_value = None
         argv = ["udocker", "-h"]
         cmdp = CmdParser()
@@ -801,6 +865,18 @@ class UdockerCLITestCase(TestCase):
         self.assertTrue(mock_chkimg.called)
         self.assertTrue(self.local.cd_imagerepo.called)
         self.assertTrue(mock_create.called)
+        mock_pool.assert_called_with(self.local, "ipyrad", "latest")
+
+        argv = ["udocker", "run", "ipyrad"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_create.reset_mock()
+        mock_pool.return_value.claim.return_value = "54321"
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_run(cmdp)
+        self.assertEqual(status, 0)
+        self.assertFalse(mock_create.called)
+        mock_exec.assert_called_with(self.local, "54321")
 
         exeng_patch.stop()
 
@@ -813,20 +889,30 @@ class UdockerCLITestCase(TestCase):
         status = udoc.do_images(cmdp)
         self.assertEqual(status, 1)
 
-        argv = ["udocker", "images", "-l"]
+        argv = ["udocker", "images", "-l", "-p"]
         cmdp = CmdParser()
         cmdp.parse(argv)
-        self.local.get_imagerepos.return_value = [("img1", "tag1")]
-        self.local.isprotected_imagerepo.return_value = False
-        self.local.cd_imagerepo.return_value = "/img1"
-        self.local.get_layers.return_value = [("l1", 1024)]
+        self.local.reposdir = "/repos"
+        self.local.get_catalog.return_value = {
+            "img1/tag1": {"imagerepo": "img1", "tag": "tag1",
+                          "protected": False, "platform": "linux/amd64",
+                          "layers": [["l1", 1024]]}}
         udoc = UdockerCLI(self.local)
         status = udoc.do_images(cmdp)
         self.assertEqual(status, 0)
-        self.assertTrue(self.local.get_imagerepos.called)
-        self.assertTrue(self.local.isprotected_imagerepo.called)
-        self.assertTrue(self.local.cd_imagerepo.called)
-        self.assertTrue(self.local.get_layers.called)
+        self.assertTrue(self.local.get_catalog.called)
+        self.assertFalse(self.local.get_imagerepos.called)
+        self.assertFalse(self.local.get_image_platform_fmt.called)
+
+        self.local.get_catalog.return_value["img1/tag1"]["platform"] = \
+            "linux/unknown"
+        self.local.cd_imagerepo.return_value = "/repos/img1/tag1"
+        self.local.get_image_platform_fmt.return_value = "linux/arm64"
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_images(cmdp)
+        self.assertEqual(status, 0)
+        self.local.cd_imagerepo.assert_called_with("img1", "tag1")
+        self.assertTrue(self.local.get_image_platform_fmt.called)
 
     @patch('udocker.cli.ExecutionMode')
     def test_25_do_ps(self, mock_exec):
@@ -846,14 +932,18 @@ class UdockerCLITestCase(TestCase):
         argv = ["udocker", "ps", "-m", "-s"]
         cmdp = CmdParser()
         cmdp.parse(argv)
-        self.local.get_containers_list.return_value = [[cdir, "/", "a"]]
+        self.local.get_containers_attrs.return_value = [
+            {"id": cdir, "names": ["a"], "imagerepo": "/", "execmode": "",
+             "platform": "linux/amd64", "protected": False, "writeable": 1,
+             "size": 1024, "size_mtime": 0}]
         mock_exec.return_value.get_engine.return_value = proot
-        self.local.isprotected_container.return_value = False
-        self.local.iswriteable_container.return_value = True
-        self.local.get_size.return_value = 1024
+        mock_exec.return_value.get_mode.return_value = "P1"
         udoc = UdockerCLI(self.local)
         status = udoc.do_ps(cmdp)
         self.assertEqual(status, 0)
+        self.local.get_containers_attrs.assert_called_with(True)
+        self.assertFalse(self.local.get_size.called)
+        self.assertEqual(mock_exec.return_value.get_mode.call_count, 1)
         exeng_patch.stop()
 
     @patch('udocker.cli.Msg')
@@ -917,9 +1007,10 @@ class UdockerCLITestCase(TestCase):
         status = udoc.do_rm(cmdp)
         self.assertEqual(status, 0)
 
+    @patch('udocker.cli.ContainerPool')
     @patch('udocker.cli.Msg')
     @patch.object(UdockerCLI, '_check_imagespec')
-    def test_27_do_rmi(self, mock_chkimg, mock_msg):
+    def test_27_do_rmi(self, mock_chkimg, mock_msg, mock_pool):
         """Test27 UdockerCLI().do_rmi()."""
         mock_msg.level = 0
         argv = ["udocker", "-h"]
@@ -967,10 +1058,12 @@ class UdockerCLITestCase(TestCase):
         mock_chkimg.return_value = ("ipyrad", "latest")
         self.local.isprotected_imagerepo.return_value = False
         self.local.del_imagerepo.return_value = True
+        mock_pool.return_value.get_config.return_value = {"size": 2}
         udoc = UdockerCLI(self.local)
         status = udoc.do_rmi(cmdp)
         self.assertEqual(status, 0)
         self.assertTrue(self.local.del_imagerepo.called)
+        self.assertTrue(mock_pool.return_value.invalidate.called)
 
     @patch('udocker.cli.Msg')
     @patch.object(UdockerCLI, '_check_imagespec')
@@ -1371,6 +1464,20 @@ class UdockerCLITestCase(TestCase):
         status = udoc.do_verify(cmdp)
         self.assertEqual(status, 0)
 
+        argv = ["udocker", "verify", "--all"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.verify_all.return_value = [("ipyrad", "latest")]
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_verify(cmdp)
+        self.assertEqual(status, 1)
+
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.verify_all.return_value = []
+        status = udoc.do_verify(cmdp)
+        self.assertEqual(status, 0)
+
     @patch('udocker.cli.ExecutionMode')
     @patch('udocker.cli.NvidiaMode')
     @patch('udocker.cli.FileUtil.rchmod')
@@ -1524,5 +1631,312 @@ class UdockerCLITestCase(TestCase):
         self.assertTrue(mock_msg.return_value.out.called)
 
 
+    @patch('udocker.cli.os.chmod')
+    @patch('udocker.cli.os.path.isdir')
+    @patch('udocker.cli.FileUtil.putdata')
+    @patch.object(UdockerCLI, '_check_imagespec')
+    @patch('udocker.cli.Msg')
+    def test_40_do_cp(self, mock_msg, mock_chkimg, mock_putdata,
+                      mock_isdir, mock_chmod):
+        """Test40 UdockerCLI().do_cp()."""
+        mock_msg.level = 0
+        argv = ["udocker", "cp", "centos:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_cp(cmdp)
+        self.assertEqual(status, 1)
+
+        argv = ["udocker", "cp", "centos:7", "/tmp"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_cp(cmdp)
+        self.assertEqual(status, 1)
+
+        argv = ["udocker", "cp", "centos:7:/etc/passwd", "/tmp"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_chkimg.return_value = ("centos", "7")
+        self.local.stat_image_file.return_value = None
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_cp(cmdp)
+        self.assertEqual(status, 1)
+        mock_chkimg.assert_called_with("centos:7")
+        self.local.stat_image_file.assert_called_with("centos", "7",
+                                                      "/etc/passwd")
+
+        argv = ["udocker", "cp", "centos:7:/etc/passwd", "/tmp"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.stat_image_file.return_value = \
+            {"path": "/etc/passwd", "type": 'f', "mode": 0o100644}
+        self.local.read_image_file.return_value = b"root:x:0:0"
+        mock_isdir.return_value = True
+        mock_putdata.return_value = b"root:x:0:0"
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_cp(cmdp)
+        self.assertEqual(status, 0)
+        mock_chmod.assert_called_with("/tmp/passwd", 0o644)
+
+        argv = ["udocker", "cp", "centos:7:/etc", "/tmp"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.stat_image_file.return_value = \
+            {"path": "/etc", "type": 'd', "mode": 0o40755}
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_cp(cmdp)
+        self.assertEqual(status, 1)
+
+    @patch('udocker.cli.ContainerPool')
+    @patch.object(UdockerCLI, '_check_imagespec')
+    @patch('udocker.cli.Msg')
+    def test_41_do_pool(self, mock_msg, mock_chkimg, mock_pool):
+        """Test41 UdockerCLI().do_pool()."""
+        mock_msg.level = 0
+        argv = ["udocker", "pool"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_pool.return_value.get_pools.return_value = \
+            [("centos", "7", 2, 1)]
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_pool(cmdp)
+        self.assertEqual(status, 0)
+        self.assertTrue(mock_pool.return_value.get_pools.called)
+
+        argv = ["udocker", "pool", "--size=x", "centos:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_chkimg.return_value = ("centos", "7")
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_pool(cmdp)
+        self.assertEqual(status, 1)
+
+        argv = ["udocker", "pool", "--size=0", "centos:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_pool.return_value.remove.return_value = True
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_pool(cmdp)
+        self.assertEqual(status, 0)
+        self.assertTrue(mock_pool.return_value.remove.called)
+
+        argv = ["udocker", "pool", "--size=3", "--execmode=f3", "centos:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.cd_imagerepo.return_value = "/tag"
+        self.local.cd_container.return_value = ""
+        mock_pool.return_value.set_config.return_value = True
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_pool(cmdp)
+        self.assertEqual(status, 0)
+        mock_pool.return_value.set_config.assert_called_with(3, "F3")
+        mock_pool.return_value.trim.assert_called_with(3)
+        self.assertTrue(mock_pool.return_value.refill_background.called)
+
+    @patch('udocker.cli.ImageFlatten')
+    @patch.object(UdockerCLI, '_check_imagespec')
+    @patch('udocker.cli.Msg')
+    def test_42_do_flatten(self, mock_msg, mock_chkimg, mock_flatten):
+        """Test42 UdockerCLI().do_flatten()."""
+        mock_msg.level = 0
+        argv = ["udocker", "flatten", "centos:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_flatten(cmdp)
+        self.assertEqual(status, 1)
+
+        argv = ["udocker", "flatten", "centos:7", "flat:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_chkimg.side_effect = [("centos", "7"), ("flat", "7")]
+        mock_flatten.return_value.flatten.return_value = True
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_flatten(cmdp)
+        self.assertEqual(status, 0)
+        mock_flatten.return_value.flatten.assert_called_with(
+            "centos", "7", "flat", "7")
+
+        argv = ["udocker", "flatten", "centos:7", "flat:7"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_chkimg.side_effect = [("centos", "7"), ("flat", "7")]
+        mock_flatten.return_value.flatten.return_value = False
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_flatten(cmdp)
+        self.assertEqual(status, 1)
+
+    @patch('udocker.cli.Msg')
+    def test_43_do_fsck(self, mock_msg):
+        """Test43 UdockerCLI().do_fsck()."""
+        mock_msg.level = 0
+        argv = ["udocker", "fsck"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.rebuild_layers_refs.return_value = None
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_fsck(cmdp)
+        self.assertEqual(status, 1)
+
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.rebuild_layers_refs.return_value = \
+            ([("sha256:aa", "centos/7")], [])
+        self.local.get_unreferenced_layers.return_value = ["/l/sha256:bb"]
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_fsck(cmdp)
+        self.assertEqual(status, 0)
+        self.assertTrue(self.local.get_unreferenced_layers.called)
+
+    @patch('udocker.cli.RepositoryPrune')
+    @patch('udocker.cli.Msg')
+    def test_44_do_prune(self, mock_msg, mock_prune):
+        """Test44 UdockerCLI().do_prune()."""
+        mock_msg.level = 0
+        argv = ["udocker", "prune", "--dry-run"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_prune.return_value.mark.return_value = \
+            [["layer", "/l/sha256:aa", 1024]]
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_prune(cmdp)
+        self.assertEqual(status, 0)
+        self.assertFalse(mock_prune.return_value.sweep.called)
+
+        argv = ["udocker", "prune"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_prune.return_value.sweep.return_value = []
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_prune(cmdp)
+        self.assertEqual(status, 0)
+        mock_prune.return_value.sweep.assert_called_once_with(
+            [["layer", "/l/sha256:aa", 1024]])
+
+    @patch('udocker.cli.ContainerDedup')
+    @patch('udocker.cli.Msg')
+    def test_45_do_dedup(self, mock_msg, mock_dedup):
+        """Test45 UdockerCLI().do_dedup()."""
+        mock_msg.level = 0
+        argv = ["udocker", "dedup", "c1"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.get_container_id.return_value = ""
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_dedup(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_dedup.called)
+
+        argv = ["udocker", "dedup", "--reflink", "c1"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.get_container_id.return_value = "c1-id"
+        mock_dedup.return_value.dedup.return_value = (2, 8192)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_dedup(cmdp)
+        self.assertEqual(status, 0)
+        mock_dedup.assert_called_with(self.local, True)
+        mock_dedup.return_value.dedup.assert_called_with(["c1-id"])
+
+        argv = ["udocker", "dedup"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_dedup.return_value.dedup.return_value = None
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_dedup(cmdp)
+        self.assertEqual(status, 1)
+
+    @patch('udocker.cli.RepositoryDiskReport')
+    @patch('udocker.cli.Msg')
+    def test_46_do_df(self, mock_msg, mock_report):
+        """Test46 UdockerCLI().do_df()."""
+        mock_msg.level = 0
+        argv = ["udocker", "df", "--format=xml"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_df(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_report.called)
+
+        category = {"count": 1, "size": 10, "shared": 0, "reclaimable": 0}
+        mock_report.return_value.report.return_value = {
+            "summary": {"images": category, "containers": category,
+                        "layers": dict(category, dangling=0),
+                        "temporary": category,
+                        "total": {"size": 40, "reclaimable": 0}},
+            "images": {"IMG/T1": {"size": 10, "exclusive": 10}},
+            "layers": {"sha256:aa": {"size": 10, "tags": ["IMG/T1"]}},
+            "containers": {"c1": {"names": ["n1"], "size": 10,
+                                  "exclusive": 10}},
+            "reclaimable": [{"type": "temp", "path": "/t/x", "size": 10}]}
+        argv = ["udocker", "df", "-v"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_df(cmdp)
+        self.assertEqual(status, 0)
+        mock_report.assert_called_with(self.local)
+
+        argv = ["udocker", "df", "--format=json"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_msg.reset_mock()
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_df(cmdp)
+        self.assertEqual(status, 0)
+        self.assertTrue(
+            mock_msg.return_value.out.call_args[0][0].startswith("{"))
+
+
+    @patch('udocker.cli.ContainerCommit')
+    @patch('udocker.cli.ExecutionMode')
+    @patch('udocker.cli.Msg')
+    def test_47_do_commit(self, mock_msg, mock_exec, mock_commit):
+        """Test47 UdockerCLI().do_commit()."""
+        mock_msg.level = 0
+        argv = ["udocker", "commit", "mycont"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_commit(cmdp)
+        self.assertEqual(status, 1)
+
+        argv = ["udocker", "commit", "mycont", "new:1"]
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.get_container_id.return_value = ""
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_commit(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_commit.called)
+
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        self.local.get_container_id.return_value = "123"
+        mock_exec.return_value.get_mode.return_value = "F3"
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_commit(cmdp)
+        self.assertEqual(status, 1)
+        self.assertFalse(mock_commit.called)
+
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_exec.return_value.get_mode.return_value = "P1"
+        mock_commit.return_value.commit.return_value = True
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_commit(cmdp)
+        self.assertEqual(status, 0)
+        mock_commit.return_value.commit.assert_called_with("123", "new", "1")
+
+        cmdp = CmdParser()
+        cmdp.parse(argv)
+        mock_commit.return_value.commit.return_value = False
+        udoc = UdockerCLI(self.local)
+        status = udoc.do_commit(cmdp)
+        self.assertEqual(status, 1)
+
+
 if __name__ == '__main__':
     main()
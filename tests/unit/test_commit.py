@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: RootfsManifest and ContainerCommit
+"""
+
+import stat
+import tarfile
+from unittest import TestCase, main
+from unittest.mock import patch, Mock, mock_open
+from udocker.container.commit import RootfsManifest, ContainerCommit
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+DIGEST = "sha256:" + "a" * 64
+
+
+class RootfsManifestTestCase(TestCase):
+    """Test RootfsManifest() listing of container files."""
+
+    def setUp(self):
+        Config().getconf()
+
+    def tearDown(self):
+        pass
+
+    @patch('udocker.container.commit.os.readlink')
+    def test_01__entry(self, mock_readlink):
+        """Test01 RootfsManifest()._entry()."""
+        manifest = RootfsManifest("/c/123")
+        self.assertEqual(manifest.container_root, "/c/123/ROOT")
+        f_stat = Mock(st_mode=stat.S_IFREG | 0o644, st_size=10,
+                      st_mtime=5.5)
+        self.assertEqual(manifest._entry("/x", f_stat),
+                         ['f', 10, 0o644, 5, ""])
+        f_stat.st_mode = stat.S_IFDIR | 0o755
+        self.assertEqual(manifest._entry("/x", f_stat),
+                         ['d', 0, 0o755, 5, ""])
+        f_stat.st_mode = stat.S_IFLNK | 0o777
+        mock_readlink.return_value = "usr/bin"
+        self.assertEqual(manifest._entry("/x", f_stat),
+                         ['l', 0, 0o777, 5, "usr/bin"])
+        f_stat.st_mode = stat.S_IFSOCK | 0o755
+        self.assertIsNone(manifest._entry("/x", f_stat))
+
+    @patch.object(RootfsManifest, '_entry')
+    @patch('udocker.container.commit.os.lstat')
+    @patch('udocker.container.commit.os.walk')
+    def test_02_scan(self, mock_walk, mock_lstat, mock_entry):
+        """Test02 RootfsManifest().scan()."""
+        mock_walk.return_value = [("/c/123/ROOT", ["etc"], ["sock"]),
+                                  ("/c/123/ROOT/etc", [], ["passwd"])]
+        mock_entry.side_effect = [['d', 0, 0o755, 5, ""], None,
+                                  ['f', 1, 0o644, 5, ""]]
+        entries = RootfsManifest("/c/123").scan()
+        self.assertEqual(entries, {"/etc": ['d', 0, 0o755, 5, ""],
+                                   "/etc/passwd": ['f', 1, 0o644, 5, ""]})
+        mock_lstat.assert_called_with("/c/123/ROOT/etc/passwd")
+
+    @patch('udocker.container.commit.FileUtil')
+    @patch('udocker.container.commit.Msg')
+    @patch.object(RootfsManifest, 'scan')
+    def test_03_save(self, mock_scan, mock_msg, mock_futil):
+        """Test03 RootfsManifest().save() and load()."""
+        mock_scan.return_value = {"/etc": ['d', 0, 0o755, 5, ""]}
+        mopen = mock_open()
+        with patch('udocker.container.commit.open', mopen, create=True):
+            self.assertTrue(RootfsManifest("/c/123").save())
+        mopen.assert_called_with("/c/123/rootfs.manifest", 'w')
+        self.assertFalse(mock_futil.called)
+
+        mock_scan.side_effect = OSError("denied")
+        self.assertFalse(RootfsManifest("/c/123").save())
+        mock_futil.assert_called_with("/c/123/rootfs.manifest")
+
+        mopen = mock_open(read_data='{"version": 1, "entries": {"/x": []}}')
+        with patch('udocker.container.commit.open', mopen, create=True):
+            manifest = RootfsManifest("/c/123")
+            self.assertTrue(manifest.load())
+            self.assertEqual(manifest.entries, {"/x": []})
+        mopen = mock_open(read_data='{"version": 2, "entries": {}}')
+        with patch('udocker.container.commit.open', mopen, create=True):
+            self.assertFalse(RootfsManifest("/c/123").load())
+        self.assertFalse(RootfsManifest("/nonexistent/123").load())
+
+
+class ContainerCommitTestCase(TestCase):
+    """Test ContainerCommit() creation of images from containers."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.layersdir = "/r/layers"
+
+    def tearDown(self):
+        pass
+
+    def test_01__diff(self):
+        """Test01 ContainerCommit()._diff()."""
+        old = {"/bin": ['l', 0, 0o777, 5, "usr/bin"],
+               "/etc": ['d', 0, 0o755, 5, ""],
+               "/etc/hosts": ['f', 1, 0o644, 5, ""],
+               "/etc/passwd": ['f', 1, 0o644, 5, ""],
+               "/opt": ['d', 0, 0o755, 5, ""],
+               "/opt/x": ['d', 0, 0o755, 5, ""],
+               "/opt/x/y": ['f', 1, 0o644, 5, ""]}
+        new = {"/bin": ['d', 0, 0o755, 9, ""],
+               "/bin/sh": ['f', 1, 0o755, 9, ""],
+               "/etc": ['d', 0, 0o755, 9, ""],
+               "/etc/hosts": ['f', 1, 0o644, 5, ""],
+               "/etc/passwd": ['f', 2, 0o644, 9, ""]}
+        (whiteouts, changes) = ContainerCommit(self.local)._diff(old, new)
+        self.assertEqual(whiteouts, ["/bin", "/opt"])
+        self.assertEqual(changes, ["/bin", "/bin/sh", "/etc", "/etc/passwd"])
+
+        self.assertEqual(ContainerCommit(self.local)._diff(old, old),
+                         ([], []))
+
+    @patch('udocker.container.commit.LayerWriter')
+    def test_02__write_changes(self, mock_writer):
+        """Test02 ContainerCommit()._write_changes()."""
+        tarout = mock_writer.return_value.open.return_value
+        dirinfo = tarfile.TarInfo("opt")
+        dirinfo.type = tarfile.DIRTYPE
+        dirinfo.uid = 1000
+        tarout.gettarinfo.side_effect = [dirinfo, None]
+        mock_writer.return_value.close.return_value = {"file": "f"}
+        commit = ContainerCommit(self.local)
+        self.assertEqual(commit._write_changes("/c/ROOT", ["/usr/bin"],
+                                               ["/opt", "/sock"]),
+                         {"file": "f"})
+        whiteout = tarout.addfile.call_args_list[0][0][0]
+        self.assertEqual(whiteout.name, "usr/.wh.bin")
+        self.assertEqual(tarout.addfile.call_args_list[1][0][0].uid, 0)
+        self.assertEqual(tarout.addfile.call_count, 2)
+        tarout.gettarinfo.assert_called_with("/c/ROOT/sock", arcname="sock")
+
+        tarout.gettarinfo.side_effect = OSError("vanished")
+        with patch('udocker.container.commit.Msg'):
+            self.assertIsNone(commit._write_changes("/c/ROOT", [], ["/x"]))
+        self.assertTrue(mock_writer.return_value.abort.called)
+
+        mock_writer.return_value.open.return_value = None
+        self.assertIsNone(commit._write_changes("/c/ROOT", [], []))
+
+    @patch.object(ContainerCommit, '_diff_id')
+    @patch('udocker.container.commit.FileUtil')
+    @patch('udocker.container.commit.ChkSUM')
+    @patch('udocker.container.commit.LayerIndex')
+    @patch('udocker.container.commit.os.path.exists')
+    @patch('udocker.container.commit.os.path.realpath')
+    def test_03__base_layer(self, mock_realpath, mock_exists, mock_lindex,
+                            mock_chksum, mock_futil, mock_diffid):
+        """Test03 ContainerCommit()._base_layer()."""
+        mock_realpath.side_effect = lambda path: path
+        mock_lindex.return_value.compression.return_value = "gzip"
+        mock_futil.return_value.size.return_value = 10
+        commit = ContainerCommit(self.local)
+        self.assertEqual(
+            commit._base_layer("/r/layers/" + DIGEST, "sha256:bb"),
+            {"file": "/r/layers/" + DIGEST, "digest": DIGEST,
+             "diff_id": "sha256:bb", "size": 10,
+             "mediaType": commit.MEDIA_TYPES["gzip"]})
+        self.assertFalse(mock_chksum.called)
+        self.assertFalse(mock_diffid.called)
+
+        mock_lindex.return_value.compression.return_value = "tar"
+        mock_chksum.return_value.sha256.return_value = "a" * 64
+        mock_exists.return_value = False
+        mock_futil.return_value.copyto.return_value = True
+        layer = commit._base_layer("/r/layers/123.layer", "sha256:bb")
+        self.assertEqual(layer["file"], "/r/layers/" + DIGEST)
+        self.assertEqual(layer["diff_id"], DIGEST)
+        mock_futil.return_value.copyto.assert_called_with(
+            "/r/layers/" + DIGEST, link=True)
+
+        mock_lindex.return_value.compression.return_value = "gzip"
+        mock_diffid.return_value = "sha256:cc"
+        layer = commit._base_layer("/r/layers/123.layer", "sha256:bb")
+        self.assertEqual(layer["diff_id"], "sha256:cc")
+
+        with patch('udocker.container.commit.Msg'):
+            mock_futil.return_value.copyto.return_value = False
+            self.assertIsNone(commit._base_layer("/r/layers/123.layer"))
+            mock_lindex.return_value.compression.return_value = ""
+            self.assertIsNone(commit._base_layer("/r/layers/" + DIGEST))
+
+    @patch.object(ContainerCommit, '_base_layer')
+    def test_04__base_layers(self, mock_blayer):
+        """Test04 ContainerCommit()._base_layers()."""
+        mock_blayer.side_effect = lambda layer_file, diff_id: \
+            {"file": layer_file, "diff_id": diff_id}
+        commit = ContainerCommit(self.local)
+        image_json = {"rootfs": {"diff_ids": ["sha256:bb", "sha256:cc"]}}
+        self.assertEqual(commit._base_layers(image_json, ["l1", "l2"]),
+                         [{"file": "l1", "diff_id": "sha256:bb"},
+                          {"file": "l2", "diff_id": "sha256:cc"}])
+        self.assertEqual(commit._base_layers({}, ["l1"]),
+                         [{"file": "l1", "diff_id": ""}])
+
+        mock_blayer.side_effect = None
+        mock_blayer.return_value = None
+        self.assertIsNone(commit._base_layers(image_json, ["l1", "l2"]))
+
+    def test_05__container_json(self):
+        """Test05 ContainerCommit()._container_json()."""
+        container_json = {"id": "x", "Size": 1, "rootfs": {}, "config": {}}
+        image_json = {"history": [{"created_by": "/bin/sh"}]}
+        new_json = ContainerCommit(self.local)._container_json(
+            container_json, image_json, "123")
+        self.assertEqual(sorted(new_json.keys()),
+                         ["config", "created", "history"])
+        self.assertEqual(new_json["history"][0], {"created_by": "/bin/sh"})
+        self.assertEqual(new_json["history"][1]["created_by"],
+                         "udocker commit 123")
+        self.assertIn("id", container_json)
+
+    @patch.object(ContainerCommit, '_write_changes')
+    @patch.object(ContainerCommit, '_base_layers')
+    @patch('udocker.container.commit.FileUtil')
+    @patch('udocker.container.commit.RootfsManifest')
+    @patch('udocker.container.commit.Msg')
+    def test_06_commit(self, mock_msg, mock_manifest, mock_futil,
+                       mock_blayers, mock_wchanges):
+        """Test06 ContainerCommit().commit()."""
+        self.local.cd_imagerepo.side_effect = ["", "/r/repos/img/1"]
+        self.local.cd_container.return_value = "/c/123"
+        mock_manifest.return_value.load.return_value = True
+        mock_manifest.return_value.entries = {}
+        mock_manifest.return_value.scan.return_value = {}
+        self.local.load_json.return_value = {"config": {}}
+        mock_futil.return_value.getdata.return_value = "img:1"
+        self.local.get_image_attributes.return_value = ({}, ["l1"])
+        mock_blayers.return_value = [{"file": "l1"}]
+        mock_wchanges.return_value = {"file": "l2"}
+        self.local.setup_image_v2.return_value = True
+        commit = ContainerCommit(self.local)
+        self.assertFalse(commit.commit("123", "new", "1"))
+
+        self.local.get_image_attributes.return_value = ({"a": 1}, ["l1"])
+        self.local.cd_imagerepo.side_effect = ["", "/r/repos/img/1"]
+        self.assertTrue(commit.commit("123", "new", "1"))
+        self.local.cd_imagerepo.assert_called_with("img", "1")
+        self.local.index_layer.assert_called_with("l2")
+        self.assertEqual(self.local.setup_image_v2.call_args[0][3],
+                         [{"file": "l1"}, {"file": "l2"}])
+
+        self.local.cd_imagerepo.side_effect = ["", "/r/repos/img/1"]
+        mock_manifest.return_value.scan.side_effect = OSError("denied")
+        self.assertFalse(commit.commit("123", "new", "1"))
+
+        self.local.cd_imagerepo.side_effect = ["", "/r/repos/img/1"]
+        mock_manifest.return_value.load.return_value = False
+        self.assertFalse(commit.commit("123", "new", "1"))
+        self.assertEqual(mock_wchanges.call_count, 1)
+
+        self.local.cd_imagerepo.side_effect = ["/r/repos/new/1"]
+        self.assertFalse(commit.commit("123", "new", "1"))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,10 +29,13 @@ class CommonLocalFileApiTestCase(TestCase):
         clfapi = CommonLocalFileApi(self.local)
         self.assertEqual(clfapi.localrepo, self.local)
 
+    @patch('udocker.commonlocalfile.os.path.realpath')
     @patch('udocker.commonlocalfile.FileUtil.copyto')
     @patch('udocker.commonlocalfile.os.rename')
-    def test_02__move_layer_to_v1repo(self, mock_rename, mock_copy):
+    def test_02__move_layer_to_v1repo(self, mock_rename, mock_copy,
+                                      mock_realpath):
         """Test02 CommonLocalFileApi()._move_layer_to_v1repo()."""
+        mock_realpath.side_effect = lambda path: path
         layer_id = "xxx"
         filepath = "yy"
         self.local.layersdir = "/home/.udocker"
@@ -64,6 +67,16 @@ class CommonLocalFileApiTestCase(TestCase):
         self.assertTrue(mock_rename.called)
         self.assertTrue(self.local.add_image_layer.called)
 
+        layer_id = "sha256:12345"
+        filepath = "/tmp/img/blobs/sha256/12345"
+        mock_realpath.side_effect = None
+        mock_realpath.return_value = "/home/.udocker/udocker-1-x-12345"
+        clfapi = CommonLocalFileApi(self.local)
+        status = clfapi._move_layer_to_v1repo(filepath, layer_id)
+        self.assertTrue(status)
+        mock_rename.assert_called_with("/home/.udocker/udocker-1-x-12345",
+                                       "/home/.udocker/12345.layer")
+
     # def test_03__load_image_step2(self):
     #     """Test03 CommonLocalFileApi()._load_image_step2()."""
 
@@ -102,21 +115,6 @@ class CommonLocalFileApiTestCase(TestCase):
         status = clfapi._load_image(structure, imagerepo, tag)
         self.assertEqual(status, None)
 
-    @patch('udocker.commonlocalfile.Uprocess.call')
-    def test_05__untar_saved_container(self, mock_ucall):
-        """Test05 CommonLocalFileApi()._untar_saved_container()."""
-        tarfile = "file.tar"
-        destdir = "/home/.udocker/images"
-        mock_ucall.return_value = True
-        clfapi = CommonLocalFileApi(self.local)
-        status = clfapi._untar_saved_container(tarfile, destdir)
-        self.assertFalse(status)
-
-        mock_ucall.return_value = False
-        clfapi = CommonLocalFileApi(self.local)
-        status = clfapi._untar_saved_container(tarfile, destdir)
-        self.assertTrue(status)
-
     @patch('udocker.commonlocalfile.ChkSUM.hash')
     @patch('udocker.commonlocalfile.HostInfo.parse_platform')
     @patch('udocker.commonlocalfile.FileUtil.size')
@@ -142,6 +140,7 @@ class CommonLocalFileApiTestCase(TestCase):
         self.assertTrue(mock_size.called)
         self.assertTrue(mock_chksum.called)
 
+    @patch('udocker.commonlocalfile.FileUtil.reflink')
     @patch.object(CommonLocalFileApi, 'create_container_meta')
     @patch('udocker.commonlocalfile.Msg')
     @patch('udocker.commonlocalfile.os.rename')
@@ -149,7 +148,8 @@ class CommonLocalFileApiTestCase(TestCase):
     @patch('udocker.commonlocalfile.Unique.layer_v1')
     @patch('udocker.commonlocalfile.os.path.exists')
     def test_07_import_toimage(self, mock_exists, mock_layerv1,
-                               mock_copy, mock_rename, mock_msg, mock_contmeta):
+                               mock_copy, mock_rename, mock_msg, mock_contmeta,
+                               mock_reflink):
         """Test07 CommonLocalFileApi().import_toimage()."""
         tarfile = "img.tar"
         imagerepo = "/home/.udocker/images"
@@ -197,7 +197,8 @@ class CommonLocalFileApiTestCase(TestCase):
         imagerepo = "/home/.udocker/images"
         tag = "v1"
         move_tarball = True
-        mock_exists.side_effect = [True, False]
+        mock_exists.side_effect = [True, False, False]
+        mock_reflink.side_effect = OSError("not supported")
         self.local.setup_imagerepo.return_value = True
         self.local.cd_imagerepo.return_value = False
         self.local.setup_tag.return_value = True
@@ -212,7 +213,7 @@ class CommonLocalFileApiTestCase(TestCase):
         self.assertTrue(mock_rename.called)
 
         move_tarball = False
-        mock_exists.side_effect = [True, True]
+        mock_exists.side_effect = [True, True, True]
         self.local.setup_imagerepo.return_value = True
         self.local.cd_imagerepo.return_value = False
         self.local.setup_tag.return_value = True
@@ -228,6 +229,17 @@ class CommonLocalFileApiTestCase(TestCase):
         self.assertEqual(status, "12345")
         self.assertTrue(mock_layerv1.called)
         self.assertTrue(mock_contmeta.called)
+        self.assertIsNone(mock_contmeta.call_args[0][2])
+
+        mock_exists.side_effect = [True, False, False]
+        self.local.add_image_layer.side_effect = [True, True]
+        self.local.save_json.side_effect = [True, True]
+        mock_copy.return_value = True
+        status = clfapi.import_toimage(tarfile, imagerepo, tag, False)
+        self.assertEqual(status, "12345")
+        self.assertTrue(mock_reflink.called)
+        chksum = mock_copy.call_args[1]["chksum"]
+        self.assertEqual(mock_contmeta.call_args[0][2], chksum.hexdigest())
 
     @patch.object(CommonLocalFileApi, 'create_container_meta')
     @patch('udocker.commonlocalfile.Msg')
@@ -280,6 +292,8 @@ class CommonLocalFileApiTestCase(TestCase):
         self.assertTrue(mock_create.called)
         self.assertEqual(status, "345")
         self.assertTrue(mock_exists.called)
+        self.assertEqual(mock_contmeta.call_args[0][2], "")
+        self.assertEqual(mock_create.call_args[0][4].name, "sha256")
 
     @patch('udocker.commonlocalfile.Msg')
     @patch('udocker.commonlocalfile.ContainerStructure.clone_fromfile')
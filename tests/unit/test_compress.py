@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: Compression
+"""
+
+import os
+import gzip
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.utils.compress import Compression
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class CompressionTestCase(TestCase):
+    """Test Compression() parallel compression of archives."""
+
+    def setUp(self):
+        Config().getconf()
+        Config().conf['compress_threads'] = 2
+
+    def tearDown(self):
+        Config().conf['compress_threads'] = 0
+
+    def test_01_init(self):
+        """Test01 Compression()."""
+        compression = Compression("gzip")
+        self.assertEqual(compression.method, "gzip")
+        self.assertEqual(compression.threads, 2)
+
+        Config().conf['compress_threads'] = 0
+        self.assertGreaterEqual(Compression("zstd").threads, 1)
+
+    @patch('udocker.utils.compress.FileUtil.getdata')
+    def test_02_detect(self, mock_getdata):
+        """Test02 Compression().detect() and detect_file()."""
+        self.assertEqual(Compression.detect(b"\x1f\x8b\x08\x00"), "gzip")
+        self.assertEqual(Compression.detect(b"\x28\xb5\x2f\xfd"), "zstd")
+        self.assertEqual(Compression.detect(b"ustar"), "")
+        self.assertEqual(Compression.detect(b""), "")
+
+        mock_getdata.return_value = b"\x1f\x8b\x08\x00"
+        self.assertEqual(Compression.detect_file("img.tar.gz"), "gzip")
+        mock_getdata.assert_called_with('rb', 4)
+
+    @patch('udocker.utils.compress.FileUtil.find_exec')
+    def test_03__tool(self, mock_find):
+        """Test03 Compression()._tool() and tar_option()."""
+        mock_find.return_value = "/usr/bin/pigz"
+        compression = Compression("gzip")
+        self.assertEqual(compression._tool(),
+                         ["/usr/bin/pigz", "-c", "-p", "2"])
+        self.assertEqual(compression._tool(decompress=True),
+                         ["/usr/bin/pigz", "-d", "-c"])
+        self.assertEqual(compression.tar_option(),
+                         ["--use-compress-program=/usr/bin/pigz"])
+
+        mock_find.return_value = "/usr/bin/zstd"
+        compression = Compression("zstd")
+        self.assertEqual(compression._tool(),
+                         ["/usr/bin/zstd", "-c", "-q", "-T2"])
+        self.assertEqual(compression.tar_option(), [])
+
+        self.assertEqual(compression.tar_option(stream=True),
+                         ["--use-compress-program=/usr/bin/zstd"])
+
+        mock_find.return_value = ""
+        self.assertEqual(Compression("gzip")._tool(), [])
+        self.assertEqual(Compression("gzip").tar_option(), [])
+        self.assertEqual(Compression("gzip").tar_option(stream=True), ["-z"])
+        self.assertEqual(Compression("zstd").tar_option(stream=True),
+                         ["--zstd"])
+        self.assertEqual(Compression("lz4")._tool(), [])
+
+    def test_04__gzip_blocks(self):
+        """Test04 Compression()._gzip_blocks()."""
+        data = os.urandom(1000) * 300
+        compression = Compression("gzip")
+        compression.BLOCKSIZE = 64 * 1024
+        with tempfile.TemporaryFile() as infile, \
+                tempfile.TemporaryFile() as outfile:
+            infile.write(data)
+            infile.seek(0)
+            compression._gzip_blocks(os.dup(infile.fileno()),
+                                     outfile.fileno())
+            outfile.seek(0)
+            self.assertEqual(gzip.decompress(outfile.read()), data)
+        self.assertIsNone(compression._error)
+
+        member = compression._gzip_member(data)
+        self.assertEqual(gzip.decompress(member + member), data + data)
+
+    @patch('udocker.utils.compress.Msg')
+    @patch('udocker.utils.compress.threading.Thread')
+    @patch('udocker.utils.compress.os.close')
+    @patch('udocker.utils.compress.os.pipe')
+    @patch('udocker.utils.compress.subprocess.Popen')
+    @patch.object(Compression, '_tool')
+    def test_05_compress_to(self, mock_tool, mock_popen, mock_pipe,
+                            mock_close, mock_thread, mock_msg):
+        """Test05 Compression().compress_to()."""
+        mock_pipe.return_value = (5, 6)
+        mock_tool.return_value = ["/usr/bin/zstd", "-c", "-q", "-T2"]
+        compression = Compression("zstd")
+        self.assertEqual(compression.compress_to(3), 6)
+        mock_popen.assert_called_once()
+        self.assertEqual(mock_popen.call_args[1]["stdin"], 5)
+        self.assertEqual(mock_popen.call_args[1]["stdout"], 3)
+        mock_close.assert_called_with(5)
+
+        mock_tool.return_value = []
+        compression = Compression("gzip")
+        self.assertEqual(compression.compress_to(3), 6)
+        mock_thread.assert_called_with(target=compression._gzip_blocks,
+                                       args=(5, 3))
+        self.assertTrue(mock_thread.return_value.start.called)
+
+        self.assertIsNone(Compression("lz4").compress_to(3))
+
+    @patch('udocker.utils.compress.threading.Thread')
+    @patch('udocker.utils.compress.subprocess.Popen')
+    @patch.object(Compression, '_tool')
+    def test_06_decompress_from(self, mock_tool, mock_popen, mock_thread):
+        """Test06 Compression().decompress_from()."""
+        fileobj = Mock()
+        mock_tool.return_value = ["/usr/bin/zstd", "-d", "-c", "-q"]
+        compression = Compression("zstd")
+        self.assertEqual(compression.decompress_from(fileobj),
+                         mock_popen.return_value.stdout)
+        mock_thread.assert_called_with(
+            target=compression._feed,
+            args=(fileobj, mock_popen.return_value.stdin))
+
+        mock_tool.return_value = []
+        stream = Compression("gzip").decompress_from(fileobj)
+        self.assertIsInstance(stream, gzip.GzipFile)
+        self.assertIsNone(Compression("lz4").decompress_from(fileobj))
+
+    @patch('udocker.utils.compress.Msg')
+    @patch('udocker.utils.compress.os.close')
+    def test_07_close(self, mock_close, mock_msg):
+        """Test07 Compression().close()."""
+        compression = Compression("zstd")
+        compression._in_fd = 6
+        compression._proc = Mock()
+        compression._proc.wait.return_value = 0
+        self.assertTrue(compression.close())
+        mock_close.assert_called_with(6)
+        self.assertIsNone(compression._in_fd)
+
+        compression._proc.wait.return_value = 1
+        self.assertFalse(compression.close())
+        self.assertTrue(compression._proc.stdout.close.called)
+
+        compression = Compression("gzip")
+        compression._in_fd = 6
+        compression._thread = Mock()
+        compression._error = OSError("broken pipe")
+        self.assertFalse(compression.close())
+        self.assertTrue(compression._thread.join.called)
+        self.assertTrue(mock_msg.return_value.err.called)
+
+
+if __name__ == '__main__':
+    main()
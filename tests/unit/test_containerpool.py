@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: ContainerPool
+"""
+
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.container.pool import ContainerPool
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class ContainerPoolTestCase(TestCase):
+    """Test ContainerPool() pool of containers created in advance."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.topdir = "/home/u1/.udocker"
+
+    def tearDown(self):
+        pass
+
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_01_init(self, mock_regpre):
+        """Test01 ContainerPool() constructor."""
+        pool = ContainerPool(self.local, "centos/centos7", "latest")
+        self.assertEqual(pool.pool_tagdir,
+                         "/home/u1/.udocker/pool/centos/centos7/latest")
+        self.assertTrue(mock_regpre.called)
+
+    @patch('udocker.container.pool.os.listdir')
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_02_ready(self, mock_regpre, mock_lsdir):
+        """Test02 ContainerPool().ready()."""
+        mock_lsdir.return_value = ["pool.json", ".lock", "c2", "c1"]
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertEqual(pool.ready(), ["c1", "c2"])
+
+        mock_lsdir.side_effect = OSError("fail")
+        self.assertEqual(pool.ready(), [])
+
+    @patch.object(ContainerPool, 'refill_background')
+    @patch.object(ContainerPool, 'ready')
+    @patch.object(ContainerPool, 'image_digest')
+    @patch('udocker.container.pool.FileUtil.getdata')
+    @patch('udocker.container.pool.os.unlink')
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_03_claim(self, mock_regpre, mock_unlink, mock_getdata,
+                      mock_digest, mock_ready, mock_refill):
+        """Test03 ContainerPool().claim()."""
+        mock_ready.return_value = []
+        mock_digest.return_value = "sha256:aa"
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertEqual(pool.claim(), "")
+        self.assertFalse(mock_refill.called)
+
+        mock_ready.return_value = ["c1", "c2", "c3"]
+        mock_getdata.return_value = "sha256:aa"
+        mock_unlink.side_effect = [OSError("fail"), None, None]
+        self.local.cd_container.side_effect = ["", "/containers/c3"]
+        self.assertEqual(pool.claim(), "c3")
+        self.assertEqual(mock_unlink.call_count, 3)
+        self.assertTrue(mock_refill.called)
+        self.assertFalse(self.local.del_container.called)
+
+        mock_ready.return_value = ["c1", "c2"]
+        mock_getdata.side_effect = ["sha256:bb", "sha256:aa"]
+        mock_unlink.side_effect = None
+        self.local.cd_container.side_effect = None
+        self.local.cd_container.return_value = "/containers/c2"
+        self.assertEqual(pool.claim(), "c2")
+        self.local.del_container.assert_called_once_with("c1")
+
+    @patch('udocker.container.pool.FileUtil.putdata')
+    @patch('udocker.container.pool.ExecutionMode')
+    @patch('udocker.container.pool.ContainerStructure')
+    @patch.object(ContainerPool, 'invalidate')
+    @patch.object(ContainerPool, '_lock')
+    @patch.object(ContainerPool, 'ready')
+    @patch.object(ContainerPool, 'get_config')
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_04_refill(self, mock_regpre, mock_getconf, mock_ready,
+                       mock_lock, mock_invalidate, mock_cstruct,
+                       mock_xmode, mock_putdata):
+        """Test04 ContainerPool().refill()."""
+        mock_getconf.return_value = None
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertFalse(pool.refill())
+
+        mock_getconf.return_value = {"size": 2, "execmode": "F3"}
+        mock_lock.return_value = None
+        self.assertTrue(pool.refill())
+        self.assertFalse(mock_cstruct.called)
+
+        mock_lock.return_value = Mock()
+        mock_invalidate.return_value = "sha256:aa"
+        mock_ready.side_effect = [[], ["c1"], ["c1", "c2"]]
+        mock_cstruct.return_value.create_fromimage.side_effect = ["c1", "c2"]
+        mock_xmode.return_value.set_mode.return_value = True
+        self.assertTrue(pool.refill())
+        self.assertTrue(mock_invalidate.called)
+        self.assertEqual(mock_putdata.call_count, 2)
+        mock_putdata.assert_called_with("sha256:aa", 'w')
+        mock_xmode.return_value.set_mode.assert_called_with("F3")
+        mock_lock.return_value.release.assert_called_with()
+
+    @patch('udocker.container.pool.os.unlink')
+    @patch.object(ContainerPool, 'ready')
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_05_trim(self, mock_regpre, mock_ready, mock_unlink):
+        """Test05 ContainerPool().trim()."""
+        mock_ready.return_value = ["c1", "c2", "c3"]
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertTrue(pool.trim(1))
+        self.assertEqual(mock_unlink.call_count, 2)
+        self.local.del_container.assert_called_with("c3")
+
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_06_image_digest(self, mock_regpre):
+        """Test06 ContainerPool().image_digest()."""
+        self.local.cd_imagerepo.return_value = ""
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertEqual(pool.image_digest(), "")
+
+        self.local.cd_imagerepo.return_value = "/repos/centos/7"
+        self.local.get_image_attributes.return_value = (
+            {"os": "linux"}, ["/layers/sha256:aa"])
+        digest = pool.image_digest()
+        self.assertTrue(digest.startswith("sha256:"))
+        self.assertEqual(pool.image_digest(), digest)
+
+        self.local.get_image_attributes.return_value = (
+            {"os": "linux"}, ["/layers/sha256:bb"])
+        self.assertNotEqual(pool.image_digest(), digest)
+
+    @patch('udocker.container.pool.os.unlink')
+    @patch('udocker.container.pool.FileUtil.getdata')
+    @patch.object(ContainerPool, 'ready')
+    @patch.object(ContainerPool, 'image_digest')
+    @patch('udocker.container.pool.FileUtil.register_prefix')
+    def test_07_invalidate(self, mock_regpre, mock_digest, mock_ready,
+                           mock_getdata, mock_unlink):
+        """Test07 ContainerPool().invalidate()."""
+        mock_digest.return_value = "sha256:aa"
+        mock_ready.return_value = ["c1", "c2", "c3"]
+        mock_getdata.side_effect = ["sha256:aa", "sha256:bb", "sha256:bb",
+                                    "", ""]
+        pool = ContainerPool(self.local, "centos", "7")
+        self.assertEqual(pool.invalidate(), "sha256:aa")
+        self.assertEqual(mock_unlink.call_count, 2)
+        self.assertEqual(self.local.del_container.call_count, 2)
+        self.local.del_container.assert_called_with("c3")
+
+
+if __name__ == '__main__':
+    main()
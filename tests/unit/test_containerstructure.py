@@ -5,6 +5,7 @@
 udocker unit tests: ContainerStructure
 """
 
+import hashlib
 from unittest import TestCase, main
 from unittest.mock import patch, Mock
 from udocker.container.structure import ContainerStructure
@@ -165,10 +166,13 @@ class ContainerStructureTestCase(TestCase):
         status = prex._chk_container_root()
         self.assertEqual(status, 7)
 
+    @patch('udocker.container.structure.RootfsManifest')
+    @patch.object(ContainerStructure, '_chk_container_root')
     @patch.object(ContainerStructure, '_untar_layers')
     @patch('udocker.container.structure.Unique.uuid')
     @patch('udocker.container.structure.Msg')
-    def test_07_create_fromimage(self, mock_msg, mock_uuid, mock_untar):
+    def test_07_create_fromimage(self, mock_msg, mock_uuid, mock_untar,
+                                 mock_chkroot, mock_manifest):
         """Test07 ContainerStructure().create_fromimage()."""
         mock_msg.return_value.level.return_value = 0
         self.local.cd_imagerepo.return_value = ""
@@ -197,6 +201,15 @@ class ContainerStructureTestCase(TestCase):
         prex = ContainerStructure(self.local)
         status = prex.create_fromimage("imagerepo", "tag")
         self.assertEqual(status, "123456")
+        self.assertFalse(mock_manifest.called)
+
+        mock_untar.return_value = True
+        mock_chkroot.return_value = 7
+        prex = ContainerStructure(self.local)
+        status = prex.create_fromimage("imagerepo", "tag")
+        self.assertEqual(status, "123456")
+        mock_manifest.assert_called_with("/")
+        self.assertTrue(mock_manifest.return_value.save.called)
 
     @patch.object(ContainerStructure, '_chk_container_root')
     @patch.object(ContainerStructure, '_untar_layers')
@@ -268,6 +281,18 @@ class ContainerStructureTestCase(TestCase):
         prex = ContainerStructure(self.local)
         status = prex.create_fromlayer("imagerepo", "tag", "layer", cont_json)
         self.assertEqual(status, "123456")
+        self.assertNotIn("rootfs", cont_json)
+
+        # Layer hashed while extracted
+        chksum = hashlib.sha256(b"layer")
+        prex = ContainerStructure(self.local)
+        status = prex.create_fromlayer("imagerepo", "tag", "layer", cont_json,
+                                       chksum)
+        mock_untar.assert_called_with(["layer", ], "/ROOT/ROOT", chksum)
+        self.assertEqual(cont_json["rootfs"]["diff_ids"],
+                         ["sha256:" + chksum.hexdigest()])
+        self.local.save_json.assert_called_with("/ROOT/container.json",
+                                                cont_json)
 
     @patch.object(ContainerStructure, '_chk_container_root')
     @patch.object(ContainerStructure, '_untar_layers')
@@ -305,6 +330,7 @@ class ContainerStructureTestCase(TestCase):
                                  mock_uprocget, mock_base, mock_dir,
                                  mock_isdir, mock_lsdir):
         """Test10 ContainerStructure()._apply_whiteouts()."""
+        self.local.index_layer.return_value = None
         mock_hinfocmd.return_value = False
         mock_uprocget.return_value = ""
         prex = ContainerStructure(self.local)
@@ -327,12 +353,31 @@ class ContainerStructureTestCase(TestCase):
         self.assertTrue(mock_dir.called)
         self.assertTrue(mock_furm.called)
 
+        mock_uprocget.reset_mock()
+        mock_furm.reset_mock()
+        mock_base.side_effect = None
+        mock_base.return_value = ".wh.aa"
+        mock_dir.side_effect = None
+        mock_dir.return_value = "/d1"
+        mock_furm.side_effect = None
+        mock_isdir.side_effect = None
+        mock_isdir.return_value = True
+        self.local.index_layer.return_value = Mock()
+        self.local.index_layer.return_value.toc = {"entries": {}}
+        self.local.index_layer.return_value.whiteouts.return_value = \
+            ["/d1/.wh.aa"]
+        prex = ContainerStructure(self.local)
+        prex._apply_whiteouts("tarball", "/tmp")
+        self.assertFalse(mock_uprocget.called)
+        mock_furm.assert_called_once_with(recursive=True)
+
+    @patch('udocker.container.structure.FileUtil.sparsifydir')
     @patch('udocker.container.structure.HostInfo')
     @patch('udocker.container.structure.subprocess.call')
     @patch.object(ContainerStructure, '_apply_whiteouts')
     @patch('udocker.container.structure.Msg')
     def test_11__untar_layers(self, mock_msg, mock_appwhite, mock_call,
-                              mock_hinfo):
+                              mock_hinfo, mock_sparse):
         """Test11 ContainerStructure()._untar_layers()."""
         mock_msg.level = 0
         tarfiles = ["a.tar", "b.tar", ]
@@ -355,10 +400,20 @@ class ContainerStructureTestCase(TestCase):
         mock_appwhite.side_effect = [None, None]
         mock_call.side_effect = [0, 0, 0, 0]
         prex = ContainerStructure(self.local)
+        mock_sparse.return_value = (0, 0)
         status = prex._untar_layers(tarfiles, "/tmp")
         self.assertTrue(status)
         self.assertTrue(mock_call.call_count, 2)
         self.assertTrue(mock_appwhite.call_count, 2)
+        self.assertFalse(mock_sparse.called)
+
+        mock_appwhite.side_effect = [None, None]
+        mock_call.side_effect = [0, 0, 0, 0]
+        Config().conf['sparse_minsize'] = 1024 * 1024
+        status = prex._untar_layers(tarfiles, "/tmp")
+        Config().conf['sparse_minsize'] = 0
+        self.assertTrue(status)
+        mock_sparse.assert_called_with(1024 * 1024)
 
     @patch('udocker.container.structure.FileUtil.tar')
     @patch('udocker.container.structure.Msg')
@@ -401,12 +456,16 @@ class ContainerStructureTestCase(TestCase):
         self.assertEqual(status, "123456")
 
     @patch.object(ContainerStructure, '_chk_container_root')
+    @patch('udocker.container.structure.FileUtil.breaklink')
+    @patch('udocker.container.structure.os.listdir')
+    @patch('udocker.container.structure.FileUtil.clonedir')
     @patch('udocker.container.structure.FileUtil.copydir')
     @patch('udocker.container.structure.Unique.uuid')
     @patch('udocker.container.structure.Msg')
-    def test_14_clone(self, mock_msg, mock_uuid,
-                      mock_fucpd, mock_chkcont):
+    def test_14_clone(self, mock_msg, mock_uuid, mock_fucpd, mock_fuclone,
+                      mock_lsdir, mock_fubreak, mock_chkcont):
         """Test14 ContainerStructure().clone()."""
+        mock_fuclone.return_value = None
         # Empty source container_dir
         mock_msg.return_value.level.return_value = 0
         self.local.cd_container.return_value = ""
@@ -436,6 +495,127 @@ class ContainerStructureTestCase(TestCase):
         status = prex.clone()
         self.assertEqual(status, "123456")
 
+        # Files shared through reflinks or hard links
+        mock_fucpd.reset_mock()
+        mock_fuclone.return_value = True
+        mock_lsdir.return_value = ["ROOT", "container.json"]
+        prex = ContainerStructure(self.local, "src123")
+        status = prex.clone(hardlink=True)
+        self.assertEqual(status, "123456")
+        self.assertFalse(mock_fucpd.called)
+        self.assertEqual(mock_fubreak.call_count, 2)
+        self.local.hardlink_container.assert_any_call("src123")
+        self.local.hardlink_container.assert_any_call("123456")
+
+    @patch('udocker.container.structure.os.unlink')
+    @patch('udocker.container.structure.os.lstat')
+    def test_15__unlink_replaced(self, mock_lstat, mock_unlink):
+        """Test15 ContainerStructure()._unlink_replaced()."""
+        layer_index = Mock()
+        layer_index.toc = {"entries": {"/d1": ['d', 0, 493, 0, "", 0],
+                                       "/d1/f1": ['f', 1, 420, 0, "", 0],
+                                       "/d1/f2": ['f', 1, 420, 0, "", 0],
+                                       "/d1/f3": ['f', 1, 420, 0, "", 0]}}
+        linked = Mock(st_mode=0o100644, st_nlink=2)
+        single = Mock(st_mode=0o100644, st_nlink=1)
+        mock_lstat.side_effect = [linked, single, OSError("fail")]
+        prex = ContainerStructure(self.local)
+        prex._unlink_replaced(layer_index, "/ROOT")
+        mock_unlink.assert_called_once_with("/ROOT/d1/f1")
+
+    @patch('udocker.container.structure.os.close')
+    @patch('udocker.container.structure.os.open')
+    @patch('udocker.container.structure.Compression')
+    @patch('udocker.container.structure.FileUtil.tar')
+    @patch('udocker.container.structure.Msg')
+    def test_16__tar_tofile(self, mock_msg, mock_futar, mock_compress,
+                            mock_open, mock_close):
+        """Test16 ContainerStructure()._tar_tofile()."""
+        mock_futar.return_value = True
+        prex = ContainerStructure(self.local)
+        self.assertTrue(prex._tar_tofile("/ROOT", "cont.tar"))
+        mock_futar.assert_called_with("cont.tar")
+        self.assertFalse(mock_compress.called)
+
+        mock_open.return_value = 3
+        mock_compress.return_value.compress_to.return_value = 6
+        mock_compress.return_value.close.return_value = True
+        self.assertTrue(prex._tar_tofile("/ROOT", "cont.tar.zst", "zstd"))
+        mock_compress.assert_called_with("zstd")
+        mock_compress.return_value.compress_to.assert_called_with(3)
+        mock_futar.assert_called_with('-', stdout=6)
+        mock_close.assert_called_with(3)
+
+        mock_compress.return_value.close.return_value = False
+        self.assertFalse(prex._tar_tofile("/ROOT", "cont.tar.gz", "gzip"))
+
+        mock_futar.reset_mock()
+        mock_compress.return_value.compress_to.return_value = None
+        self.assertFalse(prex._tar_tofile("/ROOT", "cont.tar.gz", "gzip"))
+        self.assertFalse(mock_futar.called)
+
+        mock_open.side_effect = OSError("denied")
+        self.assertFalse(prex._tar_tofile("/ROOT", "cont.tar.gz", "gzip"))
+
+    @patch('udocker.container.structure.Msg')
+    @patch('udocker.container.structure.Compression')
+    @patch('udocker.container.structure.subprocess.Popen')
+    @patch('udocker.container.structure.open', create=True)
+    def test_17__untar_feed(self, mock_open, mock_popen, mock_compress,
+                            mock_msg):
+        """Test17 ContainerStructure()._untar_feed()."""
+        mock_open.return_value.read.side_effect = [b"\x1f\x8b..", b"tar", b""]
+        mock_compress.detect.return_value = "gzip"
+        mock_compress.return_value.tar_option.return_value = ["-z"]
+        mock_popen.return_value.wait.return_value = 0
+        chksum = hashlib.sha256()
+        prex = ContainerStructure(self.local)
+        self.assertEqual(prex._untar_feed(["tar", "-x"], "img.tar.gz",
+                                          chksum), 0)
+        self.assertEqual(mock_popen.call_args[0][0],
+                         ["tar", "-x", "-z", "-f", "-"])
+        mock_compress.return_value.tar_option.assert_called_with(stream=True)
+        self.assertEqual(mock_popen.return_value.stdin.write.call_count, 2)
+        self.assertEqual(chksum.hexdigest(),
+                         hashlib.sha256(b"\x1f\x8b..tar").hexdigest())
+        self.assertTrue(mock_open.return_value.close.called)
+
+        # tar exits early, the rest of the file is still hashed
+        mock_open.return_value.read.side_effect = [b"aa", b"bb", b""]
+        mock_popen.return_value.stdin.write.side_effect = OSError("pipe")
+        mock_popen.return_value.wait.return_value = 2
+        chksum = hashlib.sha256()
+        self.assertEqual(prex._untar_feed(["tar", "-x"], "img.tar", chksum), 2)
+        self.assertEqual(chksum.hexdigest(),
+                         hashlib.sha256(b"aabb").hexdigest())
+
+        mock_open.side_effect = OSError("not found")
+        self.assertEqual(prex._untar_feed(["tar", "-x"], "img.tar", chksum), 1)
+
+    @patch.object(ContainerStructure, '_untar_feed')
+    @patch('udocker.container.structure.HostInfo')
+    @patch('udocker.container.structure.subprocess.call')
+    @patch.object(ContainerStructure, '_apply_whiteouts')
+    @patch('udocker.container.structure.Msg')
+    def test_18__untar_layers_chksum(self, mock_msg, mock_appwhite, mock_call,
+                                     mock_hinfo, mock_feed):
+        """Test18 ContainerStructure()._untar_layers() hashing the layer."""
+        mock_msg.level = 0
+        mock_msg.VER = 3
+        mock_hinfo.return_value.cmd_has_option.return_value = False
+        mock_feed.return_value = 0
+        mock_call.return_value = 0
+        Config().conf['sparse_minsize'] = 0
+        chksum = hashlib.sha256()
+        prex = ContainerStructure(self.local)
+        self.assertTrue(prex._untar_layers(["-"], "/ROOT", chksum))
+        self.assertFalse(mock_appwhite.called)
+        self.assertEqual(mock_feed.call_args[0][1:], ("-", chksum))
+        self.assertEqual(mock_call.call_count, 1)
+
+        mock_feed.return_value = 2
+        self.assertFalse(prex._untar_layers(["a.tar"], "/ROOT", chksum))
+
 
 if __name__ == '__main__':
     main()
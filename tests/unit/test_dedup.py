@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: ContainerDedup
+"""
+
+import errno
+from unittest import TestCase, main
+from unittest.mock import patch, mock_open, Mock
+from udocker.container.dedup import ContainerDedup, file_sha256
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+BUILTIN = "builtins"
+BOPEN = BUILTIN + '.open'
+
+
+def fstat(ino, nlink=1, size=8192, mode=0o100644):
+    """Stat of a regular file"""
+    return Mock(st_ino=ino, st_nlink=nlink, st_size=size, st_mode=mode,
+                st_dev=1, st_uid=1000, st_gid=1000, st_mtime=10.0,
+                st_atime=10.0, st_blocks=size // 512)
+
+
+class ContainerDedupTestCase(TestCase):
+    """Test ContainerDedup() share identical files among containers."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.cd_container.side_effect = \
+            lambda container_id: "/c/" + container_id
+
+    def tearDown(self):
+        pass
+
+    def test_01_file_sha256(self):
+        """Test01 file_sha256()."""
+        with patch(BOPEN, mock_open(read_data=b"abc")):
+            self.assertEqual(file_sha256("/f1"), "ba7816bf8f01cfea414140de5da"
+                             "e2223b00361a396177a9cb410ff61f20015ad")
+        with patch(BOPEN, side_effect=IOError("fail")):
+            self.assertEqual(file_sha256("/f1"), "")
+
+    @patch('udocker.container.dedup.os.path.islink')
+    def test_02__select(self, mock_islink):
+        """Test02 ContainerDedup()._select()."""
+        self.local.get_containers_list.return_value = ["/c/c1", "/c/c2",
+                                                       "/c/c3", "/c/n1"]
+        mock_islink.side_effect = lambda path: path == "/c/n1"
+        self.local.get_container_attrs.side_effect = \
+            [{"execmode": "P1"}, {"execmode": "F3"}, None]
+        dedup = ContainerDedup(self.local)
+        self.assertEqual(dedup._select([]), ["c1"])
+
+        self.local.get_container_attrs.side_effect = None
+        self.local.get_container_attrs.return_value = {"execmode": "F1"}
+        self.assertEqual(dedup._select(["c1", "c1", "c2"]), ["c1", "c2"])
+
+    @patch('udocker.container.dedup.os.lstat')
+    @patch('udocker.container.dedup.os.walk')
+    def test_03__scan(self, mock_walk, mock_lstat):
+        """Test03 ContainerDedup()._scan()."""
+        mock_walk.return_value = [("/c/c1/ROOT/bin", [], ["a", "b", "c"])]
+        mock_lstat.side_effect = [fstat(1), fstat(2, size=10),
+                                  fstat(3, mode=0o120777)]
+        dedup = ContainerDedup(self.local)
+        dedup._cache["c1"] = {"version": 1, "linked": ["bin/a", "bin/z"],
+                              "files": {"bin/a": [], "bin/z": []}}
+        buckets = {}
+        dedup._scan("c1", buckets)
+        self.assertEqual(list(buckets), [(8192, 1, 0o100644, 1000, 1000)])
+        self.assertEqual([entry[1] for entry in list(buckets.values())[0]],
+                         ["bin/a"])
+        self.assertEqual(dedup._cache["c1"]["linked"], ["bin/a"])
+        self.assertEqual(list(dedup._cache["c1"]["files"]), ["bin/a"])
+
+    @patch.object(ContainerDedup, '_map')
+    def test_04__hash_files(self, mock_map):
+        """Test04 ContainerDedup()._hash_files()."""
+        mock_map.return_value = ["d2"]
+        dedup = ContainerDedup(self.local)
+        dedup._cache["c1"] = {"files": {"bin/a": [8192, 10.0, 1, "d1"]},
+                              "linked": []}
+        candidates = [("c1", "bin/a", "/c/c1/ROOT/bin/a", fstat(1)),
+                      ("c1", "bin/b", "/c/c1/ROOT/bin/b", fstat(2))]
+        digests = dedup._hash_files(candidates)
+        self.assertEqual(digests, {"/c/c1/ROOT/bin/a": "d1",
+                                   "/c/c1/ROOT/bin/b": "d2"})
+        mock_map.assert_called_once_with(file_sha256, ["/c/c1/ROOT/bin/b"])
+        self.assertEqual(dedup._cache["c1"]["files"]["bin/b"],
+                         [8192, 10.0, 2, "d2"])
+
+    @patch('udocker.container.dedup.FileUtil')
+    @patch('udocker.container.dedup.os.utime')
+    @patch('udocker.container.dedup.os.rename')
+    @patch('udocker.container.dedup.os.link')
+    @patch('udocker.container.dedup.os.chmod')
+    @patch('udocker.container.dedup.os.stat')
+    def test_05__replace(self, mock_stat, mock_chmod, mock_link,
+                         mock_rename, mock_utime, mock_fu):
+        """Test05 ContainerDedup()._replace()."""
+        mock_stat.return_value.st_mode = 0o40555
+        ContainerDedup(self.local)._replace("/c/c1/ROOT/a", "/c/c2/ROOT/a",
+                                            fstat(2))
+        self.assertEqual(mock_link.call_args[0][0], "/c/c1/ROOT/a")
+        self.assertEqual(mock_rename.call_args[0][1], "/c/c2/ROOT/a")
+        self.assertEqual(mock_chmod.call_count, 2)
+        self.assertFalse(mock_fu.called)
+
+        mock_link.reset_mock()
+        mock_stat.return_value.st_mode = 0o40755
+        ContainerDedup(self.local, True)._replace(
+            "/c/c1/ROOT/a", "/c/c2/ROOT/a", fstat(2))
+        self.assertTrue(mock_fu.return_value.reflink.called)
+        self.assertTrue(mock_utime.called)
+        self.assertFalse(mock_link.called)
+
+    @patch.object(ContainerDedup, '_replace')
+    def test_06__share(self, mock_replace):
+        """Test06 ContainerDedup()._share()."""
+        dedup = ContainerDedup(self.local)
+        for container_id in ("c1", "c2"):
+            dedup._cache[container_id] = {"files": {"a": [0, 0, 0, "d"],
+                                                    "b": [0, 0, 0, "d"]},
+                                          "linked": []}
+        files = [("c1", "a", "/c/c1/ROOT/a", fstat(1)),
+                 ("c1", "b", "/c/c1/ROOT/b", fstat(1, 2)),
+                 ("c2", "a", "/c/c2/ROOT/a", fstat(2)),
+                 ("c2", "b", "/c/c2/ROOT/b", fstat(3))]
+        mock_replace.side_effect = [None, OSError(errno.EACCES, "fail")]
+        dedup._share(files)
+        self.assertEqual(dedup._released, {(1, 2): [1, 1, 8192]})
+        self.assertEqual(dedup._changed, set(["c1", "c2"]))
+        self.assertEqual(dedup._cache["c2"]["linked"], ["a"])
+        self.assertEqual(dedup._cache["c1"]["linked"], ["a"])
+        self.assertEqual(dedup._cache["c2"]["files"]["a"],
+                         [8192, 10.0, 1, "d"])
+
+        dedup = ContainerDedup(self.local, True)
+        mock_replace.side_effect = OSError(errno.EOPNOTSUPP, "fail")
+        self.assertRaises(OSError, dedup._share, files)
+
+    @patch.object(ContainerDedup, '_save_cache')
+    @patch.object(ContainerDedup, '_share')
+    @patch.object(ContainerDedup, '_hash_files')
+    @patch.object(ContainerDedup, '_scan')
+    @patch.object(ContainerDedup, '_load_cache')
+    @patch.object(ContainerDedup, '_select')
+    def test_07_dedup(self, mock_select, mock_load, mock_scan, mock_hash,
+                      mock_share, mock_save):
+        """Test07 ContainerDedup().dedup()."""
+        entry_a = ("c1", "a", "/c/c1/ROOT/a", fstat(1))
+        entry_b = ("c2", "a", "/c/c2/ROOT/a", fstat(2))
+        entry_c = ("c2", "c", "/c/c2/ROOT/c", fstat(3))
+
+        def scan(container_id, buckets):
+            """fill the buckets"""
+            if container_id == "c1":
+                buckets["k1"] = [entry_a]
+                buckets["k2"] = [("c1", "x", "/c/c1/ROOT/x", fstat(4))]
+            else:
+                buckets["k1"].extend([entry_b, entry_c])
+
+        def share(dummy):
+            """record the changes"""
+            dedup._changed.update(["c1", "c2"])
+            dedup._released[(1, 2)] = [1, 1, 8192]
+
+        mock_select.return_value = ["c1", "c2"]
+        mock_scan.side_effect = scan
+        mock_hash.return_value = {"/c/c1/ROOT/a": "d1",
+                                  "/c/c2/ROOT/a": "d1",
+                                  "/c/c2/ROOT/c": "d2"}
+        mock_share.side_effect = share
+        dedup = ContainerDedup(self.local)
+        self.assertEqual(dedup.dedup(), (1, 8192))
+        mock_hash.assert_called_once_with([entry_a, entry_b, entry_c])
+        mock_share.assert_called_once_with([entry_a, entry_b])
+        self.assertEqual(self.local.hardlink_container.call_count, 2)
+        self.local.set_container_attrs.assert_called_with("c2", size=-1)
+        self.assertEqual(mock_save.call_count, 2)
+
+        mock_share.side_effect = OSError(errno.EOPNOTSUPP, "fail")
+        dedup = ContainerDedup(self.local, True)
+        with patch('udocker.container.dedup.Msg') as mock_msg:
+            self.assertEqual(dedup.dedup(), None)
+            self.assertIn("reflinks not supported",
+                          mock_msg.return_value.err.call_args[0][0])
+
+        mock_share.side_effect = OSError(errno.ENOSPC, "no space")
+        dedup = ContainerDedup(self.local, True)
+        with patch('udocker.container.dedup.Msg') as mock_msg:
+            self.assertEqual(dedup.dedup(), None)
+            self.assertEqual(mock_msg.return_value.err.call_args[0],
+                             ("Error: sharing files:",
+                              str(OSError(errno.ENOSPC, "no space"))))
+        self.assertEqual(
+            self.local.container_lock.return_value.release.call_count, 6)
+
+    def test_08__lock(self):
+        """Test08 ContainerDedup()._lock()."""
+        locks = {"c1": Mock(), "c2": Mock(), "c3": Mock()}
+        locks["c1"].acquire.return_value = True
+        locks["c2"].acquire.return_value = False
+        locks["c3"].acquire.return_value = True
+        self.local.container_lock.side_effect = lambda cid: locks[cid]
+        dedup = ContainerDedup(self.local)
+        self.assertEqual(dedup._lock(["c3", "c2", "c1"]), ["c3", "c1"])
+        self.assertEqual([call[0][0] for call in
+                          self.local.container_lock.call_args_list],
+                         ["c1", "c2", "c3"])
+        dedup._unlock()
+        self.assertTrue(locks["c1"].release.called)
+        self.assertTrue(locks["c3"].release.called)
+        self.assertFalse(locks["c2"].release.called)
+        self.assertEqual(dedup._locks, [])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: RepositoryDiskReport
+"""
+
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.container.diskreport import RepositoryDiskReport
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class RepositoryDiskReportTestCase(TestCase):
+    """Test RepositoryDiskReport() space used by the repository."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.layersdir = "/r/layers"
+        self.local.CONTAINER_USAGE = "usage.json"
+
+    def tearDown(self):
+        pass
+
+    @patch('udocker.container.diskreport.os.lstat')
+    @patch('udocker.container.diskreport.os.listdir')
+    def test_01__layers(self, mock_listdir, mock_lstat):
+        """Test01 RepositoryDiskReport()._layers()."""
+        mock_listdir.side_effect = OSError("fail")
+        report = RepositoryDiskReport(self.local)
+        self.assertEqual(report._layers(), ({}, 0))
+
+        mock_listdir.side_effect = None
+        mock_listdir.return_value = ["sha256:aa", "sha256:aa.toc",
+                                     "sha256:bb", "sha256:bb.lock",
+                                     "sha256:cc.tmp", "dir"]
+        mock_lstat.side_effect = \
+            lambda f_path: Mock(st_mode=0o40755 if f_path.endswith("dir")
+                                else 0o100644, st_blocks=8)
+        self.local.get_layers_refs.return_value = \
+            {"sha256:aa": ["IMG/T2", "IMG/T1"]}
+        (layers, indexes) = report._layers()
+        self.assertEqual(layers, {
+            "sha256:aa": {"size": 4096, "tags": ["IMG/T1", "IMG/T2"]},
+            "sha256:bb": {"size": 4096, "tags": []}})
+        self.assertEqual(indexes, 4096)
+
+    def test_02__images(self):
+        """Test02 RepositoryDiskReport()._images()."""
+        layers = {"sha256:aa": {"size": 10, "tags": ["IMG/T1", "IMG/T2"]},
+                  "sha256:bb": {"size": 5, "tags": ["IMG/T1"]},
+                  "sha256:cc": {"size": 3, "tags": []}}
+        images = RepositoryDiskReport(self.local)._images(layers)
+        self.assertEqual(images, {"IMG/T1": {"size": 15, "exclusive": 5},
+                                  "IMG/T2": {"size": 10, "exclusive": 0}})
+
+    @patch('udocker.container.diskreport.DiskUsage')
+    @patch('udocker.container.diskreport.os.path.islink')
+    def test_03__containers(self, mock_islink, mock_du):
+        """Test03 RepositoryDiskReport()._containers()."""
+        self.local.get_containers_list.return_value = \
+            ["/c/c1", "/c/n1", "/c/c2"]
+        mock_islink.side_effect = lambda path: path == "/c/n1"
+        self.local.get_container_name.side_effect = \
+            lambda container_id: ["n1"] if container_id == "c1" else []
+        mock_du.return_value.measure.side_effect = \
+            lambda paths: {paths[0]: (0, {})}
+        mock_du.return_value.summarize.return_value = {
+            "paths": {"/c/c1/ROOT": {"total": 30, "exclusive": 20}},
+            "total": 40, "shared": 10}
+        (containers, total, shared) = \
+            RepositoryDiskReport(self.local)._containers()
+        self.assertEqual(containers, {
+            "c1": {"names": ["n1"], "size": 30, "exclusive": 20},
+            "c2": {"names": [], "size": 0, "exclusive": 0}})
+        self.assertEqual((total, shared), (40, 10))
+        mock_du.assert_any_call("/c/c1/usage.json")
+        self.assertEqual(mock_du.return_value.save.call_count, 2)
+        mock_du.return_value.summarize.assert_called_once_with(
+            {"/c/c1/ROOT": (0, {}), "/c/c2/ROOT": (0, {})})
+
+    @patch('udocker.container.diskreport.RepositoryPrune')
+    @patch.object(RepositoryDiskReport, '_containers')
+    @patch.object(RepositoryDiskReport, '_layers')
+    def test_04_report(self, mock_layers, mock_containers, mock_prune):
+        """Test04 RepositoryDiskReport().report()."""
+        mock_layers.return_value = (
+            {"sha256:aa": {"size": 10, "tags": ["IMG/T1", "IMG/T2"]},
+             "sha256:bb": {"size": 5, "tags": ["IMG/T1"]},
+             "sha256:cc": {"size": 3, "tags": []}}, 1)
+        mock_containers.return_value = (
+            {"c1": {"names": [], "size": 30, "exclusive": 30}}, 30, 0)
+        mock_prune.return_value.mark.return_value = [
+            ["container", "/c/c2", 7], ["layer", "/r/layers/sha256:cc", 3],
+            ["temp", "/tmp/udocker-12-xx", 2]]
+        report = RepositoryDiskReport(self.local).report()
+        summary = report["summary"]
+        self.assertEqual(summary["images"], {"count": 2, "size": 15,
+                                             "shared": 10, "reclaimable": 0})
+        self.assertEqual(summary["layers"], {"count": 3, "size": 19,
+                                             "shared": 10, "dangling": 1,
+                                             "reclaimable": 3})
+        self.assertEqual(summary["containers"], {"count": 1, "size": 30,
+                                                 "shared": 0,
+                                                 "reclaimable": 7})
+        self.assertEqual(summary["temporary"], {"count": 1, "size": 2,
+                                                "shared": 0,
+                                                "reclaimable": 2})
+        self.assertEqual(summary["total"], {"size": 51, "reclaimable": 12})
+        self.assertEqual(report["images"]["IMG/T1"],
+                         {"size": 15, "exclusive": 5})
+        self.assertEqual(report["reclaimable"][0],
+                         {"type": "container", "path": "/c/c2", "size": 7})
+
+
+if __name__ == '__main__':
+    main()
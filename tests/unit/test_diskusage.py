@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: DiskUsage
+"""
+
+from unittest import TestCase, main
+from unittest.mock import patch, mock_open, Mock
+from udocker.utils.diskusage import DiskUsage
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+BUILTIN = "builtins"
+BOPEN = BUILTIN + '.open'
+
+
+class DiskUsageTestCase(TestCase):
+    """Test DiskUsage() measure the space used by directory trees."""
+
+    def setUp(self):
+        Config().getconf()
+
+    def tearDown(self):
+        pass
+
+    def test_01_init(self):
+        """Test01 DiskUsage()."""
+        disk_usage = DiskUsage("/c/usage.json")
+        self.assertEqual(disk_usage.cache_file, "/c/usage.json")
+        self.assertEqual(disk_usage.threads,
+                         Config.conf['diskusage_threads'])
+        self.assertEqual(disk_usage._cache, None)
+
+    @patch('udocker.utils.diskusage.os.path.exists')
+    def test_02__load(self, mock_exists):
+        """Test02 DiskUsage()._load()."""
+        mock_exists.return_value = False
+        disk_usage = DiskUsage("/c/usage.json")
+        disk_usage._load()
+        self.assertEqual(disk_usage._cache, {})
+
+        mock_exists.return_value = True
+        with patch(BOPEN, mock_open(
+                read_data='{"version": 1, "roots": {"/c/ROOT": {}}}')):
+            disk_usage._load()
+        self.assertEqual(disk_usage._cache, {"/c/ROOT": {}})
+
+        with patch(BOPEN, mock_open(read_data='{"version": 0}')):
+            disk_usage._load()
+        self.assertEqual(disk_usage._cache, {})
+
+    @patch('udocker.utils.diskusage.os.rename')
+    @patch.object(DiskUsage, '_load')
+    def test_03_save(self, mock_load, mock_rename):
+        """Test03 DiskUsage().save()."""
+        self.assertTrue(DiskUsage("").save())
+        self.assertFalse(mock_rename.called)
+
+        disk_usage = DiskUsage("/c/usage.json")
+        disk_usage._cache = {"/c/other": {}}
+        disk_usage._visited = {"/c/ROOT": {"": [1, 4096, {}, []]}}
+        with patch(BOPEN, mock_open()):
+            self.assertTrue(disk_usage.save())
+        self.assertFalse(mock_load.called)
+        self.assertTrue(mock_rename.called)
+        self.assertEqual(sorted(disk_usage._cache), ["/c/ROOT", "/c/other"])
+
+    @patch.object(DiskUsage, '_entries')
+    def test_04__scan(self, mock_entries):
+        """Test04 DiskUsage()._scan()."""
+        mock_entries.return_value = [
+            ("d1", Mock(st_mode=0o40755, st_nlink=2, st_blocks=8)),
+            ("f1", Mock(st_mode=0o100644, st_nlink=1, st_blocks=8)),
+            ("f2", Mock(st_mode=0o100644, st_nlink=1, st_blocks=16)),
+            ("h1", Mock(st_mode=0o100644, st_nlink=3, st_blocks=8,
+                        st_dev=1, st_ino=20)),
+        ]
+        (nbytes, links, subdirs) = DiskUsage()._scan("/c/ROOT")
+        self.assertEqual(nbytes, 24 * 512)
+        self.assertEqual(links, {"1:20": 8 * 512})
+        self.assertEqual(subdirs, ["d1"])
+
+    @patch('udocker.utils.diskusage.time.time')
+    @patch.object(DiskUsage, '_scan')
+    @patch('udocker.utils.diskusage.os.lstat')
+    def test_05__record(self, mock_lstat, mock_scan, mock_time):
+        """Test05 DiskUsage()._record()."""
+        mock_time.return_value = 1000
+        mock_lstat.return_value = Mock(st_mode=0o40755, st_dev=1,
+                                       st_mtime=900, st_blocks=8)
+        mock_scan.return_value = (4096, {}, ["d1"])
+        visited = {}
+        record = DiskUsage()._record("/c/ROOT/usr", "usr", 1, {}, visited)
+        self.assertEqual(record, [900, 4096 + 8 * 512, {}, ["d1"]])
+        self.assertEqual(visited, {"usr": record})
+
+        mock_scan.reset_mock()
+        cache = {"usr": [900, 100, {}, []]}
+        record = DiskUsage()._record("/c/ROOT/usr", "usr", 1, cache, {})
+        self.assertEqual(record, [900, 100, {}, []])
+        self.assertFalse(mock_scan.called)
+
+        mock_time.return_value = 901
+        cache = {"usr": [800, 100, {}, []]}
+        record = DiskUsage()._record("/c/ROOT/usr", "usr", 1, cache, {})
+        self.assertEqual(record[0], 0)
+        self.assertTrue(mock_scan.called)
+
+        record = DiskUsage()._record("/c/ROOT/usr", "usr", 2, {}, {})
+        self.assertEqual(record, None)
+
+    @patch.object(DiskUsage, '_record')
+    def test_06__walk(self, mock_record):
+        """Test06 DiskUsage()._walk()."""
+        mock_record.side_effect = [[1, 100, {"1:2": 10}, ["d1", "d2"]],
+                                   [1, 200, {"1:2": 10}, []],
+                                   None]
+        (nbytes, links, dummy) = DiskUsage()._walk(("/c/ROOT", "usr", 1, {}))
+        self.assertEqual(nbytes, 300)
+        self.assertEqual(links, {"1:2": 10})
+        self.assertEqual(mock_record.call_count, 3)
+
+    def test_07__map(self):
+        """Test07 DiskUsage()._map()."""
+        disk_usage = DiskUsage()
+        self.assertEqual(disk_usage._map(abs, [-1, -2, 3]), [1, 2, 3])
+        disk_usage.threads = 1
+        self.assertEqual(disk_usage._map(abs, [-1, -2, 3]), [1, 2, 3])
+
+    @patch.object(DiskUsage, '_walk')
+    @patch.object(DiskUsage, '_record')
+    @patch('udocker.utils.diskusage.os.lstat')
+    @patch.object(DiskUsage, '_load')
+    def test_08_measure(self, mock_load, mock_lstat, mock_record,
+                         mock_walk):
+        """Test08 DiskUsage().measure()."""
+        mock_lstat.return_value.st_dev = 1
+        mock_record.return_value = [1, 100, {"1:2": 10}, ["d1"]]
+        mock_walk.return_value = (200, {"1:3": 20}, {"d1": []})
+        disk_usage = DiskUsage()
+        disk_usage.threads = 1
+        disk_usage._cache = {}
+        measured = disk_usage.measure(["/c/ROOT/"])
+        self.assertEqual(measured,
+                         {"/c/ROOT": [300, {"1:2": 10, "1:3": 20}]})
+        mock_walk.assert_called_once_with(("/c/ROOT", "d1", 1, {}))
+        self.assertIn("d1", disk_usage._visited["/c/ROOT"])
+        self.assertFalse(mock_load.called)
+
+        mock_lstat.side_effect = OSError("fail")
+        self.assertEqual(disk_usage.measure(["/c/ROOT"]), {})
+
+    @patch.object(DiskUsage, 'measure')
+    def test_09_size(self, mock_measure):
+        """Test09 DiskUsage().size()."""
+        mock_measure.return_value = {"/c/ROOT": [300, {"1:2": 10}]}
+        self.assertEqual(DiskUsage().size("/c/ROOT"), 310)
+        mock_measure.return_value = {}
+        self.assertEqual(DiskUsage().size("/c/ROOT"), -1)
+
+    @patch.object(DiskUsage, 'measure')
+    def test_10_report(self, mock_measure):
+        """Test10 DiskUsage().report()."""
+        mock_measure.return_value = {
+            "/c/a": [300, {"1:2": 10, "1:3": 20}],
+            "/c/b": [100, {"1:2": 10}]}
+        usage = DiskUsage().report(["/c/a", "/c/b"])
+        self.assertEqual(usage["paths"]["/c/a"],
+                         {"total": 330, "exclusive": 320})
+        self.assertEqual(usage["paths"]["/c/b"],
+                         {"total": 110, "exclusive": 100})
+        self.assertEqual(usage["shared"], 10)
+        self.assertEqual(usage["total"], 430)
+
+
+if __name__ == '__main__':
+    main()
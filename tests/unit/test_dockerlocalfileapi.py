@@ -195,6 +195,15 @@ class DockerLocalFileAPITestCase(TestCase):
         status = dlocapi._load_image_step2(struc, imgrepo, tag)
         self.assertEqual(status, [])
 
+        struc["repolayers"][lid]["VERSION"] = "1.0"
+        mock_mvlayer.reset_mock()
+        mock_mvlayer.side_effect = None
+        mock_mvlayer.return_value = True
+        status = dlocapi._load_image_step2(struc, imgrepo, tag)
+        self.assertEqual(status, [])
+        self.assertEqual(mock_mvlayer.call_count, 2)
+        self.assertTrue(mock_msg.return_value.err.called)
+
     @patch('udocker.docker.CommonLocalFileApi._load_image')
     def test_07__load_repositories(self, mock_loadi):
         """Test07 DockerLocalFileAPI()._load_repositories()."""
@@ -250,131 +259,81 @@ class DockerLocalFileAPITestCase(TestCase):
         status = dlocapi.load(tmp_imgdir)
         self.assertEqual(status, ["repo1", "repo2"])
 
-    @patch('udocker.docker.FileUtil.putdata')
     @patch('udocker.docker.CommonLocalFileApi.create_container_meta')
-    @patch('udocker.docker.FileUtil.copyto')
-    @patch('udocker.docker.FileUtil.mkdir')
-    @patch('udocker.docker.os.path.exists')
-    @patch('udocker.docker.os.path.basename')
-    @patch('udocker.docker.FileUtil.rename')
-    @patch('udocker.docker.ChkSUM.sha256')
-    def test_09__save_image(self, mock_sha256, mock_rename, mock_osbase,
-                            mock_exists, mock_mkdir, mock_copyto,
-                            mock_meta, mock_put):
+    @patch('udocker.docker.os.path.realpath')
+    def test_09__save_image(self, mock_realpath, mock_meta):
         """Test09 DockerLocalFileAPI()._save_image()."""
-        imgrepo = "img1"
-        tag = "tag1"
-        struct = dict()
-        tmp_imgdir = "/tmp/img1"
-        manifest = dict()
-        self.local.cd_imagerepo.return_value = None
-        self.local.get_image_attributes.return_value = \
-            (manifest, ['/cont/lname1.layer'])
-        self.local.save_json.side_effect = [False, True]
-        dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi._save_image(imgrepo, tag, struct, tmp_imgdir)
-        self.assertFalse(status)
-
-        imgrepo = "IMAGE"
-        tag = "tag1"
-        fname = "x" * 64
-        fulllayer = "/tmp/" + fname + "/layer1"
-        struc = {"repolayers": {fname: {"layer_f": fulllayer}},
-                 "repositories": {"IMAGE": {"TAG": "tag1", }, }}
-        tmp_imgdir = "/tmp/img1"
-        manifest = {
-            "fsLayers": ({"blobSum": "foolayername"},),
-            "history": ({"v1Compatibility": '["foojsonstring"]'},)
-        }
-        mock_sha256.return_value = \
-            "8a29a15cefaeccf6545f7ecf11298f9672d2f0cdaf9e357a95133ac3ad3e1f07"
-        mock_rename.return_value = None
-        mock_osbase.return_value = "lname1.layer"
-        mock_exists.return_value = False
-        mock_mkdir.return_value = None
-        mock_copyto.return_value = False
-        self.local.cd_imagerepo.return_value = None
-        self.local.get_image_attributes.return_value = \
-            (manifest, ['/cont/lname1.layer'])
-        self.local.save_json.side_effect = [True, True]
+        tarstream = Mock()
+        struc = {"manifest": [], "repositories": {}, "saved": set()}
+        self.local.get_image_attributes.return_value = ({}, [])
         dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi._save_image(imgrepo, tag, struc, tmp_imgdir)
+        status = dlocapi._save_image("repo1", "tag1", struc, tarstream)
         self.assertFalse(status)
+        self.assertFalse(tarstream.add_data.called)
 
-        imgrepo = "repo1"
-        tag = "tag1"
-        fname = "x" * 64
-        fulllayer = "/tmp/" + fname + "/lname1.layer"
-        manifest = {
-            "fsLayers": ({"blobSum": "foolayername"},),
-            "history": ({"v1Compatibility": '["foojsonstring"]'},)
-        }
-        struc = {"repolayers": {fname: {"layer_f": fulllayer}},
-                 "repositories": {"repo1": {"TAG": "tag1", }, },
-                 "manifest": [manifest]}
-        tmp_imgdir = "/tmp/img1"
-        mock_sha256.return_value = \
-            "8a29a15cefaeccf6545f7ecf11298f9672d2f0cdaf9e357a95133ac3ad3e1f07"
-        mock_rename.return_value = None
-        mock_osbase.return_value = "lname1.layer"
-        mock_exists.return_value = False
-        mock_mkdir.return_value = None
-        mock_copyto.return_value = True
-        mock_meta.return_value = dict()
-        self.local.save_json.return_value = True
-        mock_put.return_value = True
-        self.local.cd_imagerepo.return_value = None
+        layer1 = "a" * 64
+        layer2 = "b" * 64
+        mock_realpath.side_effect = lambda path: path
+        mock_meta.side_effect = lambda layer_id, layer_chksum: {}
         self.local.get_image_attributes.return_value = \
-            (manifest, ['/cont/lname1.layer'])
-        self.local.save_json.side_effect = [True, True]
-        dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi._save_image(imgrepo, tag, struc, tmp_imgdir)
+            ({"config": {}}, ["/r/layers/sha256:" + layer1,
+                              "/r/layers/" + layer2 + ".layer"])
+        status = dlocapi._save_image("repo1", "tag1", struc, tarstream)
         self.assertTrue(status)
+        self.assertEqual(tarstream.add_file.call_count, 2)
+        tarstream.add_file.assert_any_call(
+            layer1 + "/layer.tar", "/r/layers/sha256:" + layer1, None)
+        self.assertIsNotNone(tarstream.add_file.call_args[0][2])
+        self.assertEqual(len(mock_meta.call_args[1]["layer_chksum"]), 64)
+        self.assertEqual(struc["repositories"], {"repo1": {"tag1": layer1}})
+        self.assertEqual(struc["manifest"][0]["Layers"],
+                         [layer1 + "/layer.tar", layer2 + "/layer.tar"])
+        self.assertIn(layer2 + "/json", [call[0][0] for call
+                                         in tarstream.add_data.call_args_list])
+
+        tarstream.reset_mock()
+        status = dlocapi._save_image("repo1", "tag2", struc, tarstream)
+        self.assertTrue(status)
+        self.assertFalse(tarstream.add_file.called)
+        self.assertFalse(tarstream.add_data.called)
+        self.assertEqual(struc["manifest"][1]["Layers"],
+                         struc["manifest"][0]["Layers"])
 
     @patch('udocker.docker.Msg')
     @patch.object(DockerLocalFileAPI, '_save_image')
-    @patch('udocker.docker.FileUtil.remove')
-    @patch('udocker.docker.FileUtil.tar')
-    @patch('udocker.docker.os.makedirs')
-    @patch('udocker.docker.FileUtil.mktmp')
-    def test_10_save(self, mock_mktmp, mock_mkdir, mock_tar,
-                     mock_rm, mock_svimg, mock_msg):
+    @patch('udocker.docker.TarStream')
+    def test_10_save(self, mock_tarstream, mock_svimg, mock_msg):
         """Test10 DockerLocalFileAPI().save()."""
-        imglist = list()
-        imgfile = ""
         mock_msg.level = 0
-        mock_mktmp.return_value = "/tmp/img1"
-        mock_mkdir.return_value = None
-        mock_rm.return_value = None
-        self.local.save_json.side_effect = [True, True]
         dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi.save(imglist, imgfile)
-        self.assertFalse(status)
+        self.assertFalse(dlocapi.save([], "img.tar"))
+        self.assertFalse(mock_tarstream.called)
 
         imglist = [("/img1", "tag1"), ]
-        imgfile = ""
-        mock_mktmp.return_value = "/tmp/img1"
-        mock_mkdir.return_value = None
-        mock_rm.return_value = None
-        mock_svimg.return_value = True
-        mock_tar.return_value = False
-        self.local.save_json.side_effect = [True, True]
-        dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi.save(imglist, imgfile)
-        self.assertFalse(status)
+        mock_tarstream.return_value.open.return_value = False
+        self.assertFalse(dlocapi.save(imglist, "img.tar"))
+        self.assertFalse(mock_svimg.called)
 
-        imglist = [("/img1", "tag1"), ]
-        imgfile = ""
-        mock_mktmp.return_value = "/tmp/img1"
-        mock_mkdir.return_value = None
-        mock_rm.return_value = None
-        mock_svimg.return_value = True
-        mock_tar.return_value = True
-        self.local.save_json.side_effect = [True, True]
-        dlocapi = DockerLocalFileAPI(self.local)
-        status = dlocapi.save(imglist, imgfile)
-        self.assertTrue(status)
+        mock_tarstream.return_value.open.return_value = True
+        mock_svimg.return_value = False
+        self.assertFalse(dlocapi.save(imglist, "img.tar"))
+        self.assertTrue(mock_tarstream.return_value.abort.called)
 
+        mock_tarstream.reset_mock()
+        mock_svimg.return_value = True
+        mock_tarstream.return_value.add_data.side_effect = OSError("full")
+        self.assertFalse(dlocapi.save(imglist, "img.tar"))
+        self.assertTrue(mock_tarstream.return_value.abort.called)
+
+        mock_tarstream.reset_mock()
+        mock_tarstream.return_value.add_data.side_effect = None
+        self.assertTrue(dlocapi.save(imglist, "img.tar"))
+        mock_tarstream.assert_called_once_with("img.tar", "")
+        names = [call[0][0] for call in
+                 mock_tarstream.return_value.add_data.call_args_list]
+        self.assertEqual(names, ["manifest.json", "repositories"])
+        self.assertTrue(mock_tarstream.return_value.close.called)
+        self.assertFalse(mock_tarstream.return_value.abort.called)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: FileLock
+"""
+
+from unittest import TestCase, main
+from unittest.mock import patch
+from udocker.utils.filelock import FileLock
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class FileLockTestCase(TestCase):
+    """Test FileLock() advisory locks on files."""
+
+    def test_01_init(self):
+        """Test01 FileLock()."""
+        lock = FileLock("/r/layers/sha256:aa.lock")
+        self.assertEqual(lock.lock_file, "/r/layers/sha256:aa.lock")
+        self.assertFalse(lock.shared)
+        self.assertTrue(lock.blocking)
+        self.assertFalse(lock.locked())
+
+    @patch('udocker.utils.filelock.os.close')
+    @patch('udocker.utils.filelock.fcntl')
+    @patch('udocker.utils.filelock.os.open')
+    def test_02_acquire(self, mock_open, mock_fcntl, mock_close):
+        """Test02 FileLock().acquire()."""
+        (mock_fcntl.LOCK_SH, mock_fcntl.LOCK_EX, mock_fcntl.LOCK_NB) = (1, 2, 4)
+        mock_open.side_effect = OSError("read-only")
+        lock = FileLock("/r/.lock")
+        self.assertFalse(lock.acquire())
+        self.assertFalse(lock.locked())
+
+        mock_open.side_effect = None
+        mock_open.return_value = 3
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked())
+        mock_fcntl.flock.assert_called_once_with(3, 2)
+        self.assertTrue(lock.acquire())
+        self.assertEqual(mock_fcntl.flock.call_count, 1)
+
+        mock_fcntl.reset_mock()
+        lock = FileLock("/r/.lock", shared=True, blocking=False)
+        self.assertTrue(lock.acquire())
+        mock_fcntl.flock.assert_called_once_with(3, 1 | 4)
+
+        mock_fcntl.flock.side_effect = IOError("would block")
+        lock = FileLock("/r/.lock", blocking=False)
+        self.assertFalse(lock.acquire())
+        mock_close.assert_called_once_with(3)
+
+    @patch('udocker.utils.filelock.os.close')
+    @patch('udocker.utils.filelock.fcntl')
+    @patch('udocker.utils.filelock.os.open')
+    def test_03_release(self, mock_open, mock_fcntl, mock_close):
+        """Test03 FileLock().release()."""
+        mock_open.return_value = 3
+        lock = FileLock("/r/.lock")
+        lock.release()
+        self.assertFalse(mock_close.called)
+        with lock:
+            self.assertTrue(lock.locked())
+        self.assertFalse(lock.locked())
+        mock_close.assert_called_once_with(3)
+
+
+if __name__ == '__main__':
+    main()
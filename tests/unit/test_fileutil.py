@@ -5,8 +5,10 @@ udocker unit tests: FileUtil
 
 import os
 import sys
+import errno
+import hashlib
 from unittest import TestCase, main
-from unittest.mock import patch, mock_open
+from unittest.mock import patch, mock_open, Mock
 from udocker.utils.fileutil import FileUtil
 from udocker.config import Config
 import collections
@@ -138,6 +140,9 @@ class FileUtilTestCase(TestCase):
         self.assertTrue(tmp_file.endswith('-filename2.txt'))
         self.assertTrue(tmp_file.startswith('/somewhere/udocker-'))
         self.assertGreater(len(tmp_file.strip()), 68)
+        tmp_file = FileUtil('filename2.txt').mktmp('/repo/tmp')
+        self.assertTrue(tmp_file.startswith('/repo/tmp/udocker-'))
+        self.assertIn(tmp_file, FileUtil.tmptrash)
 
     @patch('udocker.utils.fileutil.os.makedirs')
     @patch('udocker.utils.fileutil.os.path.abspath')
@@ -390,42 +395,29 @@ class FileUtilTestCase(TestCase):
         futil.rchmod()
         self.assertTrue(mock_fuchmod.called)
 
-    @patch('udocker.utils.fileutil.os.rmdir')
-    @patch('udocker.utils.fileutil.os.unlink')
-    @patch('udocker.utils.fileutil.os.chmod')
-    @patch('udocker.utils.fileutil.os.walk')
-    @patch('udocker.utils.fileutil.os.path.islink')
+    @patch('udocker.utils.fileutil.Msg')
+    @patch('udocker.utils.fileutil.TreeRemove')
     @patch('udocker.utils.fileutil.os.path.abspath')
     @patch('udocker.utils.fileutil.os.path.basename')
     @patch.object(FileUtil, '_register_prefix')
     def test_16__removedir(self, mock_regpre, mock_base, mock_absp,
-                           mock_islink, mock_walk, mock_chmod,
-                           mock_unlink, mock_rmdir):
+                           mock_tree, mock_msg):
         """Test16 FileUtil._removedir()."""
         mock_regpre.return_value = None
-        mock_base.return_value = 'filename.txt'
-        mock_absp.return_value = '/tmp/filename.txt'
-        mock_walk.return_value = [("/tmp", ["dir"], ["file"]), ]
-        mock_islink.side_effect = [False, True, True, True]
-        mock_chmod.side_effect = [None, None, None, None]
-        mock_unlink.side_effect = [None, None, None, None]
-        mock_rmdir.side_effect = [None, None, None, None]
+        mock_base.return_value = 'directory'
+        mock_absp.return_value = '/tmp/directory'
+        mock_tree.return_value.remove.return_value = True
         # remove directory under /tmp OK
         futil = FileUtil("/tmp/directory")
         status = futil._removedir()
-        self.assertTrue(mock_walk.called)
-        self.assertTrue(mock_islink.call_count, 2)
-        self.assertTrue(mock_chmod.call_count, 3)
+        mock_tree.return_value.remove.assert_called_with("/tmp/directory")
         self.assertTrue(status)
 
-        mock_regpre.return_value = None
-        mock_base.return_value = 'filename.txt'
-        mock_absp.return_value = '/tmp/filename.txt'
-        mock_walk.return_value = list()
-        mock_chmod.side_effect = OSError("fail")
-        futil = FileUtil("/directory")
+        mock_tree.return_value.remove.return_value = False
+        futil = FileUtil("/tmp/directory")
         status = futil._removedir()
         self.assertFalse(status)
+        self.assertTrue(mock_msg.return_value.err.called)
 
     @patch('udocker.utils.fileutil.os.path.realpath')
     @patch('udocker.utils.fileutil.os.path.exists')
@@ -813,8 +805,42 @@ class FileUtilTestCase(TestCase):
     # def test_34__file2stream(self):
     #     """Test34 FileUtil._file2stream()."""
 
-    # def test_35__file2file(self):
-    #     """Test35 FileUtil._file2file()."""
+    @patch.object(FileUtil, '_copy_fast')
+    @patch('udocker.utils.fileutil.os.path.isfile')
+    @patch('udocker.utils.fileutil.os.fstat')
+    @patch('udocker.utils.fileutil.os.link')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_35__file2file(self, mock_regpre, mock_link, mock_fstat,
+                           mock_isfile, mock_fast):
+        """Test35 FileUtil._file2file()."""
+        mock_regpre.return_value = None
+        status = FileUtil("/src").copyto("/dst", link=True)
+        self.assertTrue(status)
+        mock_link.assert_called_with("/src", "/dst")
+
+        mock_link.side_effect = OSError("cross-device link")
+        mock_isfile.return_value = True
+        mock_fstat.return_value.st_size = 10
+        with patch(BUILTINS + '.open', mock_open()):
+            status = FileUtil("/src").copyto("/dst", link=True)
+        self.assertTrue(status)
+        self.assertTrue(mock_fast.called)
+
+        mock_fast.side_effect = OSError(errno.ENOSPC, "no space")
+        with patch(BUILTINS + '.open', mock_open()):
+            status = FileUtil("/src").copyto("/dst")
+        self.assertFalse(status)
+
+        mock_link.reset_mock()
+        mock_fast.reset_mock()
+        chksum = hashlib.sha256()
+        with patch(BUILTINS + '.open', mock_open(read_data=b"layer")):
+            status = FileUtil("/src").copyto("/dst", link=True, chksum=chksum)
+        self.assertTrue(status)
+        self.assertFalse(mock_link.called)
+        self.assertFalse(mock_fast.called)
+        self.assertEqual(chksum.hexdigest(),
+                         hashlib.sha256(b"layer").hexdigest())
 
     @patch('udocker.utils.fileutil.os.path.abspath')
     @patch('udocker.utils.fileutil.os.path.basename')
@@ -1099,5 +1125,213 @@ class FileUtilTestCase(TestCase):
         self.assertEqual(status, ["/con/filename1", "/con/filename2"])
 
 
+    @patch('udocker.utils.fileutil.os.utime')
+    @patch('udocker.utils.fileutil.os.chmod')
+    @patch('udocker.utils.fileutil.os.link')
+    @patch('udocker.utils.fileutil.os.lstat')
+    @patch('udocker.utils.fileutil.os.mkdir')
+    @patch('udocker.utils.fileutil.os.path.isdir')
+    @patch('udocker.utils.fileutil.os.path.islink')
+    @patch('udocker.utils.fileutil.os.path.lexists')
+    @patch('udocker.utils.fileutil.os.walk')
+    @patch.object(FileUtil, 'reflink')
+    @patch('udocker.utils.fileutil.os.path.realpath')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_43_clonedir(self, mock_regpre, mock_rpath, mock_reflink,
+                         mock_walk, mock_lexists, mock_islink, mock_isdir,
+                         mock_mkdir, mock_lstat, mock_link, mock_chmod,
+                         mock_utime):
+        """Test43 FileUtil.clonedir()."""
+        mock_regpre.return_value = None
+        mock_rpath.return_value = "/src"
+        mock_walk.return_value = [("/src", [], ["f1"]), ]
+        mock_lexists.return_value = False
+        mock_islink.return_value = False
+        mock_isdir.return_value = False
+        mock_lstat.return_value.st_mode = 0o100644
+        mock_lstat.return_value.st_nlink = 1
+        mock_reflink.side_effect = OSError(errno.EOPNOTSUPP, "fail")
+        status = FileUtil("/src").clonedir("/dst")
+        self.assertEqual(status, None)
+        self.assertTrue(mock_mkdir.called)
+
+        mock_reflink.side_effect = None
+        status = FileUtil("/src").clonedir("/dst")
+        self.assertTrue(status)
+        self.assertTrue(mock_reflink.called)
+        self.assertFalse(mock_link.called)
+
+        mock_reflink.reset_mock()
+        status = FileUtil("/src").clonedir("/dst", hardlink=True)
+        self.assertTrue(status)
+        mock_link.assert_called_with("/src/f1", "/dst/f1")
+        self.assertFalse(mock_reflink.called)
+
+        mock_link.side_effect = OSError(errno.ENOSPC, "fail")
+        mock_walk.return_value = [("/src", [], ["f1", "f2"]), ]
+        with patch.object(FileUtil, '_clonefile') as mock_clonef:
+            mock_clonef.side_effect = [None, OSError(errno.ENOSPC, "fail")]
+            status = FileUtil("/src").clonedir("/dst", hardlink=True)
+            self.assertFalse(status)
+
+    @patch('udocker.utils.fileutil.os.rename')
+    @patch.object(FileUtil, '_file2file')
+    @patch('udocker.utils.fileutil.os.stat')
+    @patch('udocker.utils.fileutil.os.utime')
+    @patch('udocker.utils.fileutil.os.chmod')
+    @patch('udocker.utils.fileutil.os.lstat')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_44_breaklink(self, mock_regpre, mock_lstat, mock_chmod,
+                          mock_utime, mock_stat, mock_f2f, mock_rename):
+        """Test44 FileUtil.breaklink()."""
+        mock_regpre.return_value = None
+        mock_lstat.return_value.st_mode = 0o100644
+        mock_lstat.return_value.st_nlink = 1
+        status = FileUtil("/dir/file").breaklink()
+        self.assertTrue(status)
+        self.assertFalse(mock_f2f.called)
+
+        mock_lstat.return_value.st_nlink = 2
+        mock_stat.return_value.st_mode = 0o40755
+        mock_f2f.return_value = True
+        status = FileUtil("/dir/file").breaklink()
+        self.assertTrue(status)
+        self.assertTrue(mock_f2f.called)
+        self.assertEqual(mock_rename.call_args[0][1], "/dir/file")
+
+    @patch('udocker.utils.fileutil.os.read')
+    @patch('udocker.utils.fileutil.os.lseek')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_45__sparse_segments(self, mock_regpre, mock_lseek, mock_read):
+        """Test45 FileUtil()._sparse_segments()."""
+        mock_regpre.return_value = None
+        mock_read.side_effect = [b"a" * 4096 + b"\0" * 8192 + b"b", b""]
+        with patch.object(FileUtil, 'SEEK_DATA', None):
+            segments = list(FileUtil("/f1")._sparse_segments(3, 12289))
+        self.assertEqual(segments, [(0, 4096, b"a" * 4096),
+                                    (4096, 8192, None), (12288, 1, b"b")])
+
+        mock_read.side_effect = [b"c" * 100]
+        mock_lseek.side_effect = [8192, 8292, 8192]
+        with patch.object(FileUtil, 'SEEK_DATA', 3):
+            segments = list(FileUtil("/f1")._sparse_segments(3, 8292))
+        self.assertEqual(segments, [(0, 8192, None), (8192, 100, b"c" * 100)])
+
+    @patch.object(FileUtil, '_rewrite')
+    @patch.object(FileUtil, '_punch_hole')
+    @patch.object(FileUtil, '_sparse_segments')
+    @patch('udocker.utils.fileutil.os.utime')
+    @patch('udocker.utils.fileutil.os.close')
+    @patch('udocker.utils.fileutil.os.open')
+    @patch('udocker.utils.fileutil.os.lstat')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_46_sparsify(self, mock_regpre, mock_lstat, mock_open,
+                         mock_close, mock_utime, mock_segments, mock_punch,
+                         mock_rewrite):
+        """Test46 FileUtil().sparsify()."""
+        mock_regpre.return_value = None
+        mock_lstat.return_value.st_mode = 0o40755
+        self.assertEqual(FileUtil("/f1").sparsify(), 0)
+        self.assertFalse(mock_open.called)
+
+        f_stat = Mock(st_mode=0o100644, st_nlink=2, st_size=8192,
+                      st_blocks=16)
+        mock_lstat.return_value = f_stat
+        mock_lstat.side_effect = [f_stat, Mock(st_blocks=0)]
+        mock_segments.return_value = [(0, 4096, b"a"), (4096, 4096, None)]
+        self.assertEqual(FileUtil("/f1").sparsify(), 16 * 512)
+        mock_punch.assert_called_once_with(mock_open.return_value, 4096, 4096)
+        self.assertTrue(mock_utime.called)
+        self.assertTrue(mock_close.called)
+
+        mock_lstat.side_effect = None
+        mock_punch.side_effect = OSError(errno.EOPNOTSUPP, "fail")
+        mock_utime.reset_mock()
+        self.assertEqual(FileUtil("/f1").sparsify(), 0)
+        self.assertFalse(mock_rewrite.called)
+        self.assertFalse(mock_utime.called)
+
+        mock_lstat.return_value.st_nlink = 1
+        FileUtil("/f1").sparsify()
+        self.assertTrue(mock_rewrite.called)
+
+    @patch.object(FileUtil, 'sparsify')
+    @patch('udocker.utils.fileutil.os.lstat')
+    @patch('udocker.utils.fileutil.os.walk')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_47_sparsifydir(self, mock_regpre, mock_walk, mock_lstat,
+                            mock_sparsify):
+        """Test47 FileUtil().sparsifydir()."""
+        mock_regpre.return_value = None
+        mock_walk.return_value = [("/d", [], ["f1", "f2", "f3"]), ]
+        big = Mock(st_mode=0o100644, st_ino=1, st_dev=1, st_nlink=2,
+                   st_size=8192, st_blocks=16)
+        small = Mock(st_mode=0o100644, st_ino=2, st_dev=1, st_nlink=1,
+                     st_size=10, st_blocks=8)
+        mock_lstat.side_effect = [big, big, small]
+        mock_sparsify.return_value = 4096
+        status = FileUtil("/d").sparsifydir(1024)
+        self.assertEqual(status, (4096, 16 * 512 - 4096))
+        self.assertEqual(mock_sparsify.call_count, 1)
+    @patch('udocker.utils.fileutil.os.lseek')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_48__data_extents(self, mock_regpre, mock_lseek):
+        """Test48 FileUtil()._data_extents()."""
+        mock_regpre.return_value = None
+        with patch.object(FileUtil, 'SEEK_DATA', None):
+            extents = list(FileUtil("/f1")._data_extents(3, 100))
+        self.assertEqual(extents, [(0, 100)])
+
+        mock_lseek.side_effect = [10, 20, 50, 60,
+                                  OSError(errno.ENXIO, "no data")]
+        with patch.object(FileUtil, 'SEEK_DATA', 3):
+            extents = list(FileUtil("/f1")._data_extents(3, 100))
+        self.assertEqual(extents, [(10, 10), (50, 10)])
+
+    @patch('udocker.utils.fileutil.os.ftruncate')
+    @patch('udocker.utils.fileutil.os.sendfile', create=True)
+    @patch('udocker.utils.fileutil.os.lseek')
+    @patch.object(FileUtil, '_data_extents')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_49__copy_kernel(self, mock_regpre, mock_extents, mock_lseek,
+                             mock_sendfile, mock_truncate):
+        """Test49 FileUtil()._copy_kernel()."""
+        mock_regpre.return_value = None
+        mock_extents.return_value = [(0, 10), (50, 10)]
+        mock_cfr = Mock(side_effect=[6, 4, OSError(errno.EXDEV, "xdev")])
+        mock_sendfile.side_effect = [10]
+        with patch('udocker.utils.fileutil.os.copy_file_range', mock_cfr,
+                   create=True):
+            FileUtil("/f1")._copy_kernel(3, 4, 100)
+        mock_cfr.assert_any_call(3, 4, 4, 6, 6)
+        mock_sendfile.assert_called_once_with(4, 3, 50, 10)
+        mock_lseek.assert_called_with(4, 50, 0)
+        mock_truncate.assert_called_with(4, 100)
+
+    @patch.object(FileUtil, '_copy_sparse')
+    @patch.object(FileUtil, '_copy_kernel')
+    @patch('udocker.utils.fileutil.fcntl')
+    @patch.object(FileUtil, '_register_prefix')
+    def test_50__copy_fast(self, mock_regpre, mock_fcntl, mock_kernel,
+                           mock_sparse):
+        """Test50 FileUtil()._copy_fast()."""
+        mock_regpre.return_value = None
+        FileUtil("/f1")._copy_fast(3, 4, 100)
+        mock_fcntl.ioctl.assert_called_with(4, FileUtil.FICLONE, 3)
+        self.assertFalse(mock_kernel.called)
+
+        mock_fcntl.ioctl.side_effect = OSError(errno.EXDEV, "xdev")
+        FileUtil("/f1")._copy_fast(3, 4, 100)
+        mock_kernel.assert_called_with(3, 4, 100)
+        self.assertFalse(mock_sparse.called)
+
+        mock_kernel.side_effect = OSError(errno.ENOSYS, "not available")
+        FileUtil("/f1")._copy_fast(3, 4, 100)
+        mock_sparse.assert_called_with(3, 4, 100)
+
+        mock_kernel.side_effect = OSError(errno.ENOSPC, "no space")
+        self.assertRaises(OSError, FileUtil("/f1")._copy_fast, 3, 4, 100)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: ImageFlatten
+"""
+
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.container.flatten import ImageFlatten
+from udocker.container.layerindex import LayerIndex
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+def layer_index(entries):
+    """Create a LayerIndex with the given entries"""
+    lindex = LayerIndex("/layers/sha256:" + str(len(entries)))
+    lindex.toc = {"compression": "gzip", "entries": entries}
+    return lindex
+
+
+class ImageFlattenTestCase(TestCase):
+    """Test ImageFlatten() merge of image layers."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+
+    def tearDown(self):
+        pass
+
+    def test_01__hidden(self):
+        """Test01 ImageFlatten()._hidden()."""
+        upper = layer_index({"/etc/.wh.group": ['f', 0, 420, 0, "", 0],
+                             "/etc/passwd": ['f', 1, 420, 0, "", 0],
+                             "/lib": ['l', 0, 511, 0, "usr/lib", 0]})
+        iflat = ImageFlatten(self.local)
+        self.assertTrue(iflat._hidden([upper], "/etc/passwd"))
+        self.assertTrue(iflat._hidden([upper], "/etc/group"))
+        self.assertTrue(iflat._hidden([upper], "/lib/libc.so"))
+        self.assertFalse(iflat._hidden([upper], "/etc/hosts"))
+        self.assertFalse(iflat._hidden([], "/etc/passwd"))
+
+    def test_02__select(self):
+        """Test02 ImageFlatten()._select()."""
+        upper = layer_index({"/": ['d', 0, 493, 0, "", 0],
+                             "/data/.wh.x": ['f', 0, 420, 0, "", 0],
+                             "/data/y": ['f', 1, 420, 0, "", 0]})
+        lower = layer_index({"/data/x": ['f', 1, 420, 0, "", 0],
+                             "/data/xl": ['h', 0, 420, 0, "/data/x", 0],
+                             "/data/y": ['f', 1, 420, 0, "", 0]})
+        iflat = ImageFlatten(self.local)
+        selection = iflat._select([upper, lower])
+        self.assertEqual(selection[0][1], set(["/data/y"]))
+        self.assertEqual(selection[1][1], set(["/data/xl"]))
+        self.assertEqual(selection[1][2], set(["/data/x"]))
+
+    @patch('udocker.container.flatten.LayerWriter')
+    @patch.object(ImageFlatten, '_copy_layer')
+    @patch('udocker.container.flatten.Msg')
+    def test_03_flatten(self, mock_msg, mock_copy, mock_lwriter):
+        """Test03 ImageFlatten().flatten()."""
+        self.local.cd_imagerepo.return_value = "/repo/new/tag"
+        iflat = ImageFlatten(self.local)
+        self.assertFalse(iflat.flatten("img", "t1", "new", "tag"))
+        self.assertFalse(mock_lwriter.called)
+
+        upper = layer_index({"/etc/passwd": ['f', 1, 420, 0, "", 0]})
+        self.local.cd_imagerepo.side_effect = ["", "/repo/img/t1"]
+        self.local.get_image_attributes.return_value = ({"id": "x1"}, [])
+        self.local.get_image_indexes.return_value = [upper]
+        mock_copy.return_value = True
+        mock_lwriter.return_value.close.return_value = {"file": "/l/f1"}
+        self.local.setup_image_v2.return_value = True
+        self.assertTrue(iflat.flatten("img", "t1", "new", "tag"))
+        self.assertTrue(mock_copy.called)
+        args = self.local.setup_image_v2.call_args[0]
+        self.assertEqual(args[0:2], ("new", "tag"))
+        self.assertNotIn("id", args[2])
+        self.assertEqual(args[3], [{"file": "/l/f1"}])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: LayerIndex
+"""
+
+import io
+import gzip
+import tarfile
+import hashlib
+from unittest import TestCase, main
+from unittest.mock import patch, mock_open, Mock
+from udocker.container.layerindex import LayerStream, LayerIndex
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+BUILTIN = "builtins"
+BOPEN = BUILTIN + '.open'
+
+TOC = {"version": 1, "compression": "gzip", "size": 100,
+       "checkpoints": [[0, 0], [50, 2048]],
+       "entries": {"/etc": ['d', 0, 493, 512, "", 0],
+                   "/etc/passwd": ['f', 10, 420, 1024, "", 0],
+                   "/etc/shadow": ['h', 0, 420, 1536, "/etc/passwd", 0],
+                   "/etc/.wh.group": ['f', 0, 420, 2048, "", 0],
+                   "/usr/.wh..wh..opq": ['f', 0, 420, 2560, "", 0],
+                   "/bin": ['l', 0, 511, 3072, "usr/bin", 0]}}
+
+
+class LayerStreamTestCase(TestCase):
+    """Test LayerStream() decompression with checkpoints."""
+
+    def test_01_read(self):
+        """Test01 LayerStream().read() multiple gzip members."""
+        data = gzip.compress(b"a" * 100) + gzip.compress(b"b" * 50)
+        stream = LayerStream(io.BytesIO(data), "gzip")
+        self.assertEqual(stream.read(), b"a" * 100 + b"b" * 50)
+        self.assertEqual(len(stream.checkpoints), 2)
+        self.assertEqual(stream.checkpoints[1][1], 100)
+
+        coffset = stream.checkpoints[1][0]
+        filep = io.BytesIO(data)
+        filep.seek(coffset)
+        stream = LayerStream(filep, "gzip", coffset, 100)
+        self.assertEqual(stream.read(10), b"b" * 10)
+
+    def test_02_skip(self):
+        """Test02 LayerStream().skip()."""
+        stream = LayerStream(io.BytesIO(b"0123456789"), "tar")
+        self.assertTrue(stream.skip(5))
+        self.assertEqual(stream.read(2), b"56")
+        self.assertFalse(stream.skip(10))
+
+    def test_03_read_truncated(self):
+        """Test03 LayerStream().read() truncated gzip member."""
+        data = gzip.compress(b"a" * 100)
+        stream = LayerStream(io.BytesIO(data[:-6]), "gzip")
+        self.assertRaises(EOFError, stream.read)
+
+        data = gzip.compress(b"a" * 100) + gzip.compress(b"b" * 50)[:-4]
+        stream = LayerStream(io.BytesIO(data), "gzip")
+        self.assertRaises(EOFError, stream.read)
+
+    def test_04_read_trailing(self):
+        """Test04 LayerStream().read() data after the last member."""
+        data = gzip.compress(b"a" * 100)
+        stream = LayerStream(io.BytesIO(data + b"garbage"), "gzip")
+        self.assertRaises(IOError, stream.read)
+
+        stream = LayerStream(io.BytesIO(data + b"\0" * 1024), "gzip")
+        self.assertEqual(stream.read(), b"a" * 100)
+
+
+class LayerIndexTestCase(TestCase):
+    """Test LayerIndex() table of contents of image layers."""
+
+    def setUp(self):
+        Config().getconf()
+
+    def tearDown(self):
+        pass
+
+    @patch('udocker.container.layerindex.FileUtil.getdata')
+    def test_01_compression(self, mock_getdata):
+        """Test01 LayerIndex().compression()."""
+        mock_getdata.return_value = b"\x1f\x8b\x08"
+        self.assertEqual(LayerIndex("/l/f1").compression(), "gzip")
+
+        mock_getdata.return_value = b"\x00" * 257 + b"ustar\x00"
+        self.assertEqual(LayerIndex("/l/f1").compression(), "tar")
+
+        mock_getdata.return_value = b"{\"config\": 1}"
+        self.assertEqual(LayerIndex("/l/f1").compression(), "")
+
+    @patch('udocker.container.layerindex.FileUtil.size')
+    def test_02_load(self, mock_size):
+        """Test02 LayerIndex().load()."""
+        mock_size.return_value = 100
+        with patch(BOPEN, mock_open(read_data='{"version": 1}')):
+            lindex = LayerIndex("/l/f1")
+            self.assertFalse(lindex.load())
+
+        mock_size.return_value = 100
+        with patch(BOPEN, mock_open(read_data='{"version": 1, "size": 100}')):
+            lindex = LayerIndex("/l/f1")
+            self.assertTrue(lindex.load())
+            self.assertEqual(lindex.toc_file, "/l/f1.toc")
+
+        mock_size.return_value = 200
+        with patch(BOPEN, mock_open(read_data='{"version": 1, "size": 100}')):
+            lindex = LayerIndex("/l/f1")
+            self.assertFalse(lindex.load())
+
+    def test_03_lookup(self):
+        """Test03 LayerIndex().lookup()."""
+        lindex = LayerIndex("/l/f1")
+        self.assertEqual(lindex.lookup("/etc/passwd"), None)
+
+        lindex.toc = TOC
+        self.assertEqual(lindex.lookup("etc/passwd")["size"], 10)
+        self.assertEqual(lindex.lookup("/etc/shadow")["offset"], 1024)
+        self.assertEqual(lindex.lookup("/etc/shadow")["path"], "/etc/shadow")
+        self.assertEqual(lindex.lookup("/bin")["linkname"], "usr/bin")
+        self.assertEqual(lindex.lookup("/etc/group"), None)
+
+    def test_04_whiteouts(self):
+        """Test04 LayerIndex().whiteouts()."""
+        lindex = LayerIndex("/l/f1")
+        self.assertEqual(lindex.whiteouts(), [])
+        lindex.toc = TOC
+        self.assertEqual(lindex.whiteouts(),
+                         ["/etc/.wh.group", "/usr/.wh..wh..opq"])
+
+    def test_05_hides(self):
+        """Test05 LayerIndex().hides()."""
+        lindex = LayerIndex("/l/f1")
+        lindex.toc = TOC
+        self.assertTrue(lindex.hides("/etc/group"))
+        self.assertTrue(lindex.hides("/etc/group/file"))
+        self.assertTrue(lindex.hides("/usr/bin/bash"))
+        self.assertFalse(lindex.hides("/etc/hosts"))
+        self.assertFalse(lindex.hides("/"))
+
+    @patch('udocker.container.layerindex.LayerStream')
+    def test_06_read(self, mock_stream):
+        """Test06 LayerIndex().read()."""
+        lindex = LayerIndex("/l/f1")
+        lindex.toc = TOC
+        self.assertEqual(lindex.read("/etc/group"), None)
+        self.assertEqual(lindex.read("/etc"), None)
+
+        mock_stream.return_value.skip.return_value = True
+        mock_stream.return_value.read.return_value = b"root:x:0:0"
+        with patch(BOPEN, mock_open()) as mopen:
+            status = lindex.read("/etc/shadow")
+            self.assertEqual(status, b"root:x:0:0")
+            mopen.return_value.seek.assert_called_with(0)
+            mock_stream.return_value.skip.assert_called_with(1024)
+            mock_stream.return_value.read.assert_called_with(10)
+
+    @patch.object(LayerIndex, '_save')
+    @patch.object(LayerIndex, 'load')
+    @patch('udocker.container.layerindex.FileUtil.size')
+    @patch.object(LayerIndex, 'compression')
+    def test_07_verify(self, mock_compr, mock_size, mock_load, mock_save):
+        """Test07 LayerIndex().verify()."""
+        tarbuf = io.BytesIO()
+        with tarfile.open(fileobj=tarbuf, mode="w") as tarf:
+            tarinfo = tarfile.TarInfo("etc/passwd")
+            tarinfo.size = 10
+            tarf.addfile(tarinfo, io.BytesIO(b"root:x:0:0"))
+        data = gzip.compress(tarbuf.getvalue()) + b"\0" * 16
+        digest = hashlib.sha256(data).hexdigest()
+        mock_compr.return_value = "gzip"
+        mock_size.return_value = len(data)
+        mock_load.return_value = False
+        lindex = LayerIndex("/l/f1")
+        with patch(BOPEN, Mock(side_effect=lambda *args: io.BytesIO(data))):
+            self.assertEqual(lindex.verify("sha256", digest, True), "")
+            self.assertEqual(lindex.toc["entries"]["/etc/passwd"][:2],
+                             ['f', 10])
+            self.assertTrue(mock_save.called)
+            self.assertEqual(lindex.verify("sha256", "0" * 64),
+                             "layer file chksum failed")
+            self.assertEqual(mock_save.call_count, 1)
+
+        data = data[:len(data) // 2]
+        with patch(BOPEN, Mock(side_effect=lambda *args: io.BytesIO(data))):
+            self.assertTrue(lindex.verify("", "").startswith(
+                "layer tar verify failed"))
+            mock_compr.return_value = ""
+            self.assertEqual(lindex.verify("", ""), "")
+
+        mock_compr.return_value = "gzip"
+        for bad_data in (gzip.compress(tarbuf.getvalue())[:-6],
+                         gzip.compress(tarbuf.getvalue()) + b"garbage"):
+            with patch(BOPEN, Mock(return_value=io.BytesIO(bad_data))):
+                self.assertTrue(lindex.verify("", "").startswith(
+                    "layer tar verify failed"))
+
+
+if __name__ == '__main__':
+    main()
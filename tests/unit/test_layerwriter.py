@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: LayerWriter
+"""
+
+import io
+import gzip
+import hashlib
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.container.layerwriter import HashedFile, LayerWriter
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class LayerWriterTestCase(TestCase):
+    """Test LayerWriter() creation of image layers."""
+
+    def setUp(self):
+        Config().getconf()
+        self.local = Mock()
+        self.local.layersdir = "/home/u1/.udocker/layers"
+
+    def tearDown(self):
+        pass
+
+    def test_01_hashedfile(self):
+        """Test01 HashedFile().write()."""
+        buf = io.BytesIO()
+        hfile = HashedFile(buf)
+        hfile.write(b"abc")
+        hfile.write(b"def")
+        self.assertEqual(hfile.size, 6)
+        self.assertEqual(hfile.sha256.hexdigest(),
+                         hashlib.sha256(b"abcdef").hexdigest())
+        self.assertEqual(buf.getvalue(), b"abcdef")
+
+    @patch('udocker.container.layerwriter.os.rename')
+    @patch('udocker.container.layerwriter.open')
+    def test_02_close(self, mock_open, mock_rename):
+        """Test02 LayerWriter().open() and close()."""
+        buf = io.BytesIO()
+        buf.close = Mock()
+        mock_open.return_value = buf
+        lwriter = LayerWriter(self.local)
+        tarf = lwriter.open()
+        self.assertTrue(tarf)
+        layer = lwriter.close()
+        digest = "sha256:" + hashlib.sha256(buf.getvalue()).hexdigest()
+        diff_id = hashlib.sha256(gzip.decompress(buf.getvalue())).hexdigest()
+        self.assertEqual(layer["digest"], digest)
+        self.assertEqual(layer["diff_id"], "sha256:" + diff_id)
+        self.assertEqual(layer["file"], self.local.layersdir + '/' + digest)
+        self.assertEqual(layer["size"], len(buf.getvalue()))
+        self.assertTrue(mock_rename.called)
+
+    @patch('udocker.container.layerwriter.open')
+    @patch('udocker.container.layerwriter.Msg')
+    def test_03_open(self, mock_msg, mock_open):
+        """Test03 LayerWriter().open() failure."""
+        mock_open.side_effect = IOError("fail")
+        lwriter = LayerWriter(self.local)
+        self.assertEqual(lwriter.open(), None)
+        self.assertTrue(mock_msg.return_value.err.called)
+
+
+if __name__ == '__main__':
+    main()
@@ -31,13 +31,13 @@ class LocalFileAPITestCase(TestCase):
     @patch('udocker.localfile.DockerLocalFileAPI.load')
     @patch.object(LocalFileAPI, '_get_imagedir_type')
     @patch('udocker.localfile.FileUtil.remove')
-    @patch.object(LocalFileAPI, '_untar_saved_container')
+    @patch('udocker.localfile.ImageArchiveReader')
     @patch('udocker.localfile.os.makedirs')
     @patch('udocker.localfile.FileUtil.mktmp')
     @patch('udocker.localfile.Msg.err')
     @patch('udocker.localfile.os.path.exists')
     def test_02_load(self, mock_exists, mock_msg, mock_mktmp, mock_mkdir,
-                     mock_untar, mock_remove, mock_imgtype, mock_dockerload,
+                     mock_reader, mock_remove, mock_imgtype, mock_dockerload,
                      mock_ociload):
         """Test02 LocalFileAPI().load."""
         mock_exists.return_value = False
@@ -48,10 +48,10 @@ class LocalFileAPITestCase(TestCase):
         mock_exists.return_value = True
         mock_mktmp.return_value = '/tmp/imgdir'
         mock_mkdir.return_value = None
-        mock_untar.return_value = False
+        mock_reader.return_value.extract.return_value = False
         mock_remove.return_value = None
         status = LocalFileAPI(self.mock_lrepo).load('imgfile')
-        self.assertTrue(mock_mktmp.called)
+        mock_mktmp.assert_called_with(self.mock_lrepo.tmp_area.return_value)
         self.assertTrue(mock_mkdir.called)
         self.assertTrue(mock_remove.called)
         self.assertTrue(mock_msg.called)
@@ -60,7 +60,7 @@ class LocalFileAPITestCase(TestCase):
         mock_exists.return_value = True
         mock_mktmp.return_value = '/tmp/imgdir'
         mock_mkdir.return_value = None
-        mock_untar.return_value = True
+        mock_reader.return_value.extract.return_value = True
         mock_remove.return_value = None
         mock_imgtype.return_value = 'Docker'
         mock_dockerload.return_value = ['docker-repo1', 'docker-repo2']
@@ -68,11 +68,14 @@ class LocalFileAPITestCase(TestCase):
         self.assertTrue(mock_imgtype.called)
         self.assertTrue(mock_dockerload.called)
         self.assertEqual(status, ['docker-repo1', 'docker-repo2'])
+        mock_reader.return_value.extract.assert_called_with('imgfile',
+                                                           '/tmp/imgdir')
+        self.assertTrue(mock_reader.return_value.remove_unused.called)
 
         mock_exists.return_value = True
         mock_mktmp.return_value = '/tmp/imgdir'
         mock_mkdir.return_value = None
-        mock_untar.return_value = True
+        mock_reader.return_value.extract.return_value = True
         mock_remove.return_value = None
         mock_imgtype.return_value = 'OCI'
         mock_ociload.return_value = ['OCI-repo1', 'OCI-repo2']
@@ -84,13 +87,22 @@ class LocalFileAPITestCase(TestCase):
         mock_exists.return_value = True
         mock_mktmp.return_value = '/tmp/imgdir'
         mock_mkdir.return_value = None
-        mock_untar.return_value = True
+        mock_reader.return_value.extract.return_value = True
         mock_remove.return_value = None
         mock_imgtype.return_value = ''
         status = LocalFileAPI(self.mock_lrepo).load('imgfile')
         self.assertTrue(mock_imgtype.called)
         self.assertEqual(status, [])
 
+        mock_reader.return_value.link.return_value = True
+        mock_imgtype.return_value = 'OCI'
+        with patch('udocker.localfile.os.path.isdir') as mock_isdir:
+            mock_isdir.return_value = True
+            status = LocalFileAPI(self.mock_lrepo).load('/tmp/ocidir')
+        mock_reader.return_value.link.assert_called_with('/tmp/ocidir',
+                                                        '/tmp/imgdir')
+        self.assertEqual(status, ['OCI-repo1', 'OCI-repo2'])
+
     @patch('udocker.localfile.DockerLocalFileAPI.save')
     def test_03_save(self, mock_dockersave):
         """Test03 LocalFileAPI().save."""
@@ -98,6 +110,26 @@ class LocalFileAPITestCase(TestCase):
         img_tag = ['tag1', 'tag2']
         status = LocalFileAPI(self.mock_lrepo).save(img_tag, 'imgfile')
         self.assertTrue(status)
+        self.assertTrue(mock_dockersave.called)
+
+    @patch('udocker.localfile.OciLocalFileAPI.save')
+    def test_04_save_oci(self, mock_ocisave):
+        """Test04 LocalFileAPI().save OCI layout."""
+        mock_ocisave.return_value = True
+        img_tag = [('repo1', 'tag1')]
+        status = LocalFileAPI(self.mock_lrepo).save(img_tag, 'imgfile', 'oci')
+        self.assertTrue(status)
+        mock_ocisave.assert_called_once_with(img_tag, 'imgfile', '')
+
+    @patch('udocker.localfile.OciLocalFileAPI.save_dir')
+    def test_05_save_oci_dir(self, mock_ocisavedir):
+        """Test05 LocalFileAPI().save OCI layout directory."""
+        mock_ocisavedir.return_value = True
+        img_tag = [('repo1', 'tag1')]
+        status = LocalFileAPI(self.mock_lrepo).save(img_tag, 'imgdir',
+                                                    'oci-dir')
+        self.assertTrue(status)
+        mock_ocisavedir.assert_called_once_with(img_tag, 'imgdir')
 
 
 if __name__ == '__main__':
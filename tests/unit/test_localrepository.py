@@ -4,7 +4,7 @@ udocker unit tests: LocalRepository
 """
 
 from unittest import TestCase, main
-from unittest.mock import patch, mock_open, call
+from unittest.mock import patch, mock_open, call, Mock
 from udocker.container.localrepo import LocalRepository
 from udocker.config import Config
 import collections
@@ -251,26 +251,32 @@ class LocalRepositoryTestCase(TestCase):
         self.assertEqual(status, 0)
 
     @patch.object(LocalRepository, 'cd_container')
-    @patch('udocker.container.localrepo.Uprocess.get_output')
+    @patch('udocker.container.localrepo.DiskUsage')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_13_get_size(self, mock_fu, mock_getout, mock_cdcont):
+    def test_13_get_size(self, mock_fu, mock_du, mock_cdcont):
         """Test13 LocalRepository().get_size()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
         container_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
-        mock_getout.return_value = "1234 dd"
+        mock_du.return_value.size.return_value = 1234 * 1048576 + 1
         mock_cdcont.return_value = "/home/u1/.udocker/containerid"
         lrepo = LocalRepository(UDOCKER_TOPDIR)
         status = lrepo.get_size(container_id)
-        self.assertEqual(status, 1234)
-        self.assertTrue(mock_getout.called)
+        self.assertEqual(status, 1235)
+        mock_du.assert_called_with("/home/u1/.udocker/containerid/usage.json")
+        mock_du.return_value.size.assert_called_with(
+            "/home/u1/.udocker/containerid/ROOT")
+        self.assertTrue(mock_du.return_value.save.called)
+        self.assertFalse(mock_du.return_value.clear.called)
 
-        mock_fu.return_value.register_prefix.side_effect = \
-            [None, None, None]
-        container_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
-        mock_getout.return_value = ""
-        mock_cdcont.return_value = "/home/u1/.udocker/containerid"
-        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.get_size(container_id, rescan=True)
+        self.assertTrue(mock_du.return_value.clear.called)
+
+        mock_du.return_value.size.return_value = -1
+        status = lrepo.get_size(container_id)
+        self.assertEqual(status, -1)
+
+        mock_cdcont.return_value = ""
         status = lrepo.get_size(container_id)
         self.assertEqual(status, -1)
 
@@ -324,6 +330,8 @@ class LocalRepositoryTestCase(TestCase):
             self.assertTrue(mock_listdir.called)
             self.assertTrue(mock_isdir.call_count, 2)
 
+    @patch.object(LocalRepository, '_trash_remove')
+    @patch.object(LocalRepository, '_trash_put')
     @patch.object(LocalRepository, 'del_container_name')
     @patch.object(LocalRepository, 'cd_container')
     @patch.object(LocalRepository, 'get_container_name')
@@ -331,8 +339,10 @@ class LocalRepositoryTestCase(TestCase):
     @patch('udocker.container.localrepo.FileUtil')
     def test_15_del_container(self, mock_fu,
                               mock_getlist, mock_getname,
-                              mock_cdcont, mock_delname):
+                              mock_cdcont, mock_delname, mock_put,
+                              mock_trashrm):
         """Test15 LocalRepository().del_container()."""
+        mock_put.return_value = ""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
         cont_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
@@ -371,35 +381,39 @@ class LocalRepositoryTestCase(TestCase):
         status = lrepo.del_container(cont_id)
         self.assertTrue(status)
         self.assertTrue(mock_fu.return_value.remove.called)
+        self.assertFalse(mock_trashrm.called)
 
-    @patch.object(LocalRepository, 'get_containers_list')
-    @patch('udocker.container.localrepo.os.path.exists')
+        mock_fu.return_value.remove.reset_mock()
+        mock_put.return_value = "/t/.trash/udocker-1-x-" + cont_id
+        status = lrepo.del_container(cont_id, background=True)
+        self.assertTrue(status)
+        mock_put.assert_called_with(contdir)
+        mock_trashrm.assert_called_once_with(mock_put.return_value, True)
+        self.assertFalse(mock_fu.return_value.remove.called)
+
+    @patch('udocker.container.localrepo.os.path.isdir')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_16_cd_container(self, mock_fu, mock_exists,
-                             mock_getlist):
+    def test_16_cd_container(self, mock_fu, mock_isdir):
         """Test16 LocalRepository().cd_container()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
         cont_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
         cdirs = "/home/u1/.udocker/containers"
         contdir = cdirs + "/" + cont_id
-        mock_getlist.return_value = [contdir]
-        mock_exists.return_value = False
+        mock_isdir.return_value = False
         lrepo = LocalRepository(UDOCKER_TOPDIR)
         status = lrepo.cd_container(cont_id)
         self.assertEqual(status, "")
 
-        mock_fu.return_value.register_prefix.side_effect = \
-            [None, None, None]
-        cont_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
-        cdirs = "/home/u1/.udocker/containers"
-        contdir = cdirs + "/" + cont_id
-        mock_getlist.return_value = [contdir]
-        mock_exists.return_value = True
-        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        mock_isdir.return_value = True
         status = lrepo.cd_container(cont_id)
         self.assertEqual(status, contdir)
 
+        mock_isdir.reset_mock()
+        for cont_id in ("", "..", "../repos"):
+            self.assertEqual(lrepo.cd_container(cont_id), "")
+        self.assertFalse(mock_isdir.called)
+
     @patch('udocker.container.localrepo.os.path.relpath')
     @patch('udocker.container.localrepo.os.symlink')
     @patch('udocker.container.localrepo.os.path.exists')
@@ -747,16 +761,18 @@ class LocalRepositoryTestCase(TestCase):
         out = lrepo._inrepository(filename)
         self.assertEqual(out, [])
 
+    @patch.object(LocalRepository, '_refs_change')
     @patch('udocker.container.localrepo.os.readlink')
     @patch('udocker.container.localrepo.os.path.islink')
     @patch('udocker.container.localrepo.os.listdir')
     @patch.object(LocalRepository, '_inrepository')
     @patch('udocker.container.localrepo.FileUtil')
     def test_30__remove_layers(self, mock_fu, mock_in, mock_listdir,
-                               mock_islink, mock_readlink):
+                               mock_islink, mock_readlink, mock_refs):
         """Test30 LocalRepository()._remove_layers()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
+        mock_refs.return_value = None
         mock_listdir.return_value = []
         lrepo = LocalRepository(UDOCKER_TOPDIR)
         status = lrepo._remove_layers("TAG_DIR", False)
@@ -817,10 +833,27 @@ class LocalRepositoryTestCase(TestCase):
         status = lrepo._remove_layers("TAG_DIR", True)
         self.assertTrue(status)
 
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_fu.return_value.remove.reset_mock()
+        mock_fu.return_value.remove.return_value = True
+        mock_in.reset_mock()
+        mock_listdir.return_value = ["FILE1", "FILE2"]
+        mock_readlink.side_effect = ["../l/L1", "../l/L2"]
+        mock_refs.return_value = {"L2": ["IMAGE/TAG2"]}
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo._remove_layers("/r/IMAGE/TAG", False)
+        self.assertTrue(status)
+        self.assertFalse(mock_in.called)
+        mock_refs.assert_called_with(["L1", "L2"], "/r/IMAGE/TAG", add=False)
+        self.assertEqual(mock_fu.return_value.remove.call_count, 3)
+
+    @patch.object(LocalRepository, '_catalog_change')
     @patch.object(LocalRepository, 'cd_imagerepo')
     @patch.object(LocalRepository, '_remove_layers')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_31_del_imagerepo(self, mock_fu, mock_rmlayers, mock_cd):
+    def test_31_del_imagerepo(self, mock_fu, mock_rmlayers, mock_cd,
+                              mock_catalog):
         """Test31 LocalRepository()._del_imagerepo()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
@@ -841,6 +874,8 @@ class LocalRepositoryTestCase(TestCase):
         self.assertEqual(lrepo.cur_repodir, "")
         self.assertEqual(lrepo.cur_tagdir, "")
         self.assertTrue(status)
+        mock_catalog.assert_called_with(True, remove=True)
+        self.assertEqual(mock_fu.return_value.remove.call_count, 1)
 
     def _sideffect_test_32(self, arg):
         """Side effect for isdir on test 23 _get_tags()."""
@@ -935,13 +970,15 @@ class LocalRepositoryTestCase(TestCase):
         self.assertTrue(mock_islink.called)
         self.assertEqual(status, [("IMAGE/TAG/f1", 123)])
 
+    @patch.object(LocalRepository, '_refs_change')
     @patch.object(LocalRepository, '_symlink')
     @patch('udocker.container.localrepo.os.path.basename')
     @patch('udocker.container.localrepo.os.path.islink')
     @patch('udocker.container.localrepo.os.path.exists')
     @patch('udocker.container.localrepo.FileUtil')
     def test_35_add_image_layer(self, mock_fu, mock_exists,
-                                mock_islink, mock_base, mock_symln):
+                                mock_islink, mock_base, mock_symln,
+                                mock_refs):
         """Test35 LocalRepository().add_image_layer()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
@@ -988,6 +1025,7 @@ class LocalRepositoryTestCase(TestCase):
         self.assertTrue(mock_fu.return_value.remove.called)
         self.assertTrue(mock_islink.called)
         self.assertTrue(mock_symln.called)
+        mock_refs.assert_called_with(["file1"], "TAG")
 
     @patch('udocker.container.localrepo.os.makedirs')
     @patch('udocker.container.localrepo.os.path.exists')
@@ -1020,10 +1058,22 @@ class LocalRepositoryTestCase(TestCase):
         self.assertEqual(lrepo.cur_repodir, expected_directory)
         self.assertTrue(status)
 
+        mock_mkdirs.side_effect = OSError("exists")
+        with patch('udocker.container.localrepo.os.path.isdir') as mock_isdir:
+            mock_isdir.return_value = True
+            status = lrepo.setup_imagerepo("IMAGE")
+            self.assertFalse(status)
+            self.assertEqual(lrepo.cur_repodir, expected_directory)
+            mock_isdir.return_value = False
+            status = lrepo.setup_imagerepo("IMAGE")
+            self.assertEqual(status, None)
+
+    @patch.object(LocalRepository, '_catalog_change')
     @patch('udocker.container.localrepo.os.makedirs')
     @patch('udocker.container.localrepo.os.path.exists')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_37_setup_tag(self, mock_fu, mock_exists, mock_mkdirs):
+    def test_37_setup_tag(self, mock_fu, mock_exists, mock_mkdirs,
+                          mock_catalog):
         """Test37 LocalRepository().setup_tag()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
@@ -1037,6 +1087,7 @@ class LocalRepositoryTestCase(TestCase):
             self.assertEqual(lrepo.cur_tagdir, expected_directory)
             self.assertTrue(mopen.called)
             self.assertTrue(status)
+            mock_catalog.assert_called_with(expected_directory)
 
     @patch('udocker.container.localrepo.os.listdir')
     @patch('udocker.container.localrepo.os.path.exists')
@@ -1248,9 +1299,10 @@ class LocalRepositoryTestCase(TestCase):
         self.assertTrue(mock_exists.call_count, 1)
         self.assertTrue(mock_attrv1s2.call_count, 1)
 
+    @patch('udocker.container.localrepo.os.rename')
     @patch('udocker.container.localrepo.os.path.exists')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_43_save_json(self, mock_fu, mock_exists):
+    def test_43_save_json(self, mock_fu, mock_exists, mock_rename):
         """Test43 LocalRepository().save_json()."""
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
@@ -1289,10 +1341,16 @@ class LocalRepositoryTestCase(TestCase):
             lrepo = LocalRepository(UDOCKER_TOPDIR)
             lrepo.cur_repodir = lrepo.reposdir + "/IMAGE"
             lrepo.cur_tagdir = lrepo.cur_repodir + "/TAG"
+            LocalRepository._json_cache[lrepo.cur_tagdir + "/filename"] = \
+                ((1, 2, 3), "old")
             status = lrepo.save_json("filename", "data")
             self.assertTrue(mock_exists.call_count, 2)
             self.assertTrue(mopen.called)
             self.assertTrue(status)
+            self.assertEqual(mock_rename.call_args[0][1],
+                             lrepo.cur_tagdir + "/filename")
+            self.assertNotIn(lrepo.cur_tagdir + "/filename",
+                             LocalRepository._json_cache)
 
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
@@ -1304,10 +1362,13 @@ class LocalRepositoryTestCase(TestCase):
             self.assertTrue(mopen.called)
             self.assertFalse(status)
 
+    @patch('udocker.container.localrepo.os.stat')
     @patch('udocker.container.localrepo.os.path.exists')
     @patch('udocker.container.localrepo.FileUtil')
-    def test_44_load_json(self, mock_fu, mock_exists):
+    def test_44_load_json(self, mock_fu, mock_exists, mock_stat):
         """Test44 LocalRepository().load_json()."""
+        LocalRepository._json_cache = {}
+        mock_stat.return_value = Mock(st_ino=1, st_mtime=2, st_size=3)
         mock_fu.return_value.register_prefix.side_effect = \
             [None, None, None]
         mock_exists.side_effect = [True, True]
@@ -1360,6 +1421,16 @@ class LocalRepositoryTestCase(TestCase):
             self.assertTrue(mopen.called)
             self.assertFalse(status)
 
+        with patch(BOPEN, mock_open(read_data=b'{"a": 1}')) as mopen:
+            status = lrepo.load_json("/filename")
+            self.assertEqual(status, {"a": 1})
+            self.assertEqual(lrepo.load_json("/filename"), {"a": 1})
+            self.assertEqual(mopen.call_count, 1)
+            mock_stat.return_value = Mock(st_ino=4, st_mtime=2, st_size=3)
+            lrepo.load_json("/filename")
+            self.assertEqual(mopen.call_count, 2)
+        LocalRepository._json_cache = {}
+
     @patch.object(LocalRepository, 'load_json')
     @patch('udocker.container.localrepo.os.listdir')
     @patch('udocker.container.localrepo.FileUtil')
@@ -1450,5 +1521,726 @@ class LocalRepositoryTestCase(TestCase):
     #     pass
 
 
+    @patch('udocker.container.localrepo.LayerIndex')
+    @patch('udocker.container.localrepo.os.path.realpath')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_54_index_layer(self, mock_fu, mock_realpath, mock_lindex):
+        """Test54 LocalRepository().index_layer()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_realpath.return_value = UDOCKER_TOPDIR + "/layers"
+        mock_lindex.return_value.load.return_value = True
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.index_layer("/tag/sha256:1234")
+        self.assertEqual(status, mock_lindex.return_value)
+        self.assertFalse(mock_lindex.return_value.build.called)
+
+        mock_lindex.return_value.load.return_value = False
+        mock_lindex.return_value.layer_file = "/tmp/sha256:1234"
+        status = lrepo.index_layer("/tmp/sha256:1234")
+        self.assertEqual(status, None)
+        self.assertFalse(mock_lindex.return_value.build.called)
+
+        mock_lindex.return_value.layer_file = \
+            UDOCKER_TOPDIR + "/layers/sha256:1234"
+        mock_lindex.return_value.build.return_value = True
+        status = lrepo.index_layer("/tag/sha256:1234")
+        self.assertEqual(status, mock_lindex.return_value)
+
+        status = lrepo.index_layer("/tag/sha256:1234", build=False)
+        self.assertEqual(status, None)
+
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_55__image_resolve(self, mock_fu):
+        """Test55 LocalRepository()._image_resolve()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        entries = {"/bin": {"type": 'l', "linkname": "usr/bin"},
+                   "/usr": {"type": 'd', "linkname": ""},
+                   "/usr/bin": {"type": 'd', "linkname": ""},
+                   "/usr/bin/bash": {"type": 'f', "linkname": ""},
+                   "/usr/bin/sh": {"type": 'l', "linkname": "/bin/bash"}, }
+        with patch.object(LocalRepository, '_image_lookup') as mock_lookup:
+            mock_lookup.side_effect = \
+                lambda indexes, f_path: (dict(entries[f_path]), "L1") \
+                if f_path in entries else (None, None)
+            (f_stat, lindex) = lrepo._image_resolve(["L1"], "/bin/sh")
+            self.assertEqual(f_stat["path"], "/usr/bin/bash")
+            self.assertEqual(lindex, "L1")
+
+            (f_stat, lindex) = lrepo._image_resolve(["L1"], "/bin/sh",
+                                                    follow=False)
+            self.assertEqual(f_stat["path"], "/usr/bin/sh")
+            self.assertEqual(f_stat["type"], 'l')
+
+            (f_stat, lindex) = lrepo._image_resolve(["L1"],
+                                                    "/usr/bin/bash/x")
+            self.assertEqual(f_stat, None)
+
+            (f_stat, lindex) = lrepo._image_resolve(["L1"], "/etc/passwd")
+            self.assertEqual(f_stat, None)
+
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_56__image_lookup(self, mock_fu):
+        """Test56 LocalRepository()._image_lookup()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        top = Mock()
+        bottom = Mock()
+        top.lookup.return_value = None
+        top.hides.return_value = True
+        bottom.lookup.return_value = {"path": "/etc/group"}
+        status = lrepo._image_lookup([top, bottom], "/etc/group")
+        self.assertEqual(status, (None, None))
+
+        top.hides.return_value = False
+        status = lrepo._image_lookup([top, bottom], "/etc/group")
+        self.assertEqual(status, ({"path": "/etc/group"}, bottom))
+
+    @patch.object(LocalRepository, 'save_json')
+    @patch.object(LocalRepository, 'add_image_layer')
+    @patch.object(LocalRepository, 'set_version')
+    @patch.object(LocalRepository, 'setup_tag')
+    @patch.object(LocalRepository, 'setup_imagerepo')
+    @patch.object(LocalRepository, 'cd_imagerepo')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_57_setup_image_v2(self, mock_fu, mock_cdimg, mock_setimg,
+                               mock_settag, mock_setver, mock_addlayer,
+                               mock_savejson):
+        """Test57 LocalRepository().setup_image_v2()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        layers = [{"file": "/layers/sha256:aa", "digest": "sha256:aa",
+                   "size": 10, "diff_id": "sha256:bb"}]
+        mock_cdimg.return_value = "/repos/img/tag"
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.setup_image_v2("img", "tag", {"os": "linux"}, layers)
+        self.assertFalse(status)
+        self.assertFalse(mock_setimg.called)
+
+        mock_cdimg.return_value = ""
+        mock_fu.return_value.putdata.side_effect = lambda data, mode: data
+        mock_settag.return_value = True
+        mock_setver.return_value = True
+        mock_savejson.return_value = True
+        status = lrepo.setup_image_v2("img", "tag", {"os": "linux"}, layers)
+        self.assertTrue(status)
+        mock_setver.assert_called_with("v2")
+        self.assertEqual(mock_addlayer.call_count, 2)
+        manifest = mock_savejson.call_args[0][1]
+        self.assertEqual(manifest["layers"][0]["digest"], "sha256:aa")
+        self.assertEqual(manifest["schemaVersion"], 2)
+        config_data = mock_fu.return_value.putdata.call_args[0][0]
+        self.assertIn(b'"diff_ids": ["sha256:bb"]', config_data)
+
+    @patch.object(LocalRepository, '_refs_save')
+    @patch.object(LocalRepository, '_refs_scan')
+    @patch.object(LocalRepository, '_refs_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_58__refs_change(self, mock_fu, mock_lock, mock_load, mock_scan,
+                             mock_save):
+        """Test58 LocalRepository()._refs_change()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        tag_dir = lrepo.reposdir + "/IMAGE/TAG"
+        mock_lock.return_value = None
+        self.assertEqual(lrepo._refs_change(["L1"], tag_dir), None)
+        self.assertFalse(mock_load.called)
+
+        mock_lock.return_value = Mock()
+        mock_load.return_value = {"L1": ["IMAGE/OTHER"]}
+        mock_save.return_value = True
+        refs = lrepo._refs_change(["L1", "L2"], tag_dir)
+        self.assertEqual(refs, {"L1": ["IMAGE/OTHER", "IMAGE/TAG"],
+                                "L2": ["IMAGE/TAG"]})
+        self.assertFalse(mock_scan.called)
+        mock_lock.return_value.release.assert_called_with()
+
+        mock_load.return_value = None
+        mock_scan.return_value = {"L1": ["IMAGE/TAG"], "L2": ["IMAGE/TAG"],
+                                  "L3": ["IMAGE/OTHER"]}
+        refs = lrepo._refs_change(["L1", "L2"], tag_dir, add=False)
+        self.assertEqual(refs, {"L3": ["IMAGE/OTHER"]})
+
+        mock_scan.reset_mock()
+        mock_load.return_value = {"L1": ["IMAGE/TAG"], "L2": ["IMAGE/TAG"]}
+        refs = lrepo._refs_change(["L1", "L2"], tag_dir, add=False)
+        self.assertEqual(refs, {})
+        self.assertFalse(mock_scan.called)
+
+        mock_save.return_value = False
+        self.assertEqual(lrepo._refs_change(["L1"], tag_dir), None)
+
+    @patch.object(LocalRepository, '_refs_save')
+    @patch.object(LocalRepository, '_refs_scan')
+    @patch.object(LocalRepository, '_refs_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_59_rebuild_layers_refs(self, mock_fu, mock_lock, mock_load,
+                                    mock_scan, mock_save):
+        """Test59 LocalRepository().rebuild_layers_refs()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_lock.return_value = Mock()
+        mock_load.return_value = {"L1": ["IMG/T1", "IMG/T2"]}
+        mock_scan.return_value = {"L1": ["IMG/T1"], "L2": ["IMG/T3"]}
+        mock_save.return_value = True
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.rebuild_layers_refs()
+        self.assertEqual(status, ([("L2", "IMG/T3")], [("L1", "IMG/T2")]))
+        mock_save.assert_called_with(mock_scan.return_value)
+
+        mock_save.return_value = False
+        self.assertEqual(lrepo.rebuild_layers_refs(), None)
+
+    @patch('udocker.container.localrepo.os.listdir')
+    @patch.object(LocalRepository, '_refs_scan')
+    @patch.object(LocalRepository, '_refs_load')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_60_get_unreferenced_layers(self, mock_fu, mock_load, mock_scan,
+                                        mock_listdir):
+        """Test60 LocalRepository().get_unreferenced_layers()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_load.return_value = None
+        mock_scan.return_value = {"sha256:aa": ["IMG/T1"]}
+        mock_listdir.return_value = ["sha256:bb", "sha256:aa",
+                                     "sha256:aa.toc", "sha256:bb.lock"]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.get_unreferenced_layers()
+        self.assertEqual(status, [lrepo.layersdir + "/sha256:bb"])
+        self.assertTrue(mock_scan.called)
+
+        mock_load.return_value = {"sha256:aa": ["IMG/T1"],
+                                  "sha256:bb": ["IMG/T2"]}
+        mock_load.reset_mock()
+        status = lrepo.get_unreferenced_layers(rescan=True)
+        self.assertEqual(status, [lrepo.layersdir + "/sha256:bb"])
+        self.assertFalse(mock_load.called)
+
+    @patch.object(LocalRepository, 'get_layers')
+    @patch.object(LocalRepository, 'get_image_platform_fmt')
+    @patch.object(LocalRepository, 'isprotected_imagerepo')
+    @patch.object(LocalRepository, 'cd_imagerepo')
+    @patch('udocker.container.localrepo.ChkSUM')
+    @patch('udocker.container.localrepo.time.time')
+    @patch('udocker.container.localrepo.os.path.exists')
+    @patch('udocker.container.localrepo.os.stat')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_61__catalog_entry(self, mock_fu, mock_stat, mock_exists,
+                               mock_time, mock_chksum, mock_cd, mock_prot,
+                               mock_platform, mock_layers):
+        """Test61 LocalRepository()._catalog_entry()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_cd.return_value = ""
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        entry = lrepo._catalog_entry("IMAGE", "TAG")
+        self.assertEqual(entry["layers"], [])
+        self.assertFalse(mock_platform.called)
+
+        mock_cd.return_value = "/r/IMAGE/TAG"
+        mock_stat.return_value.st_mtime = 100.0
+        mock_time.return_value = 1000.0
+        mock_exists.return_value = True
+        mock_chksum.return_value.sha256.return_value = "aa"
+        mock_prot.return_value = True
+        mock_platform.return_value = "linux/amd64"
+        mock_layers.return_value = [("/r/IMAGE/TAG/sha256:bb", 10)]
+        lrepo.cur_tagdir = "/r/OTHER/TAG"
+        entry = lrepo._catalog_entry("IMAGE", "TAG")
+        self.assertEqual(entry, {"imagerepo": "IMAGE", "tag": "TAG",
+                                 "mtime": 100.0, "protected": True,
+                                 "platform": "linux/amd64",
+                                 "digest": "sha256:aa",
+                                 "layers": [["sha256:bb", 10]]})
+        self.assertEqual(lrepo.cur_tagdir, "/r/OTHER/TAG")
+        mock_platform.assert_called_with(detect=False)
+
+        mock_time.return_value = 101.0
+        entry = lrepo._catalog_entry("IMAGE", "TAG")
+        self.assertEqual(entry["mtime"], 0)
+
+    @patch.object(LocalRepository, '_catalog_entry')
+    @patch.object(LocalRepository, 'get_imagerepos')
+    @patch.object(LocalRepository, '_catalog_save')
+    @patch.object(LocalRepository, '_index_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.os.stat')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_62_get_catalog(self, mock_fu, mock_stat, mock_lock, mock_load,
+                            mock_save, mock_imgs, mock_entry):
+        """Test62 LocalRepository().get_catalog()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_stat.return_value.st_mtime = 100.0
+        mock_load.return_value = {"IMG/T1": {"mtime": 100.0}}
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        catalog = lrepo.get_catalog()
+        self.assertEqual(catalog, {"IMG/T1": {"mtime": 100.0}})
+        self.assertFalse(mock_entry.called)
+        self.assertFalse(mock_save.called)
+        self.assertFalse(mock_imgs.called)
+        self.assertFalse(mock_lock.called)
+
+        mock_load.return_value = {"IMG/T1": {"mtime": 99.0},
+                                  "IMG/T2": {"mtime": 100.0}}
+        mock_stat.side_effect = [mock_stat.return_value, OSError("fail")]
+        mock_entry.return_value = {"mtime": 100.0}
+        catalog = lrepo.get_catalog()
+        self.assertEqual(catalog, {"IMG/T1": {"mtime": 100.0}})
+        mock_entry.assert_called_with("IMG", "T1")
+        mock_save.assert_called_with({"IMG/T1": {"mtime": 100.0},
+                                      "IMG/T2": None}, False)
+        self.assertFalse(mock_lock.called)
+
+        mock_stat.side_effect = None
+        mock_load.return_value = None
+        mock_imgs.return_value = [("library/IMG", "T3")]
+        catalog = lrepo.get_catalog()
+        self.assertEqual(list(catalog), ["library/IMG/T3"])
+        mock_entry.assert_called_with("library/IMG", "T3")
+        mock_save.assert_called_with({"library/IMG/T3": {"mtime": 100.0}},
+                                     True)
+
+    @patch.object(LocalRepository, '_index_save')
+    @patch.object(LocalRepository, '_index_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_63__catalog_change(self, mock_fu, mock_lock, mock_load,
+                                mock_save):
+        """Test63 LocalRepository()._catalog_change()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_lock.return_value = Mock()
+        mock_load.return_value = None
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertTrue(lrepo._catalog_change(lrepo.reposdir + "/IMG/T1"))
+        self.assertFalse(mock_save.called)
+
+        mock_load.return_value = {"IMG/T2": {"mtime": 1.0}}
+        mock_save.return_value = True
+        self.assertTrue(lrepo._catalog_change(lrepo.reposdir + "/IMG/T1"))
+        self.assertEqual(mock_save.call_args[0][2],
+                         {"IMG/T1": {"mtime": 0}, "IMG/T2": {"mtime": 1.0}})
+
+        mock_load.return_value = {"IMG/T2": {"mtime": 1.0}}
+        self.assertTrue(lrepo._catalog_change(lrepo.reposdir + "/IMG/T2",
+                                              remove=True))
+        self.assertEqual(mock_save.call_args[0][2], {})
+
+    @patch.object(LocalRepository, 'load_json')
+    @patch.object(LocalRepository, '_isprotected')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_64__container_attrs_build(self, mock_fu, mock_isprot,
+                                       mock_ljson):
+        """Test64 LocalRepository()._container_attrs_build()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_isprot.return_value = True
+        mock_fu.return_value.getdata.side_effect = ["centos:7", "F3\n"]
+        mock_ljson.return_value = {"os": "linux", "architecture": "arm",
+                                   "variant": "v7"}
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        attrs = lrepo._container_attrs_build("/c/123")
+        self.assertEqual(attrs, {"imagerepo": "centos:7", "execmode": "F3",
+                                 "platform": "linux/arm/v7",
+                                 "protected": True, "size": -1,
+                                 "size_mtime": 0})
+
+        mock_fu.return_value.getdata.side_effect = ["", ""]
+        mock_ljson.return_value = None
+        attrs = lrepo._container_attrs_build("/c/123")
+        self.assertEqual(attrs["platform"], "unknown/unknown")
+
+    @patch.object(LocalRepository, '_container_attrs_build')
+    @patch.object(LocalRepository, '_index_save')
+    @patch.object(LocalRepository, '_index_load')
+    @patch.object(LocalRepository, 'cd_container')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_65_container_attrs(self, mock_fu, mock_cd, mock_load,
+                                mock_save, mock_build):
+        """Test65 LocalRepository().get/set_container_attrs()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_cd.return_value = ""
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo.get_container_attrs("123"), None)
+        self.assertFalse(lrepo.set_container_attrs("123", size=1))
+
+        mock_cd.return_value = "/c/123"
+        mock_load.return_value = None
+        mock_build.return_value = {"size": -1}
+        self.assertEqual(lrepo.get_container_attrs("123"), {"size": -1})
+        mock_save.assert_called_with("/c/123/attrs.json", "attrs",
+                                     {"size": -1})
+        mock_save.reset_mock()
+        self.assertTrue(lrepo.set_container_attrs("123", size=1))
+        self.assertFalse(mock_save.called)
+
+        mock_load.return_value = {"size": -1, "execmode": ""}
+        mock_save.return_value = True
+        self.assertTrue(lrepo.set_container_attrs("123", execmode="F1"))
+        mock_save.assert_called_with("/c/123/attrs.json", "attrs",
+                                     {"size": -1, "execmode": "F1"})
+
+    @patch.object(LocalRepository, 'set_container_attrs')
+    @patch.object(LocalRepository, 'get_size')
+    @patch.object(LocalRepository, 'get_container_attrs')
+    @patch('udocker.container.localrepo.os.access')
+    @patch('udocker.container.localrepo.os.stat')
+    @patch('udocker.container.localrepo.os.readlink')
+    @patch('udocker.container.localrepo.os.lstat')
+    @patch('udocker.container.localrepo.os.listdir')
+    @patch('udocker.container.localrepo.os.path.isdir')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_66_get_containers_attrs(self, mock_fu, mock_isdir, mock_ldir,
+                                     mock_lstat, mock_readlink, mock_stat,
+                                     mock_access, mock_getattrs,
+                                     mock_getsize, mock_setattrs):
+        """Test66 LocalRepository().get_containers_attrs()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_isdir.return_value = True
+        mock_ldir.return_value = ["name1", "c1", "c2"]
+        mock_lstat.side_effect = [Mock(st_mode=0o120777),
+                                  Mock(st_mode=0o40755),
+                                  Mock(st_mode=0o40755)]
+        mock_readlink.return_value = "/containers/c1"
+        mock_stat.side_effect = [Mock(st_mode=0o40755, st_mtime=5.0),
+                                 OSError("fail")]
+        mock_access.return_value = True
+        mock_getattrs.side_effect = [{"size": 10, "size_mtime": 1.0},
+                                     {"size": -1, "size_mtime": 0}]
+        mock_getsize.return_value = 20
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.get_containers_attrs(True)
+        self.assertEqual(status, [{"id": "c1", "names": ["name1"],
+                                   "writeable": 1, "size": 20,
+                                   "size_mtime": 5.0},
+                                  {"id": "c2", "names": [],
+                                   "writeable": 2, "size": -1,
+                                   "size_mtime": 0}])
+        mock_setattrs.assert_called_once_with("c1", size=20, size_mtime=5.0)
+
+    @patch('udocker.container.localrepo.LayerIndex')
+    @patch.object(LocalRepository, '_refs_save')
+    @patch.object(LocalRepository, '_refs_scan')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_67_del_unreferenced_layers(self, mock_fu, mock_lock, mock_scan,
+                                        mock_save, mock_lindex):
+        """Test67 LocalRepository().del_unreferenced_layers()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_lock.return_value = None
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        status = lrepo.del_unreferenced_layers(["/l/sha256:aa"])
+        self.assertEqual(status, [])
+        self.assertFalse(mock_scan.called)
+
+        mock_lock.return_value = Mock()
+        mock_scan.return_value = {"sha256:aa": ["IMG/T1"]}
+        mock_fu.return_value.remove.return_value = True
+        status = lrepo.del_unreferenced_layers(["/l/sha256:aa",
+                                                "/l/sha256:bb"])
+        self.assertEqual(status, ["/l/sha256:bb"])
+        mock_save.assert_called_once_with({"sha256:aa": ["IMG/T1"]})
+        mock_lindex.assert_called_once_with("/l/sha256:bb")
+        mock_lock.return_value.release.assert_called_once_with()
+
+    @patch.object(LocalRepository, 'cd_container')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_68_object_locks(self, mock_fu, mock_cd):
+        """Test68 LocalRepository().layer_lock() tag_lock() container_lock()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        lock = lrepo.layer_lock("/x/sha256:aa")
+        self.assertEqual(lock.lock_file, lrepo.layersdir + "/sha256:aa.lock")
+        self.assertFalse(lock.shared)
+        lock = lrepo.tag_lock("IMAGE/NAME", "TAG")
+        self.assertEqual(lock.lock_file,
+                         lrepo.reposdir + "/IMAGE/NAME/TAG.lock")
+        mock_cd.return_value = "/c/CONTAINER"
+        lock = lrepo.container_lock("CONTAINER")
+        self.assertEqual(lock.lock_file, "/c/CONTAINER/.lock")
+        mock_cd.return_value = ""
+        lock = lrepo.container_lock("CONTAINER")
+        self.assertEqual(lock.lock_file, "")
+
+    @patch('udocker.container.localrepo.multiprocessing')
+    @patch('udocker.container.localrepo.verify_layer')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_69__verify_layers(self, mock_fu, mock_verify, mock_mp):
+        """Test69 LocalRepository()._verify_layers()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        tasks = [("/r/sha256:aa", "sha256", "aa", True),
+                 ("/r/sha256:bb", "sha256", "bb", True)]
+        mock_mp.Pool.return_value.map.return_value = ["", "failed"]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo._verify_layers(tasks), ["", "failed"])
+        mock_mp.Pool.return_value.map.assert_called_once_with(
+            mock_verify, tasks, 1)
+        self.assertTrue(mock_mp.Pool.return_value.join.called)
+
+        mock_mp.Pool.side_effect = OSError("fail")
+        mock_verify.return_value = ""
+        self.assertEqual(lrepo._verify_layers(tasks), ["", ""])
+        mock_verify.assert_called_with(tasks[1])
+
+    @patch.object(LocalRepository, '_verify_layers')
+    @patch.object(LocalRepository, '_verify_layer_file')
+    @patch.object(LocalRepository, '_load_structure')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_70_verify_image(self, mock_fu, mock_load, mock_layer,
+                             mock_verify):
+        """Test70 LocalRepository().verify_image()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_load.return_value = {
+            "manifest": {"layers": [{"digest": "sha256:aa"}]},
+            "repolayers": {"sha256:aa": {"layer_f": "/t/sha256:aa"}}}
+        mock_layer.return_value = ("/t/sha256:aa", "sha256", "aa", False)
+        mock_verify.return_value = [""]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertTrue(lrepo.verify_image())
+        mock_verify.assert_called_once_with(
+            [("/t/sha256:aa", "sha256", "aa", False)])
+
+        mock_verify.return_value = ["layer file chksum failed"]
+        self.assertFalse(lrepo.verify_image())
+
+        mock_layer.return_value = None
+        mock_verify.return_value = []
+        self.assertFalse(lrepo.verify_image())
+
+    @patch('udocker.container.localrepo.os.path.exists')
+    @patch.object(LocalRepository, '_index_save')
+    @patch.object(LocalRepository, '_index_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_71__ledger_update(self, mock_fu, mock_lock, mock_load,
+                               mock_save, mock_exists):
+        """Test71 LocalRepository()._ledger_update()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_lock.return_value = None
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertFalse(lrepo._ledger_update({"sha256:aa": []}))
+        self.assertFalse(mock_save.called)
+
+        mock_lock.return_value = Mock()
+        mock_load.return_value = {"sha256:bb": [1], "sha256:cc": [2]}
+        mock_exists.side_effect = lambda f_path: not f_path.endswith("cc")
+        mock_save.return_value = True
+        self.assertTrue(lrepo._ledger_update({"sha256:aa": [3]}))
+        mock_save.assert_called_once_with(
+            lrepo.ledger_file, "layers", {"sha256:aa": [3], "sha256:bb": [1]})
+        mock_lock.return_value.release.assert_called_once_with()
+
+    @patch('udocker.container.localrepo.time.time')
+    @patch('udocker.container.localrepo.os.path.realpath')
+    @patch.object(LocalRepository, '_ledger_update')
+    @patch.object(LocalRepository, '_verify_layers')
+    @patch.object(LocalRepository, '_ledger_stat')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_72__verify_run(self, mock_fu, mock_stat, mock_verify,
+                            mock_update, mock_realpath, mock_time):
+        """Test72 LocalRepository()._verify_run()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_realpath.side_effect = lambda f_path: \
+            f_path if f_path == "/l" else "/l/" + f_path.split('/')[-1]
+        mock_time.return_value = 10
+        mock_stat.return_value = [100, 5, 7]
+        mock_verify.return_value = ["failed"]
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        lrepo.layersdir = "/l"
+        tasks = [("/t1/sha256:aa", "sha256", "aa", True),
+                 ("/t2/sha256:aa", "sha256", "aa", True),
+                 ("/t2/sha256:bb", "sha256", "bb", True)]
+        ledger = {"sha256:aa": [100, 5, 7, "", 1]}
+        results = lrepo._verify_run(tasks, ledger)
+        self.assertEqual(results, {"/l/sha256:aa": "",
+                                   "/l/sha256:bb": "failed"})
+        mock_verify.assert_called_once_with([tasks[2]])
+        mock_update.assert_called_once_with(
+            {"sha256:bb": [100, 5, 7, "failed", 10]})
+
+        mock_verify.reset_mock()
+        mock_verify.return_value = ["", ""]
+        results = lrepo._verify_run(tasks)
+        self.assertEqual(results, {"/l/sha256:aa": "", "/l/sha256:bb": ""})
+        mock_verify.assert_called_once_with([tasks[0], tasks[2]])
+
+    @patch.object(LocalRepository, '_verify_run')
+    @patch.object(LocalRepository, '_verify_tag')
+    @patch.object(LocalRepository, 'cd_imagerepo')
+    @patch.object(LocalRepository, 'get_imagerepos')
+    @patch.object(LocalRepository, '_index_load')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_73_verify_all(self, mock_fu, mock_load, mock_imgs, mock_cd,
+                           mock_tag, mock_run):
+        """Test73 LocalRepository().verify_all()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_load.return_value = {"sha256:aa": [100, 5, 7, "", 1]}
+        mock_imgs.return_value = [("IMG", "T2"), ("IMG", "T1")]
+        mock_cd.return_value = True
+        task = ("/t/sha256:aa", "sha256", "aa", False)
+        mock_tag.side_effect = [(True, ["sha256:aa"], [task]),
+                                (False, [], [])]
+        mock_run.return_value = {"/t/sha256:aa": ""}
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        with patch('udocker.container.localrepo.os.path.realpath',
+                   side_effect=lambda f_path: f_path):
+            self.assertEqual(lrepo.verify_all(), [("IMG", "T2")])
+        mock_run.assert_called_once_with([task], mock_load.return_value)
+
+    @patch('udocker.container.localrepo.os.rename')
+    @patch('udocker.container.localrepo.os.mkdir')
+    @patch('udocker.container.localrepo.Unique')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_74__trash_put(self, mock_fu, mock_uniq, mock_mkdir,
+                           mock_rename):
+        """Test74 LocalRepository()._trash_put()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_uniq.return_value.filename.return_value = "udocker-1-x-c1"
+        mock_mkdir.side_effect = OSError("exists")
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo._trash_put("/c/c1"),
+                         lrepo.trashdir + "/udocker-1-x-c1")
+        mock_uniq.return_value.filename.assert_called_with("c1")
+        mock_rename.assert_called_with("/c/c1",
+                                       lrepo.trashdir + "/udocker-1-x-c1")
+        mock_rename.side_effect = OSError("cross-device link")
+        self.assertEqual(lrepo._trash_put("/c/c1"), "")
+
+    @patch('udocker.container.localrepo.os._exit')
+    @patch('udocker.container.localrepo.os.waitpid')
+    @patch('udocker.container.localrepo.os.fork')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_75__trash_remove(self, mock_fu, mock_fork, mock_wait,
+                              mock_exit):
+        """Test75 LocalRepository()._trash_remove()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_fu.return_value.remove.return_value = True
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertTrue(lrepo._trash_remove("/t/.trash/x"))
+        mock_fu.return_value.remove.assert_called_with(force=True,
+                                                       recursive=True)
+        self.assertFalse(mock_fork.called)
+
+        mock_fu.return_value.remove.reset_mock()
+        mock_fork.return_value = 10
+        self.assertTrue(lrepo._trash_remove("/t/.trash/x", True))
+        mock_wait.assert_called_once_with(10, 0)
+        self.assertFalse(mock_fu.return_value.remove.called)
+
+        mock_fork.side_effect = OSError("no memory")
+        self.assertTrue(lrepo._trash_remove("/t/.trash/x", True))
+        self.assertTrue(mock_fu.return_value.remove.called)
+        self.assertFalse(mock_exit.called)
+
+    @patch('udocker.container.localrepo.os.path.isdir')
+    @patch('udocker.container.localrepo.os.makedirs')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_76_tmp_area(self, mock_fu, mock_mkdirs, mock_isdir):
+        """Test76 LocalRepository().tmp_area()."""
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo.tmp_area(), lrepo.topdir + "/tmp")
+        mock_mkdirs.assert_called_with(lrepo.topdir + "/tmp")
+        self.assertTrue(mock_fu.return_value.register_prefix.called)
+
+        mock_mkdirs.side_effect = OSError("exists")
+        mock_isdir.return_value = True
+        self.assertEqual(lrepo.tmp_area(), lrepo.tmpdir)
+        mock_isdir.return_value = False
+        self.assertEqual(lrepo.tmp_area(), Config.conf['tmpdir'])
+
+    @patch.object(LocalRepository, 'get_imagerepos')
+    @patch.object(LocalRepository, '_index_save')
+    @patch.object(LocalRepository, '_index_load')
+    @patch.object(LocalRepository, '_repo_lock')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_77__catalog_save(self, mock_fu, mock_lock, mock_load,
+                              mock_save, mock_imgs):
+        """Test77 LocalRepository()._catalog_save()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_lock.return_value = None
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertFalse(lrepo._catalog_save({"IMG/T1": None}))
+        self.assertFalse(mock_save.called)
+
+        mock_lock.return_value = Mock()
+        mock_save.return_value = True
+        mock_load.return_value = {"IMG/T1": {"mtime": 1.0},
+                                  "IMG/T2": {"mtime": 2.0}}
+        self.assertTrue(lrepo._catalog_save({"IMG/T1": None,
+                                             "IMG/T3": {"mtime": 3.0}}))
+        self.assertEqual(mock_save.call_args[0][2],
+                         {"IMG/T2": {"mtime": 2.0}, "IMG/T3": {"mtime": 3.0}})
+        self.assertFalse(mock_imgs.called)
+        mock_lock.return_value.release.assert_called_with()
+
+        mock_load.reset_mock()
+        mock_imgs.return_value = [("IMG", "T1"), ("IMG", "T4")]
+        self.assertTrue(lrepo._catalog_save({"IMG/T1": {"mtime": 1.0}},
+                                            rebuilt=True))
+        self.assertEqual(mock_save.call_args[0][2],
+                         {"IMG/T1": {"mtime": 1.0}, "IMG/T4": {"mtime": 0}})
+        self.assertFalse(mock_load.called)
+
+    @patch.object(LocalRepository, 'arch_from_image')
+    @patch.object(LocalRepository, 'get_image_attributes')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_78_get_image_platform_fmt(self, mock_fu, mock_attr, mock_arch):
+        """Test78 LocalRepository().get_image_platform_fmt()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_attr.return_value = (None, None)
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo.get_image_platform_fmt(), "unknown/unknown")
+
+        mock_attr.return_value = ({"os": "linux", "architecture": "arm64",
+                                   "variant": "v8"}, [])
+        self.assertEqual(lrepo.get_image_platform_fmt(), "linux/arm64/v8")
+
+        mock_attr.return_value = ({"os": "linux"}, [])
+        mock_arch.return_value = "amd64"
+        self.assertEqual(lrepo.get_image_platform_fmt(detect=False),
+                         "linux/unknown")
+        self.assertFalse(mock_arch.called)
+        self.assertEqual(lrepo.get_image_platform_fmt(), "linux/amd64")
+        mock_arch.assert_called_with("docker", build=False)
+
+    @patch.object(LocalRepository, 'index_layer')
+    @patch.object(LocalRepository, 'get_image_attributes')
+    @patch('udocker.container.localrepo.FileUtil')
+    def test_79_get_image_indexes(self, mock_fu, mock_attr, mock_index):
+        """Test79 LocalRepository().get_image_indexes()."""
+        mock_fu.return_value.register_prefix.side_effect = \
+            [None, None, None]
+        mock_attr.return_value = ({}, ["/l/aa", "/l/bb"])
+        mock_index.side_effect = lambda layer_file, build: layer_file
+        lrepo = LocalRepository(UDOCKER_TOPDIR)
+        self.assertEqual(lrepo.get_image_indexes(), ["/l/bb", "/l/aa"])
+        mock_index.assert_called_with("/l/aa", True)
+
+        mock_index.side_effect = None
+        mock_index.return_value = None
+        self.assertEqual(lrepo.get_image_indexes(build=False), [])
+        mock_index.assert_called_with("/l/bb", False)
+
+
 if __name__ == '__main__':
     main()
@@ -120,6 +120,118 @@ class OciLocalFileAPITestCase(TestCase):
         status = OciLocalFileAPI(self.local).load(tmpdir, imgrepo)
         self.assertEqual(status, ['r1', 'r2'])
 
+    @patch('udocker.oci.ChkSUM.sha256')
+    @patch('udocker.oci.os.path.realpath')
+    def test_08__layer_digest(self, mock_realpath, mock_sha256):
+        """Test08 OciLocalFileAPI()._layer_digest."""
+        mock_realpath.side_effect = lambda path: path
+        ociapi = OciLocalFileAPI(self.local)
+        self.assertEqual(ociapi._layer_digest("/r/layers/sha256:" + "a" * 64),
+                         ("sha256", "a" * 64))
+        self.assertFalse(mock_sha256.called)
+
+        mock_sha256.return_value = "b" * 64
+        self.assertEqual(ociapi._layer_digest("/r/layers/" + "c" * 64 + ".layer"),
+                         ("sha256", "b" * 64))
+        mock_sha256.return_value = False
+        self.assertEqual(ociapi._layer_digest("/r/layers/x.layer"), ("", ""))
+
+    @patch('udocker.oci.FileUtil.getdata')
+    def test_09__layer_media_type(self, mock_getdata):
+        """Test09 OciLocalFileAPI()._layer_media_type."""
+        ociapi = OciLocalFileAPI(self.local)
+        mock_getdata.return_value = b"\x1f\x8b\x08\x00"
+        self.assertEqual(ociapi._layer_media_type("l1"),
+                         "application/vnd.oci.image.layer.v1.tar+gzip")
+        mock_getdata.return_value = b"\x28\xb5\x2f\xfd"
+        self.assertEqual(ociapi._layer_media_type("l1"),
+                         "application/vnd.oci.image.layer.v1.tar+zstd")
+        mock_getdata.return_value = b"usr/"
+        self.assertEqual(ociapi._layer_media_type("l1"),
+                         "application/vnd.oci.image.layer.v1.tar")
+
+    @patch('udocker.oci.FileUtil.size')
+    @patch.object(OciLocalFileAPI, '_layer_media_type')
+    @patch.object(OciLocalFileAPI, '_layer_digest')
+    def test_10__save_image(self, mock_digest, mock_mtype, mock_size):
+        """Test10 OciLocalFileAPI()._save_image."""
+        tarstream = Mock()
+        blobs = set(["sha256"])
+        self.local.cd_imagerepo.return_value = ""
+        ociapi = OciLocalFileAPI(self.local)
+        self.assertIsNone(ociapi._save_image("repo/img", "t1", tarstream, blobs))
+
+        self.local.cd_imagerepo.return_value = "/r/repos/repo/img/t1"
+        self.local.get_image_attributes.return_value = \
+            ({"config": {}}, ["/r/layers/sha256:aa", "/r/layers/sha256:aa"])
+        mock_digest.return_value = ("sha256", "aa")
+        mock_mtype.return_value = "application/vnd.oci.image.layer.v1.tar"
+        mock_size.return_value = 10
+        descriptor = ociapi._save_image("repo/img", "t1", tarstream, blobs)
+        self.assertEqual(descriptor["mediaType"],
+                         "application/vnd.oci.image.manifest.v1+json")
+        self.assertEqual(
+            descriptor["annotations"]["org.opencontainers.image.ref.name"],
+            "repo/img:t1")
+        tarstream.add_file.assert_called_once_with("blobs/sha256/aa",
+                                                   "/r/layers/sha256:aa")
+        self.assertEqual(tarstream.add_data.call_count, 2)
+        self.assertIn("sha256:aa", blobs)
+
+        tarstream.reset_mock()
+        ociapi._save_image("repo/img", "t1", tarstream, blobs)
+        self.assertFalse(tarstream.add_file.called)
+        self.assertFalse(tarstream.add_data.called)
+
+    @patch('udocker.oci.Msg')
+    @patch.object(OciLocalFileAPI, '_save_image')
+    @patch('udocker.oci.TarStream')
+    def test_11_save(self, mock_tarstream, mock_svimg, mock_msg):
+        """Test11 OciLocalFileAPI().save."""
+        ociapi = OciLocalFileAPI(self.local)
+        self.assertFalse(ociapi.save([], "img.tar"))
+
+        imglist = [("repo/img", "t1")]
+        mock_tarstream.return_value.open.return_value = True
+        mock_svimg.return_value = None
+        self.assertFalse(ociapi.save(imglist, "img.tar"))
+        self.assertTrue(mock_tarstream.return_value.abort.called)
+
+        mock_tarstream.reset_mock()
+        mock_svimg.return_value = {"digest": "sha256:aa"}
+        self.assertTrue(ociapi.save(imglist, "img.tar"))
+        names = [call[0][0] for call in
+                 mock_tarstream.return_value.add_data.call_args_list]
+        self.assertEqual(names, ["oci-layout", "index.json"])
+        self.assertIn('"sha256:aa"', mock_tarstream.return_value.
+                      add_data.call_args[0][1])
+        self.assertTrue(mock_tarstream.return_value.close.called)
+
+        mock_tarstream.reset_mock()
+        mock_tarstream.return_value.add_data.side_effect = OSError("full")
+        self.assertFalse(ociapi.save(imglist, "img.tar"))
+        self.assertTrue(mock_tarstream.return_value.abort.called)
+
+    @patch('udocker.oci.Msg')
+    @patch.object(OciLocalFileAPI, '_save_layout')
+    @patch('udocker.oci.DirStream')
+    def test_12_save_dir(self, mock_dirstream, mock_svlayout, mock_msg):
+        """Test12 OciLocalFileAPI().save_dir."""
+        ociapi = OciLocalFileAPI(self.local)
+        self.assertFalse(ociapi.save_dir([], "imgdir"))
+
+        imglist = [("repo/img", "t1")]
+        mock_dirstream.return_value.open.return_value = False
+        self.assertFalse(ociapi.save_dir(imglist, "imgdir"))
+        self.assertFalse(mock_svlayout.called)
+
+        mock_dirstream.return_value.open.return_value = True
+        mock_svlayout.return_value = True
+        self.assertTrue(ociapi.save_dir(imglist, "imgdir"))
+        mock_dirstream.assert_called_with("imgdir")
+        mock_svlayout.assert_called_with(imglist, mock_dirstream.return_value,
+                                         "imgdir")
+
 
 if __name__ == '__main__':
     main()
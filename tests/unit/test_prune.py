@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: RepositoryPrune
+"""
+
+import errno
+from unittest import TestCase, main
+from unittest.mock import patch, Mock, call
+from udocker.container.prune import RepositoryPrune
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class RepositoryPruneTestCase(TestCase):
+    """Test RepositoryPrune() garbage collection of the repository."""
+
+    def setUp(self):
+        Config().getconf()
+        Config.conf['tmpdir'] = "/tmp"
+        self.local = Mock()
+        self.local.layersdir = "/r/layers"
+        self.local.reposdir = "/r/repos"
+        self.local.containersdir = "/r/containers"
+        self.local.trashdir = "/r/.trash"
+        self.local.tmpdir = "/r/tmp"
+
+    def tearDown(self):
+        pass
+
+    @patch('udocker.container.prune.os.kill')
+    def test_01__running(self, mock_kill):
+        """Test01 RepositoryPrune()._running()."""
+        prune = RepositoryPrune(self.local)
+        self.assertTrue(prune._running(10))
+        mock_kill.side_effect = OSError(errno.ESRCH, "no process")
+        self.assertFalse(prune._running(10))
+        mock_kill.side_effect = OSError(errno.EPERM, "not allowed")
+        self.assertTrue(prune._running(10))
+
+    @patch.object(RepositoryPrune, '_running')
+    def test_02__is_stale_tmp(self, mock_running):
+        """Test02 RepositoryPrune()._is_stale_tmp()."""
+        prune = RepositoryPrune(self.local)
+        before = prune._now - prune.GRACE - 1
+        old = Mock(st_mtime=before, st_ctime=before)
+        new = Mock(st_mtime=prune._now, st_ctime=prune._now)
+        self.assertFalse(prune._is_stale_tmp("sha256:aa", old))
+
+        mock_running.return_value = True
+        self.assertFalse(prune._is_stale_tmp("udocker-12-xx-layer.tmp", old))
+        mock_running.assert_called_with(12)
+        self.assertFalse(prune._is_stale_tmp(".catalog.tmp34", old))
+        mock_running.assert_called_with(34)
+        mock_running.return_value = False
+        self.assertTrue(prune._is_stale_tmp("udocker-12-xx-layer.tmp", old))
+        self.assertFalse(prune._is_stale_tmp("udocker-12-xx-layer.tmp", new))
+        self.assertFalse(prune._is_stale_tmp(".catalog.tmp34", new))
+
+        mock_running.reset_mock()
+        self.assertTrue(prune._is_stale_tmp("sha256:aa.tmp", old))
+        self.assertFalse(prune._is_stale_tmp("sha256:aa.tmp", new))
+        self.assertFalse(mock_running.called)
+
+    @patch.object(RepositoryPrune, '_is_stale_tmp')
+    @patch.object(RepositoryPrune, '_listdir')
+    def test_03__mark_layers(self, mock_listdir, mock_stale):
+        """Test03 RepositoryPrune()._mark_layers()."""
+        prune = RepositoryPrune(self.local)
+        before = prune._now - prune.GRACE - 1
+        old = Mock(st_mtime=before, st_ctime=before)
+        new = Mock(st_mtime=prune._now, st_ctime=prune._now)
+        mock_listdir.side_effect = [
+            [("sha256:aa", old), ("sha256:aa.toc", old),
+             ("sha256:bb", old), ("sha256:cc", new), ("sha256:dd.toc", old),
+             ("sha256:ee.tmp", old), ("sha256:aa.lock", old),
+             ("sha256:ff.lock", old), ("sha256:gg.lock", new)],
+            [(".catalog.tmp5", old), (".catalog", old)]]
+        mock_stale.side_effect = \
+            lambda fname, f_stat: fname.endswith((".tmp", ".tmp5"))
+        self.local.get_unreferenced_layers.return_value = \
+            ["/r/layers/sha256:bb", "/r/layers/sha256:cc"]
+        objects = sorted(prune._mark_layers())
+        self.assertEqual(objects, [["index", "/r/layers/sha256:dd.toc"],
+                                   ["layer", "/r/layers/sha256:bb"],
+                                   ["lock", "/r/layers/sha256:ff.lock"],
+                                   ["temp", "/r/layers/sha256:ee.tmp"],
+                                   ["temp", "/r/repos/.catalog.tmp5"]])
+        self.local.get_unreferenced_layers.assert_called_with(rescan=True)
+
+    @patch('udocker.container.prune.FileUtil')
+    @patch('udocker.container.prune.os.path.isdir')
+    @patch.object(RepositoryPrune, '_listdir')
+    def test_04__mark_containers(self, mock_listdir, mock_isdir, mock_fu):
+        """Test04 RepositoryPrune()._mark_containers()."""
+        prune = RepositoryPrune(self.local)
+        before = prune._now - prune.GRACE - 1
+        old = Mock(st_mode=0o40755, st_mtime=before, st_ctime=before)
+        new = Mock(st_mode=0o40755, st_mtime=prune._now, st_ctime=prune._now)
+        link = Mock(st_mode=0o120777, st_mtime=prune._now,
+                    st_ctime=prune._now)
+        mock_listdir.return_value = [("c1", old), ("c2", new),
+                                     ("n1", link), ("n2", link)]
+        mock_isdir.side_effect = [False, True]
+        mock_fu.return_value.getdata.return_value = "CLONING:inprogress"
+        self.local.get_container_name.return_value = ["n3"]
+        objects = prune._mark_containers()
+        self.assertEqual(objects, [["container", "/r/containers/c1"],
+                                   ["name", "/r/containers/n3"],
+                                   ["name", "/r/containers/n1"]])
+        self.local.get_container_name.assert_called_once_with("c1")
+
+    @patch.object(RepositoryPrune, '_tree_recent')
+    @patch.object(RepositoryPrune, '_running')
+    @patch('udocker.container.prune.os.getuid')
+    @patch.object(RepositoryPrune, '_listdir')
+    def test_05__mark_tmpdir(self, mock_listdir, mock_getuid, mock_running,
+                             mock_tree):
+        """Test05 RepositoryPrune()._mark_tmpdir()."""
+        mock_getuid.return_value = 1000
+        mock_running.return_value = False
+        prune = RepositoryPrune(self.local)
+        old = prune._now - prune.GRACE - 1
+        new = prune._now
+        mock_listdir.side_effect = [
+            [("udocker-12-xx-flatten",
+              Mock(st_uid=1000, st_mode=0o100644, st_mtime=old,
+                   st_ctime=old)),
+             ("udocker-13-xx-flatten",
+              Mock(st_uid=0, st_mtime=old, st_ctime=old)),
+             ("udocker-15-xx-flatten",
+              Mock(st_uid=1000, st_mtime=new, st_ctime=new)),
+             ("other.tmp",
+              Mock(st_uid=1000, st_mode=0o100644, st_mtime=old,
+                   st_ctime=old))],
+            [("udocker-14-xx-load",
+              Mock(st_uid=1000, st_mode=0o100644, st_mtime=old,
+                   st_ctime=old)),
+             ("udocker-16-xx-load", Mock(st_uid=1000, st_mode=0o40755,
+                                         st_mtime=old, st_ctime=old))]]
+        mock_tree.return_value = True
+        objects = prune._mark_tmpdir()
+        self.assertEqual(objects, [["temp", "/tmp/udocker-12-xx-flatten"],
+                                   ["temp", "/r/tmp/udocker-14-xx-load"]])
+        mock_listdir.assert_called_with("/r/tmp")
+        mock_tree.assert_called_once_with("/r/tmp/udocker-16-xx-load")
+
+    @patch('udocker.container.prune.os.lstat')
+    @patch('udocker.container.prune.os.walk')
+    def test_10__tree_recent(self, mock_walk, mock_lstat):
+        """Test10 RepositoryPrune()._tree_recent()."""
+        prune = RepositoryPrune(self.local)
+        old = prune._now - prune.GRACE - 1
+        mock_walk.return_value = [("/r/tmp/x", ["blobs"], []),
+                                  ("/r/tmp/x/blobs", [], ["aa", "bb"])]
+        mock_lstat.side_effect = [Mock(st_mtime=old, st_ctime=old),
+                                  OSError("vanished"),
+                                  Mock(st_mtime=old, st_ctime=prune._now)]
+        self.assertTrue(prune._tree_recent("/r/tmp/x"))
+        mock_lstat.side_effect = None
+        mock_lstat.return_value = Mock(st_mtime=old, st_ctime=old)
+        self.assertFalse(prune._tree_recent("/r/tmp/x"))
+
+    @patch.object(RepositoryPrune, '_is_stale_tmp')
+    @patch.object(RepositoryPrune, '_listdir')
+    def test_06__mark_trash(self, mock_listdir, mock_stale):
+        """Test06 RepositoryPrune()._mark_trash()."""
+        mock_listdir.return_value = [("udocker-12-xx-c1", Mock()),
+                                     ("udocker-13-xx-c2", Mock())]
+        mock_stale.side_effect = [True, False]
+        objects = RepositoryPrune(self.local)._mark_trash()
+        self.assertEqual(objects, [["trash", "/r/.trash/udocker-12-xx-c1"]])
+        mock_listdir.assert_called_with("/r/.trash")
+
+    @patch('udocker.container.prune.DiskUsage')
+    @patch('udocker.container.prune.os.lstat')
+    def test_07__size(self, mock_lstat, mock_du):
+        """Test07 RepositoryPrune()._size()."""
+        prune = RepositoryPrune(self.local)
+        mock_lstat.return_value = Mock(st_mode=0o100644, st_blocks=8)
+        self.assertEqual(prune._size(["layer", "/r/layers/sha256:aa"]),
+                         ["layer", "/r/layers/sha256:aa", 4096])
+        mock_lstat.return_value = Mock(st_mode=0o40755)
+        mock_du.return_value.size.return_value = 8192
+        self.assertEqual(prune._size(["container", "/r/containers/c1"]),
+                         ["container", "/r/containers/c1", 8192])
+        mock_lstat.side_effect = OSError("fail")
+        self.assertEqual(prune._size(["name", "/r/containers/n1"]),
+                         ["name", "/r/containers/n1", 0])
+
+    @patch.object(RepositoryPrune, '_size')
+    @patch.object(RepositoryPrune, '_mark_trash')
+    @patch.object(RepositoryPrune, '_mark_tmpdir')
+    @patch.object(RepositoryPrune, '_mark_containers')
+    @patch.object(RepositoryPrune, '_mark_tag_locks')
+    @patch.object(RepositoryPrune, '_mark_layers')
+    def test_08_mark(self, mock_layers, mock_taglocks, mock_containers,
+                     mock_tmpdir, mock_trash, mock_size):
+        """Test08 RepositoryPrune().mark()."""
+        mock_layers.return_value = [["layer", "/r/layers/sha256:aa"]]
+        mock_taglocks.return_value = []
+        mock_containers.return_value = [["container", "/r/containers/c1"]]
+        mock_tmpdir.return_value = []
+        mock_trash.return_value = [["trash", "/r/.trash/udocker-1-x-c2"]]
+        mock_size.side_effect = lambda obj: obj + [10]
+        self.assertEqual(RepositoryPrune(self.local).mark(),
+                         [["container", "/r/containers/c1", 10],
+                          ["layer", "/r/layers/sha256:aa", 10],
+                          ["trash", "/r/.trash/udocker-1-x-c2", 10]])
+
+    @patch('udocker.container.prune.FileUtil')
+    def test_09_sweep(self, mock_fu):
+        """Test09 RepositoryPrune().sweep()."""
+        objects = [["container", "/r/containers/c1", 10],
+                   ["layer", "/r/layers/sha256:aa", 10],
+                   ["layer", "/r/layers/sha256:bb", 10],
+                   ["temp", "/tmp/udocker-12-xx", 10],
+                   ["trash", "/r/.trash/udocker-1-x-c2", 10]]
+        self.local.del_unreferenced_layers.return_value = \
+            ["/r/layers/sha256:aa"]
+        mock_fu.return_value.remove.side_effect = [True, False, True]
+        prune = RepositoryPrune(self.local)
+        prune.threads = 1
+        removed = prune.sweep(objects)
+        self.assertEqual(removed, [["container", "/r/containers/c1", 10],
+                                   ["layer", "/r/layers/sha256:aa", 10],
+                                   ["trash", "/r/.trash/udocker-1-x-c2", 10]])
+        self.local.del_unreferenced_layers.assert_called_once_with(
+            ["/r/layers/sha256:aa", "/r/layers/sha256:bb"])
+        mock_fu.return_value.remove.assert_called_with(force=True,
+                                                       recursive=True)
+
+        mock_fu.reset_mock()
+        mock_fu.return_value.remove.side_effect = None
+        mock_fu.return_value.remove.return_value = True
+        mock_fu.return_value.rmdir.side_effect = [True, False]
+        removed = prune.sweep([["lock", "/r/repos/library/img/t1.lock", 0]])
+        self.assertEqual(removed, [["lock", "/r/repos/library/img/t1.lock",
+                                    0]])
+        self.assertEqual(mock_fu.call_args_list[-2:],
+                         [call("/r/repos/library/img"),
+                          call("/r/repos/library")])
+
+    @patch('udocker.container.prune.os.lstat')
+    @patch('udocker.container.prune.os.path.isdir')
+    @patch('udocker.container.prune.os.path.isfile')
+    @patch('udocker.container.prune.os.walk')
+    def test_11__mark_tag_locks(self, mock_walk, mock_isfile, mock_isdir,
+                                mock_lstat):
+        """Test11 RepositoryPrune()._mark_tag_locks()."""
+        prune = RepositoryPrune(self.local)
+        before = prune._now - prune.GRACE - 1
+        old = Mock(st_mtime=before, st_ctime=before)
+        new = Mock(st_mtime=prune._now, st_ctime=prune._now)
+        dirs = ["img", "t1"]
+        mock_walk.return_value = [
+            ("/r/repos", ["img"], [".lock", ".refs"]),
+            ("/r/repos/img", dirs, ["t1.lock", "t2.lock", "t3.lock"])]
+        mock_isfile.side_effect = lambda path: path == "/r/repos/img/t1/TAG"
+        mock_isdir.side_effect = lambda path: path == "/r/repos/img/t1"
+        mock_lstat.side_effect = lambda path: \
+            new if path.endswith("t3.lock") else old
+        self.assertEqual(prune._mark_tag_locks(),
+                         [["lock", "/r/repos/img/t2.lock"]])
+        self.assertEqual(dirs, ["img"])
+        mock_walk.assert_called_with("/r/repos")
+
+
+if __name__ == '__main__':
+    main()
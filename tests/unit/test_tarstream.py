@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: TarStream
+"""
+
+import errno
+import hashlib
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.utils.tarstream import TarStream, DirStream
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+class TarStreamTestCase(TestCase):
+    """Test TarStream() sequential writing of tar archives."""
+
+    def _stream(self, mock_write):
+        """TarStream writing to a list of buffers"""
+        written = []
+        mock_write.side_effect = \
+            lambda fdesc, data: written.append(bytes(data)) or len(data)
+        tarstream = TarStream("img.tar")
+        tarstream._fd = 3
+        tarstream._out_fd = 3
+        return (tarstream, written)
+
+    @patch('udocker.utils.tarstream.sys.stdout')
+    @patch('udocker.utils.tarstream.os.open')
+    def test_01_open(self, mock_open, mock_stdout):
+        """Test01 TarStream().open()."""
+        mock_open.return_value = 3
+        tarstream = TarStream("img.tar")
+        self.assertTrue(tarstream.open())
+        self.assertEqual(tarstream._fd, 3)
+
+        mock_open.side_effect = OSError("denied")
+        self.assertFalse(TarStream("img.tar").open())
+
+        mock_stdout.fileno.return_value = 1
+        tarstream = TarStream("-")
+        self.assertTrue(tarstream.open())
+        self.assertEqual(tarstream._fd, 1)
+
+    @patch('udocker.utils.tarstream.os.write')
+    def test_02_add_data(self, mock_write):
+        """Test02 TarStream().add_data()."""
+        (tarstream, written) = self._stream(mock_write)
+        tarstream.add_data("repositories", "{}")
+        self.assertEqual(tarstream.offset, 1024)
+        self.assertEqual(written[0][:12], b"repositories")
+        self.assertEqual(written[1], b"{}")
+        self.assertEqual(len(written[2]), 510)
+
+        tarstream.add_dir("aa")
+        self.assertEqual(tarstream.offset, 1536)
+        self.assertEqual(written[3][:3], b"aa/")
+
+    @patch('udocker.utils.tarstream.os.close')
+    @patch('udocker.utils.tarstream.os.lseek')
+    @patch('udocker.utils.tarstream.os.read')
+    @patch('udocker.utils.tarstream.os.sendfile')
+    @patch('udocker.utils.tarstream.os.fstat')
+    @patch('udocker.utils.tarstream.os.open')
+    @patch('udocker.utils.tarstream.os.write')
+    def test_03_add_file(self, mock_write, mock_open, mock_fstat,
+                         mock_sendfile, mock_read, mock_lseek, mock_close):
+        """Test03 TarStream().add_file()."""
+        mock_open.return_value = 4
+        mock_fstat.return_value = Mock(st_size=1000)
+        mock_sendfile.side_effect = [600, 400]
+        (tarstream, dummy) = self._stream(mock_write)
+        tarstream.add_file("aa/layer.tar", "/r/layers/sha256:aa")
+        self.assertEqual(tarstream.offset, 512 + 1024)
+        self.assertFalse(mock_read.called)
+        mock_sendfile.assert_called_with(3, 4, 600, 400)
+        mock_close.assert_called_once_with(4)
+
+        mock_sendfile.reset_mock()
+        mock_sendfile.side_effect = [600, OSError(errno.EINVAL, "invalid")]
+        mock_read.side_effect = [b"x" * 400]
+        (tarstream, written) = self._stream(mock_write)
+        tarstream.add_file("aa/layer.tar", "/r/layers/sha256:aa")
+        mock_lseek.assert_called_with(4, 600, 0)
+        self.assertEqual(written[1], b"x" * 400)
+        self.assertEqual(tarstream.offset, 512 + 1024)
+
+        mock_sendfile.reset_mock()
+        mock_read.side_effect = [b"x" * 1000]
+        chksum = hashlib.sha256()
+        (tarstream, written) = self._stream(mock_write)
+        tarstream.add_file("aa/layer.tar", "/r/layers/aa.layer", chksum)
+        self.assertFalse(mock_sendfile.called)
+        self.assertEqual(chksum.hexdigest(),
+                         hashlib.sha256(b"x" * 1000).hexdigest())
+
+        mock_read.side_effect = [b"x" * 10, b""]
+        (tarstream, written) = self._stream(mock_write)
+        self.assertRaises(IOError, tarstream.add_file, "aa/layer.tar",
+                          "/r/layers/aa.layer", hashlib.sha256())
+
+    @patch('udocker.utils.tarstream.os.unlink')
+    @patch('udocker.utils.tarstream.os.close')
+    @patch('udocker.utils.tarstream.os.write')
+    def test_04_close(self, mock_write, mock_close, mock_unlink):
+        """Test04 TarStream().close() and abort()."""
+        (tarstream, dummy) = self._stream(mock_write)
+        tarstream.add_data("repositories", "{}")
+        tarstream.close()
+        self.assertEqual(tarstream.offset, 10240)
+        mock_close.assert_called_once_with(3)
+        self.assertIsNone(tarstream._fd)
+
+        mock_close.reset_mock()
+        (tarstream, dummy) = self._stream(mock_write)
+        tarstream.abort()
+        mock_close.assert_called_once_with(3)
+        mock_unlink.assert_called_once_with("img.tar")
+
+        mock_close.reset_mock()
+        mock_unlink.reset_mock()
+        tarstream = TarStream("-")
+        tarstream._fd = 1
+        tarstream.abort()
+        self.assertFalse(mock_close.called)
+        self.assertFalse(mock_unlink.called)
+
+
+class DirStreamTestCase(TestCase):
+    """Test DirStream() writing of image directories."""
+
+    @patch('udocker.utils.tarstream.os.mkdir')
+    def test_01_open(self, mock_mkdir):
+        """Test01 DirStream().open()."""
+        self.assertTrue(DirStream("imgdir").open())
+        mock_mkdir.assert_called_with("imgdir", 0o755)
+
+        mock_mkdir.side_effect = OSError("exists")
+        self.assertFalse(DirStream("imgdir").open())
+
+    @patch('udocker.utils.tarstream.os.path.isdir')
+    @patch('udocker.utils.tarstream.os.mkdir')
+    def test_02_add_dir(self, mock_mkdir, mock_isdir):
+        """Test02 DirStream().add_dir()."""
+        mock_isdir.return_value = False
+        DirStream("imgdir").add_dir("blobs/sha256/")
+        mock_mkdir.assert_called_with("imgdir/blobs/sha256", 0o755)
+
+        mock_mkdir.reset_mock()
+        mock_isdir.return_value = True
+        DirStream("imgdir").add_dir("blobs")
+        self.assertFalse(mock_mkdir.called)
+
+    @patch('udocker.utils.tarstream.open', create=True)
+    @patch('udocker.utils.tarstream.FileUtil.copyto')
+    def test_03_add_file(self, mock_copyto, mock_open):
+        """Test03 DirStream().add_file()."""
+        mock_copyto.return_value = True
+        dirstream = DirStream("imgdir")
+        dirstream.add_file("blobs/sha256/aa", "/r/layers/sha256:aa")
+        mock_copyto.assert_called_with("imgdir/blobs/sha256/aa", link=True)
+        self.assertFalse(mock_open.called)
+
+        mock_open.return_value.__enter__.return_value.read.side_effect = \
+            [b"layer", b""]
+        chksum = hashlib.sha256()
+        dirstream.add_file("aa/layer.tar", "/r/layers/aa.layer", chksum)
+        self.assertEqual(chksum.hexdigest(),
+                         hashlib.sha256(b"layer").hexdigest())
+
+        mock_copyto.return_value = False
+        self.assertRaises(IOError, dirstream.add_file, "blobs/sha256/aa",
+                          "/r/layers/sha256:aa")
+
+    @patch('udocker.utils.tarstream.FileUtil.remove')
+    @patch('udocker.utils.tarstream.os.mkdir')
+    def test_04_abort(self, mock_mkdir, mock_remove):
+        """Test04 DirStream().abort()."""
+        dirstream = DirStream("/tmp/imgdir")
+        dirstream.abort()
+        self.assertFalse(mock_remove.called)
+
+        dirstream.open()
+        dirstream.abort()
+        mock_remove.assert_called_once_with(force=True, recursive=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+udocker unit tests: TreeRemove
+"""
+
+import errno
+from unittest import TestCase, main
+from unittest.mock import patch, Mock
+from udocker.utils.treeremove import TreeRemove
+from udocker.config import Config
+import collections
+
+collections.Callable = collections.abc.Callable
+
+
+def entry(name, is_dir=False):
+    """Mock of a scandir entry"""
+    dir_entry = Mock()
+    dir_entry.name = name
+    dir_entry.is_dir.return_value = is_dir
+    return dir_entry
+
+
+class TreeRemoveTestCase(TestCase):
+    """Test TreeRemove() removal of directory trees."""
+
+    def setUp(self):
+        Config().getconf()
+
+    def tearDown(self):
+        pass
+
+    def test_01_init(self):
+        """Test01 TreeRemove()."""
+        tree = TreeRemove()
+        self.assertEqual(tree.threads, Config.conf['remove_threads'])
+
+    @patch('udocker.utils.treeremove.os.fchmod')
+    @patch('udocker.utils.treeremove.os.fstat')
+    @patch('udocker.utils.treeremove.os.chmod')
+    @patch('udocker.utils.treeremove.os.open')
+    def test_02__open(self, mock_open, mock_chmod, mock_fstat, mock_fchmod):
+        """Test02 TreeRemove()._open()."""
+        mock_open.return_value = 3
+        mock_fstat.return_value = Mock(st_mode=0o40755)
+        tree = TreeRemove()
+        self.assertEqual(tree._open("usr", 4), 3)
+        self.assertFalse(mock_chmod.called)
+        self.assertFalse(mock_fchmod.called)
+
+        mock_open.side_effect = [OSError(errno.EACCES, "denied"), 3]
+        mock_fstat.return_value = Mock(st_mode=0o40500)
+        self.assertEqual(tree._open("usr", 4), 3)
+        mock_chmod.assert_called_once_with("usr", 0o700, dir_fd=4)
+        mock_fchmod.assert_called_once_with(3, 0o700)
+
+        mock_open.side_effect = OSError(errno.ENOENT, "missing")
+        self.assertRaises(OSError, tree._open, "usr", 4)
+
+    @patch('udocker.utils.treeremove.os.unlink')
+    @patch('udocker.utils.treeremove.os.scandir')
+    def test_03__clear(self, mock_scandir, mock_unlink):
+        """Test03 TreeRemove()._clear()."""
+        mock_scandir.return_value = Mock()
+        mock_scandir.return_value.__iter__ = Mock(return_value=iter(
+            [entry("bin", True), entry("a"), entry("b")]))
+        mock_unlink.side_effect = [None, OSError(errno.ENOENT, "missing")]
+        self.assertEqual(TreeRemove()._clear(3), ["bin"])
+        mock_unlink.assert_called_with("b", dir_fd=3)
+        self.assertTrue(mock_scandir.return_value.close.called)
+
+    @patch('udocker.utils.treeremove.os.rmdir')
+    @patch('udocker.utils.treeremove.os.close')
+    @patch.object(TreeRemove, '_clear')
+    @patch.object(TreeRemove, '_open')
+    def test_04__remove_fd(self, mock_open, mock_clear, mock_close,
+                           mock_rmdir):
+        """Test04 TreeRemove()._remove_fd()."""
+        mock_open.side_effect = [5, 6]
+        mock_clear.side_effect = [["lib"], []]
+        TreeRemove()._remove_fd("usr", 4)
+        mock_open.assert_called_with("lib", 5)
+        self.assertEqual(mock_close.call_count, 2)
+        mock_rmdir.assert_called_with("usr", dir_fd=4)
+
+        mock_rmdir.reset_mock()
+        mock_open.side_effect = OSError(errno.ENOENT, "missing")
+        TreeRemove()._remove_fd("usr", 4)
+        self.assertFalse(mock_rmdir.called)
+
+    @patch('udocker.utils.treeremove.os.close')
+    @patch.object(TreeRemove, '_clear')
+    @patch.object(TreeRemove, '_open')
+    def test_05__expand(self, mock_open, mock_clear, mock_close):
+        """Test05 TreeRemove()._expand()."""
+        mock_open.return_value = 3
+        mock_clear.side_effect = [["ROOT"], ["bin", "usr"], [], []]
+        tree = TreeRemove()
+        tree.threads = 1
+        self.assertEqual(tree._expand("/c/c1"), ([], ["/c/c1"]))
+
+        tree.threads = 2
+        tree.DEPTH = 2
+        self.assertEqual(tree._expand("/c/c1"),
+                         (["/c/c1", "/c/c1/ROOT"],
+                          ["/c/c1/ROOT/bin", "/c/c1/ROOT/usr"]))
+
+    @patch('udocker.utils.treeremove.os.rmdir')
+    @patch.object(TreeRemove, '_remove_walk')
+    @patch.object(TreeRemove, '_remove_fd')
+    @patch.object(TreeRemove, '_expand')
+    def test_06_remove(self, mock_expand, mock_remove_fd, mock_walk,
+                       mock_rmdir):
+        """Test06 TreeRemove().remove()."""
+        mock_expand.return_value = (["/c/c1", "/c/c1/ROOT"],
+                                    ["/c/c1/ROOT/bin"])
+        tree = TreeRemove()
+        tree._use_fd = True
+        self.assertTrue(tree.remove("/c/c1"))
+        mock_remove_fd.assert_called_once_with("/c/c1/ROOT/bin")
+        self.assertEqual(mock_rmdir.call_args_list[-1][0][0], "/c/c1")
+
+        mock_remove_fd.side_effect = OSError(errno.EPERM, "not allowed")
+        self.assertFalse(tree.remove("/c/c1"))
+
+        tree._use_fd = False
+        self.assertTrue(tree.remove("/c/c1"))
+        mock_walk.assert_called_once_with("/c/c1")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,10 +16,17 @@ from udocker.helper.keystore import KeyStore
 from udocker.helper.hostinfo import HostInfo
 from udocker.helper.unshare import Unshare
 from udocker.container.structure import ContainerStructure
+from udocker.container.pool import ContainerPool
+from udocker.container.flatten import ImageFlatten
+from udocker.container.commit import ContainerCommit
+from udocker.container.prune import RepositoryPrune
+from udocker.container.dedup import ContainerDedup
+from udocker.container.diskreport import RepositoryDiskReport
 from udocker.engine.execmode import ExecutionMode
 from udocker.engine.nvidia import NvidiaMode
 from udocker.tools import UdockerTools
 from udocker.utils.fileutil import FileUtil
+from udocker.utils.compress import Compression
 from udocker.utils.filebind import FileBind
 from udocker.utils.mountpoint import MountPoint
 
@@ -292,6 +299,7 @@ class UdockerCLI(object):
         load [options] <repo/image>
         --input=<image-file>        :load image file saved by docker
         -i <image-file>             :load image file saved by docker
+        -i <image-dir>              :load image directory in OCI layout
         """
         imagefile = cmdp.get("--input=")
         if not imagefile:
@@ -327,7 +335,14 @@ class UdockerCLI(object):
         save [options] IMAGE
         --output=<image-file>       :save image to file
         -o <image-file>             :save image to file
+        --format=docker|oci         :docker-archive (default) or OCI layout
+        --format=oci-dir            :OCI layout in a directory with linked blobs
+        --compress=gzip|zstd        :compress the image file
         """
+        imageformat = cmdp.get("--format=")
+        if not imageformat:
+            imageformat = "docker"
+        compress = cmdp.get("--compress=")
         imagefile = cmdp.get("--output=")
         if not imagefile:
             imagefile = cmdp.get("-o=")
@@ -341,6 +356,16 @@ class UdockerCLI(object):
             cmdp.get("-o")
         if cmdp.missing_options():  # syntax error
             return self.STATUS_ERROR
+        if imageformat not in ("docker", "oci", "oci-dir"):
+            Msg().err("Error: invalid image format:", imageformat)
+            return self.STATUS_ERROR
+        if compress and compress not in Compression.METHODS:
+            Msg().err("Error: invalid compression:", compress)
+            return self.STATUS_ERROR
+        if imageformat == "oci-dir" and (compress or imagefile == '-'):
+            Msg().err("Error: oci-dir requires an output directory "
+                      "without compression")
+            return self.STATUS_ERROR
         if imagefile != '-':
             if os.path.exists(imagefile):
                 Msg().err("Error: output file already exists:", imagefile)
@@ -354,7 +379,8 @@ class UdockerCLI(object):
         if not imagefile:
             Msg().err("Error: must specify filename of image file for output")
             return self.STATUS_ERROR
-        if not self.localfileapi.save(imagetag_list, imagefile):
+        if not self.localfileapi.save(imagetag_list, imagefile, imageformat,
+                                      compress):
             return self.STATUS_ERROR
         return self.STATUS_OK
 
@@ -418,9 +444,11 @@ class UdockerCLI(object):
         export - <container-id>
         -o                         :export to file, instead of stdout
         --clone                    :export in clone (udocker) format
+        --compress=gzip|zstd       :compress the tar file
         """
         to_file = cmdp.get("-o")
         clone = cmdp.get("--clone")
+        compress = cmdp.get("--compress=")
         if to_file:
             tarfile = cmdp.get("P1")
             container_id = cmdp.get("P2")
@@ -436,14 +464,17 @@ class UdockerCLI(object):
         if not tarfile:
             Msg().err("Error: invalid output file name", tarfile)
             return self.STATUS_ERROR
+        if compress and compress not in Compression.METHODS:
+            Msg().err("Error: invalid compression:", compress)
+            return self.STATUS_ERROR
         if to_file:
             Msg().out("Info: exporting to file", tarfile)
 
         cstruct = ContainerStructure(self.localrepo, container_id)
         if clone:
-            if cstruct.clone_tofile(tarfile):
+            if cstruct.clone_tofile(tarfile, compress):
                 return self.STATUS_OK
-        elif cstruct.export_tofile(tarfile):
+        elif cstruct.export_tofile(tarfile, compress):
             return self.STATUS_OK
 
         Msg().err("Error: exporting")
@@ -454,8 +485,11 @@ class UdockerCLI(object):
         clone : create a duplicate copy of an existing container
         clone <source-container-id>
         --name=<container-name>    :add an alias to the cloned container
+        --hardlink                 :share files with the source through
+                                    hard links instead of copying
         """
         name = cmdp.get("--name=")
+        hardlink = cmdp.get("--hardlink")
         container_id = cmdp.get("P1")
         if cmdp.missing_options():  # syntax error
             return self.STATUS_ERROR
@@ -467,7 +501,8 @@ class UdockerCLI(object):
             Msg().err("Error: container name already exists")
             return self.STATUS_ERROR
         Msg().out("Debug: cloning container id:", container_id, l=Msg.DBG)
-        clone_id = self.localfileapi.clone_container(container_id, name)
+        clone_id = self.localfileapi.clone_container(container_id, name,
+                                                     hardlink)
         if clone_id:
             Msg().out(clone_id)
             return self.STATUS_OK
@@ -557,6 +592,10 @@ class UdockerCLI(object):
         v2_auth_token = self.keystore.get(self.dockerioapi.registry_url)
         self.dockerioapi.set_v2_login_token(v2_auth_token)
         if self.dockerioapi.get(imagerepo, tag, platform):
+            pool = ContainerPool(self.localrepo, imagerepo, tag)
+            if pool.get_config():
+                pool.invalidate()
+                pool.refill_background()
             return self.STATUS_OK
 
         Msg().err("Error: no files downloaded")
@@ -768,6 +807,7 @@ class UdockerCLI(object):
 
         run <repo/image:tag> always creates a new container from the image
         if needed the image is pulled. This is slow and may waste storage.
+        If a pool exists for the image a container is taken from the pool.
         """
         self._get_run_options(cmdp)
         container_or_image = cmdp.get("P1")
@@ -789,7 +829,10 @@ class UdockerCLI(object):
             container_id = self.localrepo.get_container_id(container_or_image)
             if not container_id:
                 (imagerepo, tag) = self._check_imagespec(container_or_image)
-                if (imagerepo and
+                if imagerepo and pull != "always":
+                    container_id = ContainerPool(
+                        self.localrepo, imagerepo, tag).claim()
+                if (imagerepo and not container_id and
                         self.localrepo.cd_imagerepo(imagerepo, tag)):
                     container_id = self._create(imagerepo + ":" + tag)
                 if pull != "never" and (not container_id or pull == "always"):
@@ -812,11 +855,81 @@ class UdockerCLI(object):
 
         self._get_run_options(cmdp, exec_engine)
         exit_status = exec_engine.run(container_id)
+        self.localrepo.set_container_attrs(container_id, size=-1)
         if delete and not self.localrepo.isprotected_container(container_id):
-            self.localrepo.del_container(container_id)
+            self.localrepo.del_container(container_id, background=True)
 
         return exit_status
 
+    def do_pool(self, cmdp):
+        """
+        pool: keep containers created in advance for run <repo/image:tag>
+        pool [options] <repo/image:tag>
+        --size=<n>                 :number of containers to keep ready
+        --size=0                   :delete the pool and its containers
+        --execmode=<mode>          :execution mode of the containers
+        pool                       :list pools
+        """
+        imagespec = cmdp.get("P1")
+        size = cmdp.get("--size=")
+        xmode = cmdp.get("--execmode=")
+        if cmdp.missing_options():               # syntax error
+            return self.STATUS_ERROR
+
+        if not imagespec:
+            Msg().out("%-48.48s %5s %5s" % ("IMAGE", "SIZE", "READY"),
+                      l=Msg.INF)
+            for (imagerepo, tag, pool_size, ready) in \
+                    ContainerPool(self.localrepo).get_pools():
+                Msg().out("%-48.48s %5s %5s" %
+                          (imagerepo + ":" + tag, pool_size, ready))
+            return self.STATUS_OK
+
+        (imagerepo, tag) = self._check_imagespec(imagespec)
+        if not imagerepo:
+            return self.STATUS_ERROR
+
+        pool = ContainerPool(self.localrepo, imagerepo, tag)
+        if not size:
+            pool_conf = pool.get_config()
+            if not pool_conf:
+                Msg().err("Error: no pool for image:", imagespec)
+                return self.STATUS_ERROR
+            Msg().out("%s:%s size=%s ready=%s execmode=%s" %
+                      (imagerepo, tag, pool_conf["size"], len(pool.ready()),
+                       pool_conf["execmode"]))
+            return self.STATUS_OK
+
+        try:
+            size = int(size)
+        except ValueError:
+            size = -1
+        if size < 0:
+            Msg().err("Error: invalid pool size:", cmdp.get("--size="))
+            return self.STATUS_ERROR
+
+        if xmode and xmode.upper() not in \
+                ExecutionMode(self.localrepo, "").valid_modes:
+            Msg().err("Error: invalid execmode:", xmode)
+            return self.STATUS_ERROR
+
+        if not size:
+            if pool.remove():
+                return self.STATUS_OK
+            Msg().err("Error: deleting pool:", imagespec)
+            return self.STATUS_ERROR
+
+        if not self.localrepo.cd_imagerepo(imagerepo, tag):
+            Msg().err("Error: image not found:", imagespec)
+            return self.STATUS_ERROR
+
+        if not pool.set_config(size, xmode.upper() if xmode else ""):
+            return self.STATUS_ERROR
+
+        pool.trim(size)
+        pool.refill_background()
+        return self.STATUS_OK
+
     def do_images(self, cmdp):
         """
         images: list container images
@@ -830,30 +943,31 @@ class UdockerCLI(object):
         dummy = cmdp.get("--all")
         if cmdp.missing_options():               # syntax error
             return self.STATUS_ERROR
-        images_list = self.localrepo.get_imagerepos()
+        catalog = self.localrepo.get_catalog()
         Msg().out("REPOSITORY", l=Msg.INF)
-        for (imagerepo, tag) in images_list:
-            prot = (".", "P")[
-                self.localrepo.isprotected_imagerepo(imagerepo, tag)]
-            imagerepo_dir = self.localrepo.cd_imagerepo(imagerepo, tag)
+        for tag_ref in sorted(catalog):
+            entry = catalog[tag_ref]
+            imagerepo = entry["imagerepo"]
+            tag = entry["tag"]
+            prot = (".", "P")[entry["protected"]]
+            imagerepo_dir = self.localrepo.reposdir + '/' + tag_ref
 
             if print_platform:
-                platform = self.localrepo.get_image_platform_fmt()
+                platform = entry["platform"]
+                if platform.split('/')[1:2] == ["unknown"] and \
+                        self.localrepo.cd_imagerepo(imagerepo, tag):
+                    platform = self.localrepo.get_image_platform_fmt()
                 Msg().out("%-18.18s %c %s" % (platform, prot, imagerepo + ":" + tag))
             else:
                 Msg().out("%s    %c" % (imagerepo + ":" + tag, prot))
 
             if verbose:
                 Msg().out(" %s" % (imagerepo_dir))
-                layers_list = self.localrepo.get_layers(imagerepo, tag)
-                if layers_list:
-                    for (layer_name, size) in layers_list:
-                        file_size = size / (1024 * 1024)
-                        if not file_size and size:
-                            file_size = 1
-                        Msg().out("    %s (%d MB)" %
-                                  (layer_name.replace(imagerepo_dir, ""),
-                                   file_size))
+                for (layer_name, size) in entry["layers"]:
+                    file_size = size / (1024 * 1024)
+                    if not file_size and size:
+                        file_size = 1
+                    Msg().out("    /%s (%d MB)" % (layer_name, file_size))
         return self.STATUS_OK
 
     def do_ps(self, cmdp):
@@ -882,20 +996,18 @@ class UdockerCLI(object):
         fmt = "%-36.36s %c %c " + mod_h + size_h + plat_h + "%-18s %-20.20s"
         Msg().out(fmt % ("CONTAINER ID", 'P', 'M', "NAMES", "IMAGE"))
         fmt = "%-36.36s %c %c " + mod_l + size_l + plat_l + "%-18.100s %-20.100s"
-        line = [''] * 8
-        containers_list = self.localrepo.get_containers_list(False)
-        for (line[0], line[7], line[6]) in containers_list:
-            container_id = line[0]
-            exec_mode = ExecutionMode(self.localrepo, container_id)
-            line[3] = exec_mode.get_mode() if print_mode else ""
-            line[1] = ('.', 'P')[
-                self.localrepo.isprotected_container(container_id)]
-            line[2] = ('R', 'W', 'N', 'D')[
-                self.localrepo.iswriteable_container(container_id)]
-            line[4] = self.localrepo.get_size(container_id) if print_size else ""
-            platform = ContainerStructure(self.localrepo,
-                                          container_id).get_container_platform_fmt()
-            line[5] = platform if print_platform else ""
+        default_mode = ""
+        if print_mode:
+            default_mode = ExecutionMode(self.localrepo, "").get_mode()
+        for attrs in self.localrepo.get_containers_attrs(print_size):
+            line = [attrs["id"],
+                    ('.', 'P')[attrs["protected"]],
+                    ('R', 'W', 'N', 'D')[attrs["writeable"]],
+                    (attrs["execmode"] or default_mode) if print_mode else "",
+                    attrs["size"] if print_size else "",
+                    attrs["platform"] if print_platform else "",
+                    str(attrs["names"]),
+                    attrs["imagerepo"]]
             Msg().out(fmt % tuple(line))
         return self.STATUS_OK
 
@@ -968,6 +1080,60 @@ class UdockerCLI(object):
 
         return self.STATUS_OK
 
+    def do_flatten(self, cmdp):
+        """
+        flatten: create a new image with a single layer from an image
+        flatten <repo/image:tag> <new_repo/new_image:new_tag>
+        """
+        src_imagespec = cmdp.get("P1")
+        dst_imagespec = cmdp.get("P2")
+        if not (src_imagespec and dst_imagespec) or cmdp.missing_options():
+            return self.STATUS_ERROR
+
+        (imagerepo, tag) = self._check_imagespec(src_imagespec)
+        (new_imagerepo, new_tag) = self._check_imagespec(dst_imagespec)
+        if not (imagerepo and new_imagerepo):
+            return self.STATUS_ERROR
+
+        if ImageFlatten(self.localrepo).flatten(imagerepo, tag,
+                                                new_imagerepo, new_tag):
+            return self.STATUS_OK
+
+        Msg().err("Error: flatten image failed")
+        return self.STATUS_ERROR
+
+    def do_commit(self, cmdp):
+        """
+        commit: create a new image from the changes made in a container
+        commit <container-id|name> <repo/image:tag>
+        """
+        container_name = cmdp.get("P1")
+        imagespec = cmdp.get("P2")
+        if not (container_name and imagespec) or cmdp.missing_options():
+            return self.STATUS_ERROR
+
+        (imagerepo, tag) = self._check_imagespec(imagespec)
+        if not imagerepo:
+            return self.STATUS_ERROR
+
+        container_id = self.localrepo.get_container_id(container_name)
+        if not container_id:
+            Msg().err("Error: invalid container id", container_name)
+            return self.STATUS_ERROR
+
+        if ExecutionMode(self.localrepo,
+                         container_id).get_mode().startswith('F'):
+            Msg().err("Error: container files are modified by the Fn "
+                      "execution modes, change to a Pn mode first")
+            return self.STATUS_ERROR
+
+        if ContainerCommit(self.localrepo).commit(container_id,
+                                                  imagerepo, tag):
+            return self.STATUS_OK
+
+        Msg().err("Error: commit container failed")
+        return self.STATUS_ERROR
+
     def do_rmi(self, cmdp):
         """
         rmi: delete an image in the local repository
@@ -992,6 +1158,152 @@ class UdockerCLI(object):
             Msg().err("Error: deleting image")
             return self.STATUS_ERROR
 
+        pool = ContainerPool(self.localrepo, imagerepo, tag)
+        if pool.get_config():
+            pool.invalidate()
+        return self.STATUS_OK
+
+    def do_fsck(self, cmdp):
+        """
+        fsck: check the local repository and rebuild the index of the
+        image tags using each layer
+        fsck
+        """
+        if cmdp.missing_options():               # syntax error
+            return self.STATUS_ERROR
+
+        refs_changes = self.localrepo.rebuild_layers_refs()
+        if refs_changes is None:
+            Msg().err("Error: rebuilding layers references index")
+            return self.STATUS_ERROR
+
+        (missing, stale) = refs_changes
+        for (layer_name, tag_ref) in missing:
+            Msg().out("Info: added reference:", layer_name, tag_ref,
+                      l=Msg.INF)
+        for (layer_name, tag_ref) in stale:
+            Msg().out("Info: removed stale reference:", layer_name, tag_ref,
+                      l=Msg.INF)
+        self.localrepo.get_catalog(rebuild=True)
+        for layer_file in self.localrepo.get_unreferenced_layers():
+            Msg().out("Warning: layer not used by any image:", layer_file,
+                      l=Msg.WAR)
+        return self.STATUS_OK
+
+    def do_prune(self, cmdp):
+        """
+        prune: remove the layers not used by any image, containers left
+        by interrupted clones, names of deleted containers and temporary
+        files of udocker processes that are no longer running
+        prune [options]
+        --dry-run                  :only list what would be removed
+        """
+        dry_run = cmdp.get("--dry-run")
+        if cmdp.missing_options():               # syntax error
+            return self.STATUS_ERROR
+
+        prune = RepositoryPrune(self.localrepo)
+        objects = prune.mark()
+        if not dry_run:
+            objects = prune.sweep(objects)
+        Msg().out("%-9s %10s %s" % ("TYPE", "SIZE", "PATH"), l=Msg.INF)
+        for (kind, f_path, nbytes) in objects:
+            Msg().out("%-9s %10d %s" % (kind, nbytes, f_path))
+        total = sum([obj[2] for obj in objects])
+        if dry_run:
+            Msg().out("Info: reclaimable: %d objects, %d bytes" %
+                      (len(objects), total), l=Msg.INF)
+        else:
+            Msg().out("Info: reclaimed: %d objects, %d bytes" %
+                      (len(objects), total), l=Msg.INF)
+        return self.STATUS_OK
+
+    def do_dedup(self, cmdp):
+        """
+        dedup: share identical files among containers through hard links
+        dedup [options] [<container-id or name> ...]
+        --reflink                  :use copy-on-write clones instead of
+                                    hard links, requires filesystem support
+        """
+        reflink = cmdp.get("--reflink")
+        container_list = cmdp.get("P*")
+        if cmdp.missing_options():               # syntax error
+            return self.STATUS_ERROR
+
+        container_ids = []
+        for container in container_list:
+            container_id = self.localrepo.get_container_id(container)
+            if not container_id:
+                Msg().err("Error: invalid container id", container)
+                return self.STATUS_ERROR
+            container_ids.append(container_id)
+
+        result = ContainerDedup(self.localrepo, reflink).dedup(container_ids)
+        if result is None:
+            Msg().err("Error: dedup failed")
+            return self.STATUS_ERROR
+
+        Msg().out("Info: shared %d files, reclaimed %d bytes" % result,
+                  l=Msg.INF)
+        return self.STATUS_OK
+
+    def do_df(self, cmdp):
+        """
+        df: report the disk space used by the local repository, layers
+        shared by several images are counted once
+        df [options]
+        -v                         :list each image, layer, container
+                                    and reclaimable object
+        --format=json              :print the report in json
+        """
+        verbose = cmdp.get("-v")
+        out_format = cmdp.get("--format=")
+        if cmdp.missing_options():               # syntax error
+            return self.STATUS_ERROR
+        if out_format and out_format != "json":
+            Msg().err("Error: invalid format", out_format)
+            return self.STATUS_ERROR
+
+        report = RepositoryDiskReport(self.localrepo).report()
+        if out_format == "json":
+            Msg().out(json.dumps(report, sort_keys=True, indent=4))
+            return self.STATUS_OK
+
+        summary = report["summary"]
+        Msg().out("%-10s %6s %14s %14s %14s" %
+                  ("TYPE", "COUNT", "SIZE", "SHARED", "RECLAIMABLE"))
+        for category in ("images", "layers", "containers", "temporary"):
+            Msg().out("%-10s %6d %14d %14d %14d" %
+                      (category, summary[category]["count"],
+                       summary[category]["size"],
+                       summary[category]["shared"],
+                       summary[category]["reclaimable"]))
+        Msg().out("%-10s %6s %14d %14s %14d" %
+                  ("total", "", summary["total"]["size"], "",
+                   summary["total"]["reclaimable"]))
+        Msg().out("Info: %d dangling layers" %
+                  summary["layers"]["dangling"], l=Msg.INF)
+        if not verbose:
+            return self.STATUS_OK
+
+        Msg().out("\n%-50s %14s %14s" % ("IMAGE", "SIZE", "EXCLUSIVE"))
+        for (tag_ref, image) in sorted(report["images"].items()):
+            Msg().out("%-50s %14d %14d" %
+                      (tag_ref, image["size"], image["exclusive"]))
+        Msg().out("\n%-72s %14s %5s" % ("LAYER", "SIZE", "TAGS"))
+        for (layer_name, layer) in sorted(report["layers"].items()):
+            Msg().out("%-72s %14d %5d" %
+                      (layer_name, layer["size"], len(layer["tags"])))
+        Msg().out("\n%-36s %14s %14s %s" %
+                  ("CONTAINER", "SIZE", "EXCLUSIVE", "NAMES"))
+        for (container_id, container) in sorted(report["containers"].items()):
+            Msg().out("%-36s %14d %14d %s" %
+                      (container_id, container["size"],
+                       container["exclusive"],
+                       ",".join(container["names"])))
+        Msg().out("\n%-9s %14s %s" % ("TYPE", "RECLAIMABLE", "PATH"))
+        for obj in report["reclaimable"]:
+            Msg().out("%-9s %14d %s" % (obj["type"], obj["size"], obj["path"]))
         return self.STATUS_OK
 
     def do_protect(self, cmdp):
@@ -1188,8 +1500,22 @@ class UdockerCLI(object):
     def do_verify(self, cmdp):
         """
         verify: verify an image
-        verify <repo/image:tag>
+        verify [options] <repo/image:tag>
+        --all                      :verify all images, layers verified
+                                   :before that did not change are skipped
         """
+        if cmdp.get("--all"):
+            if cmdp.missing_options():               # syntax error
+                return self.STATUS_ERROR
+            failed = self.localrepo.verify_all()
+            for (imagerepo, tag) in failed:
+                Msg().err("Error: image verification failure:",
+                          imagerepo + ':' + tag)
+            if failed:
+                return self.STATUS_ERROR
+            Msg().out("Info: all images Ok", l=Msg.INF)
+            return self.STATUS_OK
+
         (imagerepo, tag) = self._check_imagespec(cmdp.get("P1"))
         if (not imagerepo) or cmdp.missing_options():  # syntax error
             return self.STATUS_ERROR
@@ -1206,6 +1532,58 @@ class UdockerCLI(object):
         Msg().err("Error: image verification failure")
         return self.STATUS_ERROR
 
+    def do_cp(self, cmdp):
+        """
+        cp: copy a file from an image without creating a container,
+        the file is read from the image layers using the layers index
+        cp <repo/image:tag>:<pathname> <destination>
+        cp <repo/image:tag>:<pathname> -    :write to stdout
+        """
+        source = cmdp.get("P1")
+        dest = cmdp.get("P2")
+        if (not (source and dest)) or cmdp.missing_options():
+            return self.STATUS_ERROR
+
+        if ":/" not in source:
+            Msg().err("Error: must specify <repo/image:tag>:<pathname>")
+            return self.STATUS_ERROR
+
+        (imagespec, f_path) = source.split(":/", 1)
+        (imagerepo, tag) = self._check_imagespec(imagespec)
+        if not imagerepo:
+            return self.STATUS_ERROR
+
+        f_stat = self.localrepo.stat_image_file(imagerepo, tag, '/' + f_path)
+        if not f_stat:
+            Msg().err("Error: file not found in image:", source)
+            return self.STATUS_ERROR
+
+        if f_stat["type"] != 'f':
+            Msg().err("Error: not a regular file:", source)
+            return self.STATUS_ERROR
+
+        data = self.localrepo.read_image_file(imagerepo, tag, f_stat["path"])
+        if data is None:
+            Msg().err("Error: reading file from image:", source)
+            return self.STATUS_ERROR
+
+        if dest == '-':
+            if sys.version_info[0] >= 3:
+                sys.stdout.buffer.write(data)
+            else:
+                sys.stdout.write(data)
+            return self.STATUS_OK
+
+        if os.path.isdir(dest):
+            dest = dest + '/' + os.path.basename(f_stat["path"])
+
+        if FileUtil(dest).putdata(data, "wb") != data:
+            Msg().err("Error: writing file:", dest)
+            return self.STATUS_ERROR
+
+        os.chmod(dest, f_stat["mode"] & 0o777)
+        return self.STATUS_OK
+
     def do_setup(self, cmdp):
         """
         setup: change container execution settings
@@ -1259,7 +1637,8 @@ class UdockerCLI(object):
         if fixperm:
             Unshare().namespace_exec(lambda: FileUtil(container_dir +
                                                       "/ROOT").rchown())
-            FileUtil(container_dir + "/ROOT").rchmod()
+            FileUtil(container_dir + "/ROOT").rchmod(
+                breaklinks=self.localrepo.ishardlinked_container(container_id))
 
         nvidia_mode = NvidiaMode(self.localrepo, container_id)
         if nvidia:
@@ -1371,20 +1750,34 @@ Commands:
   rmname <name>                 :Delete name from container
   rename <name> <new_name>      :Change container name
   clone <container_id>          :Duplicate container
+  pool --size=<n> <repo/image:tag> :Keep containers ready for run
   rm  <container-id|name>       :Delete container
   rmi <repo/image:tag>          :Delete image
   tag <repo/image:tag> <repo2/image2:tag2> :Tag image
+  flatten <repo/image:tag> <repo2/image2:tag2> :Merge image layers
+  commit <container> <repo/image:tag> :Create image from container changes
 
   import <tar> <repo/image:tag> :Import tar file (exported by docker)
   import - <repo/image:tag>     :Import from stdin (exported by docker)
   export -o <tar> <container>   :Export container directory tree to file
+  export --compress=gzip -o <tar> <container> :Export compressed
   export - <container>          :Export container directory tree to stdin
   load -i <exported-image>      :Load image from file (saved by docker)
   load                          :Load image from stdin (saved by docker)
+  load -i <oci-dir>             :Load image from directory in OCI layout
   save -o <imagefile> <repo/image:tag>  :Save image with layers to file
+  save --format=oci -o <imagefile> <repo/image:tag> :Save in OCI layout
+  save --compress=zstd -o <imagefile> <repo/image:tag> :Save compressed
+  save --format=oci-dir -o <dir> <repo/image:tag> :Save to OCI directory
 
   inspect -p <repo/image:tag>   :Print image or container metadata
   verify <repo/image:tag>       :Verify a pulled image
+  verify --all                  :Verify all images in the repository
+  fsck                          :Check and reindex the repository
+  prune --dry-run               :Remove unused layers and temporary files
+  dedup [<container-id|name>...] :Share identical files among containers
+  df -v --format=json           :Report disk space used by the repository
+  cp <repo/image:tag>:<file> <dest> :Copy file from image to host
   manifest inspect <repo/image:tag> :Print manifest metadata
 
   udocker manifest inspect centos/centos8
@@ -3,6 +3,7 @@
 
 import os
 import time
+import hashlib
 
 from udocker.msg import Msg
 from udocker.helper.unique import Unique
@@ -10,7 +11,6 @@ from udocker.helper.hostinfo import HostInfo
 from udocker.container.structure import ContainerStructure
 from udocker.engine.execmode import ExecutionMode
 from udocker.utils.fileutil import FileUtil
-from udocker.utils.uprocess import Uprocess
 from udocker.utils.chksum import ChkSUM
 
 
@@ -22,7 +22,9 @@ class CommonLocalFileApi(object):
         self._imagerepo = None
 
     def _move_layer_to_v1repo(self, filepath, layer_id, linkname=None):
-        """Copy or rename an image layer file to a v1 repository"""
+        """Copy or rename an image layer file to a v1 repository, when
+        filepath is a link to a layer already in the layers directory
+        the layer itself is renamed"""
         if filepath.endswith("json"):
             target_file = self.localrepo.layersdir + '/' + layer_id + ".json"
         elif filepath.endswith("layer.tar"):
@@ -32,10 +34,11 @@ class CommonLocalFileApi(object):
             target_file = self.localrepo.layersdir + '/' + layer_id + ".layer"
         else:
             return False
+        source_file = os.path.realpath(filepath)
         try:
-            os.rename(filepath, target_file)
+            os.rename(source_file, target_file)
         except (IOError, OSError):
-            if not FileUtil(filepath).copyto(target_file):
+            if not FileUtil(source_file).copyto(target_file):
                 return False
         self.localrepo.add_image_layer(target_file, linkname)
         return True
@@ -66,25 +69,11 @@ class CommonLocalFileApi(object):
 
         return self._load_image_step2(structure, imagerepo, tag)
 
-    def _untar_saved_container(self, tarfile, destdir):
-        """Untar container created with docker save"""
-        # umask 022
-        verbose = ''
-        if Msg.level >= Msg.VER:
-            verbose = 'v'
-
-        cmd = ["tar", "-C", destdir, "-x" + verbose,
-               "--delay-directory-restore", "--one-file-system",
-               "--no-same-owner", "--no-same-permissions", "--overwrite",
-               "-f", tarfile]
-
-        status = Uprocess().call(cmd, stderr=Msg.chlderr, close_fds=True)
-        return not status
-
-    def create_container_meta(self, layer_id, platform=""):
+    def create_container_meta(self, layer_id, platform="", layer_chksum=None):
         """Create metadata for a given container layer, used in import.
         A file for import is a tarball of a directory tree, does not contain
-        metadata. This method creates minimal metadata.
+        metadata. This method creates minimal metadata. The sha256 of the
+        layer can be passed in layer_chksum when already computed.
         """
         (p_os, p_arch, p_variant) = HostInfo().parse_platform(platform)
         container_json = {}
@@ -101,7 +90,8 @@ class CommonLocalFileApi(object):
         container_json["size"] = FileUtil(layer_file).size()
         if container_json["size"] == -1:
             container_json["size"] = 0
-        layer_chksum = ChkSUM().hash(layer_file, "sha256")
+        if layer_chksum is None:
+            layer_chksum = ChkSUM().hash(layer_file, "sha256")
         if layer_chksum:
             container_json["rootfs"] = {}
             container_json["rootfs"]["type"] = "layers"
@@ -165,7 +155,9 @@ class CommonLocalFileApi(object):
     def import_toimage(self, tarfile, imagerepo, tag, move_tarball=True,
                        platform=""):
         """Import a tar file containing a simple directory tree possibly
-        created with Docker export and create local image"""
+        created with Docker export and create local image. The tar file
+        is read once, either to hash it after being moved or reflinked,
+        or to copy it computing the hash on the way"""
         if not os.path.exists(tarfile) and tarfile != '-':
             Msg().err("Error: tar file does not exist: ", tarfile)
             return False
@@ -184,18 +176,27 @@ class CommonLocalFileApi(object):
         layer_id = Unique().layer_v1()
         layer_file = self.localrepo.layersdir + '/' + layer_id + ".layer"
         json_file = self.localrepo.layersdir + '/' + layer_id + ".json"
+        layer_chksum = None
         if move_tarball:
             try:
                 os.rename(tarfile, layer_file)
             except (IOError, OSError):
                 pass
+        if not os.path.exists(layer_file) and tarfile != '-':
+            try:
+                FileUtil(tarfile).reflink(layer_file)
+            except (IOError, OSError):
+                pass
         if not os.path.exists(layer_file):
-            if not FileUtil(tarfile).copyto(layer_file):
+            chksum = hashlib.sha256()
+            if not FileUtil(tarfile).copyto(layer_file, chksum=chksum):
                 Msg().err("Error: in move/copy file", tarfile)
                 return False
+            layer_chksum = chksum.hexdigest()
         self.localrepo.add_image_layer(layer_file)
         self.localrepo.save_json("ancestry", [layer_id])
-        container_json = self.create_container_meta(layer_id, platform)
+        container_json = self.create_container_meta(layer_id, platform,
+                                                    layer_chksum)
         self.localrepo.save_json(json_file, container_json)
         self.localrepo.add_image_layer(json_file)
         Msg().out("Info: added layer", layer_id, l=Msg.INF)
@@ -204,7 +205,9 @@ class CommonLocalFileApi(object):
     def import_tocontainer(self, tarfile, imagerepo, tag, container_name,
                            platform=""):
         """Import a tar file containing a simple directory tree possibly
-        created with Docker export and create local container ready to use"""
+        created with Docker export and create local container ready to use.
+        The tar file or stdin is extracted in a single read computing its
+        hash on the way"""
         if not imagerepo:
             imagerepo = "IMPORTED"
             tag = "latest"
@@ -217,9 +220,9 @@ class CommonLocalFileApi(object):
                           container_name)
                 return False
         layer_id = Unique().layer_v1()
-        container_json = self.create_container_meta(layer_id, platform)
+        container_json = self.create_container_meta(layer_id, platform, "")
         container_id = ContainerStructure(self.localrepo).create_fromlayer(
-            imagerepo, tag, tarfile, container_json)
+            imagerepo, tag, tarfile, container_json, hashlib.sha256())
         if container_name:
             self.localrepo.set_container_name(container_id, container_name)
         return container_id
@@ -241,17 +244,19 @@ class CommonLocalFileApi(object):
             self.localrepo.set_container_name(container_id, container_name)
         return container_id
 
-    def clone_container(self, container_id, container_name):
+    def clone_container(self, container_id, container_name, hardlink=False):
         """Clone/duplicate an existing container creating a complete
         copy including metadata, control files, and rootfs, The copy
-        will have a new id.
+        will have a new id. With hardlink the rootfs files are shared
+        with the source container through hard links.
         """
         if container_name:
             if self.localrepo.get_container_id(container_name):
                 Msg().out("Info: container name already exists:", container_name)
                 return False
 
-        dest_container_id = ContainerStructure(self.localrepo, container_id).clone()
+        dest_container_id = ContainerStructure(
+            self.localrepo, container_id).clone(hardlink)
         if container_name:
             self.localrepo.set_container_name(dest_container_id, container_name)
 
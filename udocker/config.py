@@ -145,6 +145,32 @@ class Config(object):
     conf['cpu_affinity_exec_tools'] = (["numactl", "-C", "%s", "--", ],
                                        ["taskset", "-c", "%s", ])
 
+    # index the layers content at pull and verify time
+    conf['layer_index'] = True
+
+    # list the files of containers at create time to allow commit
+    conf['rootfs_manifest'] = True
+
+    # after extraction make sparse files with at least this size, 0 disables
+    # the files are read again to find the zeros, e.g. 1024 * 1024
+    conf['sparse_minsize'] = 0
+
+    # threads used to measure the disk usage of containers and layers
+    conf['diskusage_threads'] = 8
+
+    # dedup only files with at least this size, processes used for hashing
+    conf['dedup_minsize'] = 4096
+    conf['dedup_processes'] = 4
+
+    # processes used to verify the layers of an image
+    conf['verify_processes'] = 4
+
+    # threads used to delete directory trees
+    conf['remove_threads'] = 8
+
+    # threads used to compress archives, 0 uses all the CPUs
+    conf['compress_threads'] = 0
+
     # Containers execution defaults
     conf['location'] = ""      # run container in this location
 
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Read image archives and directories directly into the local repository"""
+
+import os
+import io
+import re
+import sys
+import hashlib
+import tarfile
+
+from udocker.msg import Msg
+from udocker.helper.unique import Unique
+from udocker.utils.fileutil import FileUtil
+from udocker.utils.compress import Compression
+from udocker.container.layerindex import DigestReader
+
+
+class ImageArchiveReader(object):
+    """Read an image archive created with docker save or in the OCI
+    image layout in a single pass, from a file or from a pipe, the
+    archive may be compressed, gzip and zstd are decompressed by pigz
+    or zstd concurrently with the reading when available. The layers
+    are written directly into the repository layers directory under
+    temporary names, the blobs of OCI archives are checked against the
+    digest in their names while being written and the layer.tar of
+    docker archives against the diff_ids of the image config once the
+    archive is read. The metadata is extracted
+    to a small spill directory where a symbolic link to each layer is
+    placed, the order of the members in the archive does not matter.
+    Image directories are read in the same way, with the layers hard
+    linked instead of written. The layers are moved to their final names
+    when the image metadata is loaded, those not used by any image are
+    removed by the caller.
+    """
+
+    LAYER_MEMBER = re.compile(r"^[^/]+/layer\.tar$")
+    BLOB_MEMBER = re.compile(r"^blobs/([^/]+)/([a-f0-9]+)$")
+    META_MAXSIZE = 1024 * 1024    # larger OCI blobs are always layers
+    BUFSIZE = 1024 * 1024
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+        self.layer_files = []
+        self.layer_digests = {}
+
+    def _member_name(self, member):
+        """Normalized name of a member, "" if it would be extracted
+        outside of the spill directory"""
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name.split('/')[0] in ('.', ".."):
+            return ""
+        return name
+
+    def _write(self, fileobj, f_path):
+        """Copy the content of a member to a file"""
+        with open(f_path, "wb") as filep:
+            while True:
+                buf = fileobj.read(self.BUFSIZE)
+                if not buf:
+                    break
+                filep.write(buf)
+
+    def _write_layer(self, fileobj, name):
+        """Write a layer member into the layers directory, returns the
+        temporary layer file or "" on error"""
+        layer_file = self.localrepo.layersdir + '/' + \
+            Unique().filename(os.path.basename(name))
+        self.layer_files.append(layer_file)
+        chksum = None
+        match = self.BLOB_MEMBER.match(name)
+        if match and match.group(1) in hashlib.algorithms_available:
+            chksum = hashlib.new(match.group(1))
+        elif not match:
+            chksum = hashlib.sha256()      # compared with the diff_id
+        self._write(DigestReader(fileobj, chksum), layer_file)
+        if chksum is None:
+            return layer_file
+        if match and chksum.hexdigest() != match.group(2):
+            Msg().err("Error: layer digest mismatch:", name)
+            return ""
+        if not match:
+            self.layer_digests[os.path.realpath(layer_file)] = \
+                "sha256:" + chksum.hexdigest()
+        return layer_file
+
+    def _is_layer(self, name, size, head=b""):
+        """A member is a layer if it is the layer.tar of a docker archive
+        or an OCI blob that is not json, head are the first bytes of the
+        blobs up to META_MAXSIZE, larger blobs are always layers"""
+        if self.LAYER_MEMBER.match(name):
+            return True
+        if self.BLOB_MEMBER.match(name):
+            return size > self.META_MAXSIZE or \
+                not head.lstrip().startswith(b"{")
+        return False
+
+    def _link_target(self, member, name):
+        """Normalized name of the target of a symbolic or hard link
+        member, "" if the target is outside of the archive"""
+        if member.issym():
+            target = os.path.join(os.path.dirname(name), member.linkname)
+        else:
+            target = member.linkname
+        target = os.path.normpath(target)
+        if os.path.isabs(target) or target.split('/')[0] in ('.', ".."):
+            return ""
+        return target
+
+    def _add_links(self, links, destdir):
+        """Create the link members once their targets are extracted, a
+        link to a layer gets its own hard link of the temporary layer
+        so that each layer can be moved to its final name. Returns
+        False on error"""
+        while links:
+            pending = []
+            for (name, target) in links:
+                target_path = destdir + '/' + target
+                if not os.path.lexists(target_path):
+                    pending.append((name, target))
+                    continue
+                f_path = destdir + '/' + name
+                if os.path.lexists(f_path):
+                    continue
+                FileUtil(os.path.dirname(f_path)).mkdir()
+                source = os.path.realpath(target_path)
+                if source in [os.path.realpath(layer_file)
+                              for layer_file in self.layer_files]:
+                    digest = self.layer_digests.get(source)
+                    source = self._link_layer(source, name)
+                    if not source:
+                        return False
+                    if digest:
+                        self.layer_digests[os.path.realpath(source)] = digest
+                os.symlink(source, f_path)
+            if len(pending) == len(links):
+                for (name, target) in pending:
+                    Msg().out("Info: skipping archive link:", name, "->",
+                              target, l=Msg.VER)
+                break
+            links = pending
+        return True
+
+    def _extract(self, tarf, destdir):
+        """Extract the members, links are created at the end since their
+        targets may come later in the archive. Returns False on error"""
+        links = []
+        for member in tarf:
+            name = self._member_name(member)
+            if name and (member.issym() or member.islnk()):
+                target = self._link_target(member, name)
+                if target:
+                    links.append((name, target))
+                    continue
+            if not name or not (member.isfile() or member.isdir()):
+                Msg().out("Info: skipping archive member:", member.name,
+                          l=Msg.VER)
+                continue
+            f_path = destdir + '/' + name
+            if member.isdir():
+                FileUtil(f_path).mkdir()
+                continue
+            FileUtil(os.path.dirname(f_path)).mkdir()
+            fileobj = tarf.extractfile(member)
+            head = b""
+            if self.BLOB_MEMBER.match(name) and \
+                    member.size <= self.META_MAXSIZE:
+                fileobj = io.BytesIO(fileobj.read())
+                head = fileobj.getvalue()
+            if not self._is_layer(name, member.size, head):
+                self._write(fileobj, f_path)
+                continue
+            layer_file = self._write_layer(fileobj, name)
+            if not layer_file:
+                return False
+            os.symlink(layer_file, f_path)
+        return self._add_links(links, destdir) and \
+            self._check_diff_ids(destdir)
+
+    def _check_diff_ids(self, destdir):
+        """Compare the digests of the layer.tar members of a docker
+        archive with the diff_ids in the config of each image listed
+        in manifest.json, the diff_id is the digest of the uncompressed
+        layer. Returns False on mismatch"""
+        manifest = self.localrepo.load_json(
+            os.path.realpath(destdir) + "/manifest.json")
+        if not isinstance(manifest, list):
+            return True
+        for image in manifest:
+            try:
+                layers = image["Layers"]
+                diff_ids = self.localrepo.load_json(
+                    os.path.realpath(destdir) + '/' +
+                    image["Config"])["rootfs"]["diff_ids"]
+            except (KeyError, TypeError):
+                continue
+            if not (isinstance(layers, list) and isinstance(diff_ids, list)):
+                continue
+            for (layer_name, diff_id) in zip(layers, diff_ids):
+                layer_file = os.path.realpath(destdir + '/' + str(layer_name))
+                digest = self.layer_digests.get(layer_file)
+                if not digest or digest == diff_id or \
+                        Compression.detect_file(layer_file):
+                    continue           # compressed layers have other digest
+                Msg().err("Error: layer digest mismatch:", layer_name)
+                return False
+        return True
+
+    def _drain(self, stream):
+        """Read the padding after the end of the archive so that the
+        decompressor is not interrupted"""
+        while stream.read(self.BUFSIZE):
+            pass
+
+    def extract(self, imagefile, destdir):
+        """Read the archive imagefile or stdin if "-", extracting the
+        metadata to destdir and the layers to the layers directory.
+        Returns False on error, the layers written are then removed"""
+        compression = None
+        fileobj = None
+        try:
+            if imagefile == '-':
+                fileobj = getattr(sys.stdin, "buffer", sys.stdin)
+            else:
+                fileobj = open(imagefile, "rb")
+            stream = fileobj
+            method = Compression.detect(fileobj.peek(4)[:4])
+            if method:
+                compression = Compression(method)
+                stream = compression.decompress_from(fileobj)
+            if stream is None:
+                status = False
+            else:
+                tarf = tarfile.open(fileobj=stream, mode="r|*")
+                try:
+                    status = self._extract(tarf, destdir)
+                finally:
+                    tarf.close()
+                if status and compression:
+                    self._drain(stream)
+        except (IOError, OSError, EOFError, tarfile.TarError) as error:
+            Msg().err("Error: reading image archive:", imagefile, str(error))
+            status = False
+        if compression and not compression.close():
+            status = False
+        if fileobj and imagefile != '-':
+            fileobj.close()
+        if not status:
+            self.remove_unused()
+        return status
+
+    def _link_layer(self, f_path, name):
+        """Hard link a layer of an image directory into the layers
+        directory, returns the temporary layer file or "" on error"""
+        layer_file = self.localrepo.layersdir + '/' + \
+            Unique().filename(os.path.basename(name))
+        self.layer_files.append(layer_file)
+        if not FileUtil(f_path).copyto(layer_file, link=True):
+            Msg().err("Error: linking layer:", f_path)
+            return ""
+        return layer_file
+
+    def link(self, imagedir, destdir):
+        """Read an image directory in the OCI image layout or with the
+        content of a docker archive, copying the metadata to destdir and
+        hard linking the layers into the layers directory, the layers are
+        copied when in another filesystem and are not verified. Returns
+        False on error, the layers linked are then removed"""
+        imagedir = os.path.realpath(imagedir)
+        try:
+            for (dir_path, dummy, files) in os.walk(imagedir):
+                for f_name in files:
+                    f_path = os.path.realpath(dir_path + '/' + f_name)
+                    name = (dir_path + '/' + f_name)[len(imagedir) + 1:]
+                    if not os.path.isfile(f_path):
+                        continue
+                    dest_path = destdir + '/' + name
+                    FileUtil(os.path.dirname(dest_path)).mkdir()
+                    size = os.path.getsize(f_path)
+                    head = b""
+                    if size <= self.META_MAXSIZE:
+                        head = FileUtil(f_path).getdata('rb', 64) or b""
+                    if not self._is_layer(name, size, head):
+                        if not FileUtil(f_path).copyto(dest_path):
+                            Msg().err("Error: copying:", f_path)
+                            self.remove_unused()
+                            return False
+                        continue
+                    layer_file = self._link_layer(f_path, name)
+                    if not layer_file:
+                        self.remove_unused()
+                        return False
+                    os.symlink(layer_file, dest_path)
+        except (IOError, OSError) as error:
+            Msg().err("Error: reading image directory:", imagedir, str(error))
+            self.remove_unused()
+            return False
+        return True
+
+    def remove_unused(self):
+        """Remove the layers that were not moved to their final names"""
+        for layer_file in self.layer_files:
+            if os.path.exists(layer_file):
+                FileUtil(layer_file).remove()
+        self.layer_files = []
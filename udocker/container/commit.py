@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Create a new image from the changes made in a container"""
+
+import os
+import re
+import json
+import stat
+import time
+import hashlib
+import tarfile
+
+from udocker.msg import Msg
+from udocker.container.layerindex import LayerIndex, LayerStream, \
+    DigestReader, STREAM_ERRORS
+from udocker.container.layerwriter import LayerWriter
+from udocker.utils.chksum import ChkSUM
+from udocker.utils.fileutil import FileUtil
+
+
+class RootfsManifest(object):
+    """List of the files in the ROOT of a container with their type,
+    size, mode, mtime and symbolic link target, taken when the container
+    is created from an image. Comparing it with the ROOT at a later time
+    gives the files added, changed and removed without reading their
+    content. Sockets and devices are not listed.
+    """
+
+    VERSION = 1
+    FILENAME = "rootfs.manifest"
+
+    def __init__(self, container_dir):
+        self.container_root = container_dir + "/ROOT"
+        self.manifest_file = container_dir + '/' + self.FILENAME
+        self.entries = None
+
+    def _entry(self, f_path, f_stat):
+        """Entry of a file [type, size, mode, mtime, linkname], None for
+        files that are not listed"""
+        mode = f_stat.st_mode
+        if stat.S_ISREG(mode):
+            return ['f', f_stat.st_size, stat.S_IMODE(mode),
+                    int(f_stat.st_mtime), ""]
+        if stat.S_ISDIR(mode):
+            return ['d', 0, stat.S_IMODE(mode), int(f_stat.st_mtime), ""]
+        if stat.S_ISLNK(mode):
+            return ['l', 0, stat.S_IMODE(mode), int(f_stat.st_mtime),
+                    os.readlink(f_path)]
+        if stat.S_ISFIFO(mode):
+            return ['p', 0, stat.S_IMODE(mode), int(f_stat.st_mtime), ""]
+        return None
+
+    def _raise(self, error):
+        """Stop the walk on directories that cannot be read"""
+        raise error
+
+    def scan(self):
+        """Walk the container ROOT, returns the entries by absolute
+        pathname inside the container, raises OSError on failure"""
+        entries = {}
+        root_len = len(self.container_root)
+        for (dir_path, dirs, files) in os.walk(self.container_root,
+                                               onerror=self._raise):
+            for f_name in dirs + files:
+                f_path = dir_path + '/' + f_name
+                entry = self._entry(f_path, os.lstat(f_path))
+                if entry:
+                    entries[f_path[root_len:]] = entry
+        return entries
+
+    def save(self):
+        """Scan the container ROOT and write the manifest"""
+        try:
+            self.entries = self.scan()
+            with open(self.manifest_file, 'w') as outfile:
+                json.dump({"version": self.VERSION,
+                           "entries": self.entries}, outfile)
+        except (IOError, OSError, TypeError, ValueError) as error:
+            FileUtil(self.manifest_file).remove()
+            Msg().out("Warning: cannot write rootfs manifest:",
+                      self.manifest_file, str(error), l=Msg.WAR)
+            return False
+        return True
+
+    def load(self):
+        """Load the manifest written when the container was created"""
+        try:
+            with open(self.manifest_file, 'r') as infile:
+                manifest = json.load(infile)
+            if manifest["version"] == self.VERSION:
+                self.entries = manifest["entries"]
+                return True
+        except (IOError, OSError, KeyError, ValueError, TypeError):
+            pass
+        return False
+
+
+class ContainerCommit(object):
+    """Create a new image with the layers of the image of a container
+    plus a layer holding the changes made in the container. The files
+    of the container are compared with the rootfs manifest taken when
+    the container was created, the files added or changed are written
+    to the new layer and the files removed become whiteouts. The layers
+    of the original image are reused without being copied.
+    """
+
+    MEDIA_TYPES = {
+        "gzip": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+        "zstd": "application/vnd.oci.image.layer.v1.tar+zstd",
+        "tar": "application/vnd.docker.image.rootfs.diff.tar"}
+    DIGEST_NAME = re.compile(r"^sha256:[a-f0-9]{64}$")
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+
+    def _diff(self, old_entries, new_entries):
+        """Compare the manifest with the current ROOT, returns the
+        pathnames to be removed and the pathnames added or changed,
+        the parent directories sort before their content. Files that
+        change type are removed and added again"""
+        removed = set()
+        for (f_path, entry) in old_entries.items():
+            if f_path not in new_entries or \
+                    new_entries[f_path][0] != entry[0]:
+                removed.add(f_path)
+        whiteouts = []
+        for f_path in sorted(removed):
+            dirname = os.path.dirname(f_path)
+            while dirname != '/' and dirname not in removed:
+                dirname = os.path.dirname(dirname)
+            if dirname == '/':
+                whiteouts.append(f_path)
+        changes = sorted([f_path for (f_path, entry) in new_entries.items()
+                          if old_entries.get(f_path) != entry])
+        return (whiteouts, changes)
+
+    def _write_changes(self, container_root, whiteouts, changes):
+        """Write the layer with the whiteouts and the changed files,
+        the files are owned by root, returns the layer or None"""
+        layer_writer = LayerWriter(self.localrepo)
+        tarout = layer_writer.open()
+        if not tarout:
+            return None
+        mtime = int(time.time())
+        try:
+            for f_path in whiteouts:
+                tarinfo = tarfile.TarInfo(os.path.join(
+                    os.path.dirname(f_path),
+                    ".wh." + os.path.basename(f_path))[1:])
+                tarinfo.mtime = mtime
+                tarout.addfile(tarinfo)
+            for f_path in changes:
+                tarinfo = tarout.gettarinfo(container_root + f_path,
+                                            arcname=f_path[1:])
+                if tarinfo is None:
+                    continue
+                tarinfo.uid = tarinfo.gid = 0
+                tarinfo.uname = tarinfo.gname = "root"
+                if tarinfo.isreg():
+                    with open(container_root + f_path, "rb") as filep:
+                        tarout.addfile(tarinfo, filep)
+                else:
+                    tarout.addfile(tarinfo)
+        except (IOError, OSError, tarfile.TarError) as error:
+            Msg().err("Error: writing container changes:", str(error))
+            layer_writer.abort()
+            return None
+        return layer_writer.close()
+
+    def _diff_id(self, layer_file, compression):
+        """Digest of the uncompressed content of a layer"""
+        chksum = hashlib.sha256()
+        try:
+            with open(layer_file, "rb") as filep:
+                DigestReader(LayerStream(filep, compression), chksum).drain()
+        except STREAM_ERRORS as error:
+            Msg().err("Error: reading layer:", layer_file, str(error))
+            return ""
+        return "sha256:" + chksum.hexdigest()
+
+    def _base_layer(self, layer_file, diff_id=""):
+        """Describe a layer of the original image as a layer of the new
+        image. Layers not named after their digest, such as v1 layers,
+        are hashed and linked under the digest, the diff_id is computed
+        when not known. Returns the layer or None on error"""
+        layer_file = os.path.realpath(layer_file)
+        compression = LayerIndex(layer_file).compression()
+        if not compression:
+            Msg().err("Error: unsupported layer format:", layer_file)
+            return None
+        digest = os.path.basename(layer_file)
+        if not self.DIGEST_NAME.match(digest):
+            layer_chksum = ChkSUM().sha256(layer_file)
+            if not layer_chksum:
+                Msg().err("Error: hashing layer:", layer_file)
+                return None
+            digest = "sha256:" + layer_chksum
+            diff_id = ""
+            digest_file = self.localrepo.layersdir + '/' + digest
+            if not (os.path.exists(digest_file) or
+                    FileUtil(layer_file).copyto(digest_file, link=True)):
+                Msg().err("Error: linking layer:", layer_file)
+                return None
+            layer_file = digest_file
+        if not diff_id:
+            if compression == "tar":
+                diff_id = digest
+            else:
+                diff_id = self._diff_id(layer_file, compression)
+                if not diff_id:
+                    return None
+        return {"file": layer_file, "digest": digest, "diff_id": diff_id,
+                "size": FileUtil(layer_file).size(),
+                "mediaType": self.MEDIA_TYPES[compression]}
+
+    def _base_layers(self, container_json, layer_files):
+        """Layers of the original image, the diff_ids of the image
+        config are used for the layers named after their digest"""
+        try:
+            diff_ids = container_json["rootfs"]["diff_ids"]
+        except (KeyError, TypeError):
+            diff_ids = []
+        if not isinstance(diff_ids, list) or \
+                len(diff_ids) != len(layer_files):
+            diff_ids = [""] * len(layer_files)
+        layers = []
+        for (layer_file, diff_id) in zip(layer_files, diff_ids):
+            layer = self._base_layer(layer_file, diff_id)
+            if not layer:
+                return None
+            layers.append(layer)
+        return layers
+
+    def _container_json(self, container_json, image_json, container_id):
+        """Metadata of the new image from the container metadata"""
+        new_json = dict(container_json)
+        for key in ("id", "parent", "Size", "size", "rootfs"):
+            new_json.pop(key, None)
+        new_json["created"] = time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z",
+                                            time.gmtime())
+        history = image_json.get("history")
+        if not isinstance(history, list):
+            history = []
+        new_json["history"] = history + [
+            {"created": new_json["created"],
+             "created_by": "udocker commit " + container_id}]
+        return new_json
+
+    def commit(self, container_id, imagerepo, tag):
+        """Create imagerepo:tag from the image of the container and the
+        changes made in the container since it was created
+        """
+        if self.localrepo.cd_imagerepo(imagerepo, tag):
+            Msg().err("Error: image already exists:", imagerepo + ':' + tag)
+            return False
+        container_dir = self.localrepo.cd_container(container_id)
+        if not container_dir:
+            Msg().err("Error: container not found:", container_id)
+            return False
+        manifest = RootfsManifest(container_dir)
+        if not manifest.load():
+            Msg().err("Error: container has no rootfs manifest, it was not "
+                      "created from an image, use export and import")
+            return False
+        container_json = self.localrepo.load_json(container_dir +
+                                                  "/container.json")
+        imagespec = (FileUtil(container_dir +
+                              "/imagerepo.name").getdata('r') or "").strip()
+        (base_repo, dummy, base_tag) = imagespec.rpartition(':')
+        if not (base_repo and
+                self.localrepo.cd_imagerepo(base_repo, base_tag)):
+            Msg().err("Error: image of the container not found:", imagespec)
+            return False
+        (image_json, layer_files) = self.localrepo.get_image_attributes()
+        if not (container_json and image_json and layer_files):
+            Msg().err("Error: getting image layers or metadata")
+            return False
+        layers = self._base_layers(image_json, layer_files)
+        if layers is None:
+            return False
+        try:
+            (whiteouts, changes) = self._diff(manifest.entries,
+                                              manifest.scan())
+        except (IOError, OSError) as error:
+            Msg().err("Error: reading container files:", str(error))
+            return False
+        Msg().out("Info: committing %d changed and %d removed files" %
+                  (len(changes), len(whiteouts)), l=Msg.INF)
+        layer = self._write_changes(manifest.container_root, whiteouts,
+                                    changes)
+        if not layer:
+            return False
+        self.localrepo.index_layer(layer["file"])
+        return self.localrepo.setup_image_v2(
+            imagerepo, tag,
+            self._container_json(container_json, image_json, container_id),
+            layers + [layer, ])
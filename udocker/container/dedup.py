@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Share identical files among containers"""
+
+import os
+import stat
+import json
+import hashlib
+
+from udocker.config import Config
+from udocker.msg import Msg
+from udocker.helper.unique import Unique
+from udocker.utils.fileutil import FileUtil
+
+try:
+    import multiprocessing
+except ImportError:
+    pass
+
+
+def file_sha256(f_path):
+    """Hash the content of a file, returns the hex digest or an empty
+    string on error. Module level function to be used in a process pool.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(f_path, "rb") as filep:
+            while True:
+                data = filep.read(FileUtil.BUFSIZE)
+                if not data:
+                    break
+                sha256.update(data)
+    except (IOError, OSError):
+        return ""
+    return sha256.hexdigest()
+
+
+class ContainerDedup(object):
+    """Replace identical regular files in the directory trees of several
+    containers by hard links or, with reflink, by copy-on-write clones.
+    Files are first grouped by size, filesystem, mode and owner, only
+    the files in groups with more than one inode are hashed, this is
+    done in a pool of processes. The hashes are kept in each container
+    directory together with the size, mtime and inode of the file, in
+    following runs only new or modified files are hashed again.
+    Containers that get hard links are marked so that udocker copies
+    their files before modifying them. Containers in the execution modes
+    F3 and F4 have their executables modified and are skipped. The
+    containers are locked while their files are being shared.
+    """
+
+    DEDUP_FILE = "dedup.json"
+    SKIP_MODES = ("F3", "F4")
+
+    def __init__(self, localrepo, reflink=False):
+        self.localrepo = localrepo
+        self.reflink = reflink
+        self.minsize = Config.conf['dedup_minsize']
+        self.processes = Config.conf['dedup_processes']
+        self._cache = {}
+        self._changed = set()
+        self._released = {}
+        self._locks = []
+
+    def _load_cache(self, container_id):
+        """Hashes of the files of a container from a previous run"""
+        cache_file = self.localrepo.cd_container(container_id) + '/' + \
+            self.DEDUP_FILE
+        try:
+            with open(cache_file, 'r') as infile:
+                data = json.load(infile)
+            if data["version"] == 1:
+                return data
+        except (IOError, OSError, KeyError, ValueError, TypeError):
+            pass
+        return {"version": 1, "files": {}, "linked": []}
+
+    def _save_cache(self, container_id):
+        """Keep the hashes and the linked files of a container"""
+        cache_file = self.localrepo.cd_container(container_id) + '/' + \
+            self.DEDUP_FILE
+        tmp_file = cache_file + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_file, 'w') as outfile:
+                json.dump(self._cache[container_id], outfile)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError, TypeError, ValueError):
+            FileUtil(tmp_file).remove()
+            return False
+        return True
+
+    def _select(self, container_ids):
+        """Containers whose files can be shared, all if none given"""
+        if not container_ids:
+            container_ids = [os.path.basename(container_dir) for
+                             container_dir in
+                             self.localrepo.get_containers_list()
+                             if not os.path.islink(container_dir)]
+        selected = []
+        for container_id in container_ids:
+            attrs = self.localrepo.get_container_attrs(container_id)
+            if attrs is None:
+                Msg().err("Error: invalid container id", container_id)
+            elif attrs["execmode"] in self.SKIP_MODES:
+                Msg().out("Info: skipping container in mode",
+                          attrs["execmode"] + ':', container_id, l=Msg.INF)
+            elif container_id not in selected:
+                selected.append(container_id)
+        return selected
+
+    def _lock(self, container_ids):
+        """Lock the containers in the order of their ids, returns the
+        containers that were locked"""
+        locked = set()
+        for container_id in sorted(container_ids):
+            container_lock = self.localrepo.container_lock(container_id)
+            if container_lock.acquire():
+                self._locks.append(container_lock)
+                locked.add(container_id)
+            else:
+                Msg().err("Error: cannot lock container:", container_id)
+        return [container_id for container_id in container_ids
+                if container_id in locked]
+
+    def _unlock(self):
+        """Release the locks of the containers"""
+        for container_lock in self._locks:
+            container_lock.release()
+        self._locks = []
+
+    def _scan(self, container_id, buckets):
+        """Add the regular files of a container to the buckets of files
+        with the same size, filesystem, mode and owner. The cached hashes
+        of files that no longer exist are dropped."""
+        container_root = self.localrepo.cd_container(container_id) + "/ROOT"
+        seen = set()
+        for (dir_path, dummy, files) in os.walk(container_root):
+            for f_name in files:
+                f_path = dir_path + '/' + f_name
+                try:
+                    f_stat = os.lstat(f_path)
+                except OSError:
+                    continue
+                if not (stat.S_ISREG(f_stat.st_mode) and
+                        f_stat.st_size >= self.minsize):
+                    continue
+                key = (f_stat.st_size, f_stat.st_dev, f_stat.st_mode,
+                       f_stat.st_uid, f_stat.st_gid)
+                rel_path = f_path[len(container_root) + 1:]
+                seen.add(rel_path)
+                buckets.setdefault(key, []).append(
+                    (container_id, rel_path, f_path, f_stat))
+        cache = self._cache[container_id]
+        cache["files"] = dict([(rel_path, cached) for (rel_path, cached)
+                               in cache["files"].items() if rel_path in seen])
+        cache["linked"] = [rel_path for rel_path in cache["linked"]
+                           if rel_path in seen]
+
+    def _hash_files(self, candidates):
+        """Digest of each candidate file, reusing the cached digests of
+        files whose size, mtime and inode did not change"""
+        digests = {}
+        to_hash = []
+        for (container_id, rel_path, f_path, f_stat) in candidates:
+            cached = self._cache[container_id]["files"].get(rel_path)
+            if cached and cached[:3] == [f_stat.st_size, f_stat.st_mtime,
+                                         f_stat.st_ino]:
+                digests[f_path] = cached[3]
+            else:
+                to_hash.append(f_path)
+        Msg().out("Info: hashing %d files" % len(to_hash), l=Msg.INF)
+        for (f_path, digest) in zip(to_hash, self._map(file_sha256, to_hash)):
+            digests[f_path] = digest
+        for (container_id, rel_path, f_path, f_stat) in candidates:
+            self._cache[container_id]["files"][rel_path] = \
+                [f_stat.st_size, f_stat.st_mtime, f_stat.st_ino,
+                 digests[f_path]]
+        return digests
+
+    def _map(self, function, args):
+        """Apply function to the args in a pool of processes"""
+        if self.processes > 1 and len(args) > 1:
+            try:
+                pool = multiprocessing.Pool(self.processes)
+                try:
+                    return pool.map(function, args, 64)
+                finally:
+                    pool.close()
+                    pool.join()
+            except (NameError, OSError):
+                pass
+        return [function(arg) for arg in args]
+
+    def _replace(self, src_path, dst_path, dst_stat):
+        """Replace a file by a hard link or a clone of another file"""
+        tmp_file = os.path.dirname(dst_path) + '/.' + \
+            Unique().filename(os.path.basename(dst_path))
+        p_path = os.path.dirname(dst_path)
+        p_mode = stat.S_IMODE(os.stat(p_path).st_mode)
+        if not p_mode & stat.S_IWUSR:
+            os.chmod(p_path, p_mode | stat.S_IWUSR)
+        try:
+            if self.reflink:
+                FileUtil(src_path).reflink(tmp_file)
+                os.chmod(tmp_file, stat.S_IMODE(dst_stat.st_mode))
+                os.utime(tmp_file, (dst_stat.st_atime, dst_stat.st_mtime))
+            else:
+                os.link(src_path, tmp_file)
+            os.rename(tmp_file, dst_path)
+        except OSError:
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        finally:
+            if not p_mode & stat.S_IWUSR:
+                os.chmod(p_path, p_mode)
+
+    def _share(self, files):
+        """Share the content of identical files through the first one,
+        the links replaced are counted by inode to find the space that
+        is released"""
+        (dummy, dummy, src_path, src_stat) = files[0]
+        for (container_id, rel_path, f_path, f_stat) in files[1:]:
+            if f_stat.st_ino == src_stat.st_ino:
+                continue
+            try:
+                self._replace(src_path, f_path, f_stat)
+            except OSError as error:
+                if self.reflink and error.errno in FileUtil.NOT_SUPPORTED:
+                    raise
+                Msg().out("Warning: cannot share file:", f_path,
+                          l=Msg.WAR)
+                continue
+            released = self._released.setdefault(
+                (f_stat.st_dev, f_stat.st_ino),
+                [0, f_stat.st_nlink, f_stat.st_blocks * 512])
+            released[0] += 1
+            self._changed.update([container_id, files[0][0]])
+            cache = self._cache[container_id]
+            if self.reflink:
+                new_stat = os.lstat(f_path)
+            else:
+                new_stat = src_stat
+                for (l_container_id, l_rel_path) in \
+                        ((container_id, rel_path), files[0][:2]):
+                    linked = self._cache[l_container_id]["linked"]
+                    if l_rel_path not in linked:
+                        linked.append(l_rel_path)
+            cache["files"][rel_path][:3] = \
+                [new_stat.st_size, new_stat.st_mtime, new_stat.st_ino]
+
+    def dedup(self, container_ids=None):
+        """Share the identical files of the containers, all containers
+        if none given. Returns a tuple with the number of files replaced
+        and the bytes reclaimed, or None on failure.
+        """
+        container_ids = self._lock(self._select(container_ids))
+        try:
+            return self._dedup(container_ids)
+        finally:
+            self._unlock()
+
+    def _dedup(self, container_ids):
+        """Share the identical files of the locked containers"""
+        buckets = {}
+        for container_id in container_ids:
+            self._cache[container_id] = self._load_cache(container_id)
+            self._scan(container_id, buckets)
+        buckets = [sorted(files, key=lambda entry: entry[2])
+                   for files in buckets.values()
+                   if len(set([entry[3].st_ino for entry in files])) > 1]
+        digests = self._hash_files([entry for files in buckets
+                                    for entry in files])
+        groups = []
+        for files in buckets:
+            same_digest = {}
+            for entry in files:
+                if digests[entry[2]]:
+                    same_digest.setdefault(digests[entry[2]],
+                                           []).append(entry)
+            groups.extend(same_digest.values())
+        self._changed = set()
+        self._released = {}
+        try:
+            for files in groups:
+                if len(files) > 1:
+                    self._share(files)
+        except OSError as error:
+            if self.reflink and error.errno in FileUtil.NOT_SUPPORTED:
+                Msg().err("Error: reflinks not supported by the filesystem:",
+                          str(error))
+            else:
+                Msg().err("Error: sharing files:", str(error))
+            return None
+        finally:
+            for container_id in sorted(self._changed):
+                if not self.reflink:
+                    self.localrepo.hardlink_container(container_id)
+                self.localrepo.set_container_attrs(container_id, size=-1)
+            for container_id in container_ids:
+                self._save_cache(container_id)
+        replaced = sum([links for (links, dummy, dummy)
+                        in self._released.values()])
+        reclaimed = sum([nbytes for (links, nlink, nbytes)
+                         in self._released.values() if links >= nlink])
+        return (replaced, reclaimed)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Report of the disk space used by the local repository"""
+
+import os
+import stat
+
+from udocker.container.layerindex import LayerIndex
+from udocker.container.prune import RepositoryPrune
+from udocker.utils.diskusage import DiskUsage
+from udocker.utils.filelock import FileLock
+
+
+class RepositoryDiskReport(object):
+    """Space used by the images, layers, containers and temporary files
+    of the local repository. Layers are accounted once even when used
+    by several image tags, the space of an image tag is split between
+    the layers used only by the tag and the layers shared with other
+    tags. The containers are measured with their cached disk usage,
+    files hard linked between containers are reported as shared. The
+    reclaimable space is what prune would remove.
+    """
+
+    KINDS = {"layers": ("layer", "index"),
+             "containers": ("container", "name"),
+             "temporary": ("temp", "lock", "trash")}
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+
+    def _disk_bytes(self, f_stat):
+        """Space allocated to a file"""
+        try:
+            return f_stat.st_blocks * 512
+        except AttributeError:
+            return f_stat.st_size
+
+    def _layers(self):
+        """Layer files with their size and the image tags using them,
+        plus the bytes of the layer indexes"""
+        refs = self.localrepo.get_layers_refs()
+        layers = {}
+        indexes = 0
+        try:
+            fnames = os.listdir(self.localrepo.layersdir)
+        except OSError:
+            return (layers, indexes)
+        for fname in fnames:
+            try:
+                f_stat = os.lstat(self.localrepo.layersdir + '/' + fname)
+            except OSError:
+                continue
+            if not stat.S_ISREG(f_stat.st_mode):
+                continue
+            if fname.endswith(LayerIndex.SUFFIX):
+                indexes += self._disk_bytes(f_stat)
+            elif not (fname.endswith(FileLock.SUFFIX) or
+                      RepositoryPrune.TMP_SUFFIX.search(fname)):
+                layers[fname] = {"size": self._disk_bytes(f_stat),
+                                 "tags": sorted(refs.get(fname, []))}
+        return (layers, indexes)
+
+    def _images(self, layers):
+        """Space of each image tag in its layers and in the layers used
+        only by the tag"""
+        tags = {}
+        for layer in layers.values():
+            for tag_ref in layer["tags"]:
+                image = tags.setdefault(tag_ref, {"size": 0, "exclusive": 0})
+                image["size"] += layer["size"]
+                if len(layer["tags"]) == 1:
+                    image["exclusive"] += layer["size"]
+        return tags
+
+    def _containers(self):
+        """Space of each container ROOT, the cached directory totals of
+        each container are used and updated"""
+        measured = {}
+        containers = {}
+        for container_dir in sorted(self.localrepo.get_containers_list()):
+            if os.path.islink(container_dir):
+                continue
+            container_id = os.path.basename(container_dir)
+            container_root = container_dir + "/ROOT"
+            disk_usage = DiskUsage(container_dir + '/' +
+                                   self.localrepo.CONTAINER_USAGE)
+            measured.update(disk_usage.measure([container_root]))
+            disk_usage.save()
+            containers[container_id] = {
+                "root": container_root,
+                "names": self.localrepo.get_container_name(container_id)}
+        usage = DiskUsage().summarize(measured)
+        for container in containers.values():
+            paths = usage["paths"].get(container.pop("root"),
+                                       {"total": 0, "exclusive": 0})
+            container["size"] = paths["total"]
+            container["exclusive"] = paths["exclusive"]
+        return (containers, usage["total"], usage["shared"])
+
+    def report(self):
+        """Collect the space used by each type of object, returns a
+        dict with a summary by type and the details of each object"""
+        (layers, indexes) = self._layers()
+        images = self._images(layers)
+        (containers, containers_total, containers_shared) = \
+            self._containers()
+        reclaimable = [{"type": kind, "path": path, "size": nbytes}
+                       for (kind, path, nbytes)
+                       in RepositoryPrune(self.localrepo).mark()]
+        reclaim = dict([(category, sum([obj["size"] for obj in reclaimable
+                                        if obj["type"] in kinds]))
+                        for (category, kinds) in self.KINDS.items()])
+        used = [layer for layer in layers.values() if layer["tags"]]
+        shared = [layer for layer in used if len(layer["tags"]) > 1]
+        temporary = [obj for obj in reclaimable
+                     if obj["type"] in self.KINDS["temporary"]]
+        summary = {
+            "images": {
+                "count": len(images),
+                "size": sum([layer["size"] for layer in used]),
+                "shared": sum([layer["size"] for layer in shared]),
+                "reclaimable": 0},
+            "layers": {
+                "count": len(layers),
+                "size": sum([layer["size"] for layer in layers.values()]) +
+                        indexes,
+                "shared": sum([layer["size"] for layer in shared]),
+                "dangling": len(layers) - len(used),
+                "reclaimable": reclaim["layers"]},
+            "containers": {
+                "count": len(containers),
+                "size": containers_total,
+                "shared": containers_shared,
+                "reclaimable": reclaim["containers"]},
+            "temporary": {
+                "count": len(temporary),
+                "size": sum([obj["size"] for obj in temporary]),
+                "shared": 0,
+                "reclaimable": reclaim["temporary"]}}
+        summary["total"] = {
+            "size": sum([summary[category]["size"]
+                         for category in self.KINDS]),
+            "reclaimable": sum(reclaim.values())}
+        return {"summary": summary, "images": images, "layers": layers,
+                "containers": containers, "reclaimable": reclaimable}
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Merge the layers of an image into a single layer image"""
+
+import os
+import time
+import shutil
+import tarfile
+
+from udocker.msg import Msg
+from udocker.container.layerindex import LayerStream, STREAM_ERRORS
+from udocker.container.layerwriter import LayerWriter
+from udocker.utils.fileutil import FileUtil
+
+
+class ImageFlatten(object):
+    """Create a new image with a single layer holding the merged view of
+    the layers of an existing image. The members that are visible in the
+    merged view are selected using the layers index, the layers are then
+    read once from the bottom to the top and the selected members are
+    streamed into the new layer. Whiteouts and the data they hide are
+    dropped.
+    """
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+
+    def _normpath(self, f_path):
+        """Pathname of a member as an absolute path in the layer"""
+        return os.path.normpath('/' + f_path).replace("//", '/')
+
+    def _hidden(self, upper_indexes, f_path):
+        """Check if a member is replaced or hidden by an upper layer"""
+        for layer_index in upper_indexes:
+            entries = layer_index.toc["entries"]
+            if f_path in entries or layer_index.hides(f_path):
+                return True
+            dirname = os.path.dirname(f_path)
+            while dirname != '/':
+                if dirname in entries and entries[dirname][0] != 'd':
+                    return True
+                dirname = os.path.dirname(dirname)
+        return False
+
+    def _select(self, indexes):
+        """For each layer, ordered from the top to the bottom, get the
+        members visible in the merged view and the hard link targets
+        that are not visible but whose content is still needed
+        """
+        selection = []
+        for (idx, layer_index) in enumerate(indexes):
+            entries = layer_index.toc["entries"]
+            visible = set()
+            for f_path in entries:
+                if (f_path == '/' or
+                        os.path.basename(f_path).startswith(".wh.") or
+                        self._hidden(indexes[:idx], f_path)):
+                    continue
+                visible.add(f_path)
+            spill = set()
+            for f_path in visible:
+                entry = entries[f_path]
+                if entry[0] == 'h' and entry[4] not in visible:
+                    spill.add(entry[4])
+            selection.append((layer_index, visible, spill))
+        return selection
+
+    def _rename(self, tarinfo, name, linkname=None):
+        """Change the names of a member dropping pax overrides"""
+        tarinfo.name = name
+        tarinfo.pax_headers.pop("path", None)
+        if linkname is not None:
+            tarinfo.linkname = linkname
+            tarinfo.pax_headers.pop("linkpath", None)
+
+    def _copy_layer(self, layer_index, visible, spill, tarout):
+        """Stream the visible members of one layer to the new layer"""
+        spilled = {}
+        try:
+            with open(layer_index.layer_file, "rb") as filep:
+                tarin = tarfile.open(fileobj=LayerStream(
+                    filep, layer_index.toc["compression"]), mode="r|")
+                for tarinfo in tarin:
+                    f_path = self._normpath(tarinfo.name)
+                    if f_path in spill and tarinfo.isreg():
+                        tmp_file = FileUtil("flatten").mktmp(
+                            self.localrepo.tmp_area())
+                        with open(tmp_file, "wb") as tmpf:
+                            shutil.copyfileobj(tarin.extractfile(tarinfo),
+                                               tmpf)
+                        spilled[f_path] = [tmp_file, None]
+                    if f_path not in visible:
+                        continue
+                    if tarinfo.islnk():
+                        target = self._normpath(tarinfo.linkname)
+                        if target not in spilled:
+                            self._rename(tarinfo, f_path[1:], target[1:])
+                            tarout.addfile(tarinfo)
+                        elif spilled[target][1]:
+                            self._rename(tarinfo, f_path[1:],
+                                         spilled[target][1])
+                            tarout.addfile(tarinfo)
+                        else:
+                            self._rename(tarinfo, f_path[1:], "")
+                            tarinfo.type = tarfile.REGTYPE
+                            tarinfo.size = \
+                                FileUtil(spilled[target][0]).size()
+                            tarinfo.pax_headers.pop("size", None)
+                            with open(spilled[target][0], "rb") as tmpf:
+                                tarout.addfile(tarinfo, tmpf)
+                            spilled[target][1] = f_path[1:]
+                    elif tarinfo.issym():
+                        self._rename(tarinfo, f_path[1:])
+                        tarout.addfile(tarinfo)
+                    elif tarinfo.isreg():
+                        self._rename(tarinfo, f_path[1:])
+                        tarout.addfile(tarinfo, tarin.extractfile(tarinfo))
+                    else:
+                        self._rename(tarinfo, f_path[1:])
+                        tarout.addfile(tarinfo)
+                tarin.close()
+        except STREAM_ERRORS as error:
+            Msg().err("Error: reading layer:", layer_index.layer_file,
+                      str(error))
+            return False
+        finally:
+            for (tmp_file, dummy) in spilled.values():
+                FileUtil(tmp_file).remove()
+        return True
+
+    def _container_json(self, container_json, source):
+        """Metadata of the new image derived from the original image"""
+        new_json = dict(container_json)
+        for key in ("id", "parent", "Size", "size", "history"):
+            new_json.pop(key, None)
+        new_json["created"] = time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z",
+                                            time.gmtime())
+        new_json["history"] = [{"created": new_json["created"],
+                                "created_by": "udocker flatten " + source}]
+        return new_json
+
+    def flatten(self, imagerepo, tag, new_imagerepo, new_tag):
+        """Create new_imagerepo:new_tag from the merged view of the
+        layers of imagerepo:tag
+        """
+        if self.localrepo.cd_imagerepo(new_imagerepo, new_tag):
+            Msg().err("Error: image already exists:",
+                      new_imagerepo + ':' + new_tag)
+            return False
+        if not self.localrepo.cd_imagerepo(imagerepo, tag):
+            Msg().err("Error: image not found:", imagerepo + ':' + tag)
+            return False
+        (container_json, dummy) = self.localrepo.get_image_attributes()
+        indexes = self.localrepo.get_image_indexes()
+        if not (container_json and indexes):
+            Msg().err("Error: getting image layers or metadata")
+            return False
+        Msg().out("Info: flattening %d layers" % len(indexes), l=Msg.INF)
+        layer_writer = LayerWriter(self.localrepo)
+        tarout = layer_writer.open()
+        if not tarout:
+            return False
+        for (layer_index, visible, spill) in \
+                reversed(self._select(indexes)):
+            if not self._copy_layer(layer_index, visible, spill, tarout):
+                layer_writer.abort()
+                return False
+        layer = layer_writer.close()
+        if not layer:
+            return False
+        self.localrepo.index_layer(layer["file"])
+        return self.localrepo.setup_image_v2(
+            new_imagerepo, new_tag,
+            self._container_json(container_json, imagerepo + ':' + tag),
+            [layer, ])
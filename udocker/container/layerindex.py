@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""Table of contents of image layers for file lookups without extraction"""
+
+import os
+import json
+import zlib
+import hashlib
+import bisect
+import tarfile
+
+from udocker.msg import Msg
+from udocker.utils.fileutil import FileUtil
+from udocker.utils.compress import Compression
+
+try:
+    import zstandard
+    ZSTD_ERRORS = (zstandard.ZstdError, )
+except ImportError:
+    ZSTD_ERRORS = ()
+
+STREAM_ERRORS = (IOError, OSError, EOFError, ValueError, TypeError,
+                 zlib.error, tarfile.TarError) + ZSTD_ERRORS
+
+
+class LayerStream(object):
+    """Read only file object providing the uncompressed content of a
+    layer file. Decompression can only be restarted at the beginning
+    of a gzip member or of a zstd frame, these offsets are recorded
+    in checkpoints as pairs [compressed offset, uncompressed offset].
+    """
+
+    BUFSIZE = 1024 * 1024
+    MAGIC = Compression.MAGIC
+
+    def __init__(self, fileobj, compression, coffset=0, uoffset=0):
+        self._fileobj = fileobj
+        self.compression = compression
+        self._coffset = coffset        # compressed bytes read from file
+        self._uoffset = uoffset        # uncompressed bytes returned
+        self._buffer = b""
+        self._bufpos = 0
+        self._pending = b""            # compressed bytes not yet consumed
+        self._eof = False
+        self._dobj = None
+        self.checkpoints = [[coffset, uoffset], ]
+        if compression != "tar":
+            self._dobj = self._decompressor()
+
+    def _decompressor(self):
+        """Return a new decompression object"""
+        if self.compression == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def _next_member(self):
+        """Restart decompression at the next gzip member or zstd frame"""
+        start = self._coffset - len(self._pending)
+        magic = self.MAGIC[self.compression]
+        while len(self._pending) < len(magic):
+            data = self._fileobj.read(self.BUFSIZE)
+            if not data:
+                break
+            self._coffset += len(data)
+            self._pending += data
+        if not self._pending.startswith(magic):
+            self._skip_padding()
+            self._eof = True
+            return
+        self._dobj = self._decompressor()
+        self.checkpoints.append(
+            [start, self._uoffset + len(self._buffer) - self._bufpos])
+
+    def _skip_padding(self):
+        """Only zeros may follow the last gzip member or zstd frame,
+        raises IOError on other trailing data"""
+        data = self._pending
+        self._pending = b""
+        while data:
+            if data.strip(b"\0"):
+                raise IOError("trailing data after compressed stream")
+            data = self._fileobj.read(self.BUFSIZE)
+            self._coffset += len(data)
+
+    def _fill(self, size):
+        """Decompress until size bytes are available or end of data"""
+        if self._bufpos:
+            self._buffer = self._buffer[self._bufpos:]
+            self._bufpos = 0
+        while (size < 0 or len(self._buffer) < size) and not self._eof:
+            if self._pending:
+                data = self._pending
+                self._pending = b""
+            else:
+                data = self._fileobj.read(self.BUFSIZE)
+                self._coffset += len(data)
+                if not data:
+                    if self._dobj is not None and not self._dobj.eof:
+                        raise EOFError("compressed stream is truncated")
+                    self._eof = True
+                    break
+            if self._dobj is None:
+                self._buffer += data
+                continue
+            if self.compression == "gzip":
+                self._buffer += self._dobj.decompress(data, self.BUFSIZE)
+                if not self._dobj.eof:
+                    self._pending = self._dobj.unconsumed_tail
+            else:
+                self._buffer += self._dobj.decompress(data)
+            if self._dobj.eof:
+                self._pending = self._dobj.unused_data
+                self._next_member()
+
+    def read(self, size=-1):
+        """Read up to size bytes of uncompressed data"""
+        if size is None:
+            size = -1
+        if size < 0 or len(self._buffer) - self._bufpos < size:
+            self._fill(size)
+        if size < 0:
+            data = self._buffer[self._bufpos:]
+        else:
+            data = self._buffer[self._bufpos:self._bufpos + size]
+        self._bufpos += len(data)
+        self._uoffset += len(data)
+        return data
+
+    def skip(self, size):
+        """Discard size bytes of uncompressed data"""
+        while size > 0:
+            data = self.read(min(size, self.BUFSIZE))
+            if not data:
+                return False
+            size -= len(data)
+        return True
+
+
+class DigestReader(object):
+    """Read only file object that computes the digest of the data read"""
+
+    def __init__(self, fileobj, chksum=None):
+        self._fileobj = fileobj
+        self.chksum = chksum           # hashlib object
+
+    def read(self, size=-1):
+        """Read and add the data to the digest"""
+        data = self._fileobj.read(size)
+        if self.chksum:
+            self.chksum.update(data)
+        return data
+
+    def drain(self):
+        """Read until the end of the file"""
+        while self.read(LayerStream.BUFSIZE):
+            pass
+
+
+def verify_layer(task):
+    """Verify a layer file, task is a tuple (layer_file, algorithm,
+    digest, build). Module level function to be used in a process pool.
+    """
+    return LayerIndex(task[0]).verify(*task[1:])
+
+
+class LayerIndex(object):
+    """Table of contents of an image layer tarball. For each member
+    holds the type, size, mode, mtime, link target and the offset of
+    its data in the uncompressed stream. Together with the checkpoints
+    of the compressed stream it allows to stat and read single files
+    without extracting the layer. The index is kept in a json file
+    next to the layer file.
+    """
+
+    VERSION = 1
+    SUFFIX = ".toc"
+
+    def __init__(self, layer_file):
+        self.layer_file = os.path.realpath(layer_file)
+        self.toc_file = self.layer_file + self.SUFFIX
+        self.toc = None
+
+    def compression(self):
+        """Identify the layer format from its first bytes, returns
+        gzip, zstd, tar or an empty string if not supported"""
+        buf = FileUtil(self.layer_file).getdata('rb', 512)
+        if not buf:
+            return ""
+        if buf.startswith(LayerStream.MAGIC["gzip"]):
+            return "gzip"
+        if buf.startswith(LayerStream.MAGIC["zstd"]):
+            try:
+                dummy = zstandard.ZstdDecompressor()
+                return "zstd"
+            except NameError:
+                Msg().out("Warning: python zstandard module not found",
+                          l=Msg.WAR)
+                return ""
+        if buf[257:262] == b"ustar":
+            return "tar"
+        return ""
+
+    def _entry_type(self, tarinfo):
+        """Single character identifying the type of a tar member"""
+        if tarinfo.isreg():
+            return 'f'
+        if tarinfo.isdir():
+            return 'd'
+        if tarinfo.issym():
+            return 'l'
+        if tarinfo.islnk():
+            return 'h'
+        if tarinfo.ischr():
+            return 'c'
+        if tarinfo.isblk():
+            return 'b'
+        if tarinfo.isfifo():
+            return 'p'
+        return '?'
+
+    def _normpath(self, f_path):
+        """Pathname of a member as an absolute path in the layer"""
+        return os.path.normpath('/' + f_path).replace("//", '/')
+
+    def _scan(self, fileobj, compression):
+        """Walk the tar headers of the uncompressed layer read from
+        fileobj, returns the table of contents"""
+        entries = {}
+        stream = LayerStream(fileobj, compression)
+        tarf = tarfile.open(fileobj=stream, mode="r|")
+        for tarinfo in tarf:
+            linkname = tarinfo.linkname
+            if tarinfo.islnk():
+                linkname = self._normpath(linkname)
+            entries[self._normpath(tarinfo.name)] = \
+                [self._entry_type(tarinfo), tarinfo.size,
+                 tarinfo.mode, tarinfo.offset_data, linkname,
+                 int(tarinfo.mtime)]
+        tarf.close()
+        while stream.read(LayerStream.BUFSIZE):
+            pass                       # check the end of the stream
+        return {"version": self.VERSION, "compression": compression,
+                "size": FileUtil(self.layer_file).size(),
+                "checkpoints": stream.checkpoints, "entries": entries}
+
+    def _save(self):
+        """Write the index next to the layer file"""
+        tmp_file = self.toc_file + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_file, 'w') as outfile:
+                json.dump(self.toc, outfile)
+            os.rename(tmp_file, self.toc_file)
+        except (IOError, OSError, TypeError, ValueError):
+            FileUtil(tmp_file).remove()
+            Msg().out("Warning: cannot write layer index:", self.toc_file,
+                      l=Msg.WAR)
+
+    def build(self):
+        """Read the whole layer and write its index"""
+        compression = self.compression()
+        if not compression:
+            return False
+        Msg().out("Info: indexing layer:", self.layer_file, l=Msg.INF)
+        try:
+            with open(self.layer_file, "rb") as filep:
+                self.toc = self._scan(filep, compression)
+        except STREAM_ERRORS as error:
+            Msg().err("Error: indexing layer:", self.layer_file, str(error))
+            return False
+        self._save()
+        return True
+
+    def verify(self, algorithm="", digest="", build=False):
+        """Verify the layer reading it once, the digest of the file is
+        computed while the tar headers of the uncompressed content are
+        walked. Files that are not tarballs such as the image config are
+        only checked against the digest. With build a missing index is
+        written from the same pass. Returns an error message, empty if
+        the layer is valid.
+        """
+        chksum = None
+        if algorithm in ("sha256", "sha512"):
+            chksum = hashlib.new(algorithm)
+        compression = self.compression()
+        try:
+            with open(self.layer_file, "rb") as filep:
+                reader = DigestReader(filep, chksum)
+                if compression:
+                    toc = self._scan(reader, compression)
+                    if build and not self.load():
+                        self.toc = toc
+                        self._save()
+                reader.drain()
+        except STREAM_ERRORS as error:
+            return "layer tar verify failed: " + str(error)
+        if chksum and chksum.hexdigest() != digest:
+            return "layer file chksum failed"
+        return ""
+
+    def load(self):
+        """Load the index, an index that does not match the layer
+        file is ignored"""
+        try:
+            with open(self.toc_file, 'r') as infile:
+                toc = json.load(infile)
+            if (toc["version"] == self.VERSION and
+                    toc["size"] == FileUtil(self.layer_file).size()):
+                self.toc = toc
+                return True
+        except (IOError, OSError, KeyError, ValueError, TypeError):
+            pass
+        return False
+
+    def get(self):
+        """Load the index or build it if missing"""
+        return self.load() or self.build()
+
+    def remove(self):
+        """Delete the index file"""
+        self.toc = None
+        if os.path.exists(self.toc_file):
+            return FileUtil(self.toc_file).remove()
+        return True
+
+    def _stat(self, f_path, entry):
+        """Convert an index entry into a dictionary"""
+        return {"path": f_path, "type": entry[0], "size": entry[1],
+                "mode": entry[2], "offset": entry[3], "linkname": entry[4],
+                "mtime": entry[5]}
+
+    def lookup(self, f_path):
+        """Get the attributes of a pathname in this layer, hard links
+        are resolved to their target. Returns a dict or None"""
+        if not self.toc:
+            return None
+        f_path = self._normpath(f_path)
+        entry = self.toc["entries"].get(f_path)
+        if entry and entry[0] == 'h' and entry[4] in self.toc["entries"]:
+            entry = self.toc["entries"][entry[4]]
+        if entry:
+            return self._stat(f_path, entry)
+        return None
+
+    def whiteouts(self):
+        """List of the whiteout members in this layer"""
+        if not self.toc:
+            return []
+        return sorted([f_path for f_path in self.toc["entries"]
+                       if os.path.basename(f_path).startswith(".wh.")])
+
+    def hides(self, f_path):
+        """Check whether this layer hides pathname in the lower layers
+        either with a whiteout of the pathname or of one its parents
+        or with an opaque directory marker in one of its parents"""
+        if not self.toc:
+            return False
+        entries = self.toc["entries"]
+        f_path = self._normpath(f_path)
+        if f_path == '/':
+            return False
+        dirname = os.path.dirname(f_path)
+        basename = os.path.basename(f_path)
+        if (dirname.rstrip('/') + "/.wh." + basename) in entries:
+            return True
+        if (dirname.rstrip('/') + "/.wh..wh..opq") in entries:
+            return True
+        return self.hides(dirname)
+
+    def read(self, f_path, size=-1):
+        """Read the content of a regular file in this layer, decompression
+        starts at the nearest checkpoint preceding the file data"""
+        entry = self.lookup(f_path)
+        if not (entry and entry["type"] == 'f'):
+            return None
+        if size < 0 or size > entry["size"]:
+            size = entry["size"]
+        compression = self.toc["compression"]
+        offset = entry["offset"]
+        try:
+            with open(self.layer_file, "rb") as filep:
+                if compression == "tar":
+                    filep.seek(offset)
+                    return filep.read(size)
+                checkpoints = self.toc["checkpoints"]
+                idx = bisect.bisect_right([chk[1] for chk in checkpoints],
+                                          offset) - 1
+                (coffset, uoffset) = checkpoints[max(idx, 0)]
+                filep.seek(coffset)
+                stream = LayerStream(filep, compression, coffset, uoffset)
+                if not stream.skip(offset - uoffset):
+                    return None
+                return stream.read(size)
+        except STREAM_ERRORS as error:
+            Msg().err("Error: reading from layer:", self.layer_file,
+                      str(error))
+        return None
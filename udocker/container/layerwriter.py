@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Write image layers directly into the local repository"""
+
+import os
+import gzip
+import hashlib
+import tarfile
+
+from udocker.msg import Msg
+from udocker.helper.unique import Unique
+from udocker.utils.fileutil import FileUtil
+
+
+class HashedFile(object):
+    """Write only file object computing the sha256 and size of the
+    data written through it"""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        """Write data and update the hash"""
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._fileobj.write(data)
+
+    def flush(self):
+        """Flush the underlying file object"""
+        return self._fileobj.flush()
+
+
+class LayerWriter(object):
+    """Create a gzip compressed tar layer in the repository layers
+    directory. The digest of the compressed blob and the diff_id of
+    the uncompressed tar are computed while writing, the layer file is
+    named after its digest when closed.
+    """
+
+    COMPRESSLEVEL = 6
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+        self.tarf = None
+        self._tmp_file = ""
+        self._filep = None
+        self._gzipf = None
+        self._blob = None
+        self._diff = None
+
+    def open(self):
+        """Start a new layer, returns a tarfile object open for writing"""
+        self._tmp_file = self.localrepo.layersdir + '/' + \
+            Unique().filename("layer.tmp")
+        try:
+            self._filep = open(self._tmp_file, "wb")
+            self._blob = HashedFile(self._filep)
+            self._gzipf = gzip.GzipFile(filename="", mode="wb",
+                                        fileobj=self._blob, mtime=0,
+                                        compresslevel=self.COMPRESSLEVEL)
+            self._diff = HashedFile(self._gzipf)
+            self.tarf = tarfile.open(fileobj=self._diff, mode="w|",
+                                     format=tarfile.PAX_FORMAT)
+        except (IOError, OSError, tarfile.TarError) as error:
+            Msg().err("Error: creating layer:", self._tmp_file, str(error))
+            self.abort()
+            return None
+        return self.tarf
+
+    def close(self):
+        """Finish the layer and move it to its final name. Returns
+        a dict with file, digest, diff_id and size or None on error.
+        """
+        try:
+            self.tarf.close()
+            self._gzipf.close()
+            self._filep.close()
+            digest = "sha256:" + self._blob.sha256.hexdigest()
+            layer_file = self.localrepo.layersdir + '/' + digest
+            os.rename(self._tmp_file, layer_file)
+        except (IOError, OSError, tarfile.TarError) as error:
+            Msg().err("Error: writing layer:", self._tmp_file, str(error))
+            self.abort()
+            return None
+        return {"file": layer_file, "digest": digest, "size": self._blob.size,
+                "diff_id": "sha256:" + self._diff.sha256.hexdigest()}
+
+    def abort(self):
+        """Discard the layer being written"""
+        for fileobj in (self.tarf, self._gzipf, self._filep):
+            try:
+                if fileobj:
+                    fileobj.close()
+            except (IOError, OSError, tarfile.TarError):
+                pass
+        if self._tmp_file and os.path.exists(self._tmp_file):
+            FileUtil(self._tmp_file).remove()
+        self.tarf = None
@@ -6,14 +6,29 @@ import re
 import sys
 import stat
 import json
+import time
+import hashlib
 
 from udocker.genstr import is_genstr
 from udocker.config import Config
 from udocker.msg import Msg
 from udocker.helper.osinfo import OSInfo
+from udocker.helper.unique import Unique
 from udocker.utils.fileutil import FileUtil
 from udocker.utils.chksum import ChkSUM
-from udocker.utils.uprocess import Uprocess
+from udocker.utils.diskusage import DiskUsage
+from udocker.utils.filelock import FileLock
+from udocker.container.layerindex import LayerIndex, verify_layer
+
+try:
+    import orjson
+except ImportError:
+    pass
+
+try:
+    import multiprocessing
+except ImportError:
+    pass
 
 
 class LocalRepository(object):
@@ -32,6 +47,17 @@ class LocalRepository(object):
     5. lib:        contains python libraries
     """
 
+    LAYERS_REFS = ".refs"      # index of the image tags using each layer
+    CATALOG = ".catalog"       # cached attributes of the image tags
+    LEDGER = ".verified"       # results of the verification of layers
+    REPOS_LOCK = ".lock"
+    CATALOG_RACY = 2           # seconds, tag dirs changed recently
+    CONTAINER_ATTRS = "attrs.json"  # cached attributes of a container
+    CONTAINER_USAGE = "usage.json"  # cached disk usage of a container
+    TRASH = ".trash"           # trees moved away to be deleted
+    TMP = "tmp"                # temporary files of repository data
+    _json_cache = {}           # json files already parsed in this process
+
     def __init__(self, topdir=None):
         self.topdir = topdir if topdir else Config.conf['topdir']
         self.bindir = Config.conf['bindir']
@@ -58,6 +84,11 @@ class LocalRepository(object):
         self.cur_repodir = ""
         self.cur_tagdir = ""
         self.cur_containerdir = ""
+        self.refs_file = self.reposdir + '/' + self.LAYERS_REFS
+        self.catalog_file = self.reposdir + '/' + self.CATALOG
+        self.ledger_file = self.reposdir + '/' + self.LEDGER
+        self.trashdir = self.topdir + '/' + self.TRASH
+        self.tmpdir = self.topdir + '/' + self.TMP
 
         FileUtil(self.reposdir).register_prefix()
         FileUtil(self.layersdir).register_prefix()
@@ -115,11 +146,17 @@ class LocalRepository(object):
 
     def protect_container(self, container_id):
         """Protect a container directory against deletion"""
-        return self._protect(self.cd_container(container_id))
+        if not self._protect(self.cd_container(container_id)):
+            return False
+        self.set_container_attrs(container_id, protected=True)
+        return True
 
     def unprotect_container(self, container_id):
         """Remove the protection against deletion"""
-        return self._unprotect(self.cd_container(container_id))
+        if not self._unprotect(self.cd_container(container_id)):
+            return False
+        self.set_container_attrs(container_id, protected=False)
+        return True
 
     def isprotected_container(self, container_id):
         """See if a container directory is protected"""
@@ -142,6 +179,20 @@ class LocalRepository(object):
         """See if container or image tag are protected"""
         return os.path.exists(directory + "/PROTECT")
 
+    def hardlink_container(self, container_id):
+        """Mark a container whose files may be shared with other containers
+        through hard links, files must then be copied before modification
+        """
+        try:
+            open(self.cd_container(container_id) + "/HARDLINKS", 'w').close()
+            return True
+        except (IOError, OSError):
+            return False
+
+    def ishardlinked_container(self, container_id):
+        """See if container files may be shared through hard links"""
+        return os.path.exists(self.cd_container(container_id) + "/HARDLINKS")
+
     def iswriteable_container(self, container_id):
         """See if a container root dir is writable by this user"""
         container_root = self.cd_container(container_id) + "/ROOT"
@@ -153,15 +204,23 @@ class LocalRepository(object):
             return 1
         return 0
 
-    def get_size(self, container_id):
-        """See if a container root dir is writable by this user"""
-        container_root = self.cd_container(container_id) + "/ROOT"
-        try:
-            size, dummy = Uprocess().get_output(["du", "-s", "-m", "-x",
-                                                 container_root]).split()
-            return int(size)
-        except (ValueError, NameError, AttributeError):
+    def get_size(self, container_id, rescan=False):
+        """Disk usage of a container ROOT in MB or -1 on error. The
+        totals of each directory are cached in the container directory
+        so that only modified directories are read again, with rescan
+        the cache is ignored and everything is read.
+        """
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
             return -1
+        disk_usage = DiskUsage(container_dir + '/' + self.CONTAINER_USAGE)
+        if rescan:
+            disk_usage.clear()
+        size = disk_usage.size(container_dir + "/ROOT")
+        if size < 0:
+            return -1
+        disk_usage.save()
+        return (size + 1048575) // 1048576
 
     def get_containers_list(self, dir_only=True):
         """Get a list of all containers in the local repo
@@ -176,6 +235,9 @@ class LocalRepository(object):
         for fname in os.listdir(self.containersdir):
             container_dir = self.containersdir + '/' + fname
             if os.path.isdir(container_dir):
+                if dir_only:
+                    containers_list.append(container_dir)
+                    continue
                 try:
                     filep = open(container_dir + "/imagerepo.name", 'r')
                 except (IOError, OSError):
@@ -183,17 +245,74 @@ class LocalRepository(object):
                 else:
                     reponame = filep.read()
                     filep.close()
-                if dir_only:
-                    containers_list.append(container_dir)
-                elif not os.path.islink(container_dir):
+                if not os.path.islink(container_dir):
                     names = self.get_container_name(fname)
                     if not names:
                         names = ""
                     containers_list.append((fname, reponame, str(names)))
         return containers_list
 
-    def del_container(self, container_id, force=False):
-        """Delete a container tree, the image layers are untouched"""
+    def tmp_area(self):
+        """Directory for the temporary files of data that will be placed
+        in the repository, such as images being loaded. Being in the same
+        filesystem the data is moved into the repository by renaming and
+        the host temporary directory is not filled by large images. The
+        udocker temporary directory is used if it cannot be created."""
+        try:
+            os.makedirs(self.tmpdir)
+        except OSError:
+            if not os.path.isdir(self.tmpdir):
+                return Config.conf['tmpdir']
+        FileUtil(self.tmpdir).register_prefix()
+        return self.tmpdir
+
+    def _trash_put(self, path):
+        """Move a tree to the trash directory so that its name is free
+        at once, returns the new pathname or "" if it cannot be moved,
+        e.g. to another filesystem"""
+        trash_path = self.trashdir + '/' + \
+            Unique().filename(os.path.basename(path))
+        try:
+            os.mkdir(self.trashdir)
+        except OSError:
+            pass
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            return ""
+        return trash_path
+
+    def _trash_remove(self, trash_path, background=False):
+        """Delete a tree from the trash, with background the tree is
+        deleted by a detached process. Trees left by interrupted
+        deletions are removed by prune."""
+        if background:
+            try:
+                cpid = os.fork()
+            except OSError:
+                cpid = -1
+            if cpid > 0:
+                os.waitpid(cpid, 0)
+                return True
+            if not cpid:
+                try:
+                    os.setsid()
+                    if not os.fork():
+                        devnull = os.open(os.devnull, os.O_RDWR)
+                        for std_fd in (0, 1, 2):
+                            os.dup2(devnull, std_fd)
+                        FileUtil(trash_path).remove(force=True,
+                                                    recursive=True)
+                finally:
+                    os._exit(0)     # pylint: disable=protected-access
+        return FileUtil(trash_path).remove(force=True, recursive=True)
+
+    def del_container(self, container_id, force=False, background=False):
+        """Delete a container tree, the image layers are untouched. The
+        container is first moved to the trash so that its id and names
+        can be reused at once, with background the tree is deleted by a
+        detached process. The permissions of the directories are fixed
+        while deleting, force is kept for compatibility."""
         container_dir = self.cd_container(container_id)
         if not container_dir:
             return False
@@ -201,10 +320,11 @@ class LocalRepository(object):
         if container_dir in self.get_containers_list(True):
             for name in self.get_container_name(container_id):
                 self.del_container_name(name)  # delete aliases links
-            if force:
-                FileUtil(container_dir).rchmod(stat.S_IWUSR | stat.S_IRUSR,
-                                               stat.S_IWUSR | stat.S_IRUSR |
-                                               stat.S_IXUSR)
+            trash_path = self._trash_put(container_dir)
+            if trash_path:
+                self._trash_remove(trash_path, background)
+                self.cur_containerdir = ""
+                return True
             if FileUtil(container_dir).remove(recursive=True):
                 self.cur_containerdir = ""
                 return True
@@ -213,12 +333,113 @@ class LocalRepository(object):
 
     def cd_container(self, container_id):
         """Select a container directory for further operations"""
-        container_dir = self.containersdir + '/' + str(container_id)
-        if os.path.exists(container_dir):
-            if container_dir in self.get_containers_list(True):
-                return container_dir
+        container_id = str(container_id)
+        if '/' in container_id or container_id in ("", ".", ".."):
+            return ""
+        container_dir = self.containersdir + '/' + container_id
+        if os.path.isdir(container_dir):
+            return container_dir
         return ""
 
+    def _container_attrs_build(self, container_dir):
+        """Collect the attributes of a container from its files"""
+        attrs = {"imagerepo": "", "execmode": "", "platform": "unknown/unknown",
+                 "protected": self._isprotected(container_dir),
+                 "size": -1, "size_mtime": 0}
+        attrs["imagerepo"] = \
+            FileUtil(container_dir + "/imagerepo.name").getdata('r') or ""
+        attrs["execmode"] = \
+            (FileUtil(container_dir + "/execmode").getdata('r') or "").strip()
+        container_json = self.load_json(container_dir + "/container.json")
+        if isinstance(container_json, dict):
+            platform = [container_json.get("os", "unknown"),
+                        container_json.get("architecture", "unknown")]
+            if container_json.get("variant"):
+                platform.append(container_json["variant"])
+            attrs["platform"] = '/'.join(platform)
+        return attrs
+
+    def get_container_attrs(self, container_id):
+        """Get the cached attributes of a container: imagerepo, execmode,
+        platform, protected and the size in MB with the modification time
+        of the container ROOT when it was measured. The record is built
+        from the container files if missing. Returns dict or None.
+        """
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
+            return None
+        attrs_file = container_dir + '/' + self.CONTAINER_ATTRS
+        attrs = self._index_load(attrs_file, "attrs")
+        if attrs is None:
+            attrs = self._container_attrs_build(container_dir)
+            self._index_save(attrs_file, "attrs", attrs)
+        return attrs
+
+    def set_container_attrs(self, container_id, **attrs):
+        """Update the cached attributes of a container"""
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
+            return False
+        attrs_file = container_dir + '/' + self.CONTAINER_ATTRS
+        record = self._index_load(attrs_file, "attrs")
+        if record is None:
+            return True                # built when next needed
+        record.update(attrs)
+        if not self._index_save(attrs_file, "attrs", record):
+            FileUtil(attrs_file).remove()
+            return False
+        return True
+
+    def get_containers_attrs(self, with_size=False):
+        """List all containers with their cached attributes reading the
+        containers directory only once. Returns a list of dicts with the
+        attributes plus id, names, writeable and, if with_size, the size
+        which is measured again when the container ROOT has changed.
+        """
+        if not os.path.isdir(self.containersdir):
+            return []
+        containers = []
+        names = {}
+        for fname in os.listdir(self.containersdir):
+            try:
+                f_stat = os.lstat(self.containersdir + '/' + fname)
+            except OSError:
+                continue
+            if stat.S_ISLNK(f_stat.st_mode):
+                real_container = os.readlink(self.containersdir + '/' + fname)
+                names.setdefault(os.path.basename(real_container),
+                                 []).append(fname)
+            elif stat.S_ISDIR(f_stat.st_mode):
+                containers.append(fname)
+        containers_attrs = []
+        for container_id in sorted(containers):
+            attrs = self.get_container_attrs(container_id)
+            if attrs is None:
+                continue
+            container_root = self.containersdir + '/' + container_id + "/ROOT"
+            try:
+                root_stat = os.stat(container_root)
+            except OSError:
+                root_stat = None
+            if root_stat is None:
+                attrs["writeable"] = 2
+            elif not stat.S_ISDIR(root_stat.st_mode):
+                attrs["writeable"] = 3
+            else:
+                attrs["writeable"] = int(os.access(container_root, os.W_OK))
+            if with_size and root_stat is not None and \
+                    (attrs["size"] < 0 or
+                     attrs["size_mtime"] != root_stat.st_mtime):
+                attrs["size"] = self.get_size(container_id,
+                                              rescan=attrs["size"] < 0)
+                attrs["size_mtime"] = root_stat.st_mtime
+                self.set_container_attrs(container_id, size=attrs["size"],
+                                         size_mtime=attrs["size_mtime"])
+            attrs["id"] = container_id
+            attrs["names"] = sorted(names.get(container_id, []))
+            containers_attrs.append(attrs)
+        return containers_attrs
+
     def _symlink(self, existing_file, link_file):
         """Create relative symbolic links"""
         if os.path.exists(link_file):
@@ -379,21 +600,211 @@ class LocalRepository(object):
         """Check if a given file is in the repository"""
         return self._find(filename, self.reposdir)
 
+    def _tag_ref(self, tag_dir):
+        """Name of an image tag in the layers references index"""
+        return tag_dir[len(self.reposdir) + 1:]
+
+    def _refs_scan(self):
+        """Build the layers references index from the image tags"""
+        refs = {}
+        for (imagerepo, tag) in self.get_imagerepos():
+            tag_dir = self.reposdir + '/' + imagerepo + '/' + tag
+            for fname in os.listdir(tag_dir):
+                f_path = tag_dir + '/' + fname
+                if os.path.islink(f_path):
+                    layer_name = os.path.basename(os.readlink(f_path))
+                    tag_refs = refs.setdefault(layer_name, [])
+                    if self._tag_ref(tag_dir) not in tag_refs:
+                        tag_refs.append(self._tag_ref(tag_dir))
+        return refs
+
+    def _index_load(self, filename, key):
+        """Load a repository index file, returns dict or None"""
+        try:
+            with open(filename, 'rb') as infile:
+                index = self._json_parse(infile.read())
+            if index["version"] == 1 and isinstance(index[key], dict):
+                return index[key]
+        except (IOError, OSError, KeyError, ValueError, TypeError):
+            pass
+        return None
+
+    def _index_save(self, filename, key, data):
+        """Atomically write a repository index file"""
+        tmp_file = filename + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_file, 'w') as outfile:
+                json.dump({"version": 1, key: data}, outfile)
+            os.rename(tmp_file, filename)
+        except (IOError, OSError, TypeError, ValueError):
+            FileUtil(tmp_file).remove()
+            return False
+        return True
+
+    def _repo_lock(self):
+        """Exclusive lock serializing updates of the repository indexes,
+        returns the FileLock held or None"""
+        repo_lock = FileLock(self.reposdir + '/' + self.REPOS_LOCK)
+        if repo_lock.acquire():
+            return repo_lock
+        return None
+
+    def layer_lock(self, layer_name):
+        """Lock on a layer file, held by the process downloading the
+        layer, concurrent pulls of the same layer wait and reuse it"""
+        return FileLock(self.layersdir + '/' + os.path.basename(layer_name) +
+                        FileLock.SUFFIX)
+
+    def tag_lock(self, imagerepo, tag):
+        """Lock on an image tag, held while the tag is being pulled,
+        to be invoked after setup_imagerepo()"""
+        return FileLock(self.reposdir + '/' + imagerepo + '/' + tag +
+                        FileLock.SUFFIX)
+
+    def container_lock(self, container_id):
+        """Lock on a container, held while its files are being modified
+        e.g. when changing the execution mode"""
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
+            return FileLock("")
+        return FileLock(container_dir + '/' + FileLock.SUFFIX)
+
+    def _refs_load(self):
+        """Load the layers references index, returns dict or None"""
+        return self._index_load(self.refs_file, "layers")
+
+    def _refs_change(self, layer_names, tag_dir, add=True):
+        """Add or remove the references of an image tag to layers in
+        the references index. A missing or invalid index is rebuilt from
+        the image tags. Returns the updated index or None on failure.
+        """
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return None
+        try:
+            refs = self._refs_load()
+            if refs is None:
+                refs = self._refs_scan()
+            tag_ref = self._tag_ref(tag_dir)
+            for layer_name in layer_names:
+                tag_refs = refs.setdefault(layer_name, [])
+                if add and tag_ref not in tag_refs:
+                    tag_refs.append(tag_ref)
+                elif not add and tag_ref in tag_refs:
+                    tag_refs.remove(tag_ref)
+                if not tag_refs:
+                    del refs[layer_name]
+            if not self._refs_save(refs):
+                return None
+        finally:
+            repo_lock.release()
+        return refs
+
+    def _refs_save(self, refs):
+        """Atomically write the layers references index"""
+        return self._index_save(self.refs_file, "layers", refs)
+
+    def get_layers_refs(self, rescan=False):
+        """Get the image tags using each layer file as a dict by layer
+        name, with rescan the references are read from the image tags"""
+        refs = None
+        if not rescan:
+            refs = self._refs_load()
+        if refs is None:
+            refs = self._refs_scan()
+        return refs
+
+    def get_layer_refs(self, layer_name):
+        """List the image tags using a layer file"""
+        return self.get_layers_refs().get(os.path.basename(layer_name), [])
+
+    def rebuild_layers_refs(self):
+        """Rebuild the layers references index from the image tags.
+        Returns a tuple with the lists of (layer, tag) references that
+        were missing and that were stale in the previous index, or None
+        on failure.
+        """
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return None
+        try:
+            old_refs = self._refs_load() or {}
+            refs = self._refs_scan()
+            if not self._refs_save(refs):
+                return None
+        finally:
+            repo_lock.release()
+        missing = []
+        stale = []
+        for layer_name in sorted(set(refs) | set(old_refs)):
+            new_tags = refs.get(layer_name, [])
+            old_tags = old_refs.get(layer_name, [])
+            missing.extend([(layer_name, tag_ref) for tag_ref in new_tags
+                            if tag_ref not in old_tags])
+            stale.extend([(layer_name, tag_ref) for tag_ref in old_tags
+                          if tag_ref not in new_tags])
+        return (missing, stale)
+
+    def get_unreferenced_layers(self, rescan=False):
+        """List the files in the layers directory not used by images,
+        with rescan the references are read from the image tags"""
+        refs = self.get_layers_refs(rescan)
+        unreferenced = []
+        for fname in sorted(os.listdir(self.layersdir)):
+            if fname.endswith((LayerIndex.SUFFIX, FileLock.SUFFIX)):
+                continue
+            if fname not in refs:
+                unreferenced.append(self.layersdir + '/' + fname)
+        return unreferenced
+
+    def del_unreferenced_layers(self, layer_files):
+        """Delete layer files and their index if they are still not used
+        by any image. The references are read from the image tags while
+        holding the repository lock. Returns the list of deleted files.
+        """
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return []
+        deleted = []
+        try:
+            refs = self._refs_scan()
+            self._refs_save(refs)
+            for layer_file in layer_files:
+                if os.path.basename(layer_file) in refs:
+                    continue
+                if FileUtil(layer_file).remove():
+                    LayerIndex(layer_file).remove()
+                    deleted.append(layer_file)
+        finally:
+            repo_lock.release()
+        return deleted
+
     def _remove_layers(self, tag_dir, force):
         """Remove link to image layer and corresponding layer
         if not being used by other images
         """
+        layer_files = []
         for fname in os.listdir(tag_dir):
             f_path = tag_dir + '/' + fname  # link to layer
             if os.path.islink(f_path):
                 linkname = os.readlink(f_path)
-                layer_file = tag_dir + '/' + linkname
+                layer_files.append(tag_dir + '/' + linkname)
                 if not FileUtil(f_path).remove() and not force:
                     return False
-                if not self._inrepository(os.path.basename(linkname)):
-                    # removing actual layers not reference by other repos
-                    if not FileUtil(layer_file).remove() and not force:
-                        return False
+        refs = self._refs_change([os.path.basename(layer_file)
+                                  for layer_file in layer_files],
+                                 tag_dir, add=False)
+        for layer_file in layer_files:
+            layer_name = os.path.basename(layer_file)
+            if refs is None:
+                in_use = self._inrepository(layer_name)
+            else:
+                in_use = layer_name in refs
+            if not in_use:
+                # removing actual layers not reference by other repos
+                if not FileUtil(layer_file).remove() and not force:
+                    return False
+                LayerIndex(layer_file).remove()
         return True
 
     def del_imagerepo(self, imagerepo, tag, force=False):
@@ -402,6 +813,7 @@ class LocalRepository(object):
         if (tag_dir and
                 self._remove_layers(tag_dir, force) and
                 FileUtil(tag_dir).remove(recursive=True)):
+            self._catalog_change(tag_dir, remove=True)
             self.cur_repodir = ""
             self.cur_tagdir = ""
             while imagerepo:
@@ -429,6 +841,108 @@ class LocalRepository(object):
         """get all images repositories with tags"""
         return self._get_tags(self.reposdir)
 
+    def _catalog_entry(self, imagerepo, tag):
+        """Attributes of an image tag as kept in the catalog"""
+        (cur_repodir, cur_tagdir) = (self.cur_repodir, self.cur_tagdir)
+        entry = {"imagerepo": imagerepo, "tag": tag, "mtime": 0,
+                 "protected": False, "platform": "unknown/unknown",
+                 "digest": "", "layers": []}
+        tag_dir = self.cd_imagerepo(imagerepo, tag)
+        if tag_dir:
+            try:
+                mtime = os.stat(tag_dir).st_mtime
+            except OSError:
+                mtime = 0
+            if abs(time.time() - mtime) > self.CATALOG_RACY:
+                entry["mtime"] = mtime     # else recompute when listed
+            entry["protected"] = self.isprotected_imagerepo(imagerepo, tag)
+            entry["platform"] = self.get_image_platform_fmt(detect=False)
+            if os.path.exists(tag_dir + "/manifest"):
+                entry["digest"] = \
+                    "sha256:" + ChkSUM().sha256(tag_dir + "/manifest")
+            entry["layers"] = [[os.path.basename(filename), size] for
+                               (filename, size) in
+                               self.get_layers(imagerepo, tag)]
+        (self.cur_repodir, self.cur_tagdir) = (cur_repodir, cur_tagdir)
+        return entry
+
+    def get_catalog(self, rebuild=False):
+        """Get the catalog of the image tags, a dict indexed by the tag
+        directory relative to reposdir with imagerepo, tag, protected,
+        platform, manifest digest and layers with their sizes. Entries
+        are revalidated with the modification time of the tag directory
+        and the catalog is rebuilt from the repository if missing. The
+        catalog is read without locking, the lock is only taken to write
+        the entries that changed.
+        """
+        catalog = None
+        if not rebuild:
+            catalog = self._index_load(self.catalog_file, "images")
+        rebuilt = catalog is None
+        if rebuilt:
+            catalog = dict([(imagerepo + '/' + tag, {"mtime": 0}) for
+                            (imagerepo, tag) in self.get_imagerepos()])
+        changes = {}
+        for tag_ref in list(catalog):
+            try:
+                mtime = os.stat(self.reposdir + '/' + tag_ref).st_mtime
+            except OSError:
+                del catalog[tag_ref]
+                changes[tag_ref] = None
+                continue
+            if catalog[tag_ref].get("mtime") != mtime:
+                (imagerepo, tag) = tag_ref.rsplit('/', 1)
+                catalog[tag_ref] = self._catalog_entry(imagerepo, tag)
+                changes[tag_ref] = catalog[tag_ref]
+        if changes or rebuilt:
+            self._catalog_save(changes, rebuilt)
+        return catalog
+
+    def _catalog_save(self, changes, rebuilt=False):
+        """Write the catalog entries changed by get_catalog(), None
+        removes an entry. The catalog is loaded again under the lock to
+        keep the changes made meanwhile by other processes, a rebuilt
+        catalog starts from the image tags found while holding the lock.
+        """
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return False
+        try:
+            catalog = None
+            if not rebuilt:
+                catalog = self._index_load(self.catalog_file, "images")
+            if catalog is None:
+                catalog = dict([(imagerepo + '/' + tag, {"mtime": 0}) for
+                                (imagerepo, tag) in self.get_imagerepos()])
+            for (tag_ref, entry) in changes.items():
+                if entry is None:
+                    catalog.pop(tag_ref, None)
+                else:
+                    catalog[tag_ref] = entry
+            return self._index_save(self.catalog_file, "images", catalog)
+        finally:
+            repo_lock.release()
+
+    def _catalog_change(self, tag_dir, remove=False):
+        """Add or remove an image tag from the catalog"""
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return False
+        try:
+            catalog = self._index_load(self.catalog_file, "images")
+            if catalog is None:
+                return True            # rebuilt when next listed
+            if remove:
+                catalog.pop(self._tag_ref(tag_dir), None)
+            else:
+                catalog[self._tag_ref(tag_dir)] = {"mtime": 0}
+            if not self._index_save(self.catalog_file, "images", catalog):
+                FileUtil(self.catalog_file).remove()
+                return False
+        finally:
+            repo_lock.release()
+        return True
+
     def get_layers(self, imagerepo, tag):
         """Get all layers for a given image image tag"""
         layers_list = []
@@ -456,6 +970,9 @@ class LocalRepository(object):
         if os.path.islink(linkname):
             FileUtil(linkname).remove()
         self._symlink(filename, linkname)
+        if self._refs_change([os.path.basename(filename), ],
+                             self.cur_tagdir) is None:
+            FileUtil(self.refs_file).remove()  # rebuilt when next needed
         return True
 
     def setup_imagerepo(self, imagerepo):
@@ -468,11 +985,12 @@ class LocalRepository(object):
                 os.makedirs(directory)
                 self.cur_repodir = directory
                 return True
-
-            self.cur_repodir = directory
-            return False
         except (IOError, OSError):
-            return None
+            if not os.path.isdir(directory):   # not created by another udocker
+                return None
+
+        self.cur_repodir = directory
+        return False
 
     def setup_tag(self, tag):
         """Create directory structure for an image TAG
@@ -481,7 +999,12 @@ class LocalRepository(object):
         directory = self.cur_repodir + "/" + tag
         try:
             if not os.path.exists(directory):
-                os.makedirs(directory)
+                try:
+                    os.makedirs(directory)
+                    self._catalog_change(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
             self.cur_tagdir = directory
             out_tag = open(directory + "/TAG", 'w')
         except (IOError, OSError):
@@ -520,6 +1043,48 @@ class LocalRepository(object):
             return False
         return True
 
+    def setup_image_v2(self, imagerepo, tag, container_json, layers):
+        """Create an image TAG in v2 format from layers previously written
+        to the layers directory. Each layer is a dict with file, digest,
+        size, diff_id and optionally mediaType, gzip by default. The
+        image config is container_json with the diff_ids of the layers.
+        """
+        if self.cd_imagerepo(imagerepo, tag):
+            Msg().err("Error: image tag already exists:", imagerepo, tag)
+            return False
+        container_json = dict(container_json)
+        container_json["rootfs"] = {
+            "type": "layers",
+            "diff_ids": [layer["diff_id"] for layer in layers]}
+        config_data = json.dumps(container_json).encode()
+        config_digest = "sha256:" + hashlib.sha256(config_data).hexdigest()
+        config_file = self.layersdir + '/' + config_digest
+        if FileUtil(config_file).putdata(config_data, "wb") != config_data:
+            Msg().err("Error: writing image config:", config_file)
+            return False
+        manifest = {
+            "schemaVersion": 2,
+            "mediaType":
+                "application/vnd.docker.distribution.manifest.v2+json",
+            "config": {
+                "mediaType": "application/vnd.docker.container.image.v1+json",
+                "size": len(config_data),
+                "digest": config_digest},
+            "layers": [{
+                "mediaType": layer.get(
+                    "mediaType",
+                    "application/vnd.docker.image.rootfs.diff.tar.gzip"),
+                "size": layer["size"],
+                "digest": layer["digest"]} for layer in layers]}
+        self.setup_imagerepo(imagerepo)
+        if not (self.setup_tag(tag) and self.set_version("v2")):
+            Msg().err("Error: setting up image tag:", imagerepo, tag)
+            return False
+        for layer in layers:
+            self.add_image_layer(layer["file"])
+        self.add_image_layer(config_file)
+        return self.save_json("manifest", manifest)
+
     def _get_image_attributes_v1(self, directory):
         """Get image attributes from image directory in v1 format"""
         files = []
@@ -564,11 +1129,9 @@ class LocalRepository(object):
             files.append(layer_file)
         try:
             json_file = directory + '/' + manifest["config"]["digest"]
-            container_json = json.loads(FileUtil(json_file).getdata('r'))
-        except (IOError, OSError, AttributeError, ValueError, TypeError,
-                IndexError, KeyError):
+        except (AttributeError, TypeError, KeyError):
             return (None, files)
-        return (container_json, files)
+        return (self.load_json(json_file), files)
 
     def get_image_attributes(self):
         """Load attributes from image TAGs that have been previously
@@ -588,8 +1151,10 @@ class LocalRepository(object):
 
         return (None, None)
 
-    def get_image_platform_fmt(self):
-        """Get the image platform from the metadata"""
+    def get_image_platform_fmt(self, detect=True):
+        """Get the image platform from the metadata, with detect the
+        architecture missing in the metadata is found from the image
+        binaries"""
         (manifest_json, dummy) = self.get_image_attributes()
         if not manifest_json:
             return "unknown/unknown"
@@ -597,6 +1162,9 @@ class LocalRepository(object):
             p_architecture = manifest_json["architecture"]
         except KeyError:
             p_architecture = "unknown"
+            if detect:
+                p_architecture = \
+                    self.arch_from_image("docker", build=False) or "unknown"
         try:
             p_os = manifest_json["os"]
         except KeyError:
@@ -609,10 +1177,144 @@ class LocalRepository(object):
             return "%s/%s" % (p_os, p_architecture)
         return "%s/%s/%s" % (p_os, p_architecture, p_variant)
 
+    def index_layer(self, layer_file, build=True):
+        """Get the table of contents index of a layer file. The index
+        is built if missing and the layer is stored in the repository.
+        Returns a LayerIndex object or None.
+        """
+        layer_index = LayerIndex(layer_file)
+        if layer_index.load():
+            return layer_index
+        if not (build and Config.conf['layer_index']):
+            return None
+        layersdir = os.path.realpath(self.layersdir) + '/'
+        if not layer_index.layer_file.startswith(layersdir):
+            return None
+        if layer_index.build():
+            return layer_index
+        return None
+
+    def get_image_indexes(self, build=True):
+        """Get the indexes of the layers of the image TAG previously
+        selected via cd_imagerepo(), from the top to the bottom layer,
+        without build only the indexes that already exist are used
+        """
+        (dummy, layer_files) = self.get_image_attributes()
+        if not layer_files:
+            return []
+        indexes = []
+        for layer_file in reversed(layer_files):
+            layer_index = self.index_layer(layer_file, build)
+            if not layer_index:
+                return []
+            indexes.append(layer_index)
+        return indexes
+
+    def _image_lookup(self, indexes, f_path):
+        """Find pathname in the merged view of the layers"""
+        for layer_index in indexes:
+            f_stat = layer_index.lookup(f_path)
+            if f_stat:
+                return (f_stat, layer_index)
+            if layer_index.hides(f_path):
+                break
+        return (None, None)
+
+    def _image_resolve(self, indexes, f_path, follow=True):
+        """Resolve pathname in the merged view of the layers following
+        symbolic links in the directories and optionally in the last
+        component. Returns (stat dict, LayerIndex) or (None, None).
+        """
+        components = [name for name in f_path.split('/') if name]
+        resolved = ""
+        f_stat = None
+        layer_index = None
+        links = 0
+        while components:
+            name = components.pop(0)
+            if name == '.':
+                continue
+            if name == "..":
+                resolved = os.path.dirname(resolved).rstrip('/')
+                continue
+            (f_stat, layer_index) = \
+                self._image_lookup(indexes, resolved + '/' + name)
+            if not f_stat:
+                return (None, None)
+            if f_stat["type"] == 'l' and (components or follow):
+                links += 1
+                if links > 40:
+                    return (None, None)
+                if f_stat["linkname"].startswith('/'):
+                    resolved = ""
+                components = [link_name for link_name in
+                              f_stat["linkname"].split('/')
+                              if link_name] + components
+                continue
+            if components and f_stat["type"] != 'd':
+                return (None, None)
+            resolved = resolved + '/' + name
+        if f_stat:
+            f_stat["path"] = resolved
+        return (f_stat, layer_index)
+
+    def stat_image_file(self, imagerepo, tag, f_path, follow=True):
+        """Get the attributes of a pathname in the merged view of the
+        layers of an image. Returns a dict or None.
+        """
+        if not self.cd_imagerepo(imagerepo, tag):
+            return None
+        (f_stat, dummy) = \
+            self._image_resolve(self.get_image_indexes(), f_path, follow)
+        return f_stat
+
+    def read_image_file(self, imagerepo, tag, f_path, size=-1):
+        """Read a file from the merged view of the layers of an image
+        without extracting the layers. Returns the data or None.
+        """
+        if not self.cd_imagerepo(imagerepo, tag):
+            return None
+        return self._image_read(self.get_image_indexes(), f_path, size)
+
+    def _image_read(self, indexes, f_path, size=-1):
+        """Read a file from the merged view of the layers"""
+        (f_stat, layer_index) = self._image_resolve(indexes, f_path)
+        if not (f_stat and f_stat["type"] == 'f'):
+            return None
+        return layer_index.read(f_stat["path"], size)
+
+    def arch_from_image(self, target="UDOCKER", build=True):
+        """Get the architecture of the image TAG previously selected
+        via cd_imagerepo() from the headers of its binaries, these are
+        read from the layers without creating a container. Without
+        build the layers that are not indexed are not read.
+        """
+        indexes = self.get_image_indexes(build)
+        if not indexes:
+            return ""
+        osinfo = OSInfo('/')
+        for filename in osinfo.get_binaries_list():
+            elf_header = self._image_read(indexes, filename, 4096)
+            if not (elf_header and elf_header.startswith(b"\x7fELF")):
+                continue
+            tmp_file = FileUtil("elfheader").mktmp()
+            FileUtil(tmp_file).putdata(elf_header, "wb")
+            (sourcetype, fileinfo) = osinfo.get_filetype(tmp_file)
+            FileUtil(tmp_file).remove()
+            if not sourcetype:
+                continue
+            arch = osinfo.get_arch(sourcetype, fileinfo, target)
+            try:
+                return arch[0]
+            except IndexError:
+                continue
+        return ""
+
     def save_json(self, filename, data):
         """Save container json to a file in the image TAG directory
         that has been previously selected via cd_imagerepo()
         or if the file starts with "/" to that specific file.
+        The json is written to a temporary file that is then renamed.
         """
         if filename.startswith("/"):
             out_filename = filename
@@ -624,21 +1326,32 @@ class LocalRepository(object):
             if not os.path.exists(self.cur_tagdir):
                 return False
             out_filename = self.cur_tagdir + "/" + filename
-        outfile = None
+        tmp_file = out_filename + ".tmp" + str(os.getpid())
         try:
-            outfile = open(out_filename, 'w')
-            json.dump(data, outfile)
+            with open(tmp_file, 'w') as outfile:
+                json.dump(data, outfile)
+            os.rename(tmp_file, out_filename)
         except (IOError, OSError, AttributeError, ValueError, TypeError):
-            if outfile:
-                outfile.close()
+            FileUtil(tmp_file).remove()
             return False
-        outfile.close()
+        finally:
+            LocalRepository._json_cache.pop(out_filename, None)
         return True
 
+    def _json_parse(self, data):
+        """Parse json text, with orjson if installed"""
+        try:
+            return orjson.loads(data)
+        except (NameError, ValueError):
+            return json.loads(data)
+
     def load_json(self, filename):
         """Load container json from a file in the image TAG directory
         that has been previously selected via cd_imagerepo()
         or if the file starts with '/' from that specific file.
+        The parsed json is kept in memory and reused while the inode,
+        modification time and size of the file do not change, the
+        object returned is shared and must not be modified.
         """
         if filename.startswith('/'):
             in_filename = filename
@@ -650,15 +1363,17 @@ class LocalRepository(object):
             if not os.path.exists(self.cur_tagdir):
                 return False
             in_filename = self.cur_tagdir + '/' + filename
-        json_obj = None
-        infile = None
         try:
-            infile = open(in_filename, 'r')
-            json_obj = json.load(infile)
+            f_stat = os.stat(in_filename)
+            key = (f_stat.st_ino, f_stat.st_mtime, f_stat.st_size)
+            cached = LocalRepository._json_cache.get(in_filename)
+            if cached and cached[0] == key:
+                return cached[1]
+            with open(in_filename, 'rb') as infile:
+                json_obj = self._json_parse(infile.read())
         except (IOError, OSError, AttributeError, ValueError, TypeError):
-            pass
-        if infile:
-            infile.close()
+            return None
+        LocalRepository._json_cache[in_filename] = (key, json_obj)
         return json_obj
 
     def _load_structure(self, imagetagdir):
@@ -754,29 +1469,39 @@ class LocalRepository(object):
         return ("", layer_id)
 
     def _verify_layer_file(self, structure, layer_id):
-        """Verify layer file in repository"""
+        """Check the link to a layer file in the repository, returns
+        the task for verify_layer() or None"""
         (layer_algorithm, layer_hash) = self._split_layer_id(layer_id)
         layer_f = structure["repolayers"][layer_id]["layer_f"]
         if not (os.path.exists(layer_f) and
                 os.path.islink(layer_f)):
             Msg().err("Error: layer data file symbolic link not found",
                       layer_id)
-            return False
+            return None
         if not os.path.exists(self.cur_tagdir + '/' +
                               os.readlink(layer_f)):
             Msg().err("Error: layer data file not found")
-            return False
-        (dummy, filetype) = OSInfo('/').get_filetype(layer_f)
-        if "gzip" in filetype:
-            if not FileUtil(layer_f).verify_tar():
-                Msg().err("Error: layer tar verify failed:", layer_f)
-                return False
-        if layer_algorithm:
-            layer_f_chksum = ChkSUM().hash(layer_f, layer_algorithm)
-            if layer_f_chksum and layer_f_chksum != layer_hash:
-                Msg().err("Error: layer file chksum failed:", layer_f)
-                return False
-        return True
+            return None
+        layersdir = os.path.realpath(self.layersdir) + '/'
+        build = bool(Config.conf['layer_index'] and
+                     os.path.realpath(layer_f).startswith(layersdir))
+        return (layer_f, layer_algorithm, layer_hash, build)
+
+    def _verify_layers(self, tasks):
+        """Verify layer files in a pool of processes, each file is read
+        once. Returns the list of error messages, empty if ok."""
+        processes = Config.conf['verify_processes']
+        if processes > 1 and len(tasks) > 1:
+            try:
+                pool = multiprocessing.Pool(min(processes, len(tasks)))
+                try:
+                    return pool.map(verify_layer, tasks, 1)
+                finally:
+                    pool.close()
+                    pool.join()
+            except (NameError, OSError):
+                pass
+        return [verify_layer(task) for task in tasks]
 
     def _verify_image_v1(self, structure):
         """Verify the structure of a v1 image repository"""
@@ -822,13 +1547,15 @@ class LocalRepository(object):
                 continue
         return status
 
-    def verify_image(self):
-        """Verify the structure of an image repository"""
+    def _verify_tag(self):
+        """Verify the structure of the image tag previously selected
+        via cd_imagerepo(), returns the status and the lists of layer
+        ids and of tasks to verify the layer files"""
         Msg().out("Info: loading structure", l=Msg.INF)
         structure = self._load_structure(self.cur_tagdir)
         if not structure:
             Msg().err("Error: load of image tag structure failed")
-            return False
+            return (False, [], [])
         Msg().out("Info: verifying layers", l=Msg.INF)
         status = True
         if "ancestry" in structure and "has_json_f" in structure:
@@ -841,15 +1568,117 @@ class LocalRepository(object):
                 status = self._verify_image_v2_s1(structure)
             elif "layers" in structure["manifest"]:
                 status = self._verify_image_v2_s2(structure)
+        layer_ids = []
+        tasks = []
         for layer_id in structure["repolayers"]:
             if "layer_f" not in structure["repolayers"][layer_id]:
                 Msg().err("Error: layer file not found in structure",
                           layer_id)
                 status = False
                 continue
-            layer_status = self._verify_layer_file(structure, layer_id)
-            if not layer_status:
+            task = self._verify_layer_file(structure, layer_id)
+            if not task:
+                status = False
+                continue
+            layer_ids.append(layer_id)
+            tasks.append(task)
+        return (status, layer_ids, tasks)
+
+    def _ledger_stat(self, layer_file):
+        """Size, modification time and inode of a layer file"""
+        try:
+            f_stat = os.stat(layer_file)
+        except OSError:
+            return None
+        return [f_stat.st_size, f_stat.st_mtime, f_stat.st_ino]
+
+    def _ledger_update(self, entries):
+        """Add the results of the verification of layer files to the
+        ledger, entries of layers no longer in the repository are
+        dropped"""
+        repo_lock = self._repo_lock()
+        if repo_lock is None:
+            return False
+        try:
+            ledger = self._index_load(self.ledger_file, "layers") or {}
+            ledger.update(entries)
+            ledger = dict([(layer_name, entry) for (layer_name, entry)
+                           in ledger.items() if os.path.exists(
+                               self.layersdir + '/' + layer_name)])
+            return self._index_save(self.ledger_file, "layers", ledger)
+        finally:
+            repo_lock.release()
+
+    def _verify_run(self, tasks, ledger=None):
+        """Verify the layer files of the tasks, each file once. With a
+        ledger the files that passed a previous verification and did not
+        change since are skipped. The results are added to the ledger.
+        Returns a dict with the error of each layer file, empty if ok."""
+        results = {}
+        pending = {}
+        for task in tasks:
+            layer_file = os.path.realpath(task[0])
+            if layer_file in results or layer_file in pending:
+                continue
+            entry = (ledger or {}).get(os.path.basename(layer_file))
+            if (entry and not entry[3] and
+                    entry[:3] == self._ledger_stat(layer_file)):
+                results[layer_file] = ""
+                continue
+            pending[layer_file] = task
+        entries = {}
+        layer_files = list(pending)
+        for (layer_file, error) in \
+                zip(layer_files, self._verify_layers(
+                    [pending[layer_file] for layer_file in layer_files])):
+            results[layer_file] = error
+            f_stat = self._ledger_stat(layer_file)
+            if f_stat and os.path.dirname(layer_file) == \
+                    os.path.realpath(self.layersdir):
+                entries[os.path.basename(layer_file)] = \
+                    f_stat + [error, int(time.time())]
+        if entries:
+            self._ledger_update(entries)
+        return results
+
+    def _verify_report(self, status, layer_ids, tasks, results):
+        """Print the results of the verification of the layer files of
+        an image tag, returns the status of the image tag"""
+        for (layer_id, task) in zip(layer_ids, tasks):
+            error = results[os.path.realpath(task[0])]
+            if error:
+                Msg().err("Error: %s:" % error, task[0])
                 status = False
                 continue
             Msg().out("Info: layer ok:", layer_id, l=Msg.INF)
         return status
+
+    def verify_image(self):
+        """Verify the structure of an image repository"""
+        (status, layer_ids, tasks) = self._verify_tag()
+        return self._verify_report(status, layer_ids, tasks,
+                                   self._verify_run(tasks))
+
+    def verify_all(self):
+        """Verify all the image tags in the repository, the layers shared
+        by several tags are verified once and the layers recorded in the
+        ledger as verified that did not change since are skipped.
+        Returns the list of (imagerepo, tag) that failed.
+        """
+        ledger = self._index_load(self.ledger_file, "layers") or {}
+        tags = []
+        all_tasks = []
+        for (imagerepo, tag) in sorted(self.get_imagerepos()):
+            if not self.cd_imagerepo(imagerepo, tag):
+                continue
+            Msg().out("Info: verifying: %s:%s" % (imagerepo, tag),
+                      l=Msg.INF)
+            (status, layer_ids, tasks) = self._verify_tag()
+            tags.append((imagerepo, tag, status, layer_ids, tasks))
+            all_tasks.extend(tasks)
+        results = self._verify_run(all_tasks, ledger)
+        failed = []
+        for (imagerepo, tag, status, layer_ids, tasks) in tags:
+            if not self._verify_report(status, layer_ids, tasks, results):
+                failed.append((imagerepo, tag))
+        return failed
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Pool of containers created in advance from an image"""
+
+import os
+import json
+import hashlib
+
+from udocker.msg import Msg
+from udocker.container.structure import ContainerStructure
+from udocker.engine.execmode import ExecutionMode
+from udocker.utils.fileutil import FileUtil
+from udocker.utils.filelock import FileLock
+
+
+class ContainerPool(object):
+    """Keeps a number of containers ready to be used by run <image>.
+    The pool of an image tag is a directory with one file per ready
+    container named after the container id, holding the digest of the
+    image the container was created from. A container is claimed by
+    removing its file, unlink is atomic therefore two concurrent runs
+    never get the same container. Containers of an image that is no
+    longer the one of the tag are discarded. The pool is replenished
+    by a detached process, concurrent refills are serialized with a
+    lock on the pool directory.
+    """
+
+    POOL_CONF = "pool.json"
+    POOL_LOCK = ".lock"
+
+    def __init__(self, localrepo, imagerepo="", tag=""):
+        self.localrepo = localrepo
+        self.imagerepo = imagerepo
+        self.tag = tag
+        self.pooldir = self.localrepo.topdir + "/pool"
+        self.pool_tagdir = self.pooldir + '/' + imagerepo + '/' + tag
+        FileUtil(self.pooldir).register_prefix()
+
+    def get_config(self):
+        """Get the pool configuration, returns dict or None"""
+        if not os.path.exists(self.pool_tagdir + '/' + self.POOL_CONF):
+            return None
+        return self.localrepo.load_json(
+            self.pool_tagdir + '/' + self.POOL_CONF)
+
+    def set_config(self, size, execmode=""):
+        """Create or change the pool of the image"""
+        if not (os.path.isdir(self.pool_tagdir) or
+                FileUtil(self.pool_tagdir).mkdir()):
+            Msg().err("Error: creating pool directory:", self.pool_tagdir)
+            return False
+        return self.localrepo.save_json(
+            self.pool_tagdir + '/' + self.POOL_CONF,
+            {"size": size, "execmode": execmode})
+
+    def ready(self):
+        """List the ids of the containers ready to be claimed"""
+        try:
+            return sorted([entry for entry in os.listdir(self.pool_tagdir)
+                           if entry not in (self.POOL_CONF, self.POOL_LOCK)])
+        except OSError:
+            return []
+
+    def image_digest(self):
+        """Digest of the metadata and layers the tag points to, changes
+        when the tag is pulled or loaded again, returns an empty string
+        when the image does not exist"""
+        if not self.localrepo.cd_imagerepo(self.imagerepo, self.tag):
+            return ""
+        (container_json, layer_files) = self.localrepo.get_image_attributes()
+        if not (container_json and layer_files):
+            return ""
+        chksum = hashlib.sha256()
+        chksum.update(json.dumps(container_json, sort_keys=True).encode())
+        for layer_file in layer_files:
+            chksum.update(os.path.realpath(layer_file).encode())
+        return "sha256:" + chksum.hexdigest()
+
+    def _is_current(self, container_id, digest):
+        """Check if a ready container was created from the image with
+        digest, containers of pools of older versions have no digest"""
+        entry_digest = FileUtil(self.pool_tagdir + '/' +
+                                container_id).getdata('r')
+        return bool(entry_digest) and entry_digest == digest
+
+    def _take(self, container_id, digest):
+        """Remove a container from the pool, returns True if it was
+        created from the image with digest, containers of other images
+        are deleted"""
+        is_current = self._is_current(container_id, digest)
+        try:
+            os.unlink(self.pool_tagdir + '/' + container_id)
+        except OSError:
+            return False               # claimed by another process
+        if is_current:
+            return True
+        Msg().out("Info: discarding container of old image:", container_id,
+                  l=Msg.VER)
+        self.localrepo.del_container(container_id)
+        return False
+
+    def claim(self):
+        """Take a ready container from the pool and replenish the pool
+        in background, returns the container id or an empty string
+        """
+        digest = self.image_digest()
+        for container_id in self.ready():
+            if not self._take(container_id, digest):
+                continue
+            if self.localrepo.cd_container(container_id):
+                Msg().out("Info: using container from pool:", container_id,
+                          l=Msg.INF)
+                self.refill_background()
+                return container_id
+        return ""
+
+    def _lock(self):
+        """Exclusive non blocking lock on the pool, returns the FileLock
+        held or None"""
+        pool_lock = FileLock(self.pool_tagdir + '/' + self.POOL_LOCK,
+                             blocking=False)
+        if pool_lock.acquire():
+            return pool_lock
+        return None
+
+    def refill(self):
+        """Create containers until the pool reaches its size"""
+        pool_conf = self.get_config()
+        if not pool_conf:
+            return False
+        pool_lock = self._lock()
+        if pool_lock is None:
+            return True                # being refilled by another process
+        status = True
+        try:
+            digest = self.invalidate()
+            while len(self.ready()) < int(pool_conf["size"]):
+                container_id = ContainerStructure(
+                    self.localrepo).create_fromimage(self.imagerepo, self.tag)
+                if not container_id:
+                    status = False
+                    break
+                if (pool_conf["execmode"] and
+                        not ExecutionMode(self.localrepo, container_id)
+                        .set_mode(pool_conf["execmode"])):
+                    self.localrepo.del_container(container_id)
+                    status = False
+                    break
+                FileUtil(self.pool_tagdir + '/' + container_id).putdata(
+                    digest, 'w')
+        finally:
+            pool_lock.release()
+        return status
+
+    def refill_background(self):
+        """Refill the pool in a detached process"""
+        if not self.get_config():
+            return False
+        try:
+            cpid = os.fork()
+        except OSError:
+            return False
+        if cpid:
+            os.waitpid(cpid, 0)
+            return True
+        try:
+            os.setsid()
+            if not os.fork():
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for std_fd in (0, 1, 2):
+                    os.dup2(devnull, std_fd)
+                self.refill()
+        finally:
+            os._exit(0)             # pylint: disable=protected-access
+
+    def invalidate(self):
+        """Delete the ready containers that were not created from the
+        image the tag points to now, returns the current digest"""
+        digest = self.image_digest()
+        for container_id in self.ready():
+            if not self._is_current(container_id, digest):
+                self._take(container_id, digest)
+        return digest
+
+    def trim(self, size):
+        """Delete ready containers above size"""
+        for container_id in self.ready()[size:]:
+            try:
+                os.unlink(self.pool_tagdir + '/' + container_id)
+            except OSError:
+                continue
+            self.localrepo.del_container(container_id)
+        return True
+
+    def remove(self):
+        """Delete the pool and its ready containers"""
+        self.trim(0)
+        if not FileUtil(self.pool_tagdir).remove(recursive=True):
+            return False
+        imagerepo = self.imagerepo
+        while imagerepo:
+            FileUtil(self.pooldir + '/' + imagerepo).rmdir()
+            imagerepo = "/".join(imagerepo.split("/")[:-1])
+        return True
+
+    def get_pools(self):
+        """List the pools as (imagerepo, tag, size, ready)"""
+        pools = []
+        for (dirpath, dummy, filenames) in os.walk(self.pooldir):
+            if self.POOL_CONF not in filenames:
+                continue
+            (imagerepo, tag) = os.path.split(
+                os.path.relpath(dirpath, self.pooldir))
+            pool = ContainerPool(self.localrepo, imagerepo, tag)
+            pool_conf = pool.get_config() or {}
+            pools.append((imagerepo, tag, pool_conf.get("size", 0),
+                          len(pool.ready())))
+        return sorted(pools)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Remove the objects of the local repository that are no longer used"""
+
+import os
+import re
+import stat
+import time
+import errno
+
+from udocker.config import Config
+from udocker.container.layerindex import LayerIndex
+from udocker.utils.diskusage import DiskUsage
+from udocker.utils.filelock import FileLock
+from udocker.utils.fileutil import FileUtil
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    pass
+
+
+class RepositoryPrune(object):
+    """Garbage collection of the local repository. The references are
+    collected once, image tags to layers and names to containers, the
+    objects that are not reachable are then removed in parallel:
+    layers not used by any image and their lock files, lock files of
+    image tags that no longer exist, containers left
+    by an interrupted clone, names of containers that no longer exist,
+    temporary files of udocker processes that are no longer running and
+    trees left in the trash by interrupted deletions.
+    Objects changed less than GRACE seconds ago may belong to an
+    operation still running such as a pull and are kept, also in other
+    hosts sharing the repository.
+    """
+
+    GRACE = 3600
+    TMP_PID = re.compile(r"^udocker-(\d+)-")      # FileUtil().mktmp()
+    TMP_SUFFIX = re.compile(r"\.tmp(\d*)$")        # downloads and indexes
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+        self.threads = Config.conf['diskusage_threads']
+        self._now = time.time()
+
+    def _running(self, pid):
+        """Check if a process exists"""
+        try:
+            os.kill(pid, 0)
+        except OSError as error:
+            return error.errno == errno.EPERM
+        return True
+
+    def _recent(self, f_stat):
+        """Modified within the grace period, the change time is also
+        checked since a rename such as a move to the trash keeps the
+        modification time"""
+        return self._now - max(f_stat.st_mtime,
+                                f_stat.st_ctime) < self.GRACE
+
+    def _is_stale_tmp(self, fname, f_stat):
+        """Temporary file older than the grace period. The repository
+        may be shared by several hosts and the process id in the name
+        may belong to another host, it is only used to keep the files
+        of processes running in this host"""
+        match = self.TMP_PID.match(fname) or self.TMP_SUFFIX.search(fname)
+        if not match or self._recent(f_stat):
+            return False
+        return not (match.group(1) and self._running(int(match.group(1))))
+
+    def _listdir(self, directory):
+        """List a directory as (name, lstat) pairs"""
+        entries = []
+        try:
+            fnames = os.listdir(directory)
+        except OSError:
+            return entries
+        for fname in fnames:
+            try:
+                entries.append((fname, os.lstat(directory + '/' + fname)))
+            except OSError:
+                continue
+        return entries
+
+    def _mark_layers(self):
+        """Layer files not used by any image and temporary files in the
+        layers directory"""
+        objects = []
+        unreferenced = \
+            set(self.localrepo.get_unreferenced_layers(rescan=True))
+        layers_entries = dict(self._listdir(self.localrepo.layersdir))
+        for (fname, f_stat) in layers_entries.items():
+            f_path = self.localrepo.layersdir + '/' + fname
+            if self._is_stale_tmp(fname, f_stat):
+                objects.append(["temp", f_path])
+            elif fname.endswith(LayerIndex.SUFFIX):
+                if fname[:-len(LayerIndex.SUFFIX)] not in layers_entries:
+                    objects.append(["index", f_path])
+            elif fname.endswith(FileLock.SUFFIX):
+                if (fname[:-len(FileLock.SUFFIX)] not in layers_entries and
+                        not self._recent(f_stat)):
+                    objects.append(["lock", f_path])
+            elif f_path in unreferenced and not self._recent(f_stat):
+                objects.append(["layer", f_path])
+        for (fname, f_stat) in self._listdir(self.localrepo.reposdir):
+            if self._is_stale_tmp(fname, f_stat):
+                objects.append(["temp", self.localrepo.reposdir + '/' + fname])
+        return objects
+
+    def _mark_tag_locks(self):
+        """Lock files of image tags that were deleted, they are kept by
+        rmi since other processes may be waiting on them"""
+        objects = []
+        reposdir = self.localrepo.reposdir
+        for (dir_path, dirs, files) in os.walk(reposdir):
+            dirs[:] = [dname for dname in dirs
+                       if not os.path.isfile(dir_path + '/' + dname + "/TAG")]
+            for fname in files:
+                f_path = dir_path + '/' + fname
+                if (not fname.endswith(FileLock.SUFFIX) or
+                        fname == FileLock.SUFFIX or
+                        os.path.isdir(f_path[:-len(FileLock.SUFFIX)])):
+                    continue
+                try:
+                    if self._recent(os.lstat(f_path)):
+                        continue
+                except OSError:
+                    continue
+                objects.append(["lock", f_path])
+        return objects
+
+    def _mark_containers(self):
+        """Containers left by interrupted clones and names of containers
+        that do not exist"""
+        objects = []
+        containersdir = self.localrepo.containersdir
+        for (fname, f_stat) in self._listdir(containersdir):
+            f_path = containersdir + '/' + fname
+            if stat.S_ISLNK(f_stat.st_mode):
+                if not os.path.isdir(f_path):
+                    objects.append(["name", f_path])
+            elif (stat.S_ISDIR(f_stat.st_mode) and
+                  not self._recent(f_stat) and
+                  FileUtil(f_path + "/imagerepo.name").getdata('r') ==
+                  "CLONING:inprogress"):
+                objects.append(["container", f_path])
+                for name in self.localrepo.get_container_name(fname):
+                    objects.append(["name", containersdir + '/' + name])
+        return objects
+
+    def _tree_recent(self, d_path):
+        """Anything in a directory tree changed within the grace period,
+        the time of the directory does not change when files are written
+        in its subdirectories"""
+        for (dir_path, dirs, files) in os.walk(d_path):
+            for fname in dirs + files:
+                try:
+                    if self._recent(os.lstat(dir_path + '/' + fname)):
+                        return True
+                except OSError:
+                    continue
+        return False
+
+    def _mark_tmpdir(self):
+        """Temporary files and directories of udocker processes in the
+        udocker temporary directory and in the repository, directories
+        such as the spill directories of load and import are kept while
+        any of their content is recent"""
+        objects = []
+        for tmpdir in (Config.conf['tmpdir'], self.localrepo.tmpdir):
+            for (fname, f_stat) in self._listdir(tmpdir):
+                f_path = tmpdir + '/' + fname
+                if not (self.TMP_PID.match(fname) and
+                        f_stat.st_uid == os.getuid() and
+                        self._is_stale_tmp(fname, f_stat)):
+                    continue
+                if stat.S_ISDIR(f_stat.st_mode) and self._tree_recent(f_path):
+                    continue
+                objects.append(["temp", f_path])
+        return objects
+
+    def _mark_trash(self):
+        """Trees in the trash of udocker processes no longer running"""
+        trashdir = self.localrepo.trashdir
+        return [["trash", trashdir + '/' + fname]
+                for (fname, f_stat) in self._listdir(trashdir)
+                if self._is_stale_tmp(fname, f_stat)]
+
+    def _size(self, obj):
+        """Add the bytes used by an object"""
+        f_path = obj[1]
+        try:
+            f_stat = os.lstat(f_path)
+        except OSError:
+            return obj + [0]
+        if stat.S_ISDIR(f_stat.st_mode):
+            return obj + [max(DiskUsage().size(f_path), 0)]
+        return obj + [f_stat.st_blocks * 512]
+
+    def _remove(self, obj):
+        """Delete a temporary file, container, name, lock or trash tree,
+        the trash is outside of the directories where remove() is
+        allowed. The image repository directories left empty by the
+        removal of a tag lock are also removed"""
+        if not FileUtil(obj[1]).remove(force=obj[0] == "trash",
+                                       recursive=True):
+            return False
+        reposdir = self.localrepo.reposdir
+        if obj[0] == "lock" and obj[1].startswith(reposdir + '/'):
+            dirname = os.path.dirname(obj[1])
+            while dirname != reposdir and FileUtil(dirname).rmdir():
+                dirname = os.path.dirname(dirname)
+        return True
+
+    def _map(self, function, args):
+        """Apply function to the args in a pool of threads"""
+        if self.threads > 1 and len(args) > 1:
+            try:
+                with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                    return list(executor.map(function, args))
+            except NameError:
+                pass
+        return [function(arg) for arg in args]
+
+    def mark(self):
+        """Find the objects to be removed, returns a sorted list of
+        [kind, pathname, bytes]"""
+        objects = (self._mark_layers() + self._mark_tag_locks() +
+                   self._mark_containers() + self._mark_tmpdir() +
+                   self._mark_trash())
+        return sorted(self._map(self._size, objects))
+
+    def sweep(self, objects):
+        """Remove the objects, layers are checked again against the
+        images while holding the repository lock. Returns the list of
+        objects removed."""
+        layers = [obj for obj in objects if obj[0] in ("layer", "index")]
+        others = [obj for obj in objects if obj not in layers]
+        removed = []
+        if layers:
+            deleted = self.localrepo.del_unreferenced_layers(
+                [obj[1] for obj in layers])
+            removed.extend([obj for obj in layers if obj[1] in deleted])
+        for (obj, status) in zip(others, self._map(self._remove, others)):
+            if status:
+                removed.append(obj)
+        return sorted(removed)
@@ -2,6 +2,8 @@
 """Tools to manage the container structure"""
 
 import os
+import sys
+import stat
 import subprocess
 
 from udocker.config import Config
@@ -9,7 +11,9 @@ from udocker.msg import Msg
 from udocker.helper.unique import Unique
 from udocker.helper.hostinfo import HostInfo
 from udocker.utils.fileutil import FileUtil
+from udocker.utils.compress import Compression
 from udocker.utils.uprocess import Uprocess
+from udocker.container.commit import RootfsManifest
 
 
 class ContainerStructure(object):
@@ -19,6 +23,8 @@ class ContainerStructure(object):
     Access to container metadata.
     """
 
+    BUFSIZE = 1024 * 1024
+
     def __init__(self, localrepo, container_id=None):
         self.localrepo = localrepo
         self.container_id = container_id
@@ -173,11 +179,16 @@ class ContainerStructure(object):
         elif not self._chk_container_root():
             Msg().out("Warning: check container content:", self.container_id,
                       l=Msg.WAR)
+        if status and Config.conf['rootfs_manifest']:
+            RootfsManifest(container_dir).save()
 
         return self.container_id
 
-    def create_fromlayer(self, imagerepo, tag, layer_file, container_json):
+    def create_fromlayer(self, imagerepo, tag, layer_file, container_json,
+                         chksum=None):
         """Create a container from a layer file exported by Docker.
+        A hash object from hashlib passed in chksum is updated with the
+        layer while extracted and its digest added to the metadata.
         """
         self.imagerepo = imagerepo
         self.tag = tag
@@ -195,8 +206,13 @@ class ContainerStructure(object):
             return False
 
         fjson = container_dir + "/container.json"
+        status = self._untar_layers([layer_file, ], container_dir + "/ROOT",
+                                    chksum)
+        if status and chksum is not None:
+            container_json["rootfs"] = {
+                "type": "layers",
+                "diff_ids": [chksum.name + ':' + chksum.hexdigest(), ]}
         self.localrepo.save_json(fjson, container_json)
-        status = self._untar_layers([layer_file, ], container_dir + "/ROOT")
         if not status:
             Msg().err("Error: creating container:", self.container_id)
         elif not self._chk_container_root():
@@ -227,6 +243,21 @@ class ContainerStructure(object):
 
         return self.container_id
 
+    def _unlink_replaced(self, layer_index, destdir):
+        """Unlink the files with hard links that will be replaced by
+        files in the layer, tar --overwrite truncates existing files in
+        place which would also change the content of the other links.
+        """
+        for (f_path, entry) in layer_index.toc["entries"].items():
+            if entry[0] != 'f':
+                continue
+            try:
+                f_stat = os.lstat(destdir + f_path)
+                if stat.S_ISREG(f_stat.st_mode) and f_stat.st_nlink > 1:
+                    os.unlink(destdir + f_path)
+            except OSError:
+                continue
+
     def _apply_whiteouts(self, tarf, destdir):
         """The layered filesystem of docker uses whiteout files
         to identify files or directories to be removed.
@@ -236,14 +267,20 @@ class ContainerStructure(object):
         if Msg.level >= Msg.VER:
             verbose = 'v'
             Msg().out("Info: applying whiteouts:", tarf, l=Msg.INF)
-        wildcards = ["--wildcards", ]
-        if not HostInfo().cmd_has_option("tar", wildcards[0]):
-            wildcards = []
-        cmd = ["tar", "t" + verbose] + wildcards + ["-f", tarf, r"*/.wh.*"]
-        whiteouts = Uprocess().get_output(cmd, True)
-        if not whiteouts:
-            return
-        for wh_filename in whiteouts.split('\n'):
+        layer_index = self.localrepo.index_layer(tarf)
+        if layer_index:
+            self._unlink_replaced(layer_index, destdir)
+            whiteouts_list = layer_index.whiteouts()
+        else:
+            wildcards = ["--wildcards", ]
+            if not HostInfo().cmd_has_option("tar", wildcards[0]):
+                wildcards = []
+            cmd = ["tar", "t" + verbose] + wildcards + ["-f", tarf, r"*/.wh.*"]
+            whiteouts = Uprocess().get_output(cmd, True)
+            if not whiteouts:
+                return
+            whiteouts_list = whiteouts.split('\n')
+        for wh_filename in whiteouts_list:
             if wh_filename:
                 wh_basename = os.path.basename(wh_filename.strip())
                 wh_dirname = os.path.dirname(wh_filename)
@@ -261,10 +298,51 @@ class ContainerStructure(object):
                     FileUtil(rm_filename).remove(recursive=True)
         return
 
-    def _untar_layers(self, tarfiles, destdir):
+    def _untar_feed(self, cmd, tarf, chksum):
+        """Run tar reading the archive from a pipe fed with the content
+        of tarf or of stdin if "-", the content is read once updating
+        chksum. Returns the exit status of tar, 1 if tarf is unreadable.
+        """
+        try:
+            if tarf == '-':
+                fileobj = getattr(sys.stdin, "buffer", sys.stdin)
+            else:
+                fileobj = open(tarf, "rb")
+            buf = fileobj.read(self.BUFSIZE)
+        except (IOError, OSError):
+            Msg().err("Error: reading:", tarf)
+            return 1
+        cmd = cmd + Compression(Compression.detect(buf[:4])).tar_option(
+            stream=True) + ["-f", "-"]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stderr=Msg.chlderr, close_fds=True)
+        pipe = proc.stdin
+        status = 0
+        try:
+            while buf:
+                chksum.update(buf)
+                if pipe:
+                    try:
+                        pipe.write(buf)
+                    except (IOError, OSError):    # tar exited, hash the rest
+                        pipe = None
+                buf = fileobj.read(self.BUFSIZE)
+        except (IOError, OSError):
+            Msg().err("Error: reading:", tarf)
+            status = 1
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        if tarf != '-':
+            fileobj.close()
+        return proc.wait() or status
+
+    def _untar_layers(self, tarfiles, destdir, chksum=None):
         """Untar all container layers. Each layer is extracted
         and permissions are changed to avoid file permission
-        issues when extracting the next layer.
+        issues when extracting the next layer. With chksum the
+        layers are fed to tar through a pipe updating the hash.
         """
         if not (tarfiles and destdir):
             return False
@@ -275,8 +353,11 @@ class ContainerStructure(object):
             if not HostInfo().cmd_has_option("tar", option):
                 optional_flags.remove(option)
         for tarf in tarfiles:
-            if tarf != '-':
+            compress_flags = []
+            if tarf != '-' and chksum is None:
                 self._apply_whiteouts(tarf, destdir)
+                compress_flags = Compression(
+                    Compression.detect_file(tarf)).tar_option()
             verbose = ''
             if Msg.level >= Msg.VER:
                 verbose = 'v'
@@ -285,8 +366,15 @@ class ContainerStructure(object):
                    "--one-file-system", "--no-same-owner", "--overwrite",
                    "--exclude=dev/*", "--exclude=etc/udev/devices/*",
                    "--no-same-permissions", r"--exclude=.wh.*",
-                   ] + optional_flags + ["-f", tarf]
-            if subprocess.call(cmd, stderr=Msg.chlderr, close_fds=True):
+                   ] + optional_flags
+            if chksum is not None:
+                status_tar = self._untar_feed(cmd, tarf, chksum)
+            else:
+                status_tar = subprocess.call(cmd + compress_flags +
+                                             ["-f", tarf],
+                                             stderr=Msg.chlderr,
+                                             close_fds=True)
+            if status_tar:
                 Msg().err("Error: while extracting image layer")
                 status = False
             cmd = ["find", destdir,
@@ -303,9 +391,39 @@ class ContainerStructure(object):
             if subprocess.call(cmd, stderr=Msg.chlderr, close_fds=True):
                 status = False
                 Msg().err("Error: while modifying attributes of image layer")
+        if status and Config.conf['sparse_minsize']:
+            (sparse_saved, links_saved) = FileUtil(destdir).sparsifydir(
+                Config.conf['sparse_minsize'])
+            Msg().out("Info: saved %d bytes in sparse files and %d bytes "
+                      "in hard links" % (sparse_saved, links_saved),
+                      l=Msg.INF)
+        return status
+
+    def _tar_tofile(self, source_dir, tar_file, compress=""):
+        """Create a tar file of source_dir, compressed with gzip or zstd
+        if compress is set"""
+        if not compress:
+            return FileUtil(source_dir).tar(tar_file)
+        try:
+            if tar_file == '-':
+                out_fd = sys.stdout.fileno()
+            else:
+                out_fd = os.open(tar_file,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except (IOError, OSError):
+            Msg().err("Error: creating tar file:", tar_file)
+            return False
+        compression = Compression(compress)
+        in_fd = compression.compress_to(out_fd)
+        status = in_fd is not None and \
+            FileUtil(source_dir).tar('-', stdout=in_fd)
+        if in_fd is not None and not compression.close():
+            status = False
+        if tar_file != '-':
+            os.close(out_fd)
         return status
 
-    def export_tofile(self, clone_file):
+    def export_tofile(self, clone_file, compress=""):
         """Export a container creating a tar file of the rootfs
         """
         cont_dir = self.localrepo.cd_container(self.container_id)
@@ -313,14 +431,14 @@ class ContainerStructure(object):
             Msg().err("Error: container not found:", self.container_id)
             return False
 
-        status = FileUtil(cont_dir + "/ROOT").tar(clone_file)
+        status = self._tar_tofile(cont_dir + "/ROOT", clone_file, compress)
         if not status:
             Msg().err("Error: exporting container file system:",
                       self.container_id)
 
         return self.container_id
 
-    def clone_tofile(self, clone_file):
+    def clone_tofile(self, clone_file, compress=""):
         """Create a cloned container tar file containing both the rootfs
         and all udocker control files. This is udocker specific.
         """
@@ -329,14 +447,16 @@ class ContainerStructure(object):
             Msg().err("Error: container not found:", self.container_id)
             return False
 
-        status = FileUtil(container_dir).tar(clone_file)
+        status = self._tar_tofile(container_dir, clone_file, compress)
         if not status:
             Msg().err("Error: export container as clone:", self.container_id)
 
         return self.container_id
 
-    def clone(self):
-        """Clone a container by creating a complete copy
+    def clone(self, hardlink=False):
+        """Clone a container by creating a complete copy, the files
+        data is shared with the source container through reflinks when
+        supported by the filesystem, or through hard links if requested.
         """
         source_container_dir = self.localrepo.cd_container(self.container_id)
         if not source_container_dir:
@@ -350,7 +470,19 @@ class ContainerStructure(object):
             Msg().err("Error: create destination container: setting up")
             return False
 
-        status = FileUtil(source_container_dir).copydir(dest_container_dir)
+        futil = FileUtil(source_container_dir)
+        status = futil.clonedir(dest_container_dir, hardlink=hardlink)
+        if status and hardlink:
+            for f_name in os.listdir(dest_container_dir):
+                FileUtil(dest_container_dir + '/' + f_name).breaklink()
+            self.localrepo.hardlink_container(self.container_id)
+            self.localrepo.hardlink_container(dest_container_id)
+        elif status is None:
+            if hardlink:
+                Msg().out("Warning: hard links not supported, copying files",
+                          l=Msg.WAR)
+            status = futil.copydir(dest_container_dir)
+
         if not status:
             Msg().err("Error: creating container:", dest_container_id)
             return False
@@ -6,12 +6,14 @@ import sys
 import re
 import base64
 import json
+import hashlib
 
 from udocker.config import Config
 from udocker.msg import Msg
 from udocker.commonlocalfile import CommonLocalFileApi
 from udocker.helper.unique import Unique
 from udocker.utils.fileutil import FileUtil
+from udocker.utils.tarstream import TarStream
 from udocker.utils.curl import GetURL
 from udocker.utils.chksum import ChkSUM
 from udocker.helper.hostinfo import HostInfo
@@ -250,9 +252,10 @@ class DockerIoAPI(object):
         url = endpoint + "/v1/images/" + layer_id + "/json"
         Msg().out("Debug: json url", url, l=Msg.DBG)
         filename = self.localrepo.layersdir + '/' + layer_id + ".json"
-        if self._get_file(url, filename, 0):
-            self.localrepo.add_image_layer(filename)
-            return True
+        with self.localrepo.layer_lock(filename):
+            if self._get_file(url, filename, 0):
+                self.localrepo.add_image_layer(filename)
+                return True
         return False
 
     def get_v1_image_layer(self, endpoint, layer_id):
@@ -260,9 +263,11 @@ class DockerIoAPI(object):
         url = endpoint + "/v1/images/" + layer_id + "/layer"
         Msg().out("Debug: layer url", url, l=Msg.DBG)
         filename = self.localrepo.layersdir + '/' + layer_id + ".layer"
-        if self._get_file(url, filename, 3):
-            self.localrepo.add_image_layer(filename)
-            return True
+        with self.localrepo.layer_lock(filename):
+            if self._get_file(url, filename, 3):
+                self.localrepo.add_image_layer(filename)
+                self.localrepo.index_layer(filename)
+                return True
         return False
 
     def get_v1_layers_all(self, endpoint, layer_list):
@@ -444,9 +449,11 @@ class DockerIoAPI(object):
             "/blobs/" + layer_id
         Msg().out("Debug: layer url", url, l=Msg.DBG)
         filename = self.localrepo.layersdir + '/' + layer_id
-        if self._get_file(url, filename, 3):
-            self.localrepo.add_image_layer(filename)
-            return True
+        with self.localrepo.layer_lock(filename):
+            if self._get_file(url, filename, 3):
+                self.localrepo.add_image_layer(filename)
+                self.localrepo.index_layer(filename)
+                return True
         return False
 
     def get_v2_layers_all(self, imagerepo, fslayers):
@@ -595,19 +602,23 @@ class DockerIoAPI(object):
         """Pull a docker image from a v2 registry or v1 index"""
         Msg().out("Debug: get imagerepo: %s tag: %s" % (imagerepo, tag), l=Msg.DBG)
         (imagerepo, remoterepo) = self._parse_imagerepo(imagerepo)
-        if self.localrepo.cd_imagerepo(imagerepo, tag):
-            new_repo = False
-        else:
-            self.localrepo.setup_imagerepo(imagerepo)
-            new_repo = True
-        if self.is_v2():
-            if not platform:
-                platform = HostInfo().platform()
-            files = self.get_v2(remoterepo, tag, platform)  # try v2
-        else:
-            files = self.get_v1(remoterepo, tag)  # try v1
-        if new_repo and not files:
-            self.localrepo.del_imagerepo(imagerepo, tag, False)
+        if self.localrepo.setup_imagerepo(imagerepo) is None:
+            Msg().err("Error: creating image repository:", imagerepo)
+            return []
+        with self.localrepo.tag_lock(imagerepo, tag):  # concurrent pulls
+            if self.localrepo.cd_imagerepo(imagerepo, tag):
+                new_repo = False
+            else:
+                self.localrepo.setup_imagerepo(imagerepo)
+                new_repo = True
+            if self.is_v2():
+                if not platform:
+                    platform = HostInfo().platform()
+                files = self.get_v2(remoterepo, tag, platform)  # try v2
+            else:
+                files = self.get_v1(remoterepo, tag)  # try v1
+            if new_repo and not files:
+                self.localrepo.del_imagerepo(imagerepo, tag, False)
         return files
 
     def get_manifest(self, imagerepo, tag, platform=""):
@@ -804,10 +815,14 @@ class DockerLocalFileAPI(CommonLocalFileApi):
         layers = self._sorted_layers(structure, top_layer_id)
         for layer_id in layers:
             Msg().out("Info: adding layer:", layer_id, l=Msg.INF)
-            if str(structure["repolayers"][layer_id]["VERSION"]) != "1.0":
+            if str(structure["repolayers"][layer_id].get("VERSION")) != "1.0":
                 Msg().err("Error: layer version unknown")
                 return []
             for layer_item in ("json_f", "layer_f"):
+                if layer_item not in structure["repolayers"][layer_id]:
+                    Msg().err("Error: missing %s file in layer %s" %
+                              (layer_item[:-2], layer_id))
+                    return []
                 filename = str(structure["repolayers"][layer_id][layer_item])
                 if not self._move_layer_to_v1repo(filename, layer_id):
                     Msg().err("Error: copying %s file %s" % (layer_item[:-2], filename), l=Msg.VER)
@@ -850,16 +865,17 @@ class DockerLocalFileAPI(CommonLocalFileApi):
             repositories = self._load_image(structure, imagerepo, tag)
         return repositories
 
-    def _save_image(self, imagerepo, tag, structure, tmp_imagedir):
-        """Prepare structure with metadata for the image"""
+    def _save_image(self, imagerepo, tag, structure, tarstream):
+        """Write the layers and metadata of an image to the archive"""
         self.localrepo.cd_imagerepo(imagerepo, tag)
         (container_json, layer_files) = self.localrepo.get_image_attributes()
-        json_file = tmp_imagedir + "/container.json"
-        if (not container_json) or \
-           (not self.localrepo.save_json(json_file, container_json)):
+        if not container_json:
             return False
-        config_layer_file = str(ChkSUM().sha256(json_file)) + ".json"
-        FileUtil(json_file).rename(tmp_imagedir + '/' + config_layer_file)
+        config_data = json.dumps(container_json).encode("utf-8")
+        config_layer_file = hashlib.sha256(config_data).hexdigest() + ".json"
+        if config_layer_file not in structure["saved"]:
+            tarstream.add_data(config_layer_file, config_data)
+            structure["saved"].add(config_layer_file)
         manifest_item = {}
         manifest_item["Config"] = config_layer_file
         manifest_item["RepoTags"] = [imagerepo + ':' + tag, ]
@@ -873,54 +889,61 @@ class DockerLocalFileAPI(CommonLocalFileApi):
                                      os.path.basename(layer_f)).group(1)
             except AttributeError:
                 return False
-            if os.path.exists(tmp_imagedir + "/" + layer_id):
-                continue
-            FileUtil(tmp_imagedir + "/" + layer_id).mkdir()
-            if not FileUtil(layer_f).copyto(tmp_imagedir + "/"
-                                            + layer_id + "/layer.tar"):
-                return False
             manifest_item["Layers"].append(layer_id + "/layer.tar")
-            json_string = self.create_container_meta(layer_id)
+            if not parent_layer_id:
+                structure["repositories"][imagerepo][tag] = layer_id
+            if layer_id in structure["saved"]:
+                parent_layer_id = layer_id
+                continue
+            tarstream.add_dir(layer_id)
+            layer_chksum = None
+            if layer_f.endswith(".layer"):
+                layer_chksum = hashlib.sha256()
+            tarstream.add_file(layer_id + "/layer.tar",
+                               os.path.realpath(layer_f), layer_chksum)
+            if layer_chksum:
+                layer_chksum = layer_chksum.hexdigest()
+            json_string = self.create_container_meta(
+                layer_id, layer_chksum=layer_chksum)
             if parent_layer_id:
                 json_string["parent"] = parent_layer_id
-            else:
-                structure["repositories"][imagerepo][tag] = layer_id
             parent_layer_id = layer_id
-            if not self.localrepo.save_json(tmp_imagedir + "/"
-                                            + layer_id + "/json", json_string):
-                return False
-            if not FileUtil(tmp_imagedir + "/" +
-                            layer_id + "/VERSION").putdata("1.0", 'w'):
-                return False
+            tarstream.add_data(layer_id + "/json", json.dumps(json_string))
+            tarstream.add_data(layer_id + "/VERSION", "1.0")
+            structure["saved"].add(layer_id)
         structure["manifest"].append(manifest_item)
         return True
 
-    def save(self, imagetag_list, imagefile):
-        """Save a set of image tags to a file similarly to docker save
-        """
-        tmp_imagedir = FileUtil("save").mktmp()
-        try:
-            os.makedirs(tmp_imagedir)
-        except (IOError, OSError):
+    def save(self, imagetag_list, imagefile, compress=""):
+        """Save a set of image tags to a file similarly to docker save,
+        the archive is streamed to the file or to stdout and compressed
+        with gzip or zstd if compress is set"""
+        if not imagetag_list:
+            Msg().err("Error: no images specified")
             return False
         structure = {}
         structure["manifest"] = []
         structure["repositories"] = {}
-        status = False
-        for (imagerepo, tag) in imagetag_list:
-            status = self._save_image(imagerepo, tag, structure, tmp_imagedir)
-            if not status:
-                Msg().err("Error: save image failed:", imagerepo + ':' + tag)
-                break
-        if status:
-            self.localrepo.save_json(tmp_imagedir + "/manifest.json",
-                                     structure["manifest"])
-            self.localrepo.save_json(tmp_imagedir + "/repositories",
-                                     structure["repositories"])
-            if not FileUtil(tmp_imagedir).tar(imagefile):
-                Msg().err("Error: save image failed in writing tar", imagefile)
-                status = False
-        else:
-            Msg().err("Error: no images specified")
-        FileUtil(tmp_imagedir).remove(recursive=True)
-        return status
+        structure["saved"] = set()
+        tarstream = TarStream(imagefile, compress)
+        if not tarstream.open():
+            Msg().err("Error: cannot create image file:", imagefile)
+            return False
+        try:
+            for (imagerepo, tag) in imagetag_list:
+                if not self._save_image(imagerepo, tag, structure, tarstream):
+                    Msg().err("Error: save image failed:",
+                              imagerepo + ':' + tag)
+                    tarstream.abort()
+                    return False
+            tarstream.add_data("manifest.json",
+                               json.dumps(structure["manifest"]))
+            tarstream.add_data("repositories",
+                               json.dumps(structure["repositories"]))
+            tarstream.close()
+        except (IOError, OSError) as error:
+            Msg().err("Error: save image failed in writing tar", imagefile,
+                      str(error))
+            tarstream.abort()
+            return False
+        return True
@@ -57,6 +57,13 @@ class ExecutionMode(object):
         return xmode
 
     def set_mode(self, xmode, force=False):
+        """Set execution mode, the container is locked while its files
+        are converted, concurrent invocations wait and find the new mode
+        """
+        with self.localrepo.container_lock(self.container_id):
+            return self._set_mode(xmode, force)
+
+    def _set_mode(self, xmode, force=False):
         """Set execution mode"""
         status = False
         prev_xmode = self.get_mode()
@@ -110,6 +117,8 @@ class ExecutionMode(object):
         if status or force:
             futil = FileUtil(self.container_execmode)
             status = futil.putdata(xmode, "w")
+            self.localrepo.set_container_attrs(self.container_id,
+                                               execmode=xmode)
 
         if status or force:
             futil = FileUtil(self.container_orig_root)
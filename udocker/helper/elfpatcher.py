@@ -23,6 +23,7 @@ class ElfPatcher(object):
     ABORT_ON_ERROR = 8
     ONE_SUCCESS = 16
     ONE_OUTPUT = 32
+    BREAK_LINKS = 64
 
     def __init__(self, localrepo, container_id):
         self.localrepo = localrepo
@@ -38,6 +39,7 @@ class ElfPatcher(object):
         self._container_patch_path = self._container_dir + "/patch.path"
         self._shlib = re.compile(r"^lib\S+\.so(\.\d+)*$")
         self._uid = HostInfo.uid
+        self._hardlinks = self.localrepo.ishardlinked_container(container_id)
 
     def select_patchelf(self):
         """Set patchelf executable"""
@@ -94,6 +96,8 @@ class ElfPatcher(object):
 
                     if ((action & self.BIN and os.access(f_path, os.X_OK)) or
                             (action & self.LIB and self._shlib.match(f_name))):
+                        if action & self.BREAK_LINKS:
+                            FileUtil(f_path).breaklink()
                         out = Uprocess().get_output(self._replace(cmd, f_path))
                         if out:
                             status = out
@@ -112,6 +116,14 @@ class ElfPatcher(object):
 
         return status
 
+    def _modify_action(self):
+        """Action for _walk_fs() when patching executables and libraries,
+        files shared through hard links must be copied before patching
+        """
+        if self._hardlinks:
+            return self.BIN | self.LIB | self.BREAK_LINKS
+        return self.BIN | self.LIB
+
     def guess_elf_loader(self):
         """Search for executables and try to read the ld.so pathname"""
         patchelf_exec = self.select_patchelf()
@@ -170,7 +182,7 @@ class ElfPatcher(object):
         patchelf_exec = self.select_patchelf()
         elf_loader = self.get_container_loader()
         cmd = [patchelf_exec, "--set-root-prefix", self._container_root, "#f"]
-        self._walk_fs(cmd, self._container_root, self.BIN | self.LIB)
+        self._walk_fs(cmd, self._container_root, self._modify_action())
         newly_set = self.guess_elf_loader()
         if newly_set == elf_loader:
             try:
@@ -194,7 +206,7 @@ class ElfPatcher(object):
         else:
             cmd = [patchelf_exec, "--restore-root-prefix",
                    self._container_root, "#f"]
-        self._walk_fs(cmd, self._container_root, self.BIN | self.LIB)
+        self._walk_fs(cmd, self._container_root, self._modify_action())
         newly_set = self.guess_elf_loader()
         if newly_set == elf_loader:
             FileUtil(self._container_patch_path).remove()
@@ -227,6 +239,8 @@ class ElfPatcher(object):
         ld_library_path_new = "\x00LD_LIBRARY_REAL\x00".encode()
         ld_data = ld_data.replace(ld_library_path_orig, ld_library_path_new)
         if output_elf is None:
+            if self._hardlinks:
+                FileUtil(elf_loader).breaklink()
             return bool(FileUtil(elf_loader).putdata(ld_data, 'wb'))
 
         return bool(FileUtil(output_elf).putdata(ld_data, 'wb'))
@@ -239,6 +253,9 @@ class ElfPatcher(object):
             Msg().err("Error: original loader not found or empty")
             return False
 
+        if self._hardlinks:
+            FileUtil(elf_loader).breaklink()
+
         if not futil_ldso.copyto(elf_loader):
             Msg().err("Error: in loader copy or file locked by other process")
             return False
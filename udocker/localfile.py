@@ -7,6 +7,7 @@ from udocker.msg import Msg
 from udocker.docker import DockerLocalFileAPI
 from udocker.oci import OciLocalFileAPI
 from udocker.commonlocalfile import CommonLocalFileApi
+from udocker.container.archivereader import ImageArchiveReader
 from udocker.utils.fileutil import FileUtil
 
 
@@ -17,16 +18,22 @@ class LocalFileAPI(CommonLocalFileApi):
         CommonLocalFileApi.__init__(self, localrepo)
 
     def load(self, imagefile, imagerepo=None):
-        """Generic load of image tags to a file"""
+        """Generic load of image tags from a file, from stdin if "-" or
+        from a directory with the image layout"""
         if not os.path.exists(imagefile) and imagefile != '-':
             Msg().err("Error: image file does not exist:", imagefile)
             return False
-        tmp_imagedir = FileUtil("load").mktmp()
+        tmp_imagedir = FileUtil("load").mktmp(self.localrepo.tmp_area())
         try:
             os.makedirs(tmp_imagedir)
         except (IOError, OSError):
             return False
-        if not self._untar_saved_container(imagefile, tmp_imagedir):
+        archive = ImageArchiveReader(self.localrepo)
+        if os.path.isdir(imagefile):
+            status = archive.link(imagefile, tmp_imagedir)
+        else:
+            status = archive.extract(imagefile, tmp_imagedir)
+        if not status:
             Msg().err("Error: failed to extract container:", imagefile)
             FileUtil(tmp_imagedir).remove(recursive=True)
             return False
@@ -39,10 +46,20 @@ class LocalFileAPI(CommonLocalFileApi):
                 self.localrepo).load(tmp_imagedir, imagerepo)
         else:
             repositories = []
+        archive.remove_unused()
         FileUtil(tmp_imagedir).remove(recursive=True)
         return repositories
 
-    def save(self, imagetag_list, imagefile):
-        """Generic save of image tags to a file"""
+    def save(self, imagetag_list, imagefile, imageformat="docker",
+             compress=""):
+        """Generic save of image tags to a file, imageformat is docker
+        for a docker-archive, oci for an OCI image layout or oci-dir for
+        an OCI image layout in a new directory"""
+        if imageformat == "oci-dir":
+            return OciLocalFileAPI(self.localrepo).save_dir(
+                imagetag_list, imagefile)
+        if imageformat == "oci":
+            return OciLocalFileAPI(self.localrepo).save(
+                imagetag_list, imagefile, compress)
         return DockerLocalFileAPI(self.localrepo).save(
-            imagetag_list, imagefile)
+            imagetag_list, imagefile, compress)
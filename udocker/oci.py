@@ -2,16 +2,26 @@
 """Docker API integration"""
 
 import os
+import re
+import json
+import hashlib
 
 from udocker.msg import Msg
 from udocker.helper.unique import Unique
 from udocker.commonlocalfile import CommonLocalFileApi
+from udocker.container.layerindex import LayerStream
 from udocker.utils.fileutil import FileUtil
+from udocker.utils.chksum import ChkSUM
+from udocker.utils.tarstream import TarStream, DirStream
 
 
 class OciLocalFileAPI(CommonLocalFileApi):
     """Manipulate OCI container and/or image files"""
 
+    MANIFEST_TYPE = "application/vnd.oci.image.manifest.v1+json"
+    CONFIG_TYPE = "application/vnd.oci.image.config.v1+json"
+    LAYER_TYPE = "application/vnd.oci.image.layer.v1.tar"
+
     def __init__(self, localrepo):
         CommonLocalFileApi.__init__(self, localrepo)
 
@@ -117,3 +127,121 @@ class OciLocalFileAPI(CommonLocalFileApi):
             Msg().err("Error: failed to load image structure")
             return []
         return self._load_repositories(structure)
+
+    def _layer_digest(self, layer_f):
+        """Digest of a layer file, taken from the name of layers pulled
+        with the v2 API and computed for v1 layers"""
+        match = re.search(r"^(sha256|sha512):([a-f0-9]+)$",
+                          os.path.basename(os.path.realpath(layer_f)))
+        if match:
+            return (match.group(1), match.group(2))
+        layer_chksum = ChkSUM().sha256(layer_f)
+        if not layer_chksum:
+            return ("", "")
+        return ("sha256", layer_chksum)
+
+    def _layer_media_type(self, layer_f):
+        """Media type of a layer from the compression of its content"""
+        magic = FileUtil(layer_f).getdata('rb', 4)
+        for (compression, signature) in LayerStream.MAGIC.items():
+            if magic and magic.startswith(signature):
+                return self.LAYER_TYPE + '+' + compression
+        return self.LAYER_TYPE
+
+    def _save_blob(self, output, blobs, media_type, content):
+        """Write a json blob to the output, returns its descriptor"""
+        data = json.dumps(content).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        if "sha256:" + digest not in blobs:
+            output.add_data("blobs/sha256/" + digest, data)
+            blobs.add("sha256:" + digest)
+        return {"mediaType": media_type, "digest": "sha256:" + digest,
+                "size": len(data)}
+
+    def _save_image(self, imagerepo, tag, output, blobs):
+        """Write the blobs of an image to the output, returns the
+        descriptor of the image manifest or None on failure"""
+        if not self.localrepo.cd_imagerepo(imagerepo, tag):
+            return None
+        (container_json, layer_files) = self.localrepo.get_image_attributes()
+        if not container_json:
+            return None
+        layers = []
+        for layer_f in layer_files:
+            (algorithm, digest) = self._layer_digest(layer_f)
+            if not digest:
+                return None
+            if algorithm + ':' + digest not in blobs:
+                if algorithm not in blobs:
+                    output.add_dir("blobs/" + algorithm)
+                    blobs.add(algorithm)
+                output.add_file("blobs/" + algorithm + '/' + digest,
+                                os.path.realpath(layer_f))
+                blobs.add(algorithm + ':' + digest)
+            layers.append({"mediaType": self._layer_media_type(layer_f),
+                           "digest": algorithm + ':' + digest,
+                           "size": FileUtil(layer_f).size()})
+        manifest = {"schemaVersion": 2,
+                    "mediaType": self.MANIFEST_TYPE,
+                    "config": self._save_blob(output, blobs,
+                                              self.CONFIG_TYPE, container_json),
+                    "layers": layers}
+        descriptor = self._save_blob(output, blobs, self.MANIFEST_TYPE,
+                                     manifest)
+        descriptor["annotations"] = {
+            "org.opencontainers.image.ref.name": imagerepo + ':' + tag,
+            "io.containerd.image.name": imagerepo + ':' + tag}
+        return descriptor
+
+    def _save_layout(self, imagetag_list, output, imagefile):
+        """Write a set of image tags in the OCI image layout to output,
+        a TarStream or a DirStream already opened"""
+        index = {"schemaVersion": 2, "manifests": []}
+        blobs = set(["sha256"])
+        try:
+            output.add_data("oci-layout",
+                            json.dumps({"imageLayoutVersion": "1.0.0"}))
+            output.add_dir("blobs")
+            output.add_dir("blobs/sha256")
+            for (imagerepo, tag) in imagetag_list:
+                descriptor = self._save_image(imagerepo, tag, output, blobs)
+                if not descriptor:
+                    Msg().err("Error: save image failed:",
+                              imagerepo + ':' + tag)
+                    output.abort()
+                    return False
+                index["manifests"].append(descriptor)
+            output.add_data("index.json", json.dumps(index))
+            output.close()
+        except (IOError, OSError) as error:
+            Msg().err("Error: save image failed in writing", imagefile,
+                      str(error))
+            output.abort()
+            return False
+        return True
+
+    def save(self, imagetag_list, imagefile, compress=""):
+        """Save a set of image tags to a file in the OCI image layout,
+        the archive is streamed to the file or to stdout and compressed
+        with gzip or zstd if compress is set"""
+        if not imagetag_list:
+            Msg().err("Error: no images specified")
+            return False
+        tarstream = TarStream(imagefile, compress)
+        if not tarstream.open():
+            Msg().err("Error: cannot create image file:", imagefile)
+            return False
+        return self._save_layout(imagetag_list, tarstream, imagefile)
+
+    def save_dir(self, imagetag_list, imagedir):
+        """Save a set of image tags to a new directory in the OCI image
+        layout, the blobs of the layers are hard links to the layers in
+        the repository or copies when in another filesystem"""
+        if not imagetag_list:
+            Msg().err("Error: no images specified")
+            return False
+        dirstream = DirStream(imagedir)
+        if not dirstream.open():
+            Msg().err("Error: cannot create image directory:", imagedir)
+            return False
+        return self._save_layout(imagetag_list, dirstream, imagedir)
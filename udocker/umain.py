@@ -85,6 +85,10 @@ class UMain(object):
             "inspect": self.cli.do_inspect, "login": self.cli.do_login,
             "setup": self.cli.do_setup, "install": self.cli.do_install,
             "tag": self.cli.do_tag, "manifest": self.cli.do_manifest,
+            "cp": self.cli.do_cp, "pool": self.cli.do_pool,
+            "flatten": self.cli.do_flatten, "fsck": self.cli.do_fsck,
+            "prune": self.cli.do_prune, "dedup": self.cli.do_dedup,
+            "df": self.cli.do_df, "commit": self.cli.do_commit,
         }
 
         if ((len(self.argv) == 1) or
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Parallel compression and decompression of archives"""
+
+import os
+import zlib
+import gzip
+import threading
+import subprocess
+import collections
+
+from udocker.config import Config
+from udocker.msg import Msg
+from udocker.utils.fileutil import FileUtil
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    pass
+
+try:
+    import zstandard
+except ImportError:
+    pass
+
+
+class Compression(object):
+    """Compress or decompress a stream with gzip or zstd using several
+    CPUs. The external pigz and zstd are used when found, they run in
+    a separate process with several threads. Without pigz gzip is
+    compressed in process by a pool of threads, each one compressing
+    a block into a separate gzip member, the concatenated members are
+    a valid gzip stream. Without the zstd command the python zstandard
+    module is used. Decompression runs in the external tool concurrently
+    with the reader of the data, or in process otherwise.
+    """
+
+    METHODS = ("gzip", "zstd")
+    MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+    BLOCKSIZE = 1024 * 1024
+    GZIP_LEVEL = 6
+
+    def __init__(self, method):
+        self.method = method
+        self.threads = Config.conf['compress_threads']
+        if not self.threads:
+            try:
+                self.threads = os.cpu_count() or 1
+            except AttributeError:
+                self.threads = 1
+        self._proc = None
+        self._thread = None
+        self._in_fd = None
+        self._error = None
+
+    @staticmethod
+    def detect(buf):
+        """Compression method from the first bytes of a stream, returns
+        an empty string if not compressed with gzip or zstd"""
+        for (method, magic) in Compression.MAGIC.items():
+            if buf and buf.startswith(magic):
+                return method
+        return ""
+
+    @staticmethod
+    def detect_file(filename):
+        """Compression method of a file"""
+        return Compression.detect(FileUtil(filename).getdata('rb', 4))
+
+    def _tool(self, decompress=False):
+        """Command line of the external tool, empty if not found"""
+        if self.method == "gzip":
+            exec_path = FileUtil("pigz").find_exec()
+            if exec_path and decompress:
+                return [exec_path, "-d", "-c"]
+            if exec_path:
+                return [exec_path, "-c", "-p", str(self.threads)]
+        elif self.method == "zstd":
+            exec_path = FileUtil("zstd").find_exec()
+            if exec_path and decompress:
+                return [exec_path, "-d", "-c", "-q"]
+            if exec_path:
+                return [exec_path, "-c", "-q", "-T%d" % self.threads]
+        return []
+
+    def tar_option(self, stream=False):
+        """Option for tar to decompress with the external tool, empty
+        if tar should decompress by itself. With stream the archive is
+        read from a pipe where tar cannot detect the compression"""
+        cmd = self._tool(decompress=True)
+        if cmd and (self.method == "gzip" or stream):
+            return ["--use-compress-program=" + cmd[0]]
+        if stream and self.method == "gzip":
+            return ["-z"]
+        if stream and self.method == "zstd":
+            return ["--zstd"]
+        return []
+
+    def _write_all(self, fdesc, data):
+        """Write all the data to a file descriptor"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fdesc, view):]
+
+    def _gzip_member(self, block):
+        """Compress a block into a gzip member"""
+        zobj = zlib.compressobj(self.GZIP_LEVEL, zlib.DEFLATED,
+                                16 + zlib.MAX_WBITS)
+        return zobj.compress(block) + zobj.flush()
+
+    def _gzip_blocks(self, read_fd, out_fd):
+        """Compress the data read from read_fd block by block in a pool
+        of threads writing the members in order to out_fd"""
+        try:
+            with os.fdopen(read_fd, "rb") as reader:
+                try:
+                    executor = ThreadPoolExecutor(max_workers=self.threads)
+                except NameError:
+                    executor = None
+                pending = collections.deque()
+                while True:
+                    block = reader.read(self.BLOCKSIZE)
+                    if block and executor:
+                        pending.append(executor.submit(self._gzip_member,
+                                                       block))
+                    elif block:
+                        self._write_all(out_fd, self._gzip_member(block))
+                    while pending and (not block or
+                                       len(pending) >= self.threads * 2):
+                        self._write_all(out_fd, pending.popleft().result())
+                    if not block:
+                        break
+                if executor:
+                    executor.shutdown()
+        except (IOError, OSError, zlib.error) as error:
+            self._error = error
+
+    def _zstd_stream(self, read_fd, out_fd):
+        """Compress the data read from read_fd with zstandard"""
+        try:
+            with os.fdopen(read_fd, "rb") as reader:
+                writer = os.fdopen(os.dup(out_fd), "wb")
+                with writer:
+                    zstandard.ZstdCompressor(threads=self.threads).\
+                        copy_stream(reader, writer)
+        except (IOError, OSError, zstandard.ZstdError) as error:
+            self._error = error
+
+    def compress_to(self, out_fd):
+        """Start compressing to out_fd, returns the file descriptor to
+        write the data to be compressed or None if not supported"""
+        target = None
+        cmd = self._tool()
+        if not cmd and self.method == "gzip":
+            target = self._gzip_blocks
+        elif not cmd and self.method == "zstd":
+            try:
+                dummy = zstandard.ZstdCompressor
+                target = self._zstd_stream
+            except NameError:
+                Msg().err("Error: zstd compression not available")
+                return None
+        elif not cmd:
+            Msg().err("Error: unknown compression:", self.method)
+            return None
+        (read_fd, self._in_fd) = os.pipe()
+        if cmd:
+            Msg().out("Debug: compress:", cmd, l=Msg.DBG)
+            self._proc = subprocess.Popen(cmd, stdin=read_fd, stdout=out_fd,
+                                          stderr=Msg.chlderr, close_fds=True)
+            os.close(read_fd)
+        else:
+            self._thread = threading.Thread(target=target,
+                                            args=(read_fd, out_fd))
+            self._thread.daemon = True
+            self._thread.start()
+        return self._in_fd
+
+    def _feed(self, fileobj, pipe):
+        """Copy fileobj to the input of the external tool"""
+        try:
+            while True:
+                buf = fileobj.read(self.BLOCKSIZE)
+                if not buf:
+                    break
+                pipe.write(buf)
+        except (IOError, OSError) as error:
+            self._error = error
+        finally:
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+
+    def decompress_from(self, fileobj):
+        """Return a file object with the decompressed content of fileobj
+        or None if not supported"""
+        cmd = self._tool(decompress=True)
+        if cmd:
+            Msg().out("Debug: decompress:", cmd, l=Msg.DBG)
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=Msg.chlderr, close_fds=True)
+            self._thread = threading.Thread(target=self._feed,
+                                            args=(fileobj, self._proc.stdin))
+            self._thread.daemon = True
+            self._thread.start()
+            return self._proc.stdout
+        if self.method == "gzip":
+            return gzip.GzipFile(fileobj=fileobj, mode="rb")
+        if self.method == "zstd":
+            try:
+                return zstandard.ZstdDecompressor().stream_reader(fileobj)
+            except NameError:
+                Msg().err("Error: zstd decompression not available")
+        return None
+
+    def close(self):
+        """Finish compressing or decompressing, returns False on error"""
+        if self._in_fd is not None:
+            os.close(self._in_fd)
+            self._in_fd = None
+        elif self._proc and self._proc.stdout:
+            self._proc.stdout.close()
+        status = True
+        if self._proc:
+            status = self._proc.wait() == 0
+        if self._thread:
+            self._thread.join()
+        if self._error is not None and self._proc is None:
+            Msg().err("Error: compressing:", str(self._error))
+            status = False
+        return status
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Disk usage of directory trees measured in process"""
+
+import os
+import stat
+import json
+import time
+
+from udocker.config import Config
+from udocker.utils.fileutil import FileUtil
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    pass
+
+
+class DiskUsage(object):
+    """Measure the disk space used by directory trees without forking
+    du. The subdirectories below each tree are walked in parallel by a
+    pool of threads. Files with several hard links are accounted by
+    inode so that they are counted once, this allows to separate the
+    space used exclusively by a tree from the space shared with other
+    trees. The totals of each directory are kept in a cache keyed by
+    the directory mtime, in following measurements only the
+    directories that changed are read again.
+    """
+
+    VERSION = 1
+    RACY = 2                           # seconds, see _record()
+
+    def __init__(self, cache_file=""):
+        self.cache_file = cache_file
+        self.threads = Config.conf['diskusage_threads']
+        self._cache = None
+        self._visited = {}
+
+    def _load(self):
+        """Load the cache of directory totals"""
+        self._cache = {}
+        if not (self.cache_file and os.path.exists(self.cache_file)):
+            return
+        try:
+            with open(self.cache_file, 'r') as infile:
+                data = json.load(infile)
+            if data["version"] == self.VERSION:
+                self._cache = data["roots"]
+        except (IOError, OSError, KeyError, ValueError, TypeError):
+            pass
+
+    def save(self):
+        """Keep the totals of the trees measured since the cache was
+        loaded, the records of the other trees are left unchanged"""
+        if not self.cache_file:
+            return True
+        if self._cache is None:
+            self._load()
+        self._cache.update(self._visited)
+        tmp_file = self.cache_file + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp_file, 'w') as outfile:
+                json.dump({"version": self.VERSION, "roots": self._cache},
+                          outfile)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError, TypeError, ValueError):
+            FileUtil(tmp_file).remove()
+            return False
+        return True
+
+    def clear(self):
+        """Ignore the cached totals, everything is read again"""
+        self._cache = {}
+
+    def _disk_bytes(self, f_stat):
+        """Space allocated to a file"""
+        try:
+            return f_stat.st_blocks * 512
+        except AttributeError:
+            return f_stat.st_size
+
+    def _entries(self, dir_path):
+        """Yield the name and lstat of each entry of a directory"""
+        try:
+            scan = os.scandir(dir_path)
+        except AttributeError:
+            for name in os.listdir(dir_path):
+                yield (name, os.lstat(dir_path + '/' + name))
+            return
+        try:
+            for entry in scan:
+                yield (entry.name, entry.stat(follow_symlinks=False))
+        finally:
+            scan.close()
+
+    def _scan(self, dir_path):
+        """Read a directory, returns the bytes of files with a single
+        link, a dict of the bytes of files with several links by inode
+        and the list of subdirectories"""
+        nbytes = 0
+        links = {}
+        subdirs = []
+        for (name, f_stat) in self._entries(dir_path):
+            if stat.S_ISDIR(f_stat.st_mode):
+                subdirs.append(name)
+            elif f_stat.st_nlink > 1:
+                links["%d:%d" % (f_stat.st_dev, f_stat.st_ino)] = \
+                    self._disk_bytes(f_stat)
+            else:
+                nbytes += self._disk_bytes(f_stat)
+        return (nbytes, links, subdirs)
+
+    def _record(self, dir_path, rel_path, top_dev, cache, visited):
+        """Totals of a single directory from the cache or read from disk.
+        Directories modified less than RACY seconds ago are not cached
+        since further changes may not change their mtime. Directories in
+        other filesystems are skipped. Returns the record or None.
+        """
+        try:
+            d_stat = os.lstat(dir_path)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(d_stat.st_mode) or d_stat.st_dev != top_dev:
+            return None
+        record = cache.get(rel_path)
+        if not (record and record[0] and record[0] == d_stat.st_mtime):
+            try:
+                (nbytes, links, subdirs) = self._scan(dir_path)
+            except OSError:
+                (nbytes, links, subdirs) = (0, {}, [])
+            mtime = d_stat.st_mtime
+            if time.time() - mtime < self.RACY:
+                mtime = 0
+            record = [mtime, nbytes + self._disk_bytes(d_stat), links,
+                      subdirs]
+        visited[rel_path] = record
+        return record
+
+    def _walk(self, task):
+        """Walk a subtree, returns the bytes of files with a single link,
+        the files with several links by inode and the visited records"""
+        (root, rel_top, top_dev, cache) = task
+        nbytes = 0
+        links = {}
+        visited = {}
+        stack = [rel_top]
+        while stack:
+            rel_path = stack.pop()
+            record = self._record(root + '/' + rel_path, rel_path, top_dev,
+                                  cache, visited)
+            if record is None:
+                continue
+            nbytes += record[1]
+            links.update(record[2])
+            stack.extend([rel_path + '/' + subdir for subdir in record[3]])
+        return (nbytes, links, visited)
+
+    def _map(self, function, args):
+        """Apply function to the args in a pool of threads"""
+        if self.threads > 1 and len(args) > 1:
+            try:
+                with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                    return list(executor.map(function, args))
+            except NameError:
+                pass
+        return [function(arg) for arg in args]
+
+    def measure(self, paths):
+        """Measure each tree, returns a dict by path with the bytes of
+        files with a single link and the files with several links"""
+        if self._cache is None:
+            self._load()
+        measured = {}
+        tasks = []
+        for path in paths:
+            path = path.rstrip('/') or '/'
+            try:
+                top_dev = os.lstat(path).st_dev
+            except OSError:
+                continue
+            cache = self._cache.get(path, {})
+            visited = {}
+            record = self._record(path, "", top_dev, cache, visited)
+            if record is None:
+                continue
+            self._visited[path] = visited
+            measured[path] = [record[1], dict(record[2])]
+            tasks.extend([(path, subdir, top_dev, cache)
+                          for subdir in record[3]])
+        for (task, result) in zip(tasks, self._map(self._walk, tasks)):
+            measured[task[0]][0] += result[0]
+            measured[task[0]][1].update(result[1])
+            self._visited[task[0]].update(result[2])
+        return measured
+
+    def size(self, path):
+        """Bytes used by a directory tree or -1 on error"""
+        measured = self.measure([path]).get(path.rstrip('/') or '/')
+        if measured is None:
+            return -1
+        return measured[0] + sum(measured[1].values())
+
+    def summarize(self, measured):
+        """Separate the space used exclusively by each tree from the
+        space of files hard linked across trees, measured is a dict by
+        path as returned by measure(), possibly merged from several
+        DiskUsage objects. Returns a dict with the total and exclusive
+        bytes of each path, plus the shared and total bytes.
+        """
+        owners = {}
+        inodes = {}
+        for (dummy, links) in measured.values():
+            for (inode, nbytes) in links.items():
+                owners[inode] = owners.get(inode, 0) + 1
+                inodes[inode] = nbytes
+        usage = {"paths": {}, "shared": 0, "total": 0}
+        for (path, (nbytes, links)) in measured.items():
+            exclusive = nbytes + sum([links[inode] for inode in links
+                                      if owners[inode] == 1])
+            usage["paths"][path] = {"total": nbytes + sum(links.values()),
+                                    "exclusive": exclusive}
+            usage["total"] += exclusive
+        usage["shared"] = sum([inodes[inode] for inode in owners
+                               if owners[inode] > 1])
+        usage["total"] += usage["shared"]
+        return usage
+
+    def report(self, paths):
+        """Measure several trees that must not overlap, see summarize()"""
+        return self.summarize(self.measure(paths))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Advisory locks on files"""
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    pass
+
+
+class FileLock(object):
+    """Advisory lock held with flock() on a lock file. The lock is
+    exclusive unless shared is True, a blocking lock waits for the
+    other holders to release it. acquire() returns False when the
+    lock file cannot be created, e.g. in a read-only repository, or
+    when a non blocking lock is held by another process, the caller
+    then decides whether to proceed without the lock. Can be used as
+    a context manager, the lock is released when the block is exited.
+    """
+
+    SUFFIX = ".lock"
+
+    def __init__(self, lock_file, shared=False, blocking=True):
+        self.lock_file = lock_file
+        self.shared = shared
+        self.blocking = blocking
+        self._fd = None
+
+    def acquire(self):
+        """Take the lock, returns True if the lock is held"""
+        if self._fd is not None:
+            return True
+        try:
+            lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return False
+        try:
+            flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            if not self.blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(lock_fd, flags)
+        except (IOError, OSError, NameError):
+            os.close(lock_fd)
+            return False
+        self._fd = lock_fd
+        return True
+
+    def release(self):
+        """Release the lock"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def locked(self):
+        """Check if the lock is held by this object"""
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -5,6 +5,13 @@ import os
 import sys
 import stat
 import re
+import errno
+import ctypes
+
+try:
+    import fcntl
+except ImportError:
+    pass
 
 from udocker.genstr import is_genstr
 from udocker.msg import Msg
@@ -13,11 +20,22 @@ from udocker.helper.unique import Unique
 from udocker.helper.hostinfo import HostInfo
 from udocker.utils.uprocess import Uprocess
 from udocker.utils.uvolume import Uvolume
+from udocker.utils.treeremove import TreeRemove
 
 
 class FileUtil(object):
     """Some utilities to manipulate files"""
 
+    FICLONE = 0x40049409   # ioctl to clone a file using reflinks
+    NOT_SUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                     errno.EXDEV, errno.ENOSYS, errno.EPERM)
+    SEEK_DATA = getattr(os, "SEEK_DATA", None)
+    SEEK_HOLE = getattr(os, "SEEK_HOLE", None)
+    FALLOC_FL_KEEP_SIZE = 0x01
+    FALLOC_FL_PUNCH_HOLE = 0x02
+    SPARSE_BLOCK = 4096    # granularity of the holes created in files
+    BUFSIZE = 1024 * 1024
+
     tmptrash = {}
     safe_prefixes = []
     orig_umask = None
@@ -77,10 +95,12 @@ class FileUtil(object):
 
         return True
 
-    def mktmp(self):
-        """Generate a temporary filename"""
+    def mktmp(self, tmpdir=None):
+        """Generate a temporary filename, by default in the udocker
+        temporary directory"""
         while True:
-            tmp_file = self._tmpdir + '/' + Unique().filename(self.basename)
+            tmp_file = (tmpdir or self._tmpdir) + '/' + \
+                Unique().filename(self.basename)
             if not os.path.exists(tmp_file):
                 FileUtil.tmptrash[tmp_file] = True
                 self.filename = tmp_file
@@ -104,9 +124,9 @@ class FileUtil(object):
 
         return True
 
-    def mktmpdir(self):
+    def mktmpdir(self, tmpdir=None):
         """Create temporary directory"""
-        dirname = self.mktmp()
+        dirname = self.mktmp(tmpdir)
         if FileUtil(dirname).mkdir():
             return dirname
 
@@ -157,12 +177,15 @@ class FileUtil(object):
         """Change ownership recursively recursively"""
         return self.chown(uid, gid, recursive=True)
 
-    def _chmod(self, filename, filemode=0o600, dirmode=0o700, mask=0o755):
+    def _chmod(self, filename, filemode=0o600, dirmode=0o700, mask=0o755,
+               breaklinks=False):
         """chmod file or directory"""
         try:
             filestat = os.lstat(filename).st_mode
             if stat.S_ISREG(filestat) and filemode:
                 mode = (stat.S_IMODE(filestat) & mask) | filemode
+                if breaklinks and mode != stat.S_IMODE(filestat):
+                    FileUtil(filename).breaklink()
                 os.chmod(filename, mode)
             elif stat.S_ISDIR(filestat) and dirmode:
                 mode = (stat.S_IMODE(filestat) & mask) | dirmode
@@ -176,52 +199,34 @@ class FileUtil(object):
         except OSError:
             Msg().err("Error: changing permissions of:", filename, l=Msg.VER)
 
-    def chmod(self, filemode=0o600, dirmode=0o700, mask=0o755, recursive=False):
-        """chmod directory recursively"""
+    def chmod(self, filemode=0o600, dirmode=0o700, mask=0o755, recursive=False,
+              breaklinks=False):
+        """chmod directory recursively, if breaklinks is True files
+        having hard links are replaced by a copy before the change
+        """
         try:
             if recursive:
                 for dir_path, dirs, files in os.walk(self.filename):
                     for f_name in files:
                         self._chmod(dir_path + '/' + f_name,
-                                    filemode, None, mask)
+                                    filemode, None, mask, breaklinks)
                     for f_name in dirs:
                         self._chmod(dir_path + '/' + f_name,
                                     None, dirmode, mask)
-            self._chmod(self.filename, filemode, dirmode, mask)
+            self._chmod(self.filename, filemode, dirmode, mask, breaklinks)
 
         except OSError:
             return False
 
         return True
 
-    def rchmod(self, filemode=0o600, dirmode=0o700, mask=0o755):
+    def rchmod(self, filemode=0o600, dirmode=0o700, mask=0o755, breaklinks=False):
         """chmod directory recursively"""
-        self.chmod(filemode, dirmode, mask, True)
+        self.chmod(filemode, dirmode, mask, True, breaklinks)
 
     def _removedir(self):
         """Delete directory recursively"""
-        try:
-            for dir_path, dirs, files in os.walk(self.filename, topdown=False, followlinks=False):
-                for f_name in files:
-                    f_path = dir_path + '/' + f_name
-                    if not os.path.islink(f_path):
-                        os.chmod(f_path, stat.S_IWUSR | stat.S_IRUSR)
-
-                    os.unlink(f_path)
-
-                for f_name in dirs:
-                    f_path = dir_path + '/' + f_name
-                    if os.path.islink(f_path):
-                        os.unlink(f_path)
-                        continue
-
-                    os.chmod(f_path, stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR)
-                    os.rmdir(f_path)
-
-            os.chmod(self.filename, stat.S_IWUSR | stat.S_IRUSR | stat.S_IXUSR)
-            os.rmdir(self.filename)
-
-        except OSError:
+        if not TreeRemove().remove(self.filename):
             Msg().err("Error: removing:", self.filename, l=Msg.VER)
             return False
 
@@ -276,8 +281,9 @@ class FileUtil(object):
 
         return True
 
-    def tar(self, tarfile, sourcedir=None):
-        """Create a tar file for a given sourcedir"""
+    def tar(self, tarfile, sourcedir=None, stdout=None):
+        """Create a tar file for a given sourcedir, with tarfile "-"
+        the archive is written to stdout or to the descriptor stdout"""
         if sourcedir is None:
             sourcedir = self.filename
 
@@ -287,7 +293,8 @@ class FileUtil(object):
 
         cmd = ["tar", "-C", sourcedir, "-c" + verbose, "--one-file-system",
                "-S", "--xattrs", "-f", tarfile, "."]
-        status = Uprocess().call(cmd, stderr=Msg.chlderr, close_fds=True)
+        status = Uprocess().call(cmd, stderr=Msg.chlderr, close_fds=True,
+                                 stdout=stdout)
         if status:
             Msg().err("Error: creating tar file:", tarfile)
 
@@ -311,6 +318,377 @@ class FileUtil(object):
 
         return status
 
+    def reflink(self, dest_filename):
+        """Clone self.filename into a new file sharing the data blocks
+        through a copy-on-write reflink, requires filesystem support
+        such as in XFS or btrfs. Raises OSError on failure.
+        """
+        fdsrc = os.open(self.filename, os.O_RDONLY)
+        try:
+            fddst = os.open(dest_filename,
+                            os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError:
+            os.close(fdsrc)
+            raise
+
+        try:
+            fcntl.ioctl(fddst, FileUtil.FICLONE, fdsrc)
+        except (OSError, IOError, NameError) as error:
+            os.close(fdsrc)
+            os.close(fddst)
+            os.unlink(dest_filename)
+            if isinstance(error, NameError):
+                raise OSError(errno.ENOSYS, "reflink not available")
+            raise OSError(error.errno, error.strerror)
+
+        os.close(fdsrc)
+        os.close(fddst)
+
+    def _clonefile(self, f_path, dest_path, f_stat, hardlink, inodes):
+        """Clone one directory entry, auxiliary method of clonedir()"""
+        if os.path.lexists(dest_path) and not os.path.isdir(dest_path):
+            os.unlink(dest_path)
+
+        if stat.S_ISLNK(f_stat.st_mode):
+            os.symlink(os.readlink(f_path), dest_path)
+        elif stat.S_ISREG(f_stat.st_mode):
+            inode = (f_stat.st_dev, f_stat.st_ino)
+            if hardlink:
+                os.link(f_path, dest_path)
+            elif inode in inodes:
+                os.link(inodes[inode], dest_path)
+            else:
+                FileUtil(f_path).reflink(dest_path)
+                os.chmod(dest_path, stat.S_IMODE(f_stat.st_mode))
+                os.utime(dest_path, (f_stat.st_atime, f_stat.st_mtime))
+                if f_stat.st_nlink > 1:
+                    inodes[inode] = dest_path
+        elif stat.S_ISFIFO(f_stat.st_mode):
+            os.mkfifo(dest_path, stat.S_IMODE(f_stat.st_mode))
+        else:
+            Msg().out("Warning: skipping special file:", f_path, l=Msg.VER)
+
+    def clonedir(self, destdir, sourcedir=None, hardlink=False):
+        """Copy directories sharing the data blocks of the files, either
+        through copy-on-write reflinks or, if hardlink is True, through
+        hard links. Returns None when the method is not supported by the
+        filesystem, in this case the caller should fallback to copydir().
+        """
+        if sourcedir is None:
+            sourcedir = self.filename
+
+        sourcedir = os.path.realpath(sourcedir)
+        inodes = {}
+        dirs_list = []
+        supported = False
+        try:
+            for dir_path, dirs, files in os.walk(sourcedir):
+                dest_dir = destdir + dir_path[len(sourcedir):]
+                if not os.path.isdir(dest_dir):
+                    os.mkdir(dest_dir, 0o700)
+                else:
+                    os.chmod(dest_dir, stat.S_IMODE(os.lstat(dest_dir).st_mode) |
+                             stat.S_IRWXU)
+
+                dirs_list.append((dir_path, dest_dir))
+                for f_name in list(dirs):
+                    f_path = dir_path + '/' + f_name
+                    if os.path.islink(f_path):
+                        dirs.remove(f_name)
+                        files.append(f_name)
+
+                for f_name in files:
+                    f_path = dir_path + '/' + f_name
+                    f_stat = os.lstat(f_path)
+                    try:
+                        self._clonefile(f_path, dest_dir + '/' + f_name,
+                                        f_stat, hardlink, inodes)
+                    except OSError as error:
+                        if (not supported and stat.S_ISREG(f_stat.st_mode) and
+                                error.errno in FileUtil.NOT_SUPPORTED):
+                            Msg().out("Debug: clone not supported:", f_path,
+                                      l=Msg.DBG)
+                            return None
+                        raise
+
+                    if stat.S_ISREG(f_stat.st_mode):
+                        supported = True
+
+            for (dir_path, dest_dir) in reversed(dirs_list):
+                d_stat = os.lstat(dir_path)
+                os.chmod(dest_dir, stat.S_IMODE(d_stat.st_mode))
+                os.utime(dest_dir, (d_stat.st_atime, d_stat.st_mtime))
+
+        except (IOError, OSError) as error:
+            Msg().err("Error: cloning:", sourcedir, "to", destdir, error, l=Msg.VER)
+            return False
+
+        return True
+
+    def _rewrite(self, f_stat):
+        """Replace the file by a copy of itself keeping mode and times,
+        the copy is a new inode and holes are preserved or created
+        """
+        tmp_file = os.path.dirname(self.filename) + '/.' + \
+            Unique().filename(self.basename)
+        p_path = os.path.dirname(self.filename)
+        p_mode = stat.S_IMODE(os.stat(p_path).st_mode)
+        if not p_mode & stat.S_IWUSR:
+            os.chmod(p_path, p_mode | stat.S_IWUSR)
+
+        status = self._file2file(tmp_file)
+        if status:
+            os.chmod(tmp_file, stat.S_IMODE(f_stat.st_mode))
+            os.utime(tmp_file, (f_stat.st_atime, f_stat.st_mtime))
+            os.rename(tmp_file, self.filename)
+        elif os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+        if not p_mode & stat.S_IWUSR:
+            os.chmod(p_path, p_mode)
+
+        return status
+
+    def breaklink(self):
+        """If the file has other hard links replace it by a private copy,
+        used before modifying in place files that may be shared with
+        other containers through hard links.
+        """
+        try:
+            f_stat = os.lstat(self.filename)
+            if not (stat.S_ISREG(f_stat.st_mode) and f_stat.st_nlink > 1):
+                return True
+
+            status = self._rewrite(f_stat)
+        except (IOError, OSError):
+            Msg().err("Error: breaking hard link:", self.filename, l=Msg.VER)
+            return False
+
+        return status
+
+    def _sparse_segments(self, fdesc, size):
+        """Split the content of an open file into data and zero segments,
+        yields tuples (offset, length, data) where data is None for holes
+        and for runs of blocks filled with zeros
+        """
+        zeros = b"\0" * FileUtil.SPARSE_BLOCK
+        offset = 0
+        while offset < size:
+            (data_start, data_end) = (offset, size)
+            if FileUtil.SEEK_DATA is not None:
+                try:
+                    data_start = os.lseek(fdesc, offset, FileUtil.SEEK_DATA)
+                    data_end = min(os.lseek(fdesc, data_start,
+                                            FileUtil.SEEK_HOLE), size)
+                except OSError as error:
+                    if error.errno == errno.ENXIO:
+                        (data_start, data_end) = (size, size)
+                    else:
+                        (data_start, data_end) = (offset, size)
+
+            if data_start > offset:
+                yield (offset, data_start - offset, None)
+
+            os.lseek(fdesc, data_start, os.SEEK_SET)
+            pos = data_start
+            while pos < data_end:
+                buf = os.read(fdesc, min(FileUtil.BUFSIZE, data_end - pos))
+                if not buf:
+                    data_end = size
+                    break
+
+                idx = 0
+                while idx < len(buf):
+                    block = buf[idx:idx + FileUtil.SPARSE_BLOCK]
+                    is_zero = block == zeros[:len(block)]
+                    end = idx + len(block)
+                    while end < len(buf):
+                        block = buf[end:end + FileUtil.SPARSE_BLOCK]
+                        if (block == zeros[:len(block)]) != is_zero:
+                            break
+                        end += len(block)
+
+                    if is_zero:
+                        yield (pos + idx, end - idx, None)
+                    else:
+                        yield (pos + idx, end - idx, buf[idx:end])
+                    idx = end
+
+                pos += len(buf)
+
+            offset = data_end
+
+    def _copy_sparse(self, fdsrc, fddst, size):
+        """Copy between open files skipping holes and zero blocks"""
+        for (offset, dummy, data) in self._sparse_segments(fdsrc, size):
+            if data is not None:
+                os.lseek(fddst, offset, os.SEEK_SET)
+                while data:
+                    data = data[os.write(fddst, data):]
+
+        os.ftruncate(fddst, size)
+
+    def _data_extents(self, fdesc, size):
+        """Yield the offset and length of the data regions of an open
+        file, the holes are skipped where SEEK_DATA is supported"""
+        offset = 0
+        while offset < size:
+            (data_start, data_end) = (offset, size)
+            if FileUtil.SEEK_DATA is not None:
+                try:
+                    data_start = os.lseek(fdesc, offset, FileUtil.SEEK_DATA)
+                    data_end = min(os.lseek(fdesc, data_start,
+                                            FileUtil.SEEK_HOLE), size)
+                except OSError as error:
+                    if error.errno == errno.ENXIO:
+                        return
+                    (data_start, data_end) = (offset, size)
+
+            if data_start >= size:
+                return
+
+            yield (data_start, data_end - data_start)
+            offset = data_end
+
+    def _copy_kernel(self, fdsrc, fddst, size):
+        """Copy between open files without passing the data through
+        Python, with copy_file_range() or else sendfile(), the holes of
+        the source are kept. Raises OSError if neither is supported."""
+        copy_range = getattr(os, "copy_file_range", None)
+        for (offset, length) in self._data_extents(fdsrc, size):
+            end = offset + length
+            while offset < end:
+                if copy_range:
+                    try:
+                        nbytes = copy_range(fdsrc, fddst, end - offset,
+                                            offset, offset)
+                    except OSError as error:
+                        if error.errno not in FileUtil.NOT_SUPPORTED:
+                            raise
+                        copy_range = None
+                        continue
+                else:
+                    try:
+                        os.lseek(fddst, offset, os.SEEK_SET)
+                        nbytes = os.sendfile(fddst, fdsrc, offset,
+                                             end - offset)
+                    except AttributeError:
+                        raise OSError(errno.ENOSYS, "sendfile not available")
+                if not nbytes:
+                    break
+                offset += nbytes
+
+        os.ftruncate(fddst, size)
+
+    def _copy_fast(self, fdsrc, fddst, size):
+        """Copy between open files by the fastest method available: a
+        reflink sharing the data blocks, a copy inside the kernel or
+        else reading the data and skipping the blocks of zeros"""
+        try:
+            fcntl.ioctl(fddst, FileUtil.FICLONE, fdsrc)
+            return
+        except (IOError, OSError, NameError):
+            pass
+
+        try:
+            self._copy_kernel(fdsrc, fddst, size)
+        except OSError as error:
+            if error.errno not in FileUtil.NOT_SUPPORTED:
+                raise
+            self._copy_sparse(fdsrc, fddst, size)
+
+    def _punch_hole(self, fdesc, offset, length):
+        """Deallocate a range of an open file keeping its size, raises
+        OSError if not supported"""
+        try:
+            fallocate = ctypes.CDLL("libc.so.6", use_errno=True).fallocate
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "fallocate not available")
+
+        fallocate.restype = ctypes.c_int
+        fallocate.argtypes = (ctypes.c_int, ctypes.c_int,
+                              ctypes.c_longlong, ctypes.c_longlong)
+        if fallocate(fdesc, FileUtil.FALLOC_FL_PUNCH_HOLE |
+                     FileUtil.FALLOC_FL_KEEP_SIZE, offset, length):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def sparsify(self):
+        """Deallocate the blocks of a regular file that only contain
+        zeros. Holes are punched in place keeping the inode and thus
+        the hard links, if not supported by the filesystem files with
+        a single link are replaced by a sparse copy. Returns the number
+        of bytes saved.
+        """
+        try:
+            f_stat = os.lstat(self.filename)
+            if not stat.S_ISREG(f_stat.st_mode):
+                return 0
+
+            fdesc = os.open(self.filename, os.O_RDWR)
+        except (IOError, OSError):
+            return 0
+
+        status = True
+        try:
+            for (offset, length, data) in \
+                    self._sparse_segments(fdesc, f_stat.st_size):
+                if data is None:
+                    self._punch_hole(fdesc, offset, length)
+        except (IOError, OSError) as error:
+            status = False
+            if error.errno not in FileUtil.NOT_SUPPORTED:
+                Msg().out("Warning: making file sparse:", self.filename,
+                          str(error), l=Msg.VER)
+        finally:
+            os.close(fdesc)
+
+        try:
+            if status:
+                os.utime(self.filename, (f_stat.st_atime, f_stat.st_mtime))
+            elif f_stat.st_nlink == 1:
+                self._rewrite(f_stat)
+            return max(0, (f_stat.st_blocks -
+                           os.lstat(self.filename).st_blocks) * 512)
+        except (IOError, OSError):
+            return 0
+
+    def sparsifydir(self, minsize=0):
+        """Make sparse the regular files in a directory tree that are
+        at least minsize bytes long, a minsize of 0 disables it. Returns
+        a tuple with the bytes saved by holes and the bytes saved by
+        files sharing their data through hard links.
+        """
+        sparse_saved = 0
+        inodes = {}
+        for dir_path, dummy, files in os.walk(self.filename):
+            for f_name in files:
+                f_path = dir_path + '/' + f_name
+                try:
+                    f_stat = os.lstat(f_path)
+                except OSError:
+                    continue
+
+                if not stat.S_ISREG(f_stat.st_mode):
+                    continue
+
+                inode = (f_stat.st_dev, f_stat.st_ino)
+                if inode in inodes:
+                    inodes[inode][0] += 1
+                    continue
+
+                if minsize and f_stat.st_size >= minsize:
+                    saved = FileUtil(f_path).sparsify()
+                    sparse_saved += saved
+                else:
+                    saved = 0
+
+                inodes[inode] = [0, f_stat.st_blocks * 512 - saved]
+
+        links_saved = sum([links * disk_size
+                           for (links, disk_size) in inodes.values()])
+        return (sparse_saved, links_saved)
+
     def cleanup(self):
         """Delete all temporary files"""
         tmptrash_copy = dict(FileUtil.tmptrash)
@@ -502,7 +880,7 @@ class FileUtil(object):
 
         return True
 
-    def _stream2file(self, dest_filename, mode="w"):
+    def _stream2file(self, dest_filename, mode="w", chksum=None):
         """Copy from stdin to another file. We avoid shutil to have
         the fewest possible dependencies on other Python modules.
         """
@@ -520,6 +898,9 @@ class FileUtil(object):
             if not copy_buffer:
                 break
 
+            if chksum is not None:
+                chksum.update(copy_buffer)
+
             fpdst.write(copy_buffer)
 
         fpdst.close()
@@ -547,10 +928,17 @@ class FileUtil(object):
         fpsrc.close()
         return True
 
-    def _file2file(self, dest_filename, mode="w"):
+    def _file2file(self, dest_filename, mode="w", link=False, chksum=None):
         """Copy self.filename to another file. We avoid shutil to have
         the fewest possible dependencies on other Python modules.
         """
+        if link and mode == "w" and chksum is None:
+            try:
+                os.link(self.filename, dest_filename)
+                return True
+            except (IOError, OSError):
+                pass
+
         try:
             fpsrc = open(self.filename, "rb")
         except (IOError, OSError):
@@ -562,28 +950,48 @@ class FileUtil(object):
             fpsrc.close()
             return False
 
+        if mode == "w" and os.path.isfile(self.filename) and chksum is None:
+            try:
+                self._copy_fast(fpsrc.fileno(), fpdst.fileno(),
+                                os.fstat(fpsrc.fileno()).st_size)
+            except (IOError, OSError):
+                fpsrc.close()
+                fpdst.close()
+                return False
+
+            fpsrc.close()
+            fpdst.close()
+            return True
+
         while True:
             copy_buffer = fpsrc.read(1024 * 1024)
             if not copy_buffer:
                 break
+            if chksum is not None:
+                chksum.update(copy_buffer)
             fpdst.write(copy_buffer)
 
         fpsrc.close()
         fpdst.close()
         return True
 
-    def copyto(self, dest_filename, mode="w"):
+    def copyto(self, dest_filename, mode="w", link=False, chksum=None):
         """Copy self.filename to another file. We avoid shutil to have
         the fewest possible dependencies on other Python modules.
+        Regular files are cloned or copied inside the kernel keeping
+        their holes. With link the caller declares that neither file
+        will be modified in place and a hard link is made if possible.
+        A hash object from hashlib passed in chksum is updated with the
+        content, the file is then copied through a buffer and read once.
         """
         if self.filename == "-" and dest_filename != "-":
-            return self._stream2file(dest_filename, mode)
+            return self._stream2file(dest_filename, mode, chksum)
 
         if self.filename != "-" and dest_filename == "-":
             return self._file2stream()
 
         if self.filename != "-" and dest_filename != "-":
-            return self._file2file(dest_filename, mode)
+            return self._file2file(dest_filename, mode, link, chksum)
 
         return False
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Sequential writing of tar archives and image directories"""
+
+import os
+import sys
+import time
+import errno
+import tarfile
+
+from udocker.utils.compress import Compression
+from udocker.utils.fileutil import FileUtil
+
+
+class TarStream(object):
+    """Write a tar archive sequentially to a file or to stdout without
+    staging its members on disk. Members are added from data held in
+    memory or from files, the content of files is copied by the kernel
+    with sendfile() when supported and otherwise read in blocks. When
+    a hash object is passed with a file it is updated while the file
+    is copied, the file is still read only once. The output is never
+    seeked, a pipe can be used. The archive can be compressed with
+    gzip or zstd on the fly. Write errors raise OSError or IOError.
+    """
+
+    BLOCKSIZE = tarfile.BLOCKSIZE
+    RECORDSIZE = tarfile.RECORDSIZE
+    BUFSIZE = 1024 * 1024
+    NOT_SUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                     getattr(errno, "ENOTSUP", errno.EOPNOTSUPP))
+
+    def __init__(self, tarfile_name, compress=""):
+        self.tarfile_name = tarfile_name
+        self.compress = compress
+        self.offset = 0
+        self._fd = None
+        self._out_fd = None
+        self._compression = None
+        self._mtime = int(time.time())
+
+    def open(self):
+        """Create the archive file, "-" writes to stdout, returns False
+        if the file cannot be created"""
+        if self.tarfile_name == '-':
+            sys.stdout.flush()
+            self._out_fd = sys.stdout.fileno()
+        else:
+            try:
+                self._out_fd = os.open(self.tarfile_name, os.O_WRONLY |
+                                       os.O_CREAT | os.O_TRUNC, 0o644)
+            except (IOError, OSError):
+                return False
+        self._fd = self._out_fd
+        if self.compress:
+            self._compression = Compression(self.compress)
+            self._fd = self._compression.compress_to(self._out_fd)
+            if self._fd is None:
+                self.abort()
+                return False
+        return True
+
+    def _write(self, data):
+        """Write all the data to the archive"""
+        view = memoryview(data)
+        while view:
+            nbytes = os.write(self._fd, view)
+            self.offset += nbytes
+            view = view[nbytes:]
+
+    def _pad(self, size):
+        """Fill the last block of a member with zeros"""
+        remainder = size % self.BLOCKSIZE
+        if remainder:
+            self._write(b"\0" * (self.BLOCKSIZE - remainder))
+
+    def _header(self, name, size=0, mode=0o644, member_type=tarfile.REGTYPE):
+        """Write the header of a member"""
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = size
+        tarinfo.mode = mode
+        tarinfo.type = member_type
+        tarinfo.mtime = self._mtime
+        self._write(tarinfo.tobuf(tarfile.GNU_FORMAT))
+
+    def _sendfile(self, fdsrc, size):
+        """Copy a file to the archive in the kernel, returns the number
+        of bytes copied which is zero when sendfile() is not supported"""
+        copied = 0
+        try:
+            while copied < size:
+                nbytes = os.sendfile(self._fd, fdsrc, copied, size - copied)
+                if not nbytes:
+                    break
+                copied += nbytes
+        except AttributeError:
+            pass
+        except OSError as error:
+            if error.errno not in self.NOT_SUPPORTED:
+                raise
+        self.offset += copied
+        return copied
+
+    def add_dir(self, name):
+        """Add a directory"""
+        self._header(name.rstrip('/') + '/', mode=0o755,
+                     member_type=tarfile.DIRTYPE)
+
+    def add_data(self, name, data):
+        """Add a file with content from memory"""
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self._header(name, len(data))
+        self._write(data)
+        self._pad(len(data))
+
+    def add_file(self, name, f_path, chksum=None):
+        """Add a file with the content of f_path, chksum is a hash object
+        from hashlib to be updated with the content"""
+        fdsrc = os.open(f_path, os.O_RDONLY)
+        try:
+            size = os.fstat(fdsrc).st_size
+            self._header(name, size)
+            copied = 0
+            if chksum is None:
+                copied = self._sendfile(fdsrc, size)
+            os.lseek(fdsrc, copied, os.SEEK_SET)
+            while copied < size:
+                buf = os.read(fdsrc, min(self.BUFSIZE, size - copied))
+                if not buf:
+                    break
+                if chksum is not None:
+                    chksum.update(buf)
+                self._write(buf)
+                copied += len(buf)
+        finally:
+            os.close(fdsrc)
+        if copied != size:
+            raise IOError(errno.EIO, "file changed while archived", f_path)
+        self._pad(size)
+
+    def close(self):
+        """Write the end of archive and close the file"""
+        try:
+            self._write(b"\0" * (self.BLOCKSIZE * 2))
+            remainder = self.offset % self.RECORDSIZE
+            if remainder:
+                self._write(b"\0" * (self.RECORDSIZE - remainder))
+        finally:
+            status = self._close_fd()
+        if not status:
+            raise IOError(errno.EIO, "compression failed", self.tarfile_name)
+
+    def abort(self):
+        """Close the file and remove the incomplete archive"""
+        self._close_fd()
+        if self.tarfile_name != '-':
+            try:
+                os.unlink(self.tarfile_name)
+            except OSError:
+                pass
+
+    def _close_fd(self):
+        """Finish the compression and close the file unless it is
+        stdout, returns False if the compression failed"""
+        status = True
+        if self._compression and self._fd is not None:
+            status = self._compression.close()
+        self._compression = None
+        if self._out_fd is not None and self.tarfile_name != '-':
+            os.close(self._out_fd)
+        self._fd = None
+        self._out_fd = None
+        return status
+
+
+class DirStream(object):
+    """Write the members of an archive as files in a new directory, with
+    the same methods as TarStream. The content of files is hard linked
+    when in the same filesystem, otherwise it is cloned or copied by the
+    kernel, the files added must not be modified in place afterwards.
+    Write errors raise OSError or IOError.
+    """
+
+    BUFSIZE = 1024 * 1024
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._created = False
+
+    def open(self):
+        """Create the directory, returns False if it exists or cannot
+        be created"""
+        try:
+            os.mkdir(self.dirname, 0o755)
+        except (IOError, OSError):
+            return False
+        self._created = True
+        return True
+
+    def add_dir(self, name):
+        """Add a directory"""
+        d_path = self.dirname + '/' + name.rstrip('/')
+        if not os.path.isdir(d_path):
+            os.mkdir(d_path, 0o755)
+
+    def add_data(self, name, data):
+        """Add a file with content from memory"""
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        with open(self.dirname + '/' + name, "wb") as filep:
+            filep.write(data)
+
+    def add_file(self, name, f_path, chksum=None):
+        """Add a file linked to f_path, chksum is a hash object from
+        hashlib to be updated with the content"""
+        if chksum is not None:
+            with open(f_path, "rb") as filep:
+                while True:
+                    buf = filep.read(self.BUFSIZE)
+                    if not buf:
+                        break
+                    chksum.update(buf)
+        if not FileUtil(f_path).copyto(self.dirname + '/' + name, link=True):
+            raise IOError(errno.EIO, "cannot link or copy", f_path)
+
+    def close(self):
+        """Nothing to finish, the files are complete when added"""
+
+    def abort(self):
+        """Remove the incomplete directory"""
+        if self._created:
+            FileUtil(os.path.abspath(self.dirname)).remove(force=True,
+                                                           recursive=True)
+            self._created = False
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Removal of directory trees in parallel"""
+
+import os
+import stat
+import errno
+
+from udocker.config import Config
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    pass
+
+
+class TreeRemove(object):
+    """Remove a directory tree without forking rm. The entries of each
+    directory are read once with scandir() and unlinked relative to the
+    directory descriptor, the pathnames are not resolved again for each
+    file. Unlinking a file only requires write permission on the parent
+    directory, files are never chmoded, only the directories that are
+    not readable, writable and searchable by the owner. The upper levels
+    of the tree are read first and the subtrees below them are removed
+    by a pool of threads. Entries that vanish meanwhile, e.g. removed by
+    another process, are ignored. Without descriptor support in os the
+    tree is removed by pathnames.
+    """
+
+    USER_RWX = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+    DIR_FLAGS = (os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) |
+                 getattr(os, "O_NOFOLLOW", 0))
+    DEPTH = 4                     # levels read before using the threads
+
+    def __init__(self):
+        self.threads = Config.conf['remove_threads']
+        try:
+            self._use_fd = (
+                set([os.open, os.chmod, os.unlink, os.rmdir]) <=
+                os.supports_dir_fd and os.scandir in os.supports_fd)
+        except AttributeError:
+            self._use_fd = False
+
+    def _open(self, name, dir_fd=None):
+        """Open a directory relative to dir_fd, making it readable,
+        writable and searchable by the owner if needed"""
+        try:
+            fdesc = os.open(name, self.DIR_FLAGS, dir_fd=dir_fd)
+        except OSError as error:
+            if error.errno != errno.EACCES:
+                raise
+            os.chmod(name, self.USER_RWX, dir_fd=dir_fd)
+            fdesc = os.open(name, self.DIR_FLAGS, dir_fd=dir_fd)
+        mode = stat.S_IMODE(os.fstat(fdesc).st_mode)
+        if mode & self.USER_RWX != self.USER_RWX:
+            os.fchmod(fdesc, mode | self.USER_RWX)
+        return fdesc
+
+    def _ignore_missing(self, function, *args, **kwargs):
+        """Call an os function ignoring entries that no longer exist"""
+        try:
+            function(*args, **kwargs)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    def _clear(self, dir_fd):
+        """Unlink the entries of an open directory that are not
+        directories, returns the names of the subdirectories"""
+        subdirs = []
+        scan = os.scandir(dir_fd)
+        try:
+            for entry in scan:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    self._ignore_missing(os.unlink, entry.name,
+                                         dir_fd=dir_fd)
+        finally:
+            scan.close()
+        return subdirs
+
+    def _remove_fd(self, name, dir_fd=None):
+        """Remove a tree relative to an open directory"""
+        try:
+            sub_fd = self._open(name, dir_fd)
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return
+            raise
+        try:
+            for subdir in self._clear(sub_fd):
+                self._remove_fd(subdir, sub_fd)
+        finally:
+            os.close(sub_fd)
+        self._ignore_missing(os.rmdir, name, dir_fd=dir_fd)
+
+    def _remove_walk(self, path):
+        """Remove a tree by pathnames, the directories are fixed before
+        being read"""
+        dirs_found = []
+        self._fix_mode(path)
+        for (dir_path, dirs, files) in os.walk(path):
+            dirs_found.append(dir_path)
+            for f_name in files:
+                self._ignore_missing(os.unlink, dir_path + '/' + f_name)
+            for d_name in list(dirs):
+                d_path = dir_path + '/' + d_name
+                if os.path.islink(d_path):
+                    self._ignore_missing(os.unlink, d_path)
+                    dirs.remove(d_name)
+                else:
+                    self._fix_mode(d_path)
+        for dir_path in reversed(dirs_found):
+            self._ignore_missing(os.rmdir, dir_path)
+
+    def _fix_mode(self, dir_path):
+        """Make a directory readable, writable and searchable"""
+        mode = stat.S_IMODE(os.lstat(dir_path).st_mode)
+        if mode & self.USER_RWX != self.USER_RWX:
+            os.chmod(dir_path, mode | self.USER_RWX)
+
+    def _map(self, function, args):
+        """Apply function to the args in a pool of threads"""
+        if self.threads > 1 and len(args) > 1:
+            try:
+                with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                    return list(executor.map(function, args))
+            except NameError:
+                pass
+        return [function(arg) for arg in args]
+
+    def _expand(self, path):
+        """Read the upper levels of a tree removing their files until
+        there are enough subtrees for the threads, returns the list of
+        directories read and the list of subtrees below them"""
+        expanded = []
+        level = [path]
+        for dummy in range(self.DEPTH):
+            if self.threads < 2 or len(level) >= self.threads * 4:
+                break
+            next_level = []
+            for dir_path in level:
+                try:
+                    dir_fd = self._open(dir_path)
+                except OSError as error:
+                    if error.errno == errno.ENOENT:
+                        continue
+                    raise
+                try:
+                    next_level.extend([dir_path + '/' + subdir for subdir
+                                       in self._clear(dir_fd)])
+                finally:
+                    os.close(dir_fd)
+                expanded.append(dir_path)
+            level = next_level
+        return (expanded, level)
+
+    def remove(self, path):
+        """Remove a directory tree, returns False on error"""
+        try:
+            if not self._use_fd:
+                self._remove_walk(path)
+                return True
+            (expanded, subtrees) = self._expand(path)
+            self._map(self._remove_fd, subtrees)
+            for dir_path in reversed(expanded):
+                self._ignore_missing(os.rmdir, dir_path)
+        except OSError:
+            return False
+        return True